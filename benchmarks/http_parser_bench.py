@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Mastermind HTTP request-head parser benchmark
+Heads per second: the old SYSTEMCTL decode-and-split parser, parse_head and RequestHeadParser
+Author: Mastermind
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'proxies'))
+
+from proxylib.http import RequestHeadParser, TUNNEL_HEADERS, parse_head
+
+# Request heads as tunnel clients send them
+PLAIN = b"GET / HTTP/1.1\r\nHost: bug.example.com\r\n\r\n"
+UPGRADE = (
+    b"GET /ws HTTP/1.1\r\n"
+    b"Host: bug.example.com\r\n"
+    b"X-Online-Host: bug.example.com\r\n"
+    b"Upgrade: websocket\r\n"
+    b"Connection: Upgrade\r\n"
+    b"Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n"
+    b"Sec-WebSocket-Version: 13\r\n"
+    b"User-Agent: Mozilla/5.0 (Linux; Android 13) AppleWebKit/537.36 Chrome/120.0 Mobile Safari/537.36\r\n"
+    b"Accept-Language: en-US,en;q=0.9\r\n"
+    b"\r\n"
+)
+# An HTTP Custom payload padded with filler headers, larger than the old 1024-byte first read
+PADDED = UPGRADE[:-2] + b"".join(b"X-Pad-%d: %s\r\n" % (i, b"a" * 60) for i in range(24)) + b"\r\n"
+
+
+def legacy_parse(data):
+    """The parser websocket-systemctl used before RequestHeadParser"""
+    lines = data.decode('utf-8', errors='ignore').split('\r\n')
+    parts = lines[0].split(' ')
+    if len(parts) < 3:
+        return None, None, None
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            key, value = line.split(':', 1)
+            headers[key.strip().lower()] = value.strip()
+    return parts[0], headers.get('host', 'unknown'), parts[1]
+
+
+def split(data, segmentation):
+    """Split a head the way it might arrive from recv()"""
+    if segmentation == 'single':
+        return [data]
+    if segmentation == 'bytes':
+        return [data[i:i + 1] for i in range(len(data))]
+    # 'halves': two segments cut through the middle of the head
+    middle = len(data) // 2
+    return [data[:middle], data[middle:]]
+
+
+def incremental(segments, wanted=('host',)):
+    parser = RequestHeadParser(wanted)
+    for segment in segments:
+        parser.feed(segment)
+        head = parser.next_head()
+        if head is not None:
+            return head.method, head.header('host'), head.target
+    raise RuntimeError("Head did not complete")
+
+
+def run(label, fn, arg, duration):
+    count = 0
+    start = time.perf_counter()
+    deadline = start + duration
+    while True:
+        for _ in range(1000):
+            fn(arg)
+        count += 1000
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+    rate = count / (now - start)
+    print(f"  {label:<28} {rate:>12,.0f} heads/s")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HTTP request-head parser benchmark')
+    parser.add_argument('--duration', type=float, default=1.0, help='Seconds per case')
+    args = parser.parse_args()
+
+    for name, data in (('plain', PLAIN), ('upgrade', UPGRADE), ('padded', PADDED)):
+        print(f"{name} ({len(data)} B)")
+        # The old parser only ever saw the first 1024-byte recv()
+        truncated = len(data) > 1024
+        run("legacy decode+split" + (" (cut)" if truncated else ""), legacy_parse, data[:1024], args.duration)
+        run("parse_head (full decode)", parse_head, data, args.duration)
+        for segmentation in ('single', 'halves', 'bytes'):
+            run(f"RequestHeadParser {segmentation}", incremental, split(data, segmentation), args.duration)
+        # Every header a tunnel front end might look at, not just Host
+        run("RequestHeadParser all tunnel", lambda head: incremental([head], TUNNEL_HEADERS), data, args.duration)
+
+
+if __name__ == "__main__":
+    main()
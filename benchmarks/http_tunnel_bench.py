@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Mastermind HTTP tunnel benchmark
+Requests/s and time to first byte against a local origin: direct vs python-gettunel
+Author: Mastermind
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PROXIES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'proxies')
+sys.path.insert(0, PROXIES_DIR)
+
+from proxylib.http import SocketReader, parse_response_head, response_body_kind, BODY_LENGTH
+
+
+class OriginHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this delayed ACKs stall keep-alive
+    disable_nagle_algorithm = True
+    body = b"x" * 1024
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_origin(body_size):
+    OriginHandler.body = b"x" * body_size
+    server = ThreadingHTTPServer(('127.0.0.1', 0), OriginHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_address[1]
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def exchange(reader, request):
+    """Send one request, read the full response; returns time to the first response byte"""
+    start = time.perf_counter()
+    reader.sock.sendall(request)
+    if not reader.buffer and not reader.fill():
+        raise ConnectionError("Closed before responding")
+    first_byte = time.perf_counter() - start
+    head = reader.read_head()
+    response = parse_response_head(head)
+    if response.status != 200:
+        raise RuntimeError(f"Unexpected status {response.status}")
+    kind, length = response_body_kind(response, 'GET')
+    if kind != BODY_LENGTH:
+        raise RuntimeError(f"Unexpected body framing {kind}")
+    while len(reader.buffer) < length:
+        if not reader.fill():
+            raise ConnectionError("Closed in the middle of a body")
+    del reader.buffer[:length]
+    return first_byte
+
+
+def run_case(count, connect, request, keep_alive):
+    """Run count requests; returns (requests/s, first-byte latencies)"""
+    latencies = []
+    reader = None
+    start = time.perf_counter()
+    for _ in range(count):
+        if reader is None:
+            reader = SocketReader(connect())
+        latencies.append(exchange(reader, request))
+        if not keep_alive:
+            reader.sock.close()
+            reader = None
+    elapsed = time.perf_counter() - start
+    if reader is not None:
+        reader.sock.close()
+    return count / elapsed, latencies
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def report(label, result):
+    rate, latencies = result
+    print(f"  {label:<34} {rate:>9,.0f} req/s   TTFB p50 {percentile(latencies, 0.5) * 1e3:6.3f} ms"
+          f"   p99 {percentile(latencies, 0.99) * 1e3:6.3f} ms")
+
+
+def connect_tunnel(port, origin):
+    """Open a CONNECT tunnel to the origin through the proxy"""
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.sendall(f"CONNECT 127.0.0.1:{origin} HTTP/1.1\r\nHost: 127.0.0.1:{origin}\r\n\r\n".encode())
+    reader = SocketReader(sock)
+    head = reader.read_head()
+    if head is None or parse_response_head(head).status != 200:
+        raise RuntimeError(f"CONNECT refused: {head!r}")
+    return sock
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HTTP tunnel proxy benchmark')
+    parser.add_argument('--requests', type=int, default=2000, help='Requests per case')
+    parser.add_argument('--body-size', type=int, default=1024, help='Origin response body size in bytes')
+    parser.add_argument('--port', type=int, default=18807, help='Port for the python-gettunel instance under test')
+    args = parser.parse_args()
+
+    origin = start_origin(args.body_size)
+    proxy = subprocess.Popen(
+        [sys.executable, os.path.join(PROXIES_DIR, 'python-gettunel.py'), '--host', '127.0.0.1',
+         '--port', str(args.port), '--max-per-ip', '0'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+    def direct():
+        sock = socket.create_connection(('127.0.0.1', origin))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def proxied():
+        sock = socket.create_connection(('127.0.0.1', args.port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    origin_form = f"GET /bench HTTP/1.1\r\nHost: 127.0.0.1:{origin}\r\n\r\n".encode()
+    absolute_form = f"GET http://127.0.0.1:{origin}/bench HTTP/1.1\r\nHost: 127.0.0.1:{origin}\r\n\r\n".encode()
+
+    try:
+        wait_for_port(args.port)
+        print(f"{args.requests} GET requests, {args.body_size} B bodies")
+        report("direct, keep-alive", run_case(args.requests, direct, origin_form, True))
+        report("direct, new connection each", run_case(args.requests, direct, origin_form, False))
+        report("proxy, keep-alive", run_case(args.requests, proxied, absolute_form, True))
+        report("proxy, new client conn (pooled)", run_case(args.requests, proxied, absolute_form, False))
+        report("CONNECT tunnel, keep-alive",
+               run_case(args.requests, lambda: connect_tunnel(args.port, origin), origin_form, True))
+    finally:
+        proxy.terminate()
+        proxy.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,564 @@
+#!/usr/bin/env python3
+"""
+Mastermind proxy load test
+Drives N concurrent SOCKS4/SOCKS5/HTTP/WebSocket clients through a proxy to a local echo/sink origin
+and reports handshakes/s, connect latency percentiles, MB/s and the proxy's peak RSS, threads and FDs
+Author: Mastermind
+"""
+
+import argparse
+import asyncio
+import base64
+import concurrent.futures
+import json
+import math
+import multiprocessing
+import os
+import platform
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+PROXIES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'proxies')
+sys.path.insert(0, PROXIES_DIR)
+
+from proxylib.websocket import FrameParser, apply_mask, frame_header, OP_BINARY, DATA
+
+CHUNK = 65536
+MASK = b"\x37\xfa\x21\x3d"
+PING = os.urandom(32)
+
+# First byte a client sends through the tunnel: the origin echoes or discards the rest
+MODE_ECHO = b"E"
+MODE_SINK = b"S"
+
+# Proxy under test: script, client protocols it speaks (first is the default),
+# whether it tunnels to a fixed --backend, and a config file that puts it in tunnel mode
+PROXIES = {
+    'simple': dict(script='python-simple.py', clients=('socks5', 'socks4')),
+    'seguro': dict(script='python-seguro.py', clients=('socks5',),
+                   credentials=(b'mastermind', b'mastermind123')),
+    'gettunel': dict(script='python-gettunel.py', clients=('http',)),
+    'systemctl': dict(script='websocket-systemctl.py', clients=('websocket',), backend=True,
+                      config=('websocket-systemctl-http-response.conf', "HTTP_RESPONSE_TYPE=101\n")),
+    'websocket-custom': dict(script='websocket-custom.py', clients=('websocket',), backend=True),
+    'ws-directo': dict(script='ws-directo.py', clients=('websocket',), backend=True),
+    'tcp-bypass': dict(script='python-tcp-bypass.py', clients=('payload',), backend=True),
+    'openvpn': dict(script='python-openvpn.py', clients=('socks5',)),
+}
+
+
+# Origin
+
+async def serve_origin(reader, writer):
+    try:
+        mode = await reader.readexactly(1)
+        while True:
+            data = await reader.read(CHUNK)
+            if not data:
+                break
+            if mode == MODE_ECHO:
+                writer.write(data)
+                await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+def run_origin(port, ready):
+    """Echo/sink origin on its own process, so it does not share a GIL with the clients"""
+    async def main():
+        server = await asyncio.start_server(serve_origin, '127.0.0.1', port, backlog=4096, limit=CHUNK)
+        ready.set()
+        async with server:
+            await server.serve_forever()
+    asyncio.run(main())
+
+
+# Clients
+
+class Tunnel:
+    """Client end of a proxied connection; WebSocket tunnels frame what they send and unframe what they read"""
+
+    def __init__(self, reader, writer, framed=False):
+        self.reader = reader
+        self.writer = writer
+        self.parser = FrameParser(require_mask=False) if framed else None
+
+    def frame(self, data):
+        if self.parser is None:
+            return data
+        return frame_header(OP_BINARY, len(data), mask_key=MASK) + apply_mask(data, MASK)
+
+    async def send(self, data):
+        self.writer.write(self.frame(data))
+        await self.writer.drain()
+
+    async def recv(self):
+        """Next chunk of payload; b"" at EOF"""
+        if self.parser is None:
+            return await self.reader.read(CHUNK * 4)
+        while True:
+            event = self.parser.next_event()
+            if event is None:
+                data = await self.reader.read(CHUNK * 4)
+                if not data:
+                    return b""
+                self.parser.feed(data)
+            elif event[0] == DATA and event[1]:
+                return event[1]
+
+    async def recv_exactly(self, size):
+        got = 0
+        while got < size:
+            data = await self.recv()
+            if not data:
+                raise ConnectionError("Tunnel closed early")
+            got += len(data)
+
+    def close(self):
+        self.writer.close()
+
+
+async def read_reply(reader, size, check, what):
+    reply = await reader.readexactly(size)
+    if not check(reply):
+        raise ConnectionError(f"{what} refused: {reply!r}")
+
+
+async def read_head(reader):
+    head = await reader.readuntil(b"\r\n\r\n")
+    return head.split(b"\r\n", 1)[0]
+
+
+async def open_tunnel(kind, port, origin, credentials=None):
+    """Connect to the proxy and finish the client handshake for origin"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port, limit=CHUNK * 4)
+    writer.transport.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    target = socket.inet_aton(origin[0]) + struct.pack(">H", origin[1])
+    try:
+        if kind == 'socks5':
+            if credentials:
+                username, password = credentials
+                writer.write(b"\x05\x01\x02")
+                await read_reply(reader, 2, lambda r: r == b"\x05\x02", "SOCKS5 method")
+                writer.write(b"\x01" + bytes([len(username)]) + username + bytes([len(password)]) + password)
+                await read_reply(reader, 2, lambda r: r == b"\x01\x00", "SOCKS5 login")
+            else:
+                writer.write(b"\x05\x01\x00")
+                await read_reply(reader, 2, lambda r: r == b"\x05\x00", "SOCKS5 method")
+            writer.write(b"\x05\x01\x00\x01" + target)
+            await read_reply(reader, 10, lambda r: r[1] == 0x00, "SOCKS5 CONNECT")
+            return Tunnel(reader, writer)
+        if kind == 'socks4':
+            writer.write(b"\x04\x01" + target[4:] + target[:4] + b"\x00")
+            await read_reply(reader, 8, lambda r: r[1] == 0x5A, "SOCKS4 CONNECT")
+            return Tunnel(reader, writer)
+        if kind == 'http':
+            writer.write(f"CONNECT {origin[0]}:{origin[1]} HTTP/1.1\r\nHost: {origin[0]}:{origin[1]}\r\n\r\n".encode())
+            status = await read_head(reader)
+            if b" 200 " not in status:
+                raise ConnectionError(f"CONNECT refused: {status!r}")
+            return Tunnel(reader, writer)
+        if kind == 'payload':
+            writer.write(b"GET / HTTP/1.1\r\nHost: bug.example.com\r\nUpgrade: websocket\r\n"
+                         b"Connection: Keep-Alive\r\n\r\n")
+            await read_head(reader)
+            return Tunnel(reader, writer)
+        # websocket: a keyed RFC 6455 upgrade, payload in masked frames
+        key = base64.b64encode(os.urandom(16)).decode()
+        writer.write(f"GET / HTTP/1.1\r\nHost: bench\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                     f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n".encode())
+        status = await read_head(reader)
+        if b" 101 " not in status:
+            raise ConnectionError(f"Upgrade refused: {status!r}")
+        return Tunnel(reader, writer, framed=True)
+    except BaseException:
+        writer.close()
+        raise
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def handshake_loop(spec, deadline, latencies, errors):
+    """Open, verify and close tunnels back to back until the deadline"""
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            tunnel = await asyncio.wait_for(
+                open_tunnel(spec['client'], spec['port'], spec['origin'], spec['credentials']), spec['timeout'])
+            connected = time.perf_counter()
+            try:
+                # One round trip proves the tunnel reaches the origin
+                await tunnel.send(MODE_ECHO + PING)
+                await asyncio.wait_for(tunnel.recv_exactly(len(PING)), spec['timeout'])
+            finally:
+                tunnel.close()
+        except (OSError, EOFError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError) as e:
+            name = type(e).__name__
+            errors[name] = errors.get(name, 0) + 1
+            continue
+        latencies.append((connected - start) * 1000)
+
+
+async def bulk_transfer(spec, deadline, counted):
+    """Stream CHUNK pieces through one tunnel until the deadline; counts payload bytes received (echo) or sent (sink)"""
+    tunnel = await open_tunnel(spec['client'], spec['port'], spec['origin'], spec['credentials'])
+    chunk = tunnel.frame(os.urandom(CHUNK))
+    echo = spec['bulk'] == 'echo'
+    tunnel.writer.write(tunnel.frame(MODE_ECHO if echo else MODE_SINK))
+
+    async def send():
+        while time.perf_counter() < deadline:
+            tunnel.writer.write(chunk)
+            await tunnel.writer.drain()
+            if not echo:
+                counted[0] += CHUNK
+
+    async def receive():
+        while time.perf_counter() < deadline:
+            data = await tunnel.recv()
+            if not data:
+                raise ConnectionError("Tunnel closed early")
+            counted[0] += len(data)
+
+    try:
+        tasks = [asyncio.ensure_future(send())]
+        if echo:
+            tasks.append(asyncio.ensure_future(receive()))
+        done, pending = await asyncio.wait(tasks, timeout=max(0, deadline - time.perf_counter()) + 1)
+        for task in pending:
+            task.cancel()
+        for task in done:
+            task.result()
+    finally:
+        tunnel.close()
+
+
+def run_clients(spec, phase, count, start_at):
+    """One load-generator process: count concurrent clients in phase, starting at the shared start_at"""
+    async def main():
+        await asyncio.sleep(max(0, start_at - time.time()))
+        deadline = time.perf_counter() + spec['duration']
+        if phase == 'handshake':
+            latencies, errors = [], {}
+            await asyncio.gather(*(handshake_loop(spec, deadline, latencies, errors) for _ in range(count)))
+            return dict(latencies=latencies, errors=errors)
+        counted = [0]
+        results = await asyncio.gather(*(bulk_transfer(spec, deadline, counted) for _ in range(count)),
+                                       return_exceptions=True)
+        errors = {}
+        for result in results:
+            if isinstance(result, BaseException):
+                name = type(result).__name__
+                errors[name] = errors.get(name, 0) + 1
+        return dict(bytes=counted[0], errors=errors)
+    return asyncio.run(main())
+
+
+def run_phase(pool, spec, phase, clients, processes):
+    """Spread clients over the pool's processes; returns the per-process results and the wall time"""
+    shares = [clients // processes + (1 if i < clients % processes else 0) for i in range(processes)]
+    start_at = time.time() + 0.5
+    futures = [pool.submit(run_clients, spec, phase, share, start_at) for share in shares if share]
+    results = [future.result() for future in futures]
+    return results, spec['duration']
+
+
+# Proxy process
+
+def process_tree(pid):
+    """pid and its descendants (--workers forks), from /proc"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # comm may contain spaces; ppid is the second field after the closing parenthesis
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(children.get(current, ()))
+    return tree
+
+
+def sample_process(pid):
+    """(rss_kb, peak_rss_kb, threads, fds) summed over the process tree"""
+    rss = peak = threads = fds = 0
+    for member in process_tree(pid):
+        try:
+            with open(f'/proc/{member}/status') as f:
+                for line in f:
+                    field, _, value = line.partition(':')
+                    if field == 'VmRSS':
+                        rss += int(value.split()[0])
+                    elif field == 'VmHWM':
+                        peak += int(value.split()[0])
+                    elif field == 'Threads':
+                        threads += int(value)
+            fds += len(os.listdir(f'/proc/{member}/fd'))
+        except OSError:
+            continue
+    return rss, peak, threads, fds
+
+
+class ResourceSampler:
+    """Polls the proxy's /proc entries on a thread and keeps the peaks"""
+
+    def __init__(self, pid, interval=0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss_kb = self.peak_threads = self.peak_fds = 0
+        self.running = False
+        self.thread = None
+
+    def sample(self):
+        rss, peak, threads, fds = sample_process(self.pid)
+        self.peak_rss_kb = max(self.peak_rss_kb, rss, peak)
+        self.peak_threads = max(self.peak_threads, threads)
+        self.peak_fds = max(self.peak_fds, fds)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    def loop(self):
+        while self.running:
+            self.sample()
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        self.sample()
+        return dict(peak_rss_kb=self.peak_rss_kb, peak_threads=self.peak_threads, peak_fds=self.peak_fds)
+
+
+def start_proxy(name, proxies_dir, port, origin_port, workdir, extra_args):
+    proxy = PROXIES[name]
+    if 'config' in proxy:
+        config_dir = os.path.join(workdir, 'config', 'proxies')
+        os.makedirs(config_dir, exist_ok=True)
+        with open(os.path.join(config_dir, proxy['config'][0]), 'w') as f:
+            f.write(proxy['config'][1])
+    command = [sys.executable, os.path.join(proxies_dir, proxy['script']), '--host', '127.0.0.1',
+               '--port', str(port), '--max-per-ip', '0']
+    if proxy.get('backend'):
+        command += ['--backend', f'127.0.0.1:{origin_port}']
+    process = subprocess.Popen(command + list(extra_args), cwd=workdir,
+                               env=dict(os.environ, PYTHONPATH=proxies_dir),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return process
+        except OSError:
+            if time.time() > deadline or process.poll() is not None:
+                process.terminate()
+                raise RuntimeError(f"{proxy['script']} did not start listening on {port}")
+            time.sleep(0.1)
+
+
+# Runs and reports
+
+def merge_errors(results):
+    errors = {}
+    for result in results:
+        for name, count in result['errors'].items():
+            errors[name] = errors.get(name, 0) + count
+    return errors
+
+
+def measure(name, client, args, pool, origin_port, port):
+    """Load one proxy: a handshake phase, then a bulk phase; returns the result record"""
+    spec = dict(client=client, port=port, origin=('127.0.0.1', origin_port),
+                credentials=PROXIES[name].get('credentials'), duration=args.duration,
+                timeout=args.timeout, bulk=args.bulk)
+    with tempfile.TemporaryDirectory() as workdir:
+        process = start_proxy(name, args.proxies_dir, port, origin_port, workdir, args.proxy_arg)
+        try:
+            idle_rss_kb, _, idle_threads, idle_fds = sample_process(process.pid)
+            sampler = ResourceSampler(process.pid)
+            sampler.start()
+
+            results, elapsed = run_phase(pool, spec, 'handshake', args.clients, args.processes)
+            latencies = sorted(l for result in results for l in result['latencies'])
+            handshake = dict(
+                completed=len(latencies),
+                per_second=len(latencies) / elapsed,
+                errors=merge_errors(results),
+                connect_ms=dict(p50=percentile(latencies, 0.50), p99=percentile(latencies, 0.99),
+                                p999=percentile(latencies, 0.999),
+                                max=latencies[-1] if latencies else None,
+                                mean=sum(latencies) / len(latencies) if latencies else None),
+            )
+
+            results, elapsed = run_phase(pool, spec, 'bulk', args.clients, args.processes)
+            total = sum(result['bytes'] for result in results)
+            bulk = dict(mode=args.bulk, bytes=total, mb_per_s=total / elapsed / 1e6, errors=merge_errors(results))
+
+            resources = sampler.stop()
+            resources.update(idle_rss_kb=idle_rss_kb, idle_threads=idle_threads, idle_fds=idle_fds)
+        finally:
+            process.terminate()
+            process.wait()
+    return dict(proxy=name, client=client, handshake=handshake, bulk=bulk, resources=resources)
+
+
+def report(result):
+    handshake, bulk, resources = result['handshake'], result['bulk'], result['resources']
+    connect = handshake['connect_ms']
+
+    def ms(value):
+        return f"{value:8.2f}" if value is not None else "       -"
+
+    print(f"{result['proxy']} ({result['client']})")
+    print(f"  handshakes   {handshake['per_second']:>10,.0f} /s   connect ms p50 {ms(connect['p50'])}"
+          f"  p99 {ms(connect['p99'])}  p999 {ms(connect['p999'])}")
+    print(f"  bulk {bulk['mode']:<6}  {bulk['mb_per_s']:>10,.1f} MB/s")
+    print(f"  peak         {resources['peak_rss_kb'] / 1024:>10,.1f} MB RSS, {resources['peak_threads']} threads, "
+          f"{resources['peak_fds']} FDs (idle {resources['idle_rss_kb'] / 1024:.1f} MB, "
+          f"{resources['idle_threads']} threads, {resources['idle_fds']} FDs)")
+    for label, errors in (("handshake", handshake['errors']), ("bulk", bulk['errors'])):
+        if errors:
+            print(f"  {label} errors: " + ", ".join(f"{name} x{count}" for name, count in sorted(errors.items())))
+
+
+# Figures --compare diffs, and whether a larger value is better
+COMPARED = (
+    (('handshake', 'per_second'), "handshakes/s", True),
+    (('handshake', 'connect_ms', 'p50'), "connect p50 ms", False),
+    (('handshake', 'connect_ms', 'p99'), "connect p99 ms", False),
+    (('handshake', 'connect_ms', 'p999'), "connect p999 ms", False),
+    (('bulk', 'mb_per_s'), "MB/s", True),
+    (('resources', 'peak_rss_kb'), "peak RSS KB", False),
+    (('resources', 'peak_threads'), "peak threads", False),
+    (('resources', 'peak_fds'), "peak FDs", False),
+)
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {(r['proxy'], r['client']): r for r in baseline['results']}
+    print(f"Against {baseline_path} ({baseline['environment'].get('revision') or 'unknown revision'})")
+    for result in results:
+        old = previous.get((result['proxy'], result['client']))
+        if old is None:
+            continue
+        print(f"{result['proxy']} ({result['client']})")
+        for path, label, higher_is_better in COMPARED:
+            before, after = old, result
+            for key in path:
+                before, after = before.get(key) if before else None, after.get(key) if after else None
+            if not before or after is None:
+                continue
+            change = (after - before) / before * 100
+            better = change > 0 if higher_is_better else change < 0
+            print(f"  {label:<16} {before:>12,.2f} -> {after:>12,.2f}  {change:+6.1f}%"
+                  f"{'' if abs(change) < 5 else (' better' if better else ' worse')}")
+
+
+def environment(args):
+    try:
+        revision = subprocess.run(['git', '-C', args.proxies_dir, 'describe', '--always', '--dirty'],
+                                  capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        revision = None
+    cpu = None
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    cpu = line.split(':', 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return dict(revision=revision, python=platform.python_version(), platform=platform.platform(),
+                cpu=cpu, cpus=os.cpu_count(),
+                settings=dict(clients=args.clients, processes=args.processes, duration=args.duration,
+                              bulk=args.bulk, proxy_args=args.proxy_arg))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Proxy load test against a local echo/sink origin')
+    parser.add_argument('--proxy', action='append', choices=sorted(PROXIES) + ['all'],
+                        help='Proxy to load, repeatable (default: simple)')
+    parser.add_argument('--client', choices=['socks5', 'socks4', 'http', 'websocket', 'payload'],
+                        help="Client protocol (default: the proxy's own, e.g. socks5 for simple)")
+    parser.add_argument('--clients', type=int, default=50, help='Concurrent clients')
+    parser.add_argument('--processes', type=int, default=min(4, os.cpu_count() or 1),
+                        help='Load-generator processes the clients are spread over')
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds per phase')
+    parser.add_argument('--bulk', choices=['echo', 'sink'], default='echo',
+                        help='Bulk phase: data echoed back by the origin, or uploaded and discarded')
+    parser.add_argument('--timeout', type=float, default=10.0, help='Seconds before a handshake counts as failed')
+    parser.add_argument('--port', type=int, default=18900, help='Port for the proxy under test')
+    parser.add_argument('--origin-port', type=int, default=18999, help='Port of the local origin')
+    parser.add_argument('--proxies-dir', default=PROXIES_DIR,
+                        help='proxies/ directory to run, e.g. a checkout of an older release')
+    parser.add_argument('--proxy-arg', action='append', default=[],
+                        help='Extra argument for the proxy, repeatable (e.g. --proxy-arg=--log-level=WARNING)')
+    parser.add_argument('--json', help="Write results to this file ('-' for stdout)")
+    parser.add_argument('--compare', help='Earlier --json output to diff the results against')
+    args = parser.parse_args()
+
+    names = args.proxy or ['simple']
+    if 'all' in names:
+        names = list(PROXIES)
+    runs = []
+    for name in names:
+        client = args.client or PROXIES[name]['clients'][0]
+        if client not in PROXIES[name]['clients']:
+            parser.error(f"{name} does not speak {client} (supported: {', '.join(PROXIES[name]['clients'])})")
+        runs.append((name, client))
+
+    ready = multiprocessing.Event()
+    origin = multiprocessing.Process(target=run_origin, args=(args.origin_port, ready), daemon=True)
+    origin.start()
+    if not ready.wait(10):
+        raise RuntimeError(f"Origin did not start on {args.origin_port}")
+
+    results = []
+    try:
+        with concurrent.futures.ProcessPoolExecutor(args.processes) as pool:
+            print(f"{args.clients} clients over {args.processes} processes, {args.duration:g} s per phase")
+            for name, client in runs:
+                result = measure(name, client, args, pool, args.origin_port, args.port)
+                report(result)
+                results.append(result)
+    finally:
+        origin.terminate()
+
+    if args.compare:
+        compare(results, args.compare)
+    if args.json:
+        output = json.dumps(dict(environment=environment(args), results=results), indent=2)
+        if args.json == '-':
+            print(output)
+        else:
+            with open(args.json, 'w') as f:
+                f.write(output + "\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Mastermind protocol multiplexer benchmark
+classify() speed and connect-to-first-byte latency: direct backend vs python-openvpn dispatch
+Author: Mastermind
+"""
+
+import argparse
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+PROXIES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'proxies')
+sys.path.insert(0, PROXIES_DIR)
+
+from proxylib.sniff import classify
+
+SAMPLES = {
+    'ssh': b"SSH-2.0-OpenSSH_9.6\r\n",
+    'openvpn': b"\x00\x0e\x38" + os.urandom(14),
+    'tls': b"\x16\x03\x01\x02\x00\x01\x00\x01\xfc\x03\x03",
+    'http': b"GET / HTTP/1.1\r\nHost: example\r\n\r\n",
+    'socks': b"\x05\x01\x00",
+}
+
+
+def classify_benchmark(duration):
+    print("classify()")
+    for name, sample in SAMPLES.items():
+        count = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration:
+            for _ in range(1000):
+                classify(sample)
+            count += 1000
+        elapsed = time.perf_counter() - start
+        print(f"  {name:<8} {count / elapsed / 1e6:8.2f} M/s  ({elapsed / count * 1e9:6.0f} ns)")
+
+
+def echo_server():
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(128)
+
+    def serve(conn):
+        with conn:
+            while True:
+                data = conn.recv(4096)
+                if not data:
+                    return
+                conn.sendall(data)
+
+    def accept():
+        while True:
+            conn, _ = listener.accept()
+            threading.Thread(target=serve, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def first_byte_latency(port, payload, expect):
+    """Connect, send payload, wait for expect bytes; returns seconds"""
+    start = time.perf_counter()
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    try:
+        sock.sendall(payload)
+        received = 0
+        while received < expect:
+            data = sock.recv(4096)
+            if not data:
+                raise ConnectionError("Closed early")
+            received += len(data)
+        return time.perf_counter() - start
+    finally:
+        sock.close()
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def report(label, latencies):
+    print(f"  {label:<22} p50 {percentile(latencies, 0.5) * 1e3:7.3f} ms   p99 {percentile(latencies, 0.99) * 1e3:7.3f} ms")
+
+
+def dispatch_benchmark(count, port):
+    backend = echo_server()
+    proxy = subprocess.Popen(
+        [sys.executable, os.path.join(PROXIES_DIR, 'python-openvpn.py'), '--host', '127.0.0.1',
+         '--port', str(port), '--max-per-ip', '0', '--ssh-backend', f'127.0.0.1:{backend}',
+         '--openvpn-backend', f'127.0.0.1:{backend}', '--tls-backend', f'127.0.0.1:{backend}'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        deadline = time.time() + 10
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port)).close()
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+
+        print(f"Connect to first echoed byte ({count} connections each)")
+        report("direct backend", [first_byte_latency(backend, SAMPLES['ssh'], 1) for _ in range(count)])
+        for name in ('ssh', 'openvpn', 'tls'):
+            report(f"mux -> {name}", [first_byte_latency(port, SAMPLES[name], 1) for _ in range(count)])
+
+        # SOCKS5 is handled in process: greeting + CONNECT to the echo backend, then one byte of payload
+        request = (SAMPLES['socks'] + b"\x05\x01\x00\x01" + socket.inet_aton('127.0.0.1') +
+                   struct.pack(">H", backend) + b"x")
+        report("mux -> socks (internal)", [first_byte_latency(port, request, 13) for _ in range(count)])
+    finally:
+        proxy.terminate()
+        proxy.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Protocol multiplexer dispatch benchmark')
+    parser.add_argument('--duration', type=float, default=0.5, help='Seconds per classify() case')
+    parser.add_argument('--connections', type=int, default=500, help='Connections per dispatch case')
+    parser.add_argument('--port', type=int, default=18806, help='Port for the python-openvpn instance under test')
+    parser.add_argument('--classify-only', action='store_true', help='Skip the dispatch cases')
+    args = parser.parse_args()
+
+    classify_benchmark(args.duration)
+    if not args.classify_only:
+        dispatch_benchmark(args.connections, args.port)
+
+
+if __name__ == "__main__":
+    main()
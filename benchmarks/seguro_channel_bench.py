@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Mastermind SEGURO channel benchmark
+Record codec speed and wire overhead: old per-chunk Fernet vs ChaCha20-Poly1305/AES-GCM records,
+and end-to-end throughput through python-seguro plain vs through seguro-client.py
+Author: Mastermind
+"""
+
+import argparse
+import os
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+PROXIES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'proxies')
+sys.path.insert(0, PROXIES_DIR)
+
+from cryptography.fernet import Fernet
+
+from proxylib.securechannel import (RecordCipher, CIPHER_CHACHA20, CIPHER_AESGCM, RECORD_HEADER,
+                                    MAX_RECORD_SIZE, KEY_SIZE)
+
+# The old relay encrypted whatever one recv() returned, typically 4 KB
+FERNET_CHUNK = 4096
+CHUNK = 65536
+
+
+def fernet_case(data):
+    """Encrypt and decrypt data in FERNET_CHUNK pieces; returns (wire bytes, seconds)"""
+    cipher = Fernet(Fernet.generate_key())
+    start = time.perf_counter()
+    wire = 0
+    for offset in range(0, len(data), FERNET_CHUNK):
+        token = cipher.encrypt(data[offset:offset + FERNET_CHUNK])
+        wire += len(token)
+        cipher.decrypt(token)
+    return wire, time.perf_counter() - start
+
+
+def record_case(data, cipher_id):
+    """Seal and open data in MAX_RECORD_SIZE records; returns (wire bytes, seconds)"""
+    key = os.urandom(KEY_SIZE)
+    sender = RecordCipher(cipher_id, key)
+    receiver = RecordCipher(cipher_id, key)
+    view = memoryview(data)
+    start = time.perf_counter()
+    wire = 0
+    for offset in range(0, len(data), MAX_RECORD_SIZE):
+        record = sender.seal(view[offset:offset + MAX_RECORD_SIZE])
+        wire += len(record)
+        receiver.open(record[:RECORD_HEADER.size], record[RECORD_HEADER.size:])
+    return wire, time.perf_counter() - start
+
+
+def codec_benchmark(megabytes):
+    data = os.urandom(megabytes * 1024 * 1024)
+    print(f"Codec, encrypt + decrypt {megabytes} MB in one process")
+    cases = [
+        ("Fernet, 4 KB chunks", lambda: fernet_case(data)),
+        ("ChaCha20-Poly1305, 16 KB", lambda: record_case(data, CIPHER_CHACHA20)),
+        ("AES-256-GCM, 16 KB", lambda: record_case(data, CIPHER_AESGCM)),
+    ]
+    for label, case in cases:
+        wire, elapsed = case()
+        overhead = (wire - len(data)) / len(data) * 100
+        print(f"  {label:<26} {len(data) / elapsed / 1e6:>9,.1f} MB/s   wire overhead {overhead:5.2f}%")
+
+
+def echo_server():
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(16)
+
+    def serve(conn):
+        buffer = bytearray(CHUNK)
+        view = memoryview(buffer)
+        with conn:
+            try:
+                while True:
+                    received = conn.recv_into(buffer)
+                    if not received:
+                        return
+                    conn.sendall(view[:received])
+            except OSError:
+                pass
+
+    def accept():
+        while True:
+            conn, _ = listener.accept()
+            threading.Thread(target=serve, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def wait_listening(port, process):
+    deadline = time.time() + 10
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return
+        except OSError:
+            if time.time() > deadline or process.poll() is not None:
+                raise
+            time.sleep(0.1)
+
+
+def socks_connect(port, backend):
+    """SOCKS5 with the default SEGURO account, CONNECT to the echo backend"""
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.sendall(b"\x05\x01\x02")
+    sock.recv(2)
+    sock.sendall(b"\x01\x0amastermind\x0dmastermind123")
+    if sock.recv(2) != b"\x01\x00":
+        raise ConnectionError("SEGURO authentication failed")
+    sock.sendall(b"\x05\x01\x00\x01" + socket.inet_aton('127.0.0.1') + struct.pack(">H", backend))
+    reply = b""
+    while len(reply) < 10:
+        reply += sock.recv(10 - len(reply))
+    if reply[1] != 0:
+        raise ConnectionError(f"SEGURO CONNECT failed: {reply!r}")
+    return sock
+
+
+def throughput(sock, total):
+    """Echo total bytes through sock; returns MB/s each way"""
+    payload = os.urandom(CHUNK)
+    sender = threading.Thread(target=lambda: [sock.sendall(payload) for _ in range(total // CHUNK)])
+    start = time.perf_counter()
+    sender.start()
+    got = 0
+    while got < total:
+        data = sock.recv(CHUNK * 4)
+        if not data:
+            raise ConnectionError("Tunnel closed early")
+        got += len(data)
+    elapsed = time.perf_counter() - start
+    sender.join()
+    return total / elapsed / 1e6
+
+
+def end_to_end_benchmark(megabytes, port, client_port):
+    backend = echo_server()
+    total = megabytes * 1024 * 1024
+    workdir = tempfile.mkdtemp(prefix='seguro-bench-')
+    processes = []
+
+    def spawn(script, *arguments):
+        process = subprocess.Popen([sys.executable, os.path.join(PROXIES_DIR, script)] + list(arguments),
+                                   cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        processes.append(process)
+        return process
+
+    try:
+        server = spawn('python-seguro.py', '--host', '127.0.0.1', '--port', str(port), '--max-per-ip', '0')
+        wait_listening(port, server)
+        key_file = os.path.join(workdir, 'config', 'proxies', 'python-seguro-key.conf')
+
+        print(f"End to end, echo {megabytes} MB through python-seguro")
+        sock = socket.create_connection(('127.0.0.1', backend))
+        print(f"  {'direct backend':<26} {throughput(sock, total):>9,.1f} MB/s")
+        sock.close()
+
+        sock = socks_connect(port, backend)
+        print(f"  {'plain SOCKS5':<26} {throughput(sock, total):>9,.1f} MB/s")
+        sock.close()
+
+        for offset, cipher in enumerate(('chacha20', 'aesgcm')):
+            local_port = client_port + offset
+            client = spawn('seguro-client.py', '--server', f'127.0.0.1:{port}', '--key-file', key_file,
+                           '--port', str(local_port), '--cipher', cipher)
+            wait_listening(local_port, client)
+            sock = socks_connect(local_port, backend)
+            print(f"  {'channel, ' + cipher:<26} {throughput(sock, total):>9,.1f} MB/s")
+            sock.close()
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SEGURO encrypted channel benchmark')
+    parser.add_argument('--codec-megabytes', type=int, default=64, help='Data per codec case')
+    parser.add_argument('--megabytes', type=int, default=256, help='Data echoed per end-to-end case')
+    parser.add_argument('--port', type=int, default=18802, help='Port for the python-seguro instance under test')
+    parser.add_argument('--client-port', type=int, default=11080, help='First local port for seguro-client.py')
+    parser.add_argument('--codec-only', action='store_true', help='Skip the end-to-end cases')
+    args = parser.parse_args()
+
+    codec_benchmark(args.codec_megabytes)
+    if not args.codec_only:
+        end_to_end_benchmark(args.megabytes, args.port, args.client_port)
+
+
+if __name__ == "__main__":
+    main()
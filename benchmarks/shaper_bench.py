@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Mastermind bandwidth shaper benchmark
+Per-chunk cost of the token-bucket shaper in the relay loops, and how it shares a listener rate
+Author: Mastermind
+"""
+
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+
+PROXIES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'proxies')
+sys.path.insert(0, PROXIES_DIR)
+
+from proxylib.relay import forward_copy
+from proxylib.shaper import Shaper, throttle
+
+CHUNK = 65536
+# High enough that no case ever sleeps: only the accounting is measured
+UNREACHED_RATE = 1e15
+
+
+def charge_cost(shaper, user, threads, count):
+    """Average ns per throttle() call, count calls on each of threads threads"""
+    def worker(index):
+        flow = shaper.open(f"10.0.0.{index}", user).download
+        for _ in range(count):
+            throttle(flow, CHUNK)
+
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return (time.perf_counter() - start) / (count * threads) * 1e9
+
+
+def overhead_benchmark(count):
+    print(f"throttle() per {CHUNK // 1024} KB chunk, limits never reached")
+    cases = [
+        ("listener only", Shaper(rate=UNREACHED_RATE), None),
+        ("listener + per IP", Shaper(rate=UNREACHED_RATE, per_ip_rate=UNREACHED_RATE), None),
+        ("listener + per IP + user", Shaper(rate=UNREACHED_RATE, per_ip_rate=UNREACHED_RATE,
+                                            per_user_rate=UNREACHED_RATE), 'bench'),
+    ]
+    for label, shaper, user in cases:
+        single = charge_cost(shaper, user, 1, count)
+        contended = charge_cost(shaper, user, 8, count // 8)
+        print(f"  {label:<26} {single:7.0f} ns   8 threads {contended:7.0f} ns")
+
+
+def copy_throughput(flow, total):
+    """MB/s of forward_copy() between two socketpairs, charging flow when given"""
+    source_in, source = socket.socketpair()
+    destination, destination_out = socket.socketpair()
+    payload = os.urandom(CHUNK)
+
+    def produce():
+        for _ in range(total // CHUNK):
+            source_in.sendall(payload)
+        source_in.shutdown(socket.SHUT_WR)
+
+    def drain():
+        while destination_out.recv(CHUNK * 4):
+            pass
+
+    threads = [threading.Thread(target=produce), threading.Thread(target=drain)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    forward_copy(source, destination, lambda: True, None, None, flow)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    for sock in (source_in, source, destination, destination_out):
+        sock.close()
+    return total / elapsed / 1e6
+
+
+def relay_benchmark(megabytes, rounds):
+    """Best of rounds, alternating the cases so both see the same machine state"""
+    total = megabytes * 1024 * 1024
+    shaper = Shaper(rate=UNREACHED_RATE, per_ip_rate=UNREACHED_RATE)
+    best = {'no shaper': 0.0, 'shaper, limits unreached': 0.0}
+    for _ in range(rounds):
+        best['no shaper'] = max(best['no shaper'], copy_throughput(None, total))
+        flow = shaper.open('10.0.0.1').download
+        best['shaper, limits unreached'] = max(best['shaper, limits unreached'], copy_throughput(flow, total))
+    print(f"forward_copy() over socketpairs, {megabytes} MB, best of {rounds}")
+    for label, rate in best.items():
+        print(f"  {label:<26} {rate:9,.1f} MB/s")
+
+
+def fairness_benchmark(rate, duration):
+    """Three flows from two IPs under one listener rate; IP a stops halfway
+
+    Each half is measured over its second quarter of the run, after the
+    initial bursts and the fair-share recount have settled.
+    """
+    shaper = Shaper(rate=rate, per_ip_rate=rate * 0.8)
+    moved = {}
+    lock = threading.Lock()
+    windows = (('first', duration / 4, duration / 2), ('second', duration * 3 / 4, duration))
+    start = time.monotonic()
+
+    def flow_worker(name, ip, stop_at):
+        flow = shaper.open(ip).download
+        while time.monotonic() - start < stop_at:
+            throttle(flow, CHUNK)
+            elapsed = time.monotonic() - start
+            for phase, begin, end in windows:
+                if begin <= elapsed < end:
+                    with lock:
+                        moved[(name, phase)] = moved.get((name, phase), 0) + CHUNK
+
+    workers = [
+        threading.Thread(target=flow_worker, args=('a1', 'a', duration / 2)),
+        threading.Thread(target=flow_worker, args=('a2', 'a', duration / 2)),
+        threading.Thread(target=flow_worker, args=('b', 'b', duration)),
+    ]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    window = duration / 4
+    print(f"Fair share: listener {rate / 1e6:.0f} MB/s, per IP {rate * 0.8 / 1e6:.0f} MB/s, "
+          f"flows a1+a2 from IP a, b from IP b")
+    for phase, label in (('first', 'all three active'), ('second', 'IP a idle')):
+        rates = {name: moved.get((name, phase), 0) / window / 1e6 for name in ('a1', 'a2', 'b')}
+        print(f"  {label:<18} a1 {rates['a1']:5.2f}  a2 {rates['a2']:5.2f}  b {rates['b']:5.2f}  "
+              f"total {sum(rates.values()):5.2f} MB/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bandwidth shaper benchmark')
+    parser.add_argument('--count', type=int, default=200000, help='throttle() calls per overhead case')
+    parser.add_argument('--megabytes', type=int, default=512, help='Data copied per forward_copy() case')
+    parser.add_argument('--rounds', type=int, default=3, help='Rounds of the forward_copy() cases')
+    parser.add_argument('--rate', type=float, default=20, help='Listener rate in MB/s for the fairness case')
+    parser.add_argument('--duration', type=float, default=8, help='Seconds of the fairness case')
+    args = parser.parse_args()
+
+    overhead_benchmark(args.count)
+    relay_benchmark(args.megabytes, args.rounds)
+    fairness_benchmark(args.rate * 1e6, args.duration)
+
+
+if __name__ == "__main__":
+    main()
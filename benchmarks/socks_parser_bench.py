@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Mastermind SOCKS parser benchmark
+Measures handshakes per second through proxylib.socks.SocksParser
+Author: Mastermind
+"""
+
+import argparse
+import os
+import socket
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'proxies'))
+
+from proxylib.socks import SocksParser, GREETING, METHOD_NO_AUTH
+
+# Sample handshakes as a client would send them
+SOCKS4 = struct.pack(">BBH", 4, 1, 443) + socket.inet_aton("93.184.216.34") + b"mastermind\x00"
+SOCKS4A = struct.pack(">BBH", 4, 1, 443) + b"\x00\x00\x00\x01" + b"mastermind\x00" + b"example.com\x00"
+SOCKS5_GREETING = b"\x05\x01\x00"
+SOCKS5_REQUEST = b"\x05\x01\x00\x03" + bytes([11]) + b"example.com" + struct.pack(">H", 443)
+SOCKS5 = SOCKS5_GREETING + SOCKS5_REQUEST
+
+
+def split(data, segmentation):
+    """Split a handshake the way it might arrive from recv()"""
+    if segmentation == 'single':
+        return [data]
+    if segmentation == 'bytes':
+        return [data[i:i + 1] for i in range(len(data))]
+    # 'halves': two segments cut through the middle of a message
+    middle = len(data) // 2
+    return [data[:middle], data[middle:]]
+
+
+def handshake(segments):
+    parser = SocksParser()
+    for segment in segments:
+        parser.feed(segment)
+        while True:
+            event = parser.next_event()
+            if event is None:
+                break
+            kind, value = event
+            if kind == GREETING:
+                parser.select_method(METHOD_NO_AUTH)
+            else:
+                return value
+    raise RuntimeError("Handshake did not complete")
+
+
+def run(name, data, segmentation, duration):
+    segments = split(data, segmentation)
+    count = 0
+    start = time.perf_counter()
+    deadline = start + duration
+    while True:
+        for _ in range(1000):
+            handshake(segments)
+        count += 1000
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+    rate = count / (now - start)
+    print(f"{name:<8} {segmentation:<8} {rate:>12,.0f} handshakes/s")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SOCKS parser handshakes-per-second benchmark')
+    parser.add_argument('--duration', type=float, default=1.0, help='Seconds per case')
+    args = parser.parse_args()
+
+    for name, data in (('socks4', SOCKS4), ('socks4a', SOCKS4A), ('socks5', SOCKS5)):
+        for segmentation in ('single', 'halves', 'bytes'):
+            run(name, data, segmentation, args.duration)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Mastermind WEBSOCKET SYSTEMCTL response benchmark
+Response rendering cost, HTTP requests/s through websocket-systemctl, and config reload latency
+Author: Mastermind
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+PROXIES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'proxies')
+sys.path.insert(0, PROXIES_DIR)
+
+from proxylib.http import ResponseTemplate
+
+REQUEST = b"GET /path HTTP/1.1\r\nHost: bug.example.com\r\nUser-Agent: bench\r\n\r\n"
+RESPONSE_CONFIG = "websocket-systemctl-http-response.conf"
+
+
+def render_benchmarks(duration):
+    """Per-response cost of the pre-rendered templates"""
+    import importlib.util
+    spec = importlib.util.spec_from_file_location('systemctl', os.path.join(PROXIES_DIR, 'websocket-systemctl.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    branding = "X-Powered-By: Mastermind VPS Management\r\n"
+    templates = {
+        200: (ResponseTemplate("HTTP/1.1 200 OK\r\nContent-Length: {content_length}\r\n" + branding + "\r\n",
+                               module.HTTP_200_BODY),
+              dict(host=b"bug.example.com", path=b"/path", active=b"12", total=b"3456")),
+        301: (ResponseTemplate("HTTP/1.1 301 Moved Permanently\r\nLocation: https://{host}{path}\r\n"
+                               "Content-Length: {content_length}\r\n" + branding + "\r\n", module.HTTP_301_BODY),
+              dict(host=b"bug.example.com", path=b"/path")),
+    }
+
+    print("Render response")
+    for status, (template, values) in templates.items():
+        count = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration:
+            template.render(**values)
+            count += 1
+        print(f"  HTTP {status}  {(time.perf_counter() - start) / count * 1e6:>8.2f} us")
+
+
+def start_proxy(script, port, workdir, response_type):
+    config_dir = os.path.join(workdir, 'config', 'proxies')
+    os.makedirs(config_dir, exist_ok=True)
+    with open(os.path.join(config_dir, RESPONSE_CONFIG), 'w') as f:
+        f.write(f"HTTP_RESPONSE_TYPE={response_type}\n")
+
+    proxy = subprocess.Popen(
+        [sys.executable, script, '--host', '127.0.0.1', '--port', str(port), '--max-per-ip', '0'],
+        cwd=workdir, env=dict(os.environ, PYTHONPATH=PROXIES_DIR),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 10
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return proxy, config_dir
+        except OSError:
+            if time.time() > deadline:
+                proxy.terminate()
+                raise
+            time.sleep(0.1)
+
+
+def fetch(port):
+    """One request on a fresh connection; returns the status line"""
+    with socket.create_connection(('127.0.0.1', port)) as sock:
+        sock.sendall(REQUEST)
+        data = b""
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    return data.split(b"\r\n", 1)[0]
+
+
+def throughput(port, clients, duration):
+    counts = [0] * clients
+    stop = time.time() + duration
+
+    def client(index):
+        while time.time() < stop:
+            fetch(port)
+            counts[index] += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / duration
+
+
+def reload_latency(port, config_dir, timeout=10):
+    """Seconds from rewriting the response type until the proxy serves it, or None"""
+    before = fetch(port)
+    with open(os.path.join(config_dir, RESPONSE_CONFIG), 'w') as f:
+        f.write("HTTP_RESPONSE_TYPE=301\n")
+    start = time.time()
+    while time.time() - start < timeout:
+        status = fetch(port)
+        if status != before:
+            return time.time() - start, status.decode()
+        time.sleep(0.01)
+    return None, before.decode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='websocket-systemctl response benchmark')
+    parser.add_argument('--script', default=os.path.join(PROXIES_DIR, 'websocket-systemctl.py'),
+                        help='Proxy script to run, e.g. a checkout of an older revision')
+    parser.add_argument('--port', type=int, default=18004)
+    parser.add_argument('--clients', type=int, default=8, help='Concurrent request loops')
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds per measurement')
+    args = parser.parse_args()
+
+    render_benchmarks(min(args.duration, 2.0))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        proxy, config_dir = start_proxy(args.script, args.port, workdir, 200)
+        try:
+            print(f"HTTP 200 over fresh connections ({args.clients} clients)")
+            print(f"  {throughput(args.port, args.clients, args.duration):>10,.0f} requests/s")
+
+            latency, status = reload_latency(args.port, config_dir)
+            if latency is None:
+                print(f"Config reload: not applied live (still {status})")
+            else:
+                print(f"Config reload: {status} served {latency * 1000:.0f} ms after the edit")
+        finally:
+            proxy.terminate()
+            proxy.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Mastermind TCP bypass benchmark
+Tunnel setup rate and bulk throughput of python-tcp-bypass: splice vs copy relay
+Author: Mastermind
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+PROXIES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'proxies')
+
+CHUNK = 65536
+BANNER = b"SSH-2.0-bench\r\n"
+PAYLOAD = (b"GET / HTTP/1.1\r\nHost: bug.example.com\r\nUpgrade: websocket\r\n"
+           b"Connection: Keep-Alive\r\nUser-Agent: bench\r\n\r\n")
+
+
+def ssh_like_server():
+    """Backend that sends an SSH banner and then echoes everything"""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(256)
+
+    def serve(conn):
+        buffer = bytearray(CHUNK)
+        view = memoryview(buffer)
+        with conn:
+            try:
+                conn.sendall(BANNER)
+                while True:
+                    received = conn.recv_into(buffer)
+                    if not received:
+                        return
+                    conn.sendall(view[:received])
+            except OSError:
+                pass
+
+    def accept():
+        while True:
+            conn, _ = listener.accept()
+            threading.Thread(target=serve, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def start_proxy(port, backend, relay_mode):
+    proxy = subprocess.Popen(
+        [sys.executable, os.path.join(PROXIES_DIR, 'python-tcp-bypass.py'), '--host', '127.0.0.1',
+         '--port', str(port), '--backend', f'127.0.0.1:{backend}', '--relay', relay_mode,
+         '--max-per-ip', '0'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 10
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return proxy
+        except OSError:
+            if time.time() > deadline:
+                proxy.terminate()
+                raise
+            time.sleep(0.1)
+
+
+def open_tunnel(port, payload=PAYLOAD):
+    """Send the payload and wait for the status line and SSH banner"""
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.sendall(payload)
+    data = b""
+    while BANNER not in data:
+        chunk = sock.recv(4096)
+        if not chunk:
+            raise ConnectionError(f"Tunnel closed early: {data[:80]!r}")
+        data += chunk
+    return sock
+
+
+def tunnel_rate(port, count, concurrency, payload=PAYLOAD):
+    """Open and close count tunnels from concurrency threads; returns tunnels/s"""
+    per_thread = count // concurrency
+
+    def worker():
+        for _ in range(per_thread):
+            open_tunnel(port, payload).close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return per_thread * concurrency / (time.perf_counter() - start)
+
+
+def throughput(sock, total):
+    """Echo total bytes through sock; returns MB/s each way"""
+    payload = os.urandom(CHUNK)
+    sender = threading.Thread(target=lambda: [sock.sendall(payload) for _ in range(total // CHUNK)])
+    start = time.perf_counter()
+    sender.start()
+    got = 0
+    while got < total:
+        data = sock.recv(CHUNK * 4)
+        if not data:
+            raise ConnectionError("Tunnel closed early")
+        got += len(data)
+    elapsed = time.perf_counter() - start
+    sender.join()
+    return total / elapsed / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TCP bypass proxy benchmark')
+    parser.add_argument('--tunnels', type=int, default=2000, help='Tunnels opened per setup-rate case')
+    parser.add_argument('--concurrency', type=int, default=8, help='Client threads opening tunnels')
+    parser.add_argument('--megabytes', type=int, default=256, help='Data echoed per throughput case')
+    parser.add_argument('--port', type=int, default=18808, help='Port for the python-tcp-bypass instance under test')
+    args = parser.parse_args()
+
+    backend = ssh_like_server()
+    total = args.megabytes * 1024 * 1024
+
+    print("Direct backend")
+    sock = socket.create_connection(('127.0.0.1', backend))
+    sock.recv(len(BANNER))
+    print(f"  throughput                  {throughput(sock, total):>10,.1f} MB/s")
+    sock.close()
+
+    for relay_mode in ('splice', 'copy'):
+        proxy = start_proxy(args.port, backend, relay_mode)
+        try:
+            print(f"python-tcp-bypass --relay {relay_mode}")
+            rate = tunnel_rate(args.port, args.tunnels, args.concurrency)
+            print(f"  tunnels/s with payload      {rate:>10,.0f}")
+            rate = tunnel_rate(args.port, args.tunnels, args.concurrency, b"SSH-2.0-client\r\n")
+            print(f"  tunnels/s plain SSH         {rate:>10,.0f}")
+            sock = open_tunnel(args.port)
+            print(f"  throughput                  {throughput(sock, total):>10,.1f} MB/s")
+            sock.close()
+        finally:
+            proxy.terminate()
+            proxy.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Mastermind UDP relay benchmark
+Packets/s and per-packet round-trip latency through python-simple's SOCKS5 UDP ASSOCIATE vs direct UDP
+Author: Mastermind
+"""
+
+import argparse
+import multiprocessing
+import os
+import socket
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+PROXIES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'proxies')
+sys.path.insert(0, PROXIES_DIR)
+
+from proxylib.udp import udp_header
+
+
+def echo_server(port, ready):
+    """UDP echo on its own process, so it does not share a GIL with the load generator"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    sock.bind(('127.0.0.1', port))
+    ready.set()
+    buffer = bytearray(65535)
+    view = memoryview(buffer)
+    while True:
+        size, address = sock.recvfrom_into(buffer)
+        sock.sendto(view[:size], address)
+
+
+def start_proxy(port, mode, workdir):
+    proxy = subprocess.Popen(
+        [sys.executable, os.path.join(PROXIES_DIR, 'python-simple.py'), '--host', '127.0.0.1',
+         '--port', str(port), '--mode', mode, '--max-per-ip', '0'],
+        cwd=workdir, env=dict(os.environ, PYTHONPATH=PROXIES_DIR),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 10
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return proxy
+        except OSError:
+            if time.time() > deadline:
+                proxy.terminate()
+                raise
+            time.sleep(0.1)
+
+
+def associate(port):
+    """Open a UDP ASSOCIATE; returns the control connection and the relay address"""
+    control = socket.create_connection(('127.0.0.1', port))
+    control.sendall(b"\x05\x01\x00" + b"\x05\x03\x00\x01" + socket.inet_aton("0.0.0.0") + struct.pack(">H", 0))
+    reply = b""
+    while len(reply) < 12:
+        chunk = control.recv(12 - len(reply))
+        if not chunk:
+            raise ConnectionError("Proxy closed the control connection")
+        reply += chunk
+    if reply[3] != 0x00:
+        raise RuntimeError(f"UDP ASSOCIATE refused (reply {reply[3]})")
+    relay = (socket.inet_ntoa(reply[6:10]), struct.unpack(">H", reply[10:12])[0])
+    return control, relay
+
+
+class Client:
+    """One UDP flow: direct to the echo server, or wrapped in SOCKS5 UDP headers through the relay"""
+
+    def __init__(self, echo, payload_size, proxy_port=None):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.control = None
+        payload = os.urandom(payload_size)
+        if proxy_port is None:
+            self.target = echo
+            self.datagram = payload
+        else:
+            self.control, self.target = associate(proxy_port)
+            self.datagram = udp_header(echo) + payload
+        self.sock.connect(self.target)
+
+    def close(self):
+        self.sock.close()
+        if self.control is not None:
+            self.control.close()
+
+
+def latency(client, count):
+    """Round-trip times in microseconds of count sequential datagrams"""
+    client.sock.settimeout(1.0)
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        client.sock.send(client.datagram)
+        try:
+            client.sock.recv(65535)
+        except socket.timeout:
+            continue
+        samples.append((time.perf_counter() - start) * 1e6)
+    return samples
+
+
+def throughput(clients, window, duration):
+    """Packets/s echoed with window datagrams in flight per client; returns (rate, lost)"""
+    received = [0] * len(clients)
+    lost = [0] * len(clients)
+    stop = time.perf_counter() + duration
+
+    def run(index, client):
+        sock = client.sock
+        sock.settimeout(0.2)
+        for _ in range(window):
+            sock.send(client.datagram)
+        while time.perf_counter() < stop:
+            try:
+                sock.recv(65535)
+            except socket.timeout:
+                # Refill the window after a loss
+                lost[index] += 1
+                sock.send(client.datagram)
+                continue
+            received[index] += 1
+            sock.send(client.datagram)
+
+    threads = [threading.Thread(target=run, args=(i, c)) for i, c in enumerate(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(received) / (time.perf_counter() - start), sum(lost)
+
+
+def report(label, samples, rate, lost):
+    samples.sort()
+    p99 = samples[int(len(samples) * 0.99) - 1] if samples else 0
+    median = statistics.median(samples) if samples else 0
+    print(f"  {label:<22} {rate:>10,.0f} packets/s  rtt p50 {median:>7.1f} us  p99 {p99:>7.1f} us"
+          f"  timeouts {lost}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SOCKS5 UDP ASSOCIATE relay benchmark')
+    parser.add_argument('--port', type=int, default=18801, help='Port for the python-simple instance under test')
+    parser.add_argument('--echo-port', type=int, default=18802, help='Port of the local UDP echo server')
+    parser.add_argument('--mode', choices=['asyncio', 'thread'], default='asyncio', help='python-simple engine')
+    parser.add_argument('--clients', type=int, default=4, help='Concurrent UDP flows')
+    parser.add_argument('--window', type=int, default=32, help='Datagrams in flight per flow')
+    parser.add_argument('--size', type=int, default=160, help='Payload bytes per datagram (VoIP/game sized)')
+    parser.add_argument('--samples', type=int, default=2000, help='Sequential round trips for the latency figures')
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds of the packets/s run')
+    args = parser.parse_args()
+
+    ready = multiprocessing.Event()
+    echo = multiprocessing.Process(target=echo_server, args=(args.echo_port, ready), daemon=True)
+    echo.start()
+    ready.wait(5)
+    echo_address = ('127.0.0.1', args.echo_port)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        proxy = start_proxy(args.port, args.mode, workdir)
+        try:
+            print(f"{args.clients} flows, {args.window} datagrams in flight each, {args.size} B payloads")
+            for label, proxy_port in (("direct UDP", None), (f"UDP ASSOCIATE ({args.mode})", args.port)):
+                clients = [Client(echo_address, args.size, proxy_port) for _ in range(args.clients)]
+                samples = latency(clients[0], args.samples)
+                rate, lost = throughput(clients, args.window, args.duration)
+                report(label, samples, rate, lost)
+                for client in clients:
+                    client.close()
+        finally:
+            proxy.terminate()
+            proxy.wait()
+            echo.terminate()
+
+
+if __name__ == '__main__':
+    main()
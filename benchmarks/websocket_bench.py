@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Mastermind WebSocket tunnel benchmark
+Frame codec speed and echo throughput: raw TCP vs the ws-directo or websocket-systemctl tunnel
+Author: Mastermind
+"""
+
+import argparse
+import base64
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+PROXIES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'proxies')
+sys.path.insert(0, PROXIES_DIR)
+
+from proxylib.websocket import FrameParser, apply_mask, encode_frame, frame_header, OP_BINARY, DATA
+
+CHUNK = 65536
+MASK = b"\x37\xfa\x21\x3d"
+BANNER = b"SSH-2.0-bench\r\n"
+
+# Tunnelling proxies: script and the config file that puts them in tunnel mode
+PROXIES = {
+    'ws-directo': ('ws-directo.py', None),
+    'websocket-systemctl': ('websocket-systemctl.py',
+                            ('websocket-systemctl-http-response.conf', "HTTP_RESPONSE_TYPE=101\n")),
+}
+
+
+def mask_bytewise(data, key):
+    """Reference per-byte unmasking loop, for comparison"""
+    return bytes(b ^ key[i & 3] for i, b in enumerate(data))
+
+
+def rate(function, size, duration):
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        function()
+        count += 1
+    return count * size / (time.perf_counter() - start) / 1e6
+
+
+def codec_benchmarks(duration):
+    print("Codec")
+    for size in (1024, 16384, 65536):
+        payload = os.urandom(size)
+        bulk = rate(lambda: apply_mask(payload, MASK), size, duration)
+        print(f"  unmask bulk      {size:>6} B  {bulk:>10,.1f} MB/s")
+    payload = os.urandom(16384)
+    loop = rate(lambda: mask_bytewise(payload, MASK), 16384, duration)
+    print(f"  unmask per-byte  {16384:>6} B  {loop:>10,.1f} MB/s")
+
+    stream = encode_frame(OP_BINARY, os.urandom(16384), mask_key=MASK) * 64
+
+    def parse():
+        parser = FrameParser()
+        parser.feed(stream)
+        while parser.next_event() is not None:
+            pass
+
+    parsed = rate(parse, len(stream), duration)
+    print(f"  parse 16 KB frames          {parsed:>10,.1f} MB/s")
+
+
+def echo_server():
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(16)
+
+    def serve(conn):
+        buffer = bytearray(CHUNK)
+        view = memoryview(buffer)
+        with conn:
+            while True:
+                received = conn.recv_into(buffer)
+                if not received:
+                    return
+                conn.sendall(view[:received])
+
+    def accept():
+        while True:
+            conn, _ = listener.accept()
+            threading.Thread(target=serve, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def pump(sock, total, send_chunk, receive):
+    """Send total bytes in send_chunk() pieces while receive() drains the echo"""
+    sender = threading.Thread(target=lambda: [sock.sendall(send_chunk()) for _ in range(total // CHUNK)])
+    start = time.perf_counter()
+    sender.start()
+    receive(total)
+    elapsed = time.perf_counter() - start
+    sender.join()
+    return total / elapsed / 1e6
+
+
+def raw_receive(sock):
+    def receive(total):
+        got = 0
+        while got < total:
+            data = sock.recv(CHUNK * 4)
+            if not data:
+                raise ConnectionError("Tunnel closed early")
+            got += len(data)
+    return receive
+
+
+def websocket_receive(sock):
+    parser = FrameParser(require_mask=False)
+
+    def receive(total):
+        got = 0
+        while got < total:
+            event = parser.next_event()
+            if event is None:
+                data = sock.recv(CHUNK * 4)
+                if not data:
+                    raise ConnectionError("Tunnel closed early")
+                parser.feed(data)
+            elif event[0] == DATA:
+                got += len(event[1])
+    return receive
+
+
+def upgrade(port, key=True):
+    sock = socket.create_connection(('127.0.0.1', port))
+    request = "GET / HTTP/1.1\r\nHost: bench\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+    if key:
+        request += f"Sec-WebSocket-Key: {base64.b64encode(os.urandom(16)).decode()}\r\nSec-WebSocket-Version: 13\r\n"
+    sock.sendall((request + "\r\n").encode())
+    head = b""
+    while not head.endswith(b"\r\n\r\n"):
+        head += sock.recv(1)
+    if b" 101 " not in head.split(b"\r\n")[0]:
+        raise RuntimeError(f"Upgrade refused: {head[:80]!r}")
+    return sock
+
+
+def start_proxy(name, port, backend, workdir):
+    script, config = PROXIES[name]
+    if config is not None:
+        config_dir = os.path.join(workdir, 'config', 'proxies')
+        os.makedirs(config_dir, exist_ok=True)
+        with open(os.path.join(config_dir, config[0]), 'w') as f:
+            f.write(config[1])
+    return subprocess.Popen(
+        [sys.executable, os.path.join(PROXIES_DIR, script), '--host', '127.0.0.1',
+         '--port', str(port), '--backend', f'127.0.0.1:{backend}', '--max-per-ip', '0'],
+        cwd=workdir, env=dict(os.environ, PYTHONPATH=PROXIES_DIR),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def throughput_benchmarks(megabytes, port, name):
+    backend = echo_server()
+    workdir = tempfile.TemporaryDirectory()
+    proxy = start_proxy(name, port, backend, workdir.name)
+    try:
+        deadline = time.time() + 10
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port)).close()
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+
+        total = megabytes * 1024 * 1024
+        payload = os.urandom(CHUNK)
+        print(f"Echo throughput ({megabytes} MB each way)")
+
+        sock = socket.create_connection(('127.0.0.1', backend))
+        print(f"  raw TCP to backend          {pump(sock, total, lambda: payload, raw_receive(sock)):>10,.1f} MB/s")
+        sock.close()
+
+        sock = upgrade(port, key=False)
+        print(f"  {name} raw mode".ljust(38) + f"{pump(sock, total, lambda: payload, raw_receive(sock)):>10,.1f} MB/s")
+        sock.close()
+
+        if name == 'websocket-systemctl':
+            # SSH over WebSocket: a keyed upgrade, then the SSH banner and raw bytes
+            sock = upgrade(port)
+            sock.sendall(BANNER)
+            raw_receive(sock)(len(BANNER))
+            print(f"  {name} keyed raw".ljust(38) + f"{pump(sock, total, lambda: payload, raw_receive(sock)):>10,.1f} MB/s")
+            sock.close()
+
+        # Clients mask every frame; pre-masked frames keep the client side out of the measurement
+        frame = frame_header(OP_BINARY, CHUNK, mask_key=MASK) + apply_mask(payload, MASK)
+        sock = upgrade(port)
+        print(f"  {name} RFC 6455 frames".ljust(38) +
+              f"{pump(sock, total, lambda: frame, websocket_receive(sock)):>10,.1f} MB/s")
+        sock.close()
+    finally:
+        proxy.terminate()
+        proxy.wait()
+        workdir.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='WebSocket codec and tunnel benchmark')
+    parser.add_argument('--duration', type=float, default=1.0, help='Seconds per codec case')
+    parser.add_argument('--megabytes', type=int, default=256, help='Data echoed per throughput case')
+    parser.add_argument('--port', type=int, default=18805, help='Port for the proxy instance under test')
+    parser.add_argument('--proxy', choices=sorted(PROXIES), default='ws-directo', help='Tunnelling proxy to measure')
+    parser.add_argument('--codec-only', action='store_true', help='Skip the throughput cases')
+    args = parser.parse_args()
+
+    codec_benchmarks(args.duration)
+    if not args.codec_only:
+        throughput_benchmarks(args.megabytes, args.port, args.proxy)
+
+
+if __name__ == "__main__":
+    main()
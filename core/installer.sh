@@ -55,6 +55,8 @@ Wants=network.target
 
 [Service]
 Type=simple
+# Reload hands the listening socket to a new process, which the old one reports as MAINPID
+NotifyAccess=all
 User=root
 Group=root
 ExecStart=/usr/bin/python3 $script_file
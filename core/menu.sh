@@ -519,11 +519,36 @@ stop_proxy_service() {
 restart_proxy_service() {
     local service_name="$1"
     local proxy_name="$2"
+    local unit="mastermind-$service_name"
+    
+    # Units installed with NotifyAccess=all restart gracefully on reload: the running proxy
+    # hands its listening socket to a new process and drains its open tunnels
+    if systemctl is-active --quiet "$unit" && \
+       [[ "$(systemctl show --property=NotifyAccess --value "$unit")" == "all" ]]; then
+        local old_pid
+        old_pid=$(systemctl show --property=MainPID --value "$unit")
+        
+        info_message "Reloading $proxy_name without dropping connections..."
+        systemctl reload "$unit"
+        
+        local waited=0
+        while [[ "$(systemctl show --property=MainPID --value "$unit")" == "$old_pid" && $waited -lt 15 ]]; do
+            sleep 1
+            waited=$((waited + 1))
+        done
+        
+        if [[ "$(systemctl show --property=MainPID --value "$unit")" != "$old_pid" ]]; then
+            success_message "$proxy_name reloaded; the previous instance is draining its open tunnels"
+        else
+            warning_message "$proxy_name did not take over within ${waited}s; the running instance keeps serving"
+        fi
+        return
+    fi
     
     info_message "Restarting $proxy_name..."
-    systemctl restart "mastermind-$service_name"
+    systemctl restart "$unit"
     
-    if systemctl is-active --quiet "mastermind-$service_name"; then
+    if systemctl is-active --quiet "$unit"; then
         success_message "$proxy_name restarted successfully"
     else
         handle_error "Failed to restart $proxy_name"
@@ -766,8 +791,31 @@ ssh_tunnel_menu() {
 }
 
 udp_relay_menu() {
-    echo -e "${CYAN}UDP Relay functionality${NC}"
-    echo -e "${YELLOW}Available through protocol-specific configurations${NC}"
+    show_banner
+    echo -e "${WHITE}UDP RELAY (SOCKS5 UDP ASSOCIATE)${NC}"
+    echo -e "${WHITE}================================================================${NC}"
+    echo -e "${CYAN}Python SIMPLE:${NC} $(systemctl is-active mastermind-python-simple 2>/dev/null || echo 'inactive') - Port 8001/udp"
+    if ss -uln | grep -q ":8001 "; then
+        echo -e "${GREEN}UDP relay listening on 8001/udp${NC}"
+    else
+        echo -e "${YELLOW}UDP relay not listening (started with --no-udp or service stopped)${NC}"
+    fi
+    echo -e "${YELLOW}Clients enable UDP forwarding on a SOCKS5 connection to port 8001${NC}"
+    echo -e "${WHITE}================================================================${NC}"
+    echo -e "${CYAN}1.${NC} Allow 8001/udp in the firewall"
+    echo -e "${CYAN}2.${NC} Restart Python SIMPLE"
+    echo -e "${CYAN}0.${NC} Back"
+    echo -e "${WHITE}================================================================${NC}"
+    echo -e -n "${YELLOW}Please enter your choice [0-2]: ${NC}"
+    
+    read udp_choice
+    
+    case $udp_choice in
+        1) ufw allow 8001/udp && success_message "8001/udp allowed" ;;
+        2) systemctl restart mastermind-python-simple && success_message "Python SIMPLE restarted" ;;
+        0) return ;;
+        *) warning_message "Invalid option. Please try again." ;;
+    esac
 }
 
 port_forwarding_menu() {
@@ -1506,6 +1554,8 @@ configure_ufw_firewall() {
     for port in 8001 8002 8003 8004 8005 8006 8007 8008; do
         ufw allow $port/tcp
     done
+    # SOCKS5 UDP ASSOCIATE relay of Python SIMPLE
+    ufw allow 8001/udp
     
     ufw --force enable
     success_message "UFW firewall configured"
@@ -0,0 +1,5 @@
+"""
+Mastermind proxy library
+Shared building blocks for the Python proxies in proxies/
+Author: Mastermind
+"""
@@ -0,0 +1,312 @@
+"""
+Mastermind proxy admission control
+Caps concurrent connections per proxy, per source IP and in handshake
+Author: Mastermind
+"""
+
+import collections
+import contextvars
+import selectors
+import socket
+import struct
+import threading
+import time
+
+DEFAULT_MAX_CONNECTIONS = 2048
+DEFAULT_MAX_PER_IP = 128
+DEFAULT_MAX_HANDSHAKES = 256
+DEFAULT_BACKLOG = 50
+# Seconds a refused client gets to send its first bytes, read on the reject thread
+REJECT_WAIT = 1.0
+# Refused sockets waiting for their first bytes; past this they are closed at once
+MAX_PENDING_REJECTS = 256
+# Reject thread wake-up interval, the granularity of REJECT_WAIT and of new hand-overs
+REJECT_TICK = 0.05
+
+# Fast-reject replies
+SOCKS4_REJECT = struct.pack(">BBHI", 0, 91, 0, 0)
+# Method selection immediately followed by "general SOCKS server failure"
+SOCKS5_REJECT = b"\x05\x00" + b"\x05\x01\x00\x01" + socket.inet_aton("0.0.0.0") + struct.pack(">H", 0)
+HTTP_REJECT = (
+    b"HTTP/1.1 503 Service Unavailable\r\n"
+    b"Retry-After: 5\r\n"
+    b"Content-Length: 0\r\n"
+    b"Connection: close\r\n"
+    b"Server: Mastermind-Proxy/2.0\r\n\r\n"
+)
+
+# Ticket of the connection being served by the current thread or task
+current_ticket = contextvars.ContextVar('mastermind_admission_ticket', default=None)
+
+
+class AdmissionTicket:
+    """Slots held by one admitted connection"""
+
+    __slots__ = ('control', 'ip', 'handshaking', 'released', 'admitted_at', 'established_at', 'trace')
+
+    def __init__(self, control, ip, trace=None):
+        self.control = control
+        self.ip = ip
+        self.handshaking = True
+        self.released = False
+        self.admitted_at = time.monotonic()
+        self.established_at = None
+        self.trace = trace
+
+    def activate(self):
+        """Make this the ticket of the current thread or task"""
+        current_ticket.set(self)
+
+    def handshake_done(self):
+        """Give back the handshake slot once the tunnel is established"""
+        if self.handshaking:
+            self.handshaking = False
+            self.established_at = time.monotonic()
+            self.control.end_handshake(self)
+
+    def release(self):
+        """Give back every slot held by this connection"""
+        if not self.released:
+            self.released = True
+            self.control.release(self)
+            self.handshaking = False
+
+
+def handshake_done():
+    """Mark the handshake of the current connection as finished"""
+    ticket = current_ticket.get()
+    if ticket is not None:
+        ticket.handshake_done()
+
+
+def current_client_ip():
+    """Source IP of the connection being served, or None outside a ticket"""
+    ticket = current_ticket.get()
+    return ticket.ip if ticket is not None else None
+
+
+class AdmissionControl:
+    """Thread-safe connection limits with rejection counters
+
+    A limit of 0 disables that check. When metrics (a ProxyMetrics) is
+    given, handshake and tunnel times are observed as tickets finish.
+    With a tracer (a ConnectionTracer) every ticket carries the stage
+    trace of its connection.
+    """
+
+    def __init__(self, max_connections=DEFAULT_MAX_CONNECTIONS, max_per_ip=DEFAULT_MAX_PER_IP,
+                 max_handshakes=DEFAULT_MAX_HANDSHAKES, metrics=None, tracer=None):
+        self.max_connections = max_connections
+        self.max_per_ip = max_per_ip
+        self.max_handshakes = max_handshakes
+        self.metrics = metrics
+        self.tracer = tracer
+        self._lock = threading.Lock()
+
+        self.active = 0
+        self.handshaking = 0
+        self.per_ip = {}
+
+        # Statistics
+        self.admitted = 0
+        self.rejected_connections = 0
+        self.rejected_per_ip = 0
+        self.rejected_handshakes = 0
+
+    def admit(self, ip, sock=None):
+        """Reserve slots for a new connection; returns a ticket or None
+
+        sock, the accepted socket, lets the tracer read how long the
+        connection waited in the listen queue.
+        """
+        with self._lock:
+            if self.max_connections and self.active >= self.max_connections:
+                self.rejected_connections += 1
+                return None
+            if self.max_handshakes and self.handshaking >= self.max_handshakes:
+                self.rejected_handshakes += 1
+                return None
+            count = self.per_ip.get(ip, 0)
+            if self.max_per_ip and count >= self.max_per_ip:
+                self.rejected_per_ip += 1
+                return None
+
+            self.per_ip[ip] = count + 1
+            self.active += 1
+            self.handshaking += 1
+            self.admitted += 1
+        return AdmissionTicket(self, ip, self.tracer.begin(ip, sock) if self.tracer is not None else None)
+
+    def end_handshake(self, ticket):
+        with self._lock:
+            self.handshaking -= 1
+        if self.metrics is not None:
+            self.metrics.handshake_time.observe(ticket.established_at - ticket.admitted_at)
+        if ticket.trace is not None:
+            ticket.trace.mark_established()
+
+    def release(self, ticket):
+        ip = ticket.ip
+        with self._lock:
+            self.active -= 1
+            if ticket.handshaking:
+                self.handshaking -= 1
+            count = self.per_ip.get(ip, 0) - 1
+            if count > 0:
+                self.per_ip[ip] = count
+            else:
+                self.per_ip.pop(ip, None)
+        if self.metrics is not None:
+            if ticket.handshaking:
+                self.metrics.handshake_failures.inc()
+            else:
+                self.metrics.tunnel_duration.observe(time.monotonic() - ticket.established_at)
+        if ticket.trace is not None:
+            ticket.trace.finish()
+
+    def stats(self):
+        """Return a snapshot of admission counters"""
+        with self._lock:
+            return {
+                'active': self.active,
+                'handshaking': self.handshaking,
+                'source_ips': len(self.per_ip),
+                'admitted': self.admitted,
+                'rejected_connections': self.rejected_connections,
+                'rejected_per_ip': self.rejected_per_ip,
+                'rejected_handshakes': self.rejected_handshakes,
+                'rejected_total': self.rejected_connections + self.rejected_per_ip + self.rejected_handshakes,
+            }
+
+    def format_stats(self):
+        """One-line summary for the periodic stats log"""
+        s = self.stats()
+        return (f"Admission - Handshaking: {s['handshaking']}, Source IPs: {s['source_ips']}, "
+                f"Rejected: {s['rejected_total']} (limit {s['rejected_connections']}, "
+                f"per-IP {s['rejected_per_ip']}, handshake {s['rejected_handshakes']})")
+
+
+def rejection_for(data, http=False):
+    """Pick the fast-reject reply matching the client's first bytes"""
+    if data[:1] == b"\x04":
+        return SOCKS4_REJECT
+    if data[:1] == b"\x05":
+        return SOCKS5_REJECT
+    return HTTP_REJECT if http else b""
+
+
+def answer_rejected(client_socket, data, http=False):
+    """Send the fast-reject reply matching data and close the socket
+
+    data has been read off the socket, so close() ends with a FIN rather
+    than a reset that could discard the reply.
+    """
+    try:
+        reply = rejection_for(data, http)
+        if reply:
+            client_socket.send(reply)
+    except OSError:
+        pass
+    finally:
+        client_socket.close()
+
+
+class Rejector:
+    """Replies to refused connections without blocking the accept loop
+
+    A SOCKS greeting rarely arrives together with the accept, so a
+    refused socket whose first bytes are not there yet is handed to one
+    daemon thread. It waits up to REJECT_WAIT for them on a selector,
+    replies and closes; a client still silent by then is closed without
+    a reply (HTTP proxies send their 503 regardless). Past max_pending
+    waiting sockets a refused connection is answered at once. The thread
+    exits when nothing is left to wait for and is started again, also in
+    a forked worker, by the next hand-over.
+    """
+
+    def __init__(self, wait=REJECT_WAIT, max_pending=MAX_PENDING_REJECTS):
+        self.wait = wait
+        self.max_pending = max_pending
+        self.incoming = collections.deque()
+        self.pending = 0
+        self.thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, client_socket, http=False):
+        """Take over a refused socket; never blocks"""
+        try:
+            client_socket.setblocking(False)
+            data = client_socket.recv(1024)
+        except BlockingIOError:
+            data = None
+        except OSError:
+            data = b""
+        if data is not None:
+            answer_rejected(client_socket, data, http)
+            return
+
+        with self._lock:
+            full = self.pending >= self.max_pending
+            if not full:
+                self.pending += 1
+                self.incoming.append((client_socket, http, time.monotonic() + self.wait))
+                if self.thread is None or not self.thread.is_alive():
+                    self.thread = threading.Thread(target=self.run)
+                    self.thread.daemon = True
+                    self.thread.start()
+        if full:
+            answer_rejected(client_socket, b"", http)
+
+    def run(self):
+        """Reject thread: answer each waiting socket once it is readable or its wait is over"""
+        selector = selectors.DefaultSelector()
+        try:
+            while True:
+                with self._lock:
+                    if not self.incoming and not selector.get_map():
+                        self.thread = None
+                        return
+                    while self.incoming:
+                        client_socket, http, deadline = self.incoming.popleft()
+                        selector.register(client_socket, selectors.EVENT_READ, (http, deadline))
+
+                finished = []
+                for key, _ in selector.select(REJECT_TICK):
+                    try:
+                        data = key.fileobj.recv(1024)
+                    except OSError:
+                        data = b""
+                    finished.append((key, data))
+                now = time.monotonic()
+                ready = {key.fileobj for key, _ in finished}
+                finished.extend((key, b"") for key in selector.get_map().values()
+                                if key.data[1] <= now and key.fileobj not in ready)
+
+                for key, data in finished:
+                    selector.unregister(key.fileobj)
+                    answer_rejected(key.fileobj, data, key.data[0])
+                if finished:
+                    with self._lock:
+                        self.pending -= len(finished)
+        finally:
+            selector.close()
+
+
+rejector = Rejector()
+
+
+def reject_connection(client_socket, http=False):
+    """Refuse a connection from the accept loop without blocking it"""
+    rejector.submit(client_socket, http)
+
+
+def add_admission_arguments(parser):
+    """Register the admission-control command line options"""
+    parser.add_argument("--max-connections", type=int, default=DEFAULT_MAX_CONNECTIONS,
+                        help="Maximum concurrent connections (0 = unlimited)")
+    parser.add_argument("--max-per-ip", type=int, default=DEFAULT_MAX_PER_IP,
+                        help="Maximum concurrent connections per source IP (0 = unlimited)")
+    parser.add_argument("--max-handshakes", type=int, default=DEFAULT_MAX_HANDSHAKES,
+                        help="Maximum connections still in handshake (0 = unlimited)")
+    parser.add_argument("--backlog", type=int, default=DEFAULT_BACKLOG,
+                        help="listen() backlog of the accept queue")
@@ -0,0 +1,316 @@
+"""
+Mastermind proxy authentication
+Username/password backend: file or SQLite users, scrypt hashes, TTL cache and per-IP throttling
+Author: Mastermind
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# scrypt cost: 16 MB and roughly 50 ms per verification
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SCRYPT_SALT_SIZE = 16
+SCRYPT_KEY_SIZE = 32
+
+DEFAULT_CACHE_TTL = 300
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_MAX_FAILURES = 5
+DEFAULT_FAILURE_WINDOW = 60
+DEFAULT_LOCKOUT = 60
+# Seconds between checks of the user sources for changes
+DEFAULT_RELOAD_INTERVAL = 5
+# Failure records kept before stale ones are swept
+MAX_TRACKED_IPS = 10000
+
+# Mastermind web panel database (see web/app.py)
+DEFAULT_USERS_DB = "/etc/mastermind/mastermind.db"
+
+
+def hash_password(password):
+    """Return an scrypt hash string for password"""
+    salt = os.urandom(SCRYPT_SALT_SIZE)
+    key = hashlib.scrypt(password.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P,
+                         dklen=SCRYPT_KEY_SIZE)
+    return (f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$"
+            f"{base64.b64encode(salt).decode()}${base64.b64encode(key).decode()}")
+
+
+def verify_password(stored, password):
+    """Check password against a stored hash
+
+    Accepts the scrypt format written by hash_password() and, for users
+    created by the web panel, bare SHA-256 hex digests.
+    """
+    if stored.startswith('scrypt$'):
+        try:
+            _, n, r, p, salt, expected = stored.split('$')
+            salt = base64.b64decode(salt)
+            expected = base64.b64decode(expected)
+            key = hashlib.scrypt(password.encode(), salt=salt, n=int(n), r=int(r), p=int(p),
+                                 dklen=len(expected))
+        except ValueError:
+            return False
+        return hmac.compare_digest(key, expected)
+    if len(stored) == 64:
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored.lower())
+    return False
+
+
+class FileUserSource:
+    """username:hash lines in a text file; # starts a comment"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def version(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def load(self):
+        users = {}
+        if not os.path.exists(self.path):
+            return users
+        with open(self.path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                username, sep, stored = line.partition(':')
+                if sep and username and stored:
+                    users[username.strip()] = stored.strip()
+        return users
+
+    def __str__(self):
+        return self.path
+
+
+class SQLiteUserSource:
+    """Active rows of the users table in the Mastermind database"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def version(self):
+        # Writes in WAL mode touch the -wal file, not the database itself
+        versions = []
+        for path in (self.path, self.path + '-wal'):
+            try:
+                st = os.stat(path)
+                versions.append((st.st_ino, st.st_size, st.st_mtime_ns))
+            except OSError:
+                versions.append(None)
+        return tuple(versions) if versions[0] else None
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=5)
+        try:
+            rows = conn.execute('SELECT username, password_hash FROM users WHERE is_active = 1').fetchall()
+        finally:
+            conn.close()
+        return {username: stored for username, stored in rows}
+
+    def __str__(self):
+        return self.path
+
+
+class Authenticator:
+    """Thread-safe credential check shared by every connection of a proxy
+
+    - users are merged from sources in order, later sources winning,
+      and reloaded when a source changes on disk (checked at most every
+      reload_interval seconds, on the next attempt)
+    - successful verifications are cached for cache_ttl seconds, keyed
+      by a keyed digest of the credentials rather than the password, so
+      a reconnecting client skips the KDF; a changed hash misses
+    - max_failures failed attempts from one IP within failure_window
+      seconds lock that IP out for lockout seconds, without running the
+      KDF; at most one KDF per CPU runs at a time
+    """
+
+    def __init__(self, sources, cache_ttl=DEFAULT_CACHE_TTL, cache_size=DEFAULT_CACHE_SIZE,
+                 max_failures=DEFAULT_MAX_FAILURES, failure_window=DEFAULT_FAILURE_WINDOW,
+                 lockout=DEFAULT_LOCKOUT, reload_interval=DEFAULT_RELOAD_INTERVAL, logger=None):
+        self.sources = list(sources)
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.max_failures = max_failures
+        self.failure_window = failure_window
+        self.lockout = lockout
+        self.reload_interval = reload_interval
+        self.logger = logger
+
+        self._lock = threading.Lock()
+        self._kdf_slots = threading.BoundedSemaphore(os.cpu_count() or 1)
+        self._cache_key = os.urandom(32)
+        # Verified instead of a real hash for unknown users
+        self._dummy_hash = hash_password(os.urandom(16).hex())
+        self._cache = OrderedDict()
+        # ip -> [failures in window, window start, locked until]
+        self._failures = {}
+
+        self.users = {}
+        self._loaded = [{} for _ in self.sources]
+        self._versions = None
+        self._next_check = 0.0
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+        self.successes = 0
+        self.failures = 0
+        self.throttled = 0
+        self.lockouts = 0
+        self.reloads = 0
+
+        self.reload()
+
+    def reload(self):
+        """Re-read every source; one that cannot be read keeps the users it last had"""
+        for index, source in enumerate(self.sources):
+            try:
+                self._loaded[index] = source.load()
+            except (OSError, sqlite3.Error) as e:
+                if self.logger:
+                    self.logger.error(f"Cannot load users from {source}: {e}")
+        users = {}
+        for loaded in self._loaded:
+            users.update(loaded)
+        with self._lock:
+            self.users = users
+            self._versions = [source.version() for source in self.sources]
+            self.reloads += 1
+        if self.logger:
+            self.logger.info(f"Loaded {len(users)} proxy users from {', '.join(map(str, self.sources))}")
+
+    def check_reload(self):
+        """Reload if a source changed since the last load"""
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_check:
+                return
+            self._next_check = now + self.reload_interval
+            versions = self._versions
+        if [source.version() for source in self.sources] != versions:
+            self.reload()
+
+    def throttled_ip(self, ip, now):
+        """Return True if ip is locked out; caller holds the lock"""
+        entry = self._failures.get(ip)
+        if entry is None:
+            return False
+        if entry[2] > now:
+            return True
+        if entry[2] or now - entry[1] > self.failure_window:
+            del self._failures[ip]
+        return False
+
+    def record_failure(self, ip, now):
+        """Count a failed attempt; caller holds the lock"""
+        self.failures += 1
+        if not self.max_failures:
+            return
+        if len(self._failures) >= MAX_TRACKED_IPS:
+            for stale in [key for key, (_, start, until) in self._failures.items()
+                          if until <= now and now - start > self.failure_window]:
+                del self._failures[stale]
+        entry = self._failures.get(ip)
+        if entry is None:
+            entry = self._failures[ip] = [0, now, 0.0]
+        entry[0] += 1
+        if entry[0] >= self.max_failures:
+            entry[2] = now + self.lockout
+            self.lockouts += 1
+            if self.logger:
+                self.logger.warning(f"Locked out {ip} for {self.lockout}s after {entry[0]} failed logins")
+
+    def authenticate(self, username, password, ip):
+        """Return True if the credentials are valid and ip is not locked out"""
+        self.check_reload()
+        digest = hmac.new(self._cache_key, f"{username}\0{password}".encode(), hashlib.sha256).digest()
+        now = time.monotonic()
+
+        with self._lock:
+            if self.throttled_ip(ip, now):
+                self.throttled += 1
+                return False
+            stored = self.users.get(username)
+            entry = self._cache.get(digest)
+            if entry is not None and entry[0] > now and entry[1] == stored:
+                self._cache.move_to_end(digest)
+                self.hits += 1
+                self.successes += 1
+                return True
+            self.misses += 1
+
+        # Unknown users still pay for a KDF so response time does not reveal them
+        with self._kdf_slots:
+            valid = verify_password(stored or self._dummy_hash, password) and stored is not None
+
+        now = time.monotonic()
+        with self._lock:
+            if not valid:
+                self.record_failure(ip, now)
+                return False
+            self.successes += 1
+            self._failures.pop(ip, None)
+            if self.cache_ttl <= 0:
+                return True
+            self._cache[digest] = (now + self.cache_ttl, stored)
+            self._cache.move_to_end(digest)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return True
+
+    def stats(self):
+        """Return a snapshot of authentication counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'users': len(self.users),
+                'cache_entries': len(self._cache),
+                'locked_ips': sum(1 for entry in self._failures.values() if entry[2] > time.monotonic()),
+                'cache_hits': self.hits,
+                'cache_misses': self.misses,
+                'successes': self.successes,
+                'failures': self.failures,
+                'throttled': self.throttled,
+                'lockouts': self.lockouts,
+                'reloads': self.reloads,
+                'cache_hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def format_stats(self):
+        """One-line summary for the periodic stats log"""
+        s = self.stats()
+        return (f"Auth - Users: {s['users']}, OK: {s['successes']}, Failed: {s['failures']}, "
+                f"Throttled: {s['throttled']}, Locked IPs: {s['locked_ips']}, "
+                f"Cache hit rate: {s['cache_hit_rate']:.1%}")
+
+
+def add_auth_arguments(parser, users_file):
+    """Register the authentication command line options"""
+    parser.add_argument("--users-file", default=users_file,
+                        help="username:hash file (hashes from --hash-password)")
+    parser.add_argument("--users-db", default=DEFAULT_USERS_DB,
+                        help="Mastermind SQLite database whose active users may log in ('' to disable)")
+    parser.add_argument("--auth-cache-ttl", type=int, default=DEFAULT_CACHE_TTL,
+                        help="Seconds a successful login is cached (0 = always run the KDF)")
+    parser.add_argument("--auth-max-failures", type=int, default=DEFAULT_MAX_FAILURES,
+                        help="Failed logins per source IP before it is locked out (0 = never)")
+    parser.add_argument("--auth-lockout", type=int, default=DEFAULT_LOCKOUT,
+                        help="Seconds a source IP stays locked out")
+    parser.add_argument("--hash-password", action="store_true",
+                        help="Prompt for a password, print its hash for the users file and exit")
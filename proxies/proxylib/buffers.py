@@ -0,0 +1,76 @@
+"""
+Mastermind proxy buffer pool
+Bounded pool of reusable receive buffers for the relay loops
+Author: Mastermind
+"""
+
+import threading
+
+DEFAULT_BUFFER_SIZE = 65536
+DEFAULT_MAX_BUFFERS = 256
+
+
+class BufferPool:
+    """Thread-safe, bounded free list of equally sized bytearrays
+
+    acquire() never blocks: when the free list is empty a new buffer is
+    allocated (a miss). release() keeps at most max_buffers idle buffers
+    and drops the rest, so idle memory is capped at
+    buffer_size * max_buffers.
+    """
+
+    def __init__(self, buffer_size=DEFAULT_BUFFER_SIZE, max_buffers=DEFAULT_MAX_BUFFERS):
+        self.buffer_size = buffer_size
+        self.max_buffers = max_buffers
+        self._free = []
+        self._lock = threading.Lock()
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+        self.discards = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+
+    def acquire(self):
+        """Take a buffer from the pool, allocating one on a miss"""
+        with self._lock:
+            self.in_use += 1
+            if self.in_use > self.peak_in_use:
+                self.peak_in_use = self.in_use
+            if self._free:
+                self.hits += 1
+                return self._free.pop()
+            self.misses += 1
+        return bytearray(self.buffer_size)
+
+    def release(self, buffer):
+        """Return a buffer to the pool"""
+        with self._lock:
+            self.in_use -= 1
+            if len(self._free) < self.max_buffers and len(buffer) == self.buffer_size:
+                self._free.append(buffer)
+            else:
+                self.discards += 1
+
+    def stats(self):
+        """Return a snapshot of pool usage"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'buffer_size': self.buffer_size,
+                'max_buffers': self.max_buffers,
+                'in_use': self.in_use,
+                'peak_in_use': self.peak_in_use,
+                'idle': len(self._free),
+                'hits': self.hits,
+                'misses': self.misses,
+                'discards': self.discards,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def format_stats(self):
+        """One-line summary for the periodic stats log"""
+        s = self.stats()
+        return (f"Buffers - In use: {s['in_use']} (peak {s['peak_in_use']}), Idle: {s['idle']}, "
+                f"Hits: {s['hits']}, Misses: {s['misses']}, Hit rate: {s['hit_rate']:.1%}")
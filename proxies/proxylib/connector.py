@@ -0,0 +1,281 @@
+"""
+Mastermind proxy upstream connector
+Happy Eyeballs (RFC 8305) connection racing over every resolved address
+Author: Mastermind
+"""
+
+import asyncio
+import errno
+import itertools
+import selectors
+import socket
+import threading
+import time
+
+from .tracing import current_trace
+
+# Delay before starting the next attempt while earlier ones are pending
+CONNECTION_ATTEMPT_DELAY = 0.25
+DEFAULT_CONNECT_TIMEOUT = 10
+
+
+def address_family(address):
+    """Return the socket family of an IP address string"""
+    return socket.AF_INET6 if ':' in address else socket.AF_INET
+
+
+def interleave_addresses(addresses):
+    """Order addresses IPv6 first, alternating families (RFC 8305 section 4)"""
+    ipv6 = [a for a in addresses if ':' in a]
+    ipv4 = [a for a in addresses if ':' not in a]
+    ordered = []
+    for pair in itertools.zip_longest(ipv6, ipv4):
+        ordered.extend(a for a in pair if a is not None)
+    return ordered
+
+
+class Connector:
+    """Race staggered connection attempts and keep per-attempt latency stats
+
+    Attempts start CONNECTION_ATTEMPT_DELAY apart, or immediately after
+    the previous one fails; the first to complete wins and the rest are
+    closed. When metrics (a ProxyMetrics) is given, the total connect
+    time of each call is observed there as well, and the resolve and
+    connect stages go to the trace of the connection being served.
+    """
+
+    def __init__(self, resolver, attempt_delay=CONNECTION_ATTEMPT_DELAY,
+                 timeout=DEFAULT_CONNECT_TIMEOUT, metrics=None):
+        self.resolver = resolver
+        self.metrics = metrics
+        self.attempt_delay = attempt_delay
+        self.timeout = timeout
+        self._lock = threading.Lock()
+
+        # Statistics per family: attempts, successes, failures, latency sum, latency max
+        self.families = {
+            'ipv4': [0, 0, 0, 0.0, 0.0],
+            'ipv6': [0, 0, 0, 0.0, 0.0],
+        }
+        self.connects = 0
+        self.connect_failures = 0
+
+    def record_attempt(self, address, started, success):
+        """Record the outcome and latency of one connection attempt"""
+        latency = time.monotonic() - started
+        with self._lock:
+            entry = self.families['ipv6' if ':' in address else 'ipv4']
+            entry[0] += 1
+            entry[1 if success else 2] += 1
+            entry[3] += latency
+            if latency > entry[4]:
+                entry[4] = latency
+
+    def record_result(self, started, success):
+        with self._lock:
+            if success:
+                self.connects += 1
+            else:
+                self.connect_failures += 1
+        if self.metrics is not None:
+            if success:
+                self.metrics.connect_time.observe(time.monotonic() - started)
+            else:
+                self.metrics.connect_failures.inc()
+
+    def connect(self, host, port):
+        """Connect to host:port and return a blocking socket"""
+        trace = current_trace()
+        started = time.monotonic()
+        try:
+            addresses = interleave_addresses(self.resolver.resolve(host))
+        except OSError:
+            self.record_result(started, False)
+            raise
+        if trace is not None:
+            trace.mark_resolved(started, host, port)
+        deadline = time.monotonic() + self.timeout
+        selector = selectors.DefaultSelector()
+        pending = {}
+        next_index = 0
+        next_start = 0.0
+        winner = None
+        last_error = None
+
+        try:
+            while winner is None:
+                now = time.monotonic()
+                if now >= deadline:
+                    raise socket.timeout(f"Connection to {host}:{port} timed out")
+
+                # Start the next attempt when its turn comes or nothing else is pending
+                if next_index < len(addresses) and (now >= next_start or not pending):
+                    address = addresses[next_index]
+                    next_index += 1
+                    next_start = now + self.attempt_delay
+
+                    sock = None
+                    try:
+                        sock = socket.socket(address_family(address), socket.SOCK_STREAM)
+                        sock.setblocking(False)
+                        err = sock.connect_ex((address, port))
+                    except OSError as e:
+                        # No stack for this family (EAFNOSUPPORT) or out of descriptors: try the next address
+                        self.record_attempt(address, now, False)
+                        last_error = e
+                        if sock is not None:
+                            sock.close()
+                        next_start = now
+                        continue
+                    if err == 0:
+                        self.record_attempt(address, now, True)
+                        winner = sock
+                        break
+                    if err not in (errno.EINPROGRESS, errno.EAGAIN):
+                        self.record_attempt(address, now, False)
+                        last_error = OSError(err, f"{address}:{port}: {errno.errorcode.get(err, err)}")
+                        sock.close()
+                        next_start = now
+                        continue
+                    selector.register(sock, selectors.EVENT_WRITE, (address, now))
+                    pending[sock] = address
+                    continue
+
+                if not pending:
+                    raise last_error or OSError(errno.EHOSTUNREACH, f"No usable address for {host}")
+
+                wait_until = deadline
+                if next_index < len(addresses):
+                    wait_until = min(wait_until, next_start)
+
+                for key, _ in selector.select(max(0.0, wait_until - now)):
+                    sock = key.fileobj
+                    address, attempt_started = key.data
+                    selector.unregister(sock)
+                    del pending[sock]
+
+                    err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    if err == 0:
+                        self.record_attempt(address, attempt_started, True)
+                        winner = sock
+                        break
+
+                    self.record_attempt(address, attempt_started, False)
+                    last_error = OSError(err, f"{address}:{port}: {errno.errorcode.get(err, err)}")
+                    sock.close()
+                    # A failed attempt lets the next one start right away
+                    next_start = time.monotonic()
+        except OSError:
+            self.record_result(started, False)
+            raise
+        finally:
+            for sock in pending:
+                if sock is not winner:
+                    sock.close()
+            selector.close()
+
+        self.record_result(started, True)
+        if trace is not None:
+            trace.mark_connected()
+        winner.setblocking(True)
+        return winner
+
+    async def attempt_async(self, address, port):
+        """One non-blocking connection attempt on the event loop"""
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        try:
+            sock = socket.socket(address_family(address), socket.SOCK_STREAM)
+        except OSError:
+            self.record_attempt(address, started, False)
+            raise
+        sock.setblocking(False)
+        try:
+            await loop.sock_connect(sock, (address, port))
+        except BaseException as e:
+            sock.close()
+            if not isinstance(e, asyncio.CancelledError):
+                self.record_attempt(address, started, False)
+            raise
+        self.record_attempt(address, started, True)
+        return sock
+
+    async def connect_async(self, host, port):
+        """Connect to host:port from a coroutine and return a non-blocking socket"""
+        trace = current_trace()
+        started = time.monotonic()
+        try:
+            addresses = interleave_addresses(await self.resolver.resolve_async(host))
+        except OSError:
+            self.record_result(started, False)
+            raise
+        if trace is not None:
+            trace.mark_resolved(started, host, port)
+        deadline = time.monotonic() + self.timeout
+        pending = set()
+        winner = None
+        last_error = None
+
+        try:
+            index = 0
+            while winner is None:
+                if index < len(addresses):
+                    pending.add(asyncio.ensure_future(self.attempt_async(addresses[index], port)))
+                    index += 1
+
+                remaining = deadline - time.monotonic()
+                if not pending or remaining <= 0:
+                    break
+
+                # Wait one stagger delay (or until the deadline once every address is in flight);
+                # a failed attempt ends the wait early so the next one starts right away
+                timeout = min(self.attempt_delay, remaining) if index < len(addresses) else remaining
+                done, pending = await asyncio.wait(pending, timeout=timeout,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                    elif winner is None:
+                        winner = task.result()
+                    else:
+                        task.result().close()
+        finally:
+            for task in pending:
+                task.cancel()
+            # An attempt may have connected just before it was cancelled
+            for result in await asyncio.gather(*pending, return_exceptions=True):
+                if isinstance(result, socket.socket):
+                    result.close()
+
+        if winner is None:
+            self.record_result(started, False)
+            if time.monotonic() >= deadline:
+                raise socket.timeout(f"Connection to {host}:{port} timed out")
+            raise last_error or OSError(errno.EHOSTUNREACH, f"No usable address for {host}")
+
+        self.record_result(started, True)
+        if trace is not None:
+            trace.mark_connected()
+        return winner
+
+    def stats(self):
+        """Return a snapshot of connect counters and attempt latency"""
+        with self._lock:
+            result = {'connects': self.connects, 'connect_failures': self.connect_failures}
+            for family, (attempts, successes, failures, total, peak) in self.families.items():
+                result[family] = {
+                    'attempts': attempts,
+                    'successes': successes,
+                    'failures': failures,
+                    'avg_latency': total / attempts if attempts else 0.0,
+                    'max_latency': peak,
+                }
+            return result
+
+    def format_stats(self):
+        """One-line summary for the periodic stats log"""
+        s = self.stats()
+        v4, v6 = s['ipv4'], s['ipv6']
+        return (f"Upstream - Connected: {s['connects']}, Failed: {s['connect_failures']}, "
+                f"IPv4 attempts: {v4['attempts']} ({v4['failures']} failed, avg {v4['avg_latency'] * 1000:.1f} ms), "
+                f"IPv6 attempts: {v6['attempts']} ({v6['failures']} failed, avg {v6['avg_latency'] * 1000:.1f} ms)")
@@ -0,0 +1,325 @@
+"""
+Mastermind listening-socket handoff
+Zero-downtime restarts: systemd socket activation, or passing the listeners to a successor over SCM_RIGHTS
+Author: Mastermind
+"""
+
+import os
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+# Seconds the old process keeps serving its open tunnels after a handoff
+DEFAULT_DRAIN_TIMEOUT = 300
+# Seconds between checks of the draining flag in the accept loops
+ACCEPT_POLL = 0.5
+# Seconds a successor may take from receiving the listeners to accepting on them
+HANDOFF_TIMEOUT = 30
+# Seconds the successor waits for the predecessor to release the handoff address
+RELEASE_TIMEOUT = 5
+# First descriptor passed by systemd socket activation
+SD_LISTEN_FDS_START = 3
+# Most listeners passed in one handoff (one per worker)
+MAX_LISTENERS = 256
+
+MSG_TAKE = b"T"
+MSG_READY = b"R"
+MSG_BYE = b"B"
+COUNT = struct.Struct(">H")
+
+
+def handoff_address(port):
+    """Abstract Unix socket on which the instance serving port hands over its listeners"""
+    return f"\0mastermind-proxy-handoff-{port}"
+
+
+def sd_notify(state):
+    """Send state to the systemd service manager; a no-op outside a notify-enabled unit"""
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
+        return False
+    if address.startswith('@'):
+        address = '\0' + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.sendto(state.encode(), address)
+        return True
+    except OSError:
+        return False
+
+
+def systemd_listeners():
+    """Listening sockets passed by systemd socket activation, if this process is their target"""
+    try:
+        if int(os.environ.get('LISTEN_PID', 0)) != os.getpid():
+            return []
+        count = int(os.environ.get('LISTEN_FDS', 0))
+    except ValueError:
+        return []
+    for name in ('LISTEN_PID', 'LISTEN_FDS', 'LISTEN_FDNAMES'):
+        os.environ.pop(name, None)
+    return [socket.socket(fileno=fd) for fd in range(SD_LISTEN_FDS_START, SD_LISTEN_FDS_START + count)]
+
+
+def recv_exact(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Handoff peer closed the connection")
+        data += chunk
+    return data
+
+
+class ListenerHandoff:
+    """The listening sockets of one proxy instance across restarts
+
+    At start, listen() takes the listeners from systemd socket activation
+    or from a running instance on the same port; otherwise it binds them.
+    On SIGHUP the instance starts a copy of itself, passes it the
+    listeners over SCM_RIGHTS and, once the copy accepts on them, stops
+    accepting and drains its open tunnels for at most drain_timeout
+    seconds. Both share the same kernel accept queue, so no connection is
+    refused or reset in between. Under systemd the new process is
+    reported as the unit's main PID (the unit needs NotifyAccess=all).
+
+    With --workers the supervisor owns the handoff and one SO_REUSEPORT
+    listener per worker; each worker is assigned its listener and drains
+    when the supervisor forwards the SIGHUP.
+    """
+
+    def __init__(self, port, logger, drain_timeout=DEFAULT_DRAIN_TIMEOUT):
+        self.port = port
+        self.logger = logger
+        self.drain_timeout = drain_timeout
+        self.listeners = []
+        self.worker = False
+        self.draining = False
+        self.drain_started = None
+        self.on_drain = None
+        self._predecessor = None
+        self._server = None
+        self._restarting = False
+
+    @property
+    def accepting(self):
+        return not self.draining
+
+    def take_over(self):
+        """Receive the listeners of the instance running on our port; returns [] if there is none"""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(HANDOFF_TIMEOUT)
+        try:
+            sock.connect(handoff_address(self.port))
+            sock.sendall(MSG_TAKE)
+            data, fds, _, _ = socket.recv_fds(sock, COUNT.size, MAX_LISTENERS)
+        except (ConnectionRefusedError, FileNotFoundError):
+            sock.close()
+            return []
+        except OSError as e:
+            sock.close()
+            self.logger.warning(f"Listener handoff from the running instance failed: {e}")
+            return []
+        if len(data) < COUNT.size or COUNT.unpack(data)[0] != len(fds):
+            for fd in fds:
+                os.close(fd)
+            sock.close()
+            self.logger.warning("Listener handoff from the running instance was incomplete")
+            return []
+        self._predecessor = sock
+        return [socket.socket(fileno=fd) for fd in fds]
+
+    def open_listeners(self, count, address, backlog, reuse_port=False):
+        """Return count listening sockets bound to address, inheriting as many as are on offer"""
+        inherited = systemd_listeners() or self.take_over()
+        if inherited:
+            source = 'systemd' if self._predecessor is None else 'the running instance'
+            self.logger.info(f"Took over {min(len(inherited), count)} listening socket(s) from {source}")
+        for extra in inherited[count:]:
+            extra.close()
+        listeners = inherited[:count]
+        while len(listeners) < count:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if reuse_port or count > 1:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            try:
+                sock.bind(address)
+                sock.listen(backlog)
+            except OSError:
+                sock.close()
+                for listener in listeners:
+                    listener.close()
+                self.abandon()
+                raise
+            listeners.append(sock)
+        for listener in listeners:
+            listener.settimeout(ACCEPT_POLL)
+        self.listeners = listeners
+        return listeners
+
+    def listen(self, server_socket, address, backlog):
+        """Return the socket a proxy should accept on
+
+        server_socket is the proxy's freshly created socket; it is bound
+        and returned unless a listener was inherited or assigned, in which
+        case it is closed. The returned socket times out every
+        ACCEPT_POLL seconds so the accept loop can notice a handoff.
+        """
+        if not self.worker:
+            reuse_port = bool(server_socket.getsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT))
+            self.open_listeners(1, address, backlog, reuse_port)
+            self.ready()
+        server_socket.close()
+        return self.listeners[0]
+
+    def assign(self, listeners, index):
+        """Worker side: keep listener index of the supervisor's listeners and close the others"""
+        self.worker = True
+        self.on_drain = None
+        # The handoff address must be released as soon as the supervisor closes it
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        for position, listener in enumerate(listeners):
+            if position != index:
+                listener.close()
+        self.listeners = [listeners[index]]
+
+    def ready(self):
+        """Accepting on the listeners: release the predecessor and accept restarts ourselves"""
+        if self._predecessor is not None:
+            try:
+                self._predecessor.sendall(MSG_READY)
+                recv_exact(self._predecessor, 1)
+            except OSError as e:
+                self.logger.warning(f"Predecessor did not confirm the handoff: {e}")
+            finally:
+                self._predecessor.close()
+                self._predecessor = None
+        sd_notify("READY=1")
+
+        signal.signal(signal.SIGHUP, self.handle_sighup)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        deadline = time.monotonic() + RELEASE_TIMEOUT
+        while True:
+            try:
+                server.bind(handoff_address(self.port))
+                break
+            except OSError as e:
+                if time.monotonic() > deadline:
+                    server.close()
+                    self.logger.error(f"Graceful restart unavailable, handoff address busy: {e}")
+                    return
+                time.sleep(0.1)
+        server.listen(4)
+        self._server = server
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def abandon(self):
+        """Give up a takeover; the predecessor keeps serving"""
+        if self._predecessor is not None:
+            self._predecessor.close()
+            self._predecessor = None
+
+    def handle_sighup(self, sig, frame):
+        if self.worker:
+            self.begin_drain()
+        elif not self._restarting and not self.draining:
+            self._restarting = True
+            threading.Thread(target=self.spawn_successor, daemon=True).start()
+
+    def spawn_successor(self):
+        """Start a copy of this instance; it connects back for the listeners"""
+        try:
+            process = subprocess.Popen([sys.executable] + sys.argv)
+            self.logger.info(f"Graceful restart: started successor pid {process.pid}")
+        except OSError as e:
+            self.logger.error(f"Graceful restart failed to start a successor: {e}")
+            self._restarting = False
+            return
+        # A successor that dies before taking over must not leave a zombie or block the next attempt
+        process.wait()
+        if not self.draining:
+            self.logger.error(f"Graceful restart: successor exited with status {process.returncode} "
+                              f"before taking over; still serving")
+        self._restarting = False
+
+    def serve(self):
+        """Handoff server thread: give the listeners to the first successor that becomes ready"""
+        while not self.draining:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            with conn:
+                try:
+                    self.hand_over(conn)
+                except OSError as e:
+                    self.logger.warning(f"Listener handoff aborted: {e}")
+
+    def hand_over(self, conn):
+        conn.settimeout(HANDOFF_TIMEOUT)
+        if recv_exact(conn, 1) != MSG_TAKE:
+            return
+        pid = struct.unpack("3i", conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                                  struct.calcsize("3i")))[0]
+        socket.send_fds(conn, [COUNT.pack(len(self.listeners))], [s.fileno() for s in self.listeners])
+        if recv_exact(conn, 1) != MSG_READY:
+            return
+
+        # The successor accepts on the same sockets now; stop accepting and drain
+        self.begin_drain()
+        self._server.close()
+        sd_notify(f"MAINPID={pid}")
+        self.logger.info(f"Handed the listening socket(s) to pid {pid}; draining open tunnels "
+                         f"for up to {self.drain_timeout:g}s")
+        conn.sendall(MSG_BYE)
+
+    def begin_drain(self):
+        if not self.draining:
+            self.drain_started = time.monotonic()
+            self.draining = True
+            if self.on_drain is not None:
+                self.on_drain()
+
+    def drain_remaining(self, active):
+        """Seconds left to wait for active() tunnels, or 0 when done"""
+        if not self.draining or not active():
+            return 0
+        return max(0.0, self.drain_started + self.drain_timeout - time.monotonic())
+
+    def drain(self, active):
+        """After a handoff, block until active() reaches 0 or the drain deadline passes"""
+        while self.drain_remaining(active):
+            time.sleep(0.5)
+        self.log_drained(active)
+
+    async def drain_async(self, active):
+        """drain() for the asyncio engine"""
+        import asyncio
+        while self.drain_remaining(active):
+            await asyncio.sleep(0.5)
+        self.log_drained(active)
+
+    def log_drained(self, active):
+        if not self.draining:
+            return
+        remaining = active()
+        if remaining:
+            self.logger.warning(f"Drain deadline reached, closing {remaining} open tunnel(s)")
+        else:
+            self.logger.info("All tunnels drained")
+
+
+def add_handoff_arguments(parser):
+    """Register the graceful restart command line options"""
+    parser.add_argument("--drain-timeout", type=float, default=DEFAULT_DRAIN_TIMEOUT,
+                        help="Seconds an instance replaced by a graceful restart (SIGHUP or "
+                             "systemctl reload) keeps serving its open tunnels")
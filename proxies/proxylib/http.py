@@ -0,0 +1,502 @@
+"""
+Mastermind HTTP helpers
+Incremental request/response head parsing and body framing for the HTTP-speaking proxies
+Author: Mastermind
+"""
+
+import functools
+import string
+
+from .buffers import DEFAULT_BUFFER_SIZE
+from .tracing import trace_request
+
+# Largest request head accepted before the connection is dropped
+MAX_HEAD_SIZE = 8192
+# Longest chunk-size or trailer line accepted in a chunked body
+MAX_LINE_SIZE = 4096
+
+RECV_SIZE = 4096
+
+# Headers that describe one hop and must not be forwarded (RFC 9110 section 7.6.1).
+# Transfer-Encoding and Trailer stay: bodies are forwarded in their original framing.
+HOP_BY_HOP_HEADERS = frozenset((
+    'connection', 'proxy-connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'upgrade',
+))
+
+# Request headers the tunnel front ends act on, RequestHeadParser's default set.
+# Each wanted header costs one scan of the head, so proxies pass just the ones they use.
+TUNNEL_HEADERS = (
+    'host', 'upgrade', 'connection', 'sec-websocket-key', 'sec-websocket-version',
+    'x-online-host', 'x-forward-host', 'x-forwarded-host', 'x-real-host',
+    'content-length', 'transfer-encoding',
+)
+
+# Body framing kinds returned by request_body_kind() / response_body_kind()
+BODY_NONE = 'none'
+BODY_LENGTH = 'length'
+BODY_CHUNKED = 'chunked'
+BODY_CLOSE = 'close'
+
+
+class HttpError(ValueError):
+    """Malformed or oversized HTTP message"""
+
+
+class HttpRequest:
+    """A parsed HTTP request head"""
+
+    __slots__ = ('method', 'target', 'version', 'headers')
+
+    def __init__(self, method, target, version, headers):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers
+
+    def header(self, name, default=None):
+        """Return a header value by lower-case name"""
+        return self.headers.get(name, default)
+
+    def __repr__(self):
+        return f"HttpRequest({self.method} {self.target} {self.version})"
+
+
+class RequestHead:
+    """A request head with only the wanted headers extracted
+
+    headers maps each wanted lower-case name that was present to its raw
+    bytes value; header() decodes just the one asked for, so a RequestHead
+    can stand in for an HttpRequest. raw is the whole head, blank line
+    included.
+    """
+
+    __slots__ = ('method', 'target', 'version', 'headers', 'raw')
+
+    def __init__(self, method, target, version, headers, raw):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers
+        self.raw = raw
+
+    def header(self, name, default=None):
+        """Return a header value by lower-case name"""
+        value = self.headers.get(name)
+        return default if value is None else value.decode('latin-1')
+
+    def __repr__(self):
+        return f"RequestHead({self.method} {self.target} {self.version})"
+
+
+class HttpResponse:
+    """A parsed HTTP response head"""
+
+    __slots__ = ('version', 'status', 'reason', 'headers')
+
+    def __init__(self, version, status, reason, headers):
+        self.version = version
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+
+    def header(self, name, default=None):
+        """Return a header value by lower-case name"""
+        return self.headers.get(name, default)
+
+    def __repr__(self):
+        return f"HttpResponse({self.version} {self.status} {self.reason})"
+
+
+class SocketReader:
+    """Buffered reader over a blocking socket for HTTP message framing
+
+    read_head() only rescans the bytes that arrived since its last look
+    for the blank line, so a head split over many segments costs one pass.
+    Bytes read past the end of a message stay buffered for the next one,
+    which is what makes keep-alive and pipelining work.
+    """
+
+    def __init__(self, sock, data=b""):
+        self.sock = sock
+        self.buffer = bytearray(data)
+        self.scanned = 0
+
+    def fill(self):
+        """Receive more bytes; returns False at end of stream"""
+        chunk = self.sock.recv(RECV_SIZE)
+        if not chunk:
+            return False
+        self.buffer += chunk
+        return True
+
+    def read_head(self, max_size=MAX_HEAD_SIZE):
+        """Return the next head including its blank line, or None on a clean close"""
+        buffer = self.buffer
+        while True:
+            end = buffer.find(b"\r\n\r\n", max(self.scanned - 3, 0))
+            if end >= 0:
+                end += 4
+                head = bytes(buffer[:end])
+                del buffer[:end]
+                self.scanned = 0
+                return head
+            if len(buffer) > max_size:
+                raise HttpError("Message head too large")
+            self.scanned = len(buffer)
+            if not self.fill():
+                if buffer:
+                    raise ConnectionError("Peer closed in the middle of a message head")
+                return None
+
+    def read_line(self, max_size=MAX_LINE_SIZE):
+        """Return the next CRLF-terminated line including the CRLF"""
+        buffer = self.buffer
+        start = 0
+        while True:
+            end = buffer.find(b"\r\n", start)
+            if end >= 0:
+                line = bytes(buffer[:end + 2])
+                del buffer[:end + 2]
+                return line
+            if len(buffer) > max_size:
+                raise HttpError("Line too long")
+            start = max(len(buffer) - 1, 0)
+            if not self.fill():
+                raise ConnectionError("Peer closed in the middle of a line")
+
+    def take_buffer(self):
+        """Return and clear every buffered byte"""
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        self.scanned = 0
+        return data
+
+    def forward(self, destination, length, counter=None, pool=None):
+        """Copy exactly length bytes of body to destination"""
+        if self.buffer:
+            count = min(length, len(self.buffer))
+            destination.sendall(self.buffer[:count])
+            del self.buffer[:count]
+            length -= count
+            if counter is not None:
+                counter.inc(count)
+        if not length:
+            return
+
+        buffer = pool.acquire() if pool is not None else bytearray(DEFAULT_BUFFER_SIZE)
+        view = memoryview(buffer)
+        try:
+            while length:
+                received = self.sock.recv_into(buffer, min(length, len(buffer)))
+                if not received:
+                    raise ConnectionError("Peer closed in the middle of a body")
+                destination.sendall(view[:received])
+                length -= received
+                if counter is not None:
+                    counter.inc(received)
+        finally:
+            view.release()
+            if pool is not None:
+                pool.release(buffer)
+
+    def forward_chunked(self, destination, counter=None, pool=None):
+        """Copy a chunked body, including its trailers, to destination"""
+        while True:
+            line = self.read_line()
+            destination.sendall(line)
+            try:
+                size = int(line.split(b";", 1)[0].strip(), 16)
+            except ValueError:
+                raise HttpError(f"Bad chunk size line: {line[:40]!r}")
+            if size == 0:
+                break
+            # Chunk data plus its trailing CRLF
+            self.forward(destination, size + 2, counter, pool)
+
+        # Trailer section, ended by an empty line
+        while True:
+            line = self.read_line()
+            destination.sendall(line)
+            if line == b"\r\n":
+                return
+
+    def forward_until_close(self, destination, counter=None, pool=None):
+        """Copy everything until the peer closes (close-delimited bodies)"""
+        if self.buffer:
+            destination.sendall(self.buffer)
+            if counter is not None:
+                counter.inc(len(self.buffer))
+            self.buffer.clear()
+
+        buffer = pool.acquire() if pool is not None else bytearray(DEFAULT_BUFFER_SIZE)
+        view = memoryview(buffer)
+        try:
+            while True:
+                received = self.sock.recv_into(buffer)
+                if not received:
+                    return
+                destination.sendall(view[:received])
+                if counter is not None:
+                    counter.inc(received)
+        finally:
+            view.release()
+            if pool is not None:
+                pool.release(buffer)
+
+    def forward_body(self, destination, kind, length=0, counter=None, pool=None):
+        """Copy a body framed as returned by request_body_kind()/response_body_kind()"""
+        if kind == BODY_LENGTH:
+            self.forward(destination, length, counter, pool)
+        elif kind == BODY_CHUNKED:
+            self.forward_chunked(destination, counter, pool)
+        elif kind == BODY_CLOSE:
+            self.forward_until_close(destination, counter, pool)
+
+
+def read_head(sock, data=b"", max_size=MAX_HEAD_SIZE):
+    """Read from a blocking socket until a full request head has arrived
+
+    Returns (head, rest) where head ends with the blank line and rest is
+    whatever the client sent after it.
+    """
+    reader = SocketReader(sock, data)
+    head = reader.read_head(max_size)
+    if head is None:
+        raise ConnectionError("Client closed before sending a request head")
+    return head, reader.take_buffer()
+
+
+def parse_headers(lines):
+    headers = {}
+    for line in lines:
+        if not line:
+            continue
+        name, sep, value = line.partition(":")
+        if not sep:
+            raise HttpError(f"Malformed header line: {line[:80]!r}")
+        name = name.strip().lower()
+        value = value.strip()
+        headers[name] = f"{headers[name]}, {value}" if name in headers else value
+    return headers
+
+
+def parse_head(head):
+    """Parse a request head into an HttpRequest"""
+    lines = head.decode('latin-1').split("\r\n")
+    parts = lines[0].split(" ")
+    if len(parts) != 3:
+        raise HttpError(f"Malformed request line: {lines[0][:80]!r}")
+    method, target, version = parts
+    return HttpRequest(method, target, version, parse_headers(lines[1:]))
+
+
+@functools.lru_cache(maxsize=None)
+def header_needles(names):
+    """(name, needle) pairs: a header starts right after a CRLF and is matched lower-cased"""
+    return tuple((name, b"\r\n" + name.encode('latin-1') + b":") for name in names)
+
+
+class RequestHeadParser:
+    """Incremental bytes-level parser for one HTTP/1.x request head
+
+    feed() appends whatever recv() returned, in any segmentation;
+    next_head() returns a RequestHead once the blank line has arrived, or
+    None when more bytes are needed, scanning only the bytes that arrived
+    since the last call. Past the request line only the wanted headers
+    are located and sliced out, a repeated one yielding its first value;
+    the rest of the head is never decoded or split. A head longer than
+    max_size raises HttpError. Bytes the client sent after the head are
+    available from remaining().
+    """
+
+    def __init__(self, wanted=TUNNEL_HEADERS, max_size=MAX_HEAD_SIZE):
+        self.buffer = bytearray()
+        self.max_size = max_size
+        self.scanned = 0
+        self.wanted = header_needles(tuple(wanted))
+
+    def feed(self, data):
+        self.buffer += data
+
+    def remaining(self):
+        """Return and clear bytes received after the head"""
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        self.scanned = 0
+        return data
+
+    def next_head(self):
+        """Return the RequestHead, or None if more data is needed"""
+        buffer = self.buffer
+        end = buffer.find(b"\r\n\r\n", max(self.scanned - 3, 0))
+        if end < 0:
+            if len(buffer) > self.max_size:
+                raise HttpError("Message head too large")
+            self.scanned = len(buffer)
+            return None
+        end += 4
+        if end > self.max_size:
+            raise HttpError("Message head too large")
+        head = bytes(buffer[:end])
+        del buffer[:end]
+        self.scanned = 0
+        return self.parse(head)
+
+    def parse(self, head):
+        """Build a RequestHead from a complete head ending with its blank line"""
+        line_end = head.find(b"\r\n")
+        parts = head[:line_end].decode('latin-1').split(" ")
+        if len(parts) != 3:
+            raise HttpError(f"Malformed request line: {head[:min(line_end, 80)]!r}")
+        method, target, version = parts
+
+        lower = head.lower()
+        headers = {}
+        for name, needle in self.wanted:
+            start = lower.find(needle, line_end)
+            if start < 0:
+                continue
+            start += len(needle)
+            headers[name] = head[start:head.find(b"\r\n", start)].strip(b" \t")
+        return RequestHead(method, target, version, headers, head)
+
+
+def recv_head(sock, parser):
+    """Read from a blocking socket until the parser yields a request head"""
+    head = parser.next_head()
+    while head is None:
+        data = sock.recv(RECV_SIZE)
+        if not data:
+            raise ConnectionError("Client closed before sending a request head")
+        parser.feed(data)
+        head = parser.next_head()
+    trace_request()
+    return head
+
+
+def parse_response_head(head):
+    """Parse a response head into an HttpResponse"""
+    lines = head.decode('latin-1').split("\r\n")
+    parts = lines[0].split(" ", 2)
+    if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+        raise HttpError(f"Malformed status line: {lines[0][:80]!r}")
+    try:
+        status = int(parts[1])
+    except ValueError:
+        raise HttpError(f"Malformed status code: {parts[1][:10]!r}")
+    return HttpResponse(parts[0], status, parts[2] if len(parts) > 2 else "", parse_headers(lines[1:]))
+
+
+def content_length(headers):
+    value = headers.get('content-length')
+    try:
+        length = int(value)
+    except (TypeError, ValueError):
+        raise HttpError(f"Bad Content-Length: {value!r}")
+    if length < 0:
+        raise HttpError(f"Bad Content-Length: {value!r}")
+    return length
+
+
+def request_body_kind(request):
+    """Return (kind, length) for the body following a request head"""
+    if 'chunked' in request.header('transfer-encoding', '').lower():
+        return BODY_CHUNKED, 0
+    if 'content-length' in request.headers:
+        length = content_length(request.headers)
+        return (BODY_LENGTH, length) if length else (BODY_NONE, 0)
+    return BODY_NONE, 0
+
+
+def response_body_kind(response, request_method):
+    """Return (kind, length) for the body following a response head"""
+    if request_method == 'HEAD' or response.status < 200 or response.status in (204, 304):
+        return BODY_NONE, 0
+    if 'chunked' in response.header('transfer-encoding', '').lower():
+        return BODY_CHUNKED, 0
+    if 'content-length' in response.headers:
+        length = content_length(response.headers)
+        return (BODY_LENGTH, length) if length else (BODY_NONE, 0)
+    return BODY_CLOSE, 0
+
+
+def wants_keep_alive(message):
+    """Return True when an HttpRequest/HttpResponse allows the connection to be reused"""
+    tokens = message.header('connection', '').lower()
+    if message.version == 'HTTP/1.0':
+        return 'keep-alive' in tokens
+    return 'close' not in tokens
+
+
+def rewrite_head(head, first_line, drop=HOP_BY_HOP_HEADERS, extra=()):
+    """Return head with a new first line, the drop headers removed and extra lines added
+
+    Works on the raw lines so repeated headers such as Set-Cookie are
+    forwarded exactly as received.
+    """
+    lines = head.decode('latin-1').split("\r\n")
+    # Headers named in Connection are hop-by-hop as well
+    named = set(drop)
+    for line in lines[1:]:
+        name, sep, value = line.partition(":")
+        if sep and name.strip().lower() == 'connection':
+            named.update(token.strip().lower() for token in value.split(","))
+
+    kept = [first_line]
+    for line in lines[1:]:
+        if not line:
+            continue
+        name = line.split(":", 1)[0].strip().lower()
+        if name not in named:
+            kept.append(line)
+    kept.extend(extra)
+    return ("\r\n".join(kept) + "\r\n\r\n").encode('latin-1')
+
+
+class ResponseTemplate:
+    """An HTTP response pre-rendered to bytes around its dynamic fields
+
+    head and body are str.format templates. Their literal text is encoded
+    once, here, into a single bytes %-format, so render() is one C-level
+    formatting pass over the field values, given as bytes. A
+    {content_length} field in head is computed from the static body size
+    plus the lengths of the body's field values; a body without fields
+    has its Content-Length rendered into the template.
+    """
+
+    def __init__(self, head, body=""):
+        body_format, self.body_fields, self.body_size = self.compile(body)
+        if not self.body_fields:
+            head = head.replace('{content_length}', str(self.body_size))
+            self.body_fields = None
+        head_format, head_fields, _ = self.compile(head)
+        self.template = head_format + body_format
+        self.fields = tuple(head_fields + (self.body_fields or []))
+
+    @staticmethod
+    def compile(template):
+        """Turn a str.format template into a bytes %-format, its field names and its literal size"""
+        chunks = []
+        fields = []
+        size = 0
+        for literal, field, _, _ in string.Formatter().parse(template):
+            literal = literal.encode()
+            size += len(literal)
+            chunks.append(literal.replace(b"%", b"%%"))
+            if field is not None:
+                chunks.append(b"%s")
+                fields.append(field)
+        return b"".join(chunks), fields, size
+
+    def render(self, **values):
+        """Return the response bytes for the given field values"""
+        if self.body_fields is not None:
+            size = self.body_size + sum([len(values[field]) for field in self.body_fields])
+            values['content_length'] = b"%d" % size
+        return self.template % tuple([values[field] for field in self.fields])
+
+
+def escape_template(text):
+    """Make text safe to embed literally in a ResponseTemplate"""
+    return text.replace('{', '{{').replace('}', '}}')
@@ -0,0 +1,421 @@
+"""
+Mastermind proxy logging
+Queued, batched log writer with per-message sampling and rate limits, text or JSONL output
+Author: Mastermind
+"""
+
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+LOG_DIR = "/var/log/mastermind/proxies"
+CONFIG_FILE = "config/proxies/logging.conf"
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+LOG_FORMATS = ('text', 'jsonl')
+
+# Records waiting for the writer; beyond this they are dropped, not waited for
+DEFAULT_QUEUE_SIZE = 10000
+# Records written between two flushes while the queue stays busy
+BATCH_SIZE = 512
+# Seconds between reports of dropped records, and of records suppressed by sampling
+DROP_REPORT_INTERVAL = 1
+REPORT_INTERVAL = 10
+# Seconds stop() waits for the writer to drain the queue
+STOP_TIMEOUT = 2
+
+
+def parse_rule(value):
+    """Split '<message prefix>:<number>' on its last colon"""
+    prefix, sep, number = value.rpartition(':')
+    if not sep or not prefix:
+        raise ValueError(f"Invalid log rule {value!r} (expected <message prefix>:<number>)")
+    return prefix, float(number)
+
+
+class LogRule:
+    """Sampling or rate limit for INFO and DEBUG records whose message starts with prefix
+
+    sample keeps one record in every sample; rate keeps at most rate
+    records per second, with a burst of one second.
+    """
+
+    __slots__ = ('prefix', 'sample', 'rate', 'tokens', 'stamp', 'seen', 'kept', 'reported')
+
+    def __init__(self, prefix, sample=0, rate=0):
+        self.prefix = prefix
+        self.sample = int(sample)
+        self.rate = rate
+        self.tokens = rate
+        self.stamp = time.monotonic()
+        self.seen = 0
+        self.kept = 0
+        self.reported = 0
+
+    def allow(self):
+        """Caller holds the filter lock"""
+        self.seen += 1
+        if self.sample > 1 and self.seen % self.sample != 1:
+            return False
+        if self.rate:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+        self.kept += 1
+        return True
+
+    @property
+    def suppressed(self):
+        return self.seen - self.kept
+
+
+class SamplingFilter(logging.Filter):
+    """Apply the first matching LogRule; warnings and errors always pass"""
+
+    def __init__(self, rules):
+        super().__init__()
+        self.rules = list(rules)
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.rules:
+            return True
+        message = record.msg if isinstance(record.msg, str) else str(record.msg)
+        for rule in self.rules:
+            if message.startswith(rule.prefix):
+                with self._lock:
+                    return rule.allow()
+        return True
+
+    @property
+    def suppressed(self):
+        return sum(rule.suppressed for rule in self.rules)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that counts and drops records when the queue is full instead of blocking"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.enqueued = 0
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+
+
+class BatchedFlush:
+    """Handler mixin: emit() leaves the data buffered until the listener calls flush_batch()"""
+
+    def flush(self):
+        pass
+
+    def flush_batch(self):
+        super().flush()
+
+
+class BatchedStreamHandler(BatchedFlush, logging.StreamHandler):
+    pass
+
+
+class BatchedFileHandler(BatchedFlush, logging.FileHandler):
+    pass
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def __init__(self, proxy):
+        super().__init__()
+        self.proxy = proxy
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc)
+                          .isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'proxy': self.proxy,
+            'pid': record.process,
+            'msg': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, separators=(',', ':'))
+
+
+class BatchingQueueListener(logging.handlers.QueueListener):
+    """QueueListener that flushes its handlers once per batch rather than once per record
+
+    A batch ends when the queue runs empty or BATCH_SIZE records have
+    been written. Between batches the listener reports records dropped
+    by the queue handler and suppressed by the sampling filter.
+    """
+
+    def __init__(self, log_queue, handlers, queue_handler, sampling):
+        super().__init__(log_queue, *handlers)
+        self.queue_handler = queue_handler
+        self.sampling = sampling
+        self.io_lock = threading.Lock()
+        self.unflushed = 0
+        self.written = 0
+        self.batches = 0
+        self.reported_drops = 0
+        self.next_drop_report = 0.0
+        self.next_report = 0.0
+
+    def dequeue(self, block):
+        while True:
+            if self.unflushed and (self.unflushed >= BATCH_SIZE or self.queue.empty()):
+                self.flush()
+            now = time.monotonic()
+            if now >= self.next_report:
+                self.next_report = now + REPORT_INTERVAL
+                self.report()
+            elif now >= self.next_drop_report and self.queue_handler.dropped > self.reported_drops:
+                self.next_drop_report = now + DROP_REPORT_INTERVAL
+                self.report_drops()
+            try:
+                return self.queue.get(timeout=REPORT_INTERVAL)
+            except queue.Empty:
+                continue
+
+    def handle(self, record):
+        with self.io_lock:
+            super().handle(record)
+        self.unflushed += 1
+        self.written += 1
+
+    def flush(self):
+        with self.io_lock:
+            for handler in self.handlers:
+                handler.flush_batch()
+        self.unflushed = 0
+        self.batches += 1
+
+    def note(self, level, message):
+        """Write a record of the logging pipeline's own, bypassing the queue and the sampling"""
+        record = logging.LogRecord('proxylib.logs', level, __file__, 0, message, None, None)
+        self.handle(record)
+
+    def report_drops(self):
+        dropped = self.queue_handler.dropped
+        if dropped > self.reported_drops:
+            self.note(logging.WARNING, f"Log queue full: dropped {dropped - self.reported_drops} records "
+                                       f"({dropped} since start)")
+            self.reported_drops = dropped
+
+    def report(self):
+        self.report_drops()
+        for rule in self.sampling.rules:
+            suppressed = rule.suppressed
+            if suppressed > rule.reported:
+                self.note(logging.INFO, f"Log sampling: suppressed {suppressed - rule.reported} "
+                                        f"'{rule.prefix}' records")
+                rule.reported = suppressed
+        if self.unflushed:
+            self.flush()
+
+    def enqueue_sentinel(self):
+        # The queue may be full; wait for room rather than failing like put_nowait()
+        self.queue.put(self._sentinel, timeout=STOP_TIMEOUT)
+
+
+class LogPipeline:
+    """The queue handler, sampling filter and background writer of one proxy process
+
+    Proxy threads only format the message and put it on a bounded queue;
+    file and console I/O happens on the listener thread. Forked workers
+    get a fresh queue and writer of their own.
+    """
+
+    def __init__(self, name, handlers, queue_size, rules):
+        self.name = name
+        self.queue_size = queue_size
+        self.handlers = handlers
+        self.sampling = SamplingFilter(rules)
+        self.queue_handler = DroppingQueueHandler(queue.Queue(queue_size))
+        self.queue_handler.addFilter(self.sampling)
+        self.listener = BatchingQueueListener(self.queue_handler.queue, handlers,
+                                              self.queue_handler, self.sampling)
+
+    def start(self):
+        self.listener.start()
+        atexit.register(self.stop)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(before=self.before_fork, after_in_parent=self.after_fork_parent,
+                                after_in_child=self.after_fork_child)
+
+    def stop(self):
+        """Write out the queued records and stop the writer"""
+        if self.listener._thread is None:
+            return
+        try:
+            self.listener.enqueue_sentinel()
+        except queue.Full:
+            pass
+        self.listener._thread.join(STOP_TIMEOUT)
+        self.listener._thread = None
+        self.listener.report()
+
+    def before_fork(self):
+        # Empty the stream buffers so the child does not write the parent's lines again
+        self.listener.io_lock.acquire()
+        for handler in self.handlers:
+            handler.flush_batch()
+
+    def after_fork_parent(self):
+        self.listener.io_lock.release()
+
+    def after_fork_child(self):
+        # Only the forking thread survives: the writer and the queue's locks are the parent's
+        log_queue = queue.Queue(self.queue_size)
+        self.queue_handler.queue = log_queue
+        self.queue_handler.enqueued = 0
+        self.queue_handler.dropped = 0
+        self.listener = BatchingQueueListener(log_queue, self.handlers, self.queue_handler, self.sampling)
+        self.listener.start()
+
+    def stats(self):
+        return {
+            'queued': self.queue_handler.queue.qsize(),
+            'enqueued': self.queue_handler.enqueued,
+            'dropped': self.queue_handler.dropped,
+            'suppressed': self.sampling.suppressed,
+            'written': self.listener.written,
+            'batches': self.listener.batches,
+        }
+
+
+_options = {}
+_pipeline = None
+
+
+def load_logging_config(config_file=CONFIG_FILE):
+    """Read the shared logging config, then apply the options given to configure_logging()
+
+    The file holds FORMAT=text|jsonl, QUEUE_SIZE=, LEVEL= and any number
+    of SAMPLE=<message prefix>:<keep one in N> and
+    RATE_LIMIT=<message prefix>:<records per second> lines.
+    """
+    options = {'format': 'text', 'queue_size': DEFAULT_QUEUE_SIZE, 'level': 'INFO', 'rules': []}
+    if os.path.exists(config_file):
+        with open(config_file, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                key, sep, value = line.partition('=')
+                if not sep:
+                    continue
+                value = value.strip()
+                if key == 'FORMAT':
+                    options['format'] = value
+                elif key == 'QUEUE_SIZE':
+                    options['queue_size'] = int(value)
+                elif key == 'LEVEL':
+                    options['level'] = value.upper()
+                elif key == 'SAMPLE':
+                    prefix, number = parse_rule(value)
+                    options['rules'].append(LogRule(prefix, sample=number))
+                elif key == 'RATE_LIMIT':
+                    prefix, number = parse_rule(value)
+                    options['rules'].append(LogRule(prefix, rate=number))
+
+    for key in ('format', 'queue_size', 'level'):
+        if _options.get(key) is not None:
+            options[key] = _options[key]
+    options['rules'].extend(_options.get('rules', ()))
+    if options['format'] not in LOG_FORMATS:
+        raise ValueError(f"Invalid log format {options['format']!r} (expected one of {', '.join(LOG_FORMATS)})")
+    return options
+
+
+def setup_proxy_logging(name, metrics=None, log_dir=LOG_DIR, console=True):
+    """Route the root logger through a LogPipeline writing to <log_dir>/<name>.log
+
+    In jsonl format the file is <name>.jsonl and the console stays
+    text. A second call in the same process returns the running
+    pipeline.
+    """
+    global _pipeline
+    if _pipeline is not None:
+        return _pipeline
+
+    options = load_logging_config()
+    os.makedirs(log_dir, exist_ok=True)
+
+    handlers = []
+    if options['format'] == 'jsonl':
+        handler = BatchedFileHandler(f"{log_dir}/{name}.jsonl")
+        handler.setFormatter(JsonFormatter(name))
+    else:
+        handler = BatchedFileHandler(f"{log_dir}/{name}.log")
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    handlers.append(handler)
+    if console:
+        handler = BatchedStreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        handlers.append(handler)
+
+    pipeline = LogPipeline(name, handlers, options['queue_size'], options['rules'])
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(pipeline.queue_handler)
+    root.setLevel(options['level'])
+    pipeline.start()
+
+    if metrics is not None:
+        metrics.add_stats('logging', pipeline.stats,
+                          counters=('enqueued', 'dropped', 'suppressed', 'written', 'batches'))
+    _pipeline = pipeline
+    return pipeline
+
+
+def stop_logging():
+    """Drain and stop the writer; used before os._exit(), which skips atexit handlers"""
+    if _pipeline is not None:
+        _pipeline.stop()
+
+
+def configure_logging(args):
+    """Keep the --log-* command line options for setup_proxy_logging()"""
+    _options['format'] = args.log_format
+    _options['queue_size'] = args.log_queue_size
+    _options['level'] = args.log_level
+    rules = []
+    for value in args.log_sample:
+        prefix, number = parse_rule(value)
+        rules.append(LogRule(prefix, sample=number))
+    for value in args.log_rate_limit:
+        prefix, number = parse_rule(value)
+        rules.append(LogRule(prefix, rate=number))
+    _options['rules'] = rules
+
+
+def add_logging_arguments(parser):
+    """Register the logging command line options"""
+    parser.add_argument("--log-format", choices=LOG_FORMATS, default=None,
+                        help="Log file format: text lines or one JSON object per line (.jsonl)")
+    parser.add_argument("--log-level", default=None, type=str.upper,
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help="Lowest level written")
+    parser.add_argument("--log-queue-size", type=int, default=None,
+                        help=f"Records buffered for the writer before new ones are dropped "
+                             f"(default {DEFAULT_QUEUE_SIZE})")
+    parser.add_argument("--log-sample", action="append", default=[], metavar="PREFIX:N",
+                        help="Keep one in N INFO records starting with PREFIX (repeatable)")
+    parser.add_argument("--log-rate-limit", action="append", default=[], metavar="PREFIX:N",
+                        help="Keep at most N INFO records per second starting with PREFIX (repeatable)")
@@ -0,0 +1,454 @@
+"""
+Mastermind proxy metrics
+Thread-safe counters and histograms exported in Prometheus text format
+Author: Mastermind
+"""
+
+import bisect
+import http.server
+import math
+import os
+import socket
+import socketserver
+import threading
+
+METRIC_PREFIX = 'mastermind_proxy'
+
+# Upper bounds in seconds for handshake and upstream connect times
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds in seconds for tunnel lifetimes
+DURATION_BUCKETS = (1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0, 14400.0, 86400.0)
+
+# Quantiles HDR histograms export as a Prometheus summary
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_value(value):
+    """Render a sample value the way Prometheus expects"""
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        if math.isnan(value):
+            return 'NaN'
+        return repr(value)
+    return str(int(value))
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels.items()
+    )
+    return '{' + pairs + '}'
+
+
+class Counter:
+    """Monotonically increasing value"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, labels):
+        yield self.name, labels, self.value
+
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+
+    kind = 'gauge'
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+
+class FunctionMetric:
+    """Counter or gauge whose value is read from a callable at scrape time"""
+
+    def __init__(self, name, help_text, function, kind='gauge'):
+        self.name = name
+        self.help = help_text
+        self.function = function
+        self.kind = kind
+
+    def samples(self, labels):
+        yield self.name, labels, self.function()
+
+
+class Histogram:
+    """Distribution of observed values over fixed buckets"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        """Return (cumulative bucket counts, sum, count)"""
+        with self._lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        cumulative = []
+        running = 0
+        for value in counts:
+            running += value
+            cumulative.append(running)
+        return cumulative, total, count
+
+    def samples(self, labels):
+        cumulative, total, count = self.snapshot()
+        bounds = self.buckets + (math.inf,)
+        for bound, value in zip(bounds, cumulative):
+            yield self.name + '_bucket', dict(labels, le=format_value(float(bound))), value
+        yield self.name + '_sum', labels, total
+        yield self.name + '_count', labels, count
+
+
+class HdrHistogram:
+    """Log-linear histogram with bounded relative error, after HdrHistogram
+
+    Values are counted in whole units of resolution (microseconds by
+    default). Below 2**precision units each value has a bucket of its
+    own; above that every power of two is split into 2**(precision - 1)
+    buckets, so a recorded value is off by less than 1 / 2**(precision - 1)
+    (1.6% at the default 7 bits) at any magnitude. Values above highest
+    land in the last bucket. Exported as a Prometheus summary.
+    """
+
+    kind = 'summary'
+
+    def __init__(self, name, help_text, precision=7, resolution=1e-6, highest=3600.0, quantiles=QUANTILES):
+        self.name = name
+        self.help = help_text
+        self.precision = precision
+        self.sub_buckets = 1 << precision
+        self.half = self.sub_buckets >> 1
+        self.resolution = resolution
+        self.scale = 1 / resolution
+        self.highest_units = int(highest / resolution)
+        self.quantiles = quantiles
+        self.counts = [0] * (self.index(self.highest_units) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max_units = 0
+        self._lock = threading.Lock()
+
+    def index(self, units):
+        if units < self.sub_buckets:
+            return units
+        shift = units.bit_length() - self.precision
+        return shift * self.half + (units >> shift)
+
+    def bucket_range(self, index):
+        """Lowest and highest value, in units, counted in bucket index"""
+        if index < self.sub_buckets:
+            return index, index
+        shift = index // self.half - 1
+        sub = index - shift * self.half
+        return sub << shift, ((sub + 1) << shift) - 1
+
+    def observe(self, value):
+        # index() inlined: this runs several times per connection
+        units = int(value * self.scale)
+        if units < self.sub_buckets:
+            if units < 0:
+                units = 0
+            index = units
+        else:
+            if units > self.highest_units:
+                units = self.highest_units
+            shift = units.bit_length() - self.precision
+            index = shift * self.half + (units >> shift)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+            if units > self.max_units:
+                self.max_units = units
+
+    def snapshot(self):
+        """Return (sparse [(bucket index, count)], sum, count, max units)"""
+        with self._lock:
+            buckets = [(index, count) for index, count in enumerate(self.counts) if count]
+            return buckets, self.sum, self.count, self.max_units
+
+    def quantile_units(self, buckets, count, max_units, fraction):
+        """Highest value, in units, of the bucket holding the fraction-th value"""
+        if not count:
+            return 0
+        rank = max(1, math.ceil(fraction * count))
+        seen = 0
+        for index, bucket_count in buckets:
+            seen += bucket_count
+            if seen >= rank:
+                return min(self.bucket_range(index)[1], max_units)
+        return max_units
+
+    def quantile(self, fraction):
+        buckets, _, count, max_units = self.snapshot()
+        return self.quantile_units(buckets, count, max_units, fraction) / self.scale
+
+    def samples(self, labels):
+        buckets, total, count, max_units = self.snapshot()
+        for fraction in self.quantiles:
+            value = self.quantile_units(buckets, count, max_units, fraction) / self.scale
+            yield self.name, dict(labels, quantile=format_value(float(fraction))), value
+        yield self.name + '_sum', labels, total
+        yield self.name + '_count', labels, count
+
+
+class MetricsRegistry:
+    """Named metrics sharing a prefix and a set of constant labels"""
+
+    def __init__(self, labels=None, prefix=METRIC_PREFIX):
+        self.labels = dict(labels or {})
+        self.prefix = prefix
+        self.metrics = []
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        metric.name = f"{self.prefix}_{metric.name}"
+        with self._lock:
+            self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text):
+        return self.register(Counter(name, help_text))
+
+    def gauge(self, name, help_text):
+        return self.register(Gauge(name, help_text))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, buckets))
+
+    def hdr_histogram(self, name, help_text, **options):
+        return self.register(HdrHistogram(name, help_text, **options))
+
+    def function(self, name, help_text, function, kind='gauge'):
+        return self.register(FunctionMetric(name, help_text, function, kind))
+
+    def add_stats(self, component, stats, counters=()):
+        """Export every numeric field of a stats() snapshot as <component>_<field>
+
+        Fields listed in counters are typed as counters (and get a _total
+        suffix); everything else is a gauge. Nested dicts become
+        <component>_<key>_<field>.
+        """
+        with self._lock:
+            self.collectors.append((component, stats, frozenset(counters)))
+
+    def collected(self):
+        """Yield metric-like objects for the registered stats() snapshots"""
+        with self._lock:
+            collectors = list(self.collectors)
+        for component, stats, counters in collectors:
+            try:
+                snapshot = stats()
+            except Exception:
+                continue
+            for name, value, kind in flatten_stats(component, snapshot, counters):
+                yield FunctionMetric(f"{self.prefix}_{name}", f"{component} {name[len(component) + 1:]}",
+                                     lambda value=value: value, kind)
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self.metrics)
+        lines = []
+        for metric in metrics + list(self.collected()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples(self.labels):
+                lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def flatten_stats(component, snapshot, counters):
+    for key, value in snapshot.items():
+        if isinstance(value, dict):
+            yield from flatten_stats(f"{component}_{key}", value, counters)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            if key in counters:
+                yield f"{component}_{key}_total", value, 'counter'
+            else:
+                yield f"{component}_{key}", value, 'gauge'
+
+
+class ProxyMetrics(MetricsRegistry):
+    """The instruments every Mastermind proxy exports
+
+    Connection counts come from the admission controller, which already
+    tracks them under its lock; the histograms are fed by the admission
+    ticket (handshake and tunnel time) and the connector (upstream
+    connect time), and the relay loops add to the byte counters.
+    """
+
+    def __init__(self, proxy_name):
+        super().__init__({'proxy': proxy_name})
+        self.bytes_in = self.counter('bytes_in_total', 'Bytes received from clients')
+        self.bytes_out = self.counter('bytes_out_total', 'Bytes sent to clients')
+        self.handshake_failures = self.counter(
+            'handshake_failures_total', 'Connections closed before the tunnel was established')
+        self.connect_failures = self.counter(
+            'upstream_connect_failures_total', 'Upstream connects that failed or timed out')
+        self.handshake_time = self.histogram(
+            'handshake_seconds', 'Time from accept until the tunnel is established', LATENCY_BUCKETS)
+        self.connect_time = self.histogram(
+            'upstream_connect_seconds', 'Upstream connect time including DNS resolution', LATENCY_BUCKETS)
+        self.tunnel_duration = self.histogram(
+            'tunnel_duration_seconds', 'Lifetime of established tunnels', DURATION_BUCKETS)
+
+    def track(self, admission, buffer_pool=None, resolver=None, connector=None):
+        """Export connection counts and the stats() of the shared components"""
+        self.function('connections_active', 'Connections currently open',
+                      lambda: admission.active)
+        self.function('connections_total', 'Connections accepted', lambda: admission.admitted, 'counter')
+        self.add_stats('admission', admission.stats,
+                       counters=('admitted', 'rejected_connections', 'rejected_per_ip',
+                                 'rejected_handshakes', 'rejected_total'))
+        if buffer_pool is not None:
+            self.add_stats('buffer_pool', buffer_pool.stats, counters=('hits', 'misses', 'discards'))
+        if resolver is not None:
+            self.add_stats('resolver', resolver.stats,
+                           counters=('hits', 'negative_hits', 'misses', 'coalesced', 'evictions', 'failures'))
+        if connector is not None:
+            self.add_stats('connector', connector.stats,
+                           counters=('connects', 'connect_failures', 'attempts', 'successes', 'failures'))
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Serve the registry on GET /metrics (and /)"""
+
+    server_version = 'Mastermind-Proxy-Metrics/2.0'
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TCPMetricsServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        # The successor of a graceful restart binds the port while this process still drains
+        if hasattr(socket, 'SO_REUSEPORT'):
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+
+class TCP6MetricsServer(TCPMetricsServer):
+    address_family = socket.AF_INET6
+
+
+class UnixMetricsServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        # Remove a socket left behind by a previous run
+        try:
+            os.unlink(self.server_address)
+        except FileNotFoundError:
+            pass
+        super().server_bind()
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        return request, ('unix', 0)
+
+
+def parse_metrics_address(address):
+    """Split a --metrics value into ('unix', path) or ('tcp', (host, port))"""
+    if address.startswith('unix:'):
+        return 'unix', address[5:]
+    if address.startswith('/'):
+        return 'unix', address
+    host, sep, port = address.rpartition(':')
+    if not sep:
+        host, port = '127.0.0.1', address
+    return 'tcp', (host.strip('[]') or '127.0.0.1', int(port))
+
+
+def worker_metrics_address(address, index):
+    """Metrics address of worker index: TCP port + index + 1, or path.<index>"""
+    kind, target = parse_metrics_address(address)
+    if kind == 'unix':
+        return f"unix:{target}.{index}"
+    host, port = target
+    return f"[{host}]:{port + index + 1}" if ':' in host else f"{host}:{port + index + 1}"
+
+
+def serve_metrics(registry, address):
+    """Serve registry on address from a daemon thread; returns the server"""
+    kind, target = parse_metrics_address(address)
+    if kind == 'unix':
+        server = UnixMetricsServer(target, MetricsHandler)
+    elif ':' in target[0]:
+        server = TCP6MetricsServer(target, MetricsHandler)
+    else:
+        server = TCPMetricsServer(target, MetricsHandler)
+    server.registry = registry
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def start_metrics_server(registry, address, logger, name):
+    """serve_metrics() that logs instead of raising; returns the server or None"""
+    try:
+        server = serve_metrics(registry, address)
+    except (OSError, ValueError) as e:
+        logger.error(f"{name} metrics server failed on {address}: {e}")
+        return None
+    logger.info(f"{name} metrics on {address}")
+    return server
+
+
+def add_metrics_arguments(parser):
+    """Register the metrics command line option"""
+    parser.add_argument("--metrics", default=None, metavar="ADDRESS",
+                        help="Serve Prometheus metrics on host:port, port (localhost) or a Unix "
+                             "socket path; with --workers, worker N uses port+N+1 or path.N")
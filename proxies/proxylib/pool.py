@@ -0,0 +1,117 @@
+"""
+Mastermind upstream connection pool
+Idle keep-alive connections kept per origin for reuse by the HTTP proxies
+Author: Mastermind
+"""
+
+import socket
+import threading
+import time
+
+DEFAULT_MAX_IDLE_PER_HOST = 8
+# Seconds an idle connection may wait in the pool (origins commonly close after 60 s or less)
+DEFAULT_IDLE_TIMEOUT = 30.0
+
+
+def is_alive(sock):
+    """Return True if an idle socket is still open with nothing unread"""
+    # A socket with a timeout would wait out the timeout even with MSG_DONTWAIT
+    timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        data = sock.recv(1, socket.MSG_PEEK)
+    except (BlockingIOError, InterruptedError):
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.settimeout(timeout)
+    # b"" means the origin closed it; unexpected bytes mean it is out of sync
+    return False
+
+
+class ConnectionPool:
+    """Thread-safe LIFO pools of idle upstream sockets keyed by (host, port)
+
+    acquire() hands out the most recently used idle socket that is still
+    open, or connects a new one through the connector. release() returns
+    a socket whose last response was fully read and allowed keep-alive.
+    """
+
+    def __init__(self, connector, max_idle_per_host=DEFAULT_MAX_IDLE_PER_HOST,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.connector = connector
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.discards = 0
+
+    def acquire(self, host, port):
+        """Return (socket, reused) for host:port"""
+        key = (host, port)
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                if not idle:
+                    self.misses += 1
+                    break
+                sock, released_at = idle.pop()
+                if not idle:
+                    del self._idle[key]
+
+            if now - released_at < self.idle_timeout and is_alive(sock):
+                with self._lock:
+                    self.hits += 1
+                return sock, True
+
+            with self._lock:
+                self.stale += 1
+            sock.close()
+
+        return self.connector.connect(host, port), False
+
+    def release(self, host, port, sock):
+        """Park a reusable socket; it is closed if the pool for host:port is full"""
+        key = (host, port)
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append((sock, time.monotonic()))
+                return
+            self.discards += 1
+        sock.close()
+
+    def close(self):
+        """Close every idle socket"""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for entries in idle.values():
+            for sock, _ in entries:
+                sock.close()
+
+    def stats(self):
+        """Return a snapshot of pool counters"""
+        with self._lock:
+            acquires = self.hits + self.misses
+            return {
+                'idle': sum(len(entries) for entries in self._idle.values()),
+                'hosts': len(self._idle),
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'discards': self.discards,
+                'reuse_rate': self.hits / acquires if acquires else 0.0,
+            }
+
+    def format_stats(self):
+        """Return stats() as a log-friendly line"""
+        s = self.stats()
+        return (f"Upstream pool - Idle: {s['idle']} ({s['hosts']} hosts), Reuse: {s['reuse_rate']:.1%}, "
+                f"Hits: {s['hits']}, Misses: {s['misses']}, Stale: {s['stale']}, Discards: {s['discards']}")
@@ -0,0 +1,181 @@
+"""
+Mastermind connection reaper
+Registry of established tunnels that closes idle and over-age ones from a hashed timer wheel
+Author: Mastermind
+"""
+
+import math
+import threading
+import time
+
+# Seconds without traffic in either direction before a tunnel is closed (0 = never)
+DEFAULT_IDLE_TIMEOUT = 600
+# Seconds a tunnel may live regardless of traffic (0 = unlimited)
+DEFAULT_MAX_LIFETIME = 0
+# Seconds per wheel tick; timeouts are enforced to within one tick
+DEFAULT_TICK = 1.0
+# Wheel slots; deadlines further than one revolution ahead wait for a later pass
+WHEEL_SLOTS = 512
+
+REASON_IDLE = 'idle'
+REASON_LIFETIME = 'lifetime'
+
+
+class Tunnel:
+    """One registered tunnel; the relay calls touch() for every chunk it moves"""
+
+    __slots__ = ('reaper', 'close', 'last_active', 'expires', 'deadline', 'slot')
+
+    def __init__(self, reaper, close, now, expires):
+        self.reaper = reaper
+        self.close = close
+        self.last_active = now
+        self.expires = expires
+        self.deadline = None
+        self.slot = None
+
+    def touch(self):
+        # A plain store of the wheel's tick counter: no clock read and no lock per chunk
+        self.last_active = self.reaper.tick
+
+    def unregister(self):
+        self.reaper.unregister(self)
+
+
+class ConnectionReaper:
+    """Closes tunnels idle for idle_timeout seconds or older than max_lifetime
+
+    Tunnels sit in the slot of the wheel tick at which they may first
+    expire. Activity only updates a tunnel's last_active tick; when its
+    slot comes round the tunnel is either closed or moved to the slot of
+    its new deadline, so each tick touches only the tunnels hashed to one
+    slot and traffic never takes the registry lock. A tick is one
+    DEFAULT_TICK interval of the reaper thread started by start().
+
+    close is called on the reaper thread and must only wake the relay
+    (shut the sockets down, or schedule a close on an event loop); the
+    relay then finishes and unregisters the tunnel as usual.
+    """
+
+    def __init__(self, idle_timeout=DEFAULT_IDLE_TIMEOUT, max_lifetime=DEFAULT_MAX_LIFETIME,
+                 tick=DEFAULT_TICK, slots=WHEEL_SLOTS):
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.tick_seconds = tick
+        self.idle_ticks = math.ceil(idle_timeout / tick) if idle_timeout else 0
+        self.lifetime_ticks = math.ceil(max_lifetime / tick) if max_lifetime else 0
+        self.wheel = [set() for _ in range(slots)]
+        self.tick = 0
+        self.tracked = 0
+        self.running = False
+        self._lock = threading.Lock()
+
+        # Statistics
+        self.reaped_idle = 0
+        self.reaped_lifetime = 0
+
+    @property
+    def enabled(self):
+        return bool(self.idle_ticks or self.lifetime_ticks)
+
+    def due(self, tunnel):
+        """First tick at which tunnel may expire, with the reason"""
+        idle = tunnel.last_active + self.idle_ticks if self.idle_ticks else None
+        if tunnel.expires is not None and (idle is None or tunnel.expires <= idle):
+            return tunnel.expires, REASON_LIFETIME
+        return idle, REASON_IDLE
+
+    def schedule(self, tunnel, deadline):
+        """Hash tunnel into the slot of deadline; caller holds the lock"""
+        tunnel.deadline = max(deadline, self.tick + 1)
+        tunnel.slot = self.wheel[tunnel.deadline % len(self.wheel)]
+        tunnel.slot.add(tunnel)
+
+    def register(self, close):
+        """Track a new tunnel; returns its Tunnel, or None when no timeout is configured"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            now = self.tick
+            expires = now + self.lifetime_ticks if self.lifetime_ticks else None
+            tunnel = Tunnel(self, close, now, expires)
+            self.schedule(tunnel, self.due(tunnel)[0])
+            self.tracked += 1
+        return tunnel
+
+    def unregister(self, tunnel):
+        with self._lock:
+            if tunnel.slot is not None:
+                tunnel.slot.discard(tunnel)
+                tunnel.slot = None
+                self.tracked -= 1
+
+    def advance(self):
+        """Move the wheel one tick; returns the (tunnel, reason) pairs that expired"""
+        expired = []
+        with self._lock:
+            self.tick += 1
+            now = self.tick
+            slot = self.wheel[now % len(self.wheel)]
+            for tunnel in [tunnel for tunnel in slot if tunnel.deadline <= now]:
+                slot.discard(tunnel)
+                deadline, reason = self.due(tunnel)
+                if deadline <= now:
+                    tunnel.slot = None
+                    self.tracked -= 1
+                    expired.append((tunnel, reason))
+                else:
+                    self.schedule(tunnel, deadline)
+            for _, reason in expired:
+                if reason == REASON_IDLE:
+                    self.reaped_idle += 1
+                else:
+                    self.reaped_lifetime += 1
+        return expired
+
+    def run(self):
+        """Reaper thread: one advance() per tick, catching up if the thread was late"""
+        started = time.monotonic()
+        while self.running:
+            time.sleep(self.tick_seconds)
+            target = int((time.monotonic() - started) / self.tick_seconds)
+            while self.tick < target:
+                for tunnel, _ in self.advance():
+                    try:
+                        tunnel.close()
+                    except (OSError, RuntimeError):
+                        pass  # Already closed, or its event loop has stopped
+
+    def start(self):
+        """Start the reaper thread; a no-op when no timeout is configured"""
+        if not self.enabled or self.running:
+            return
+        self.running = True
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def stats(self):
+        return {
+            'tracked': self.tracked,
+            'reaped': self.reaped_idle + self.reaped_lifetime,
+            'reaped_idle': self.reaped_idle,
+            'reaped_lifetime': self.reaped_lifetime,
+        }
+
+    def format_stats(self):
+        """One-line summary for the periodic stats log"""
+        s = self.stats()
+        return (f"Reaper - Tracked: {s['tracked']}, Reaped: {s['reaped']} "
+                f"(idle {s['reaped_idle']}, lifetime {s['reaped_lifetime']})")
+
+
+def add_reaper_arguments(parser):
+    """Register the tunnel timeout command line options"""
+    parser.add_argument("--idle-timeout", type=float, default=DEFAULT_IDLE_TIMEOUT,
+                        help="Close tunnels without traffic for this many seconds (0 = never)")
+    parser.add_argument("--max-lifetime", type=float, default=DEFAULT_MAX_LIFETIME,
+                        help="Close tunnels older than this many seconds (0 = unlimited)")
@@ -0,0 +1,188 @@
+"""
+Mastermind proxy relay
+Bidirectional socket relay with a zero-copy splice() path on Linux
+Author: Mastermind
+"""
+
+import errno
+import os
+import socket
+import sys
+import threading
+
+from .buffers import DEFAULT_BUFFER_SIZE
+from .shaper import throttle
+from .tracing import first_byte_hooks
+
+RELAY_MODES = ('auto', 'splice', 'copy')
+
+# Bytes moved per splice() call; matches the default Linux pipe capacity
+SPLICE_CHUNK_SIZE = 65536
+
+# Errors meaning "splice cannot be used on these descriptors"
+SPLICE_UNSUPPORTED_ERRNOS = (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP)
+
+
+def splice_supported():
+    """Return True when os.splice() is available on this platform"""
+    return sys.platform.startswith('linux') and hasattr(os, 'splice')
+
+
+def shutdown_pair(source, destination):
+    """Shut down both ends of a tunnel without closing them
+
+    shutdown() wakes a peer thread blocked in recv()/splice() on the same
+    socket, which close() alone does not do on Linux.
+    """
+    for sock in (source, destination):
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def close_pair(source, destination):
+    """Shut down and close both ends of a tunnel"""
+    shutdown_pair(source, destination)
+    for sock in (source, destination):
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+
+def forward_copy(source, destination, is_running, pool=None, counter=None, flow=None, tunnel=None,
+                 first=None):
+    """Copy data from source to destination through a reusable buffer
+
+    recv_into() fills a pooled bytearray in place and sendall() writes a
+    memoryview slice of it, resuming after short writes, so no bytes
+    object is created per chunk. Each chunk is added to counter, charged
+    to the shaper flow and marks the reaper tunnel active, if given;
+    first is called once, after the first chunk is written.
+    """
+    buffer = pool.acquire() if pool is not None else bytearray(DEFAULT_BUFFER_SIZE)
+    view = memoryview(buffer)
+    try:
+        while is_running():
+            received = source.recv_into(buffer)
+            if not received:
+                break
+            destination.sendall(view[:received])
+            if first is not None:
+                first()
+                first = None
+            if counter is not None:
+                counter.inc(received)
+            if tunnel is not None:
+                tunnel.touch()
+            if flow is not None:
+                throttle(flow, received)
+    except OSError:
+        pass
+    finally:
+        view.release()
+        if pool is not None:
+            pool.release(buffer)
+        shutdown_pair(source, destination)
+
+
+def forward_splice(source, destination, is_running, pool=None, counter=None, flow=None, tunnel=None,
+                   first=None):
+    """Move data from source to destination through a kernel pipe
+
+    Falls back to forward_copy() if the kernel refuses to splice these
+    descriptors before any data has been moved.
+    """
+    try:
+        pipe_r, pipe_w = os.pipe()
+    except OSError:
+        return forward_copy(source, destination, is_running, pool, counter, flow, tunnel, first)
+
+    moved_any = False
+    fallback = False
+    try:
+        src_fd = source.fileno()
+        dst_fd = destination.fileno()
+        while is_running():
+            pending = os.splice(src_fd, pipe_w, SPLICE_CHUNK_SIZE,
+                                flags=os.SPLICE_F_MOVE | os.SPLICE_F_MORE)
+            if pending == 0:
+                break
+            moved_any = True
+            if counter is not None:
+                counter.inc(pending)
+            moved = pending
+            while pending:
+                pending -= os.splice(pipe_r, dst_fd, pending, flags=os.SPLICE_F_MOVE)
+            if first is not None:
+                first()
+                first = None
+            if tunnel is not None:
+                tunnel.touch()
+            if flow is not None:
+                throttle(flow, moved)
+    except OSError as e:
+        fallback = not moved_any and e.errno in SPLICE_UNSUPPORTED_ERRNOS
+    finally:
+        os.close(pipe_r)
+        os.close(pipe_w)
+        if not fallback:
+            shutdown_pair(source, destination)
+
+    if fallback:
+        forward_copy(source, destination, is_running, pool, counter, flow, tunnel, first)
+
+
+def relay(client_socket, server_socket, is_running, mode='auto', pool=None, metrics=None, shaping=None,
+          reaper=None):
+    """Relay data in both directions until either side closes
+
+    The server-to-client direction runs on a helper thread and the
+    client-to-server direction on the calling thread, so a tunnel costs
+    one extra thread rather than two. The copy loop draws its buffers
+    from pool when one is given, and moved bytes are counted in the
+    bytes_in/bytes_out counters of metrics. shaping, a TunnelShaping from
+    the proxy's Shaper, rate-limits both directions and is closed here.
+    With a ConnectionReaper the tunnel is registered for the duration of
+    the relay and shut down by the reaper once idle or over age; socket
+    timeouts are then cleared, as the reaper owns the idle policy. The
+    first chunk each way is marked on the connection's trace.
+
+    The forward loops only shut the sockets down; both are closed here
+    once both directions have stopped. splice() works on raw descriptor
+    numbers, and closing them while the other direction is still looping
+    would let it splice from whichever new connection reuses the number.
+    """
+    bytes_in = metrics.bytes_in if metrics is not None else None
+    bytes_out = metrics.bytes_out if metrics is not None else None
+    upload = shaping.upload if shaping is not None else None
+    download = shaping.download if shaping is not None else None
+    first_upstream, first_downstream = first_byte_hooks()
+
+    tunnel = reaper.register(lambda: shutdown_pair(client_socket, server_socket)) if reaper is not None else None
+
+    # 'splice' and 'auto' both degrade to the copy loop off Linux
+    if mode != 'copy' and splice_supported():
+        forward = forward_splice
+    else:
+        forward = forward_copy
+    # splice() needs blocking descriptors; a socket timeout makes them non-blocking
+    if forward is forward_splice or tunnel is not None:
+        client_socket.settimeout(None)
+        server_socket.settimeout(None)
+
+    server_to_client = threading.Thread(
+        target=forward,
+        args=(server_socket, client_socket, is_running, pool, bytes_out, download, tunnel, first_downstream)
+    )
+    server_to_client.daemon = True
+    server_to_client.start()
+
+    forward(client_socket, server_socket, is_running, pool, bytes_in, upload, tunnel, first_upstream)
+    server_to_client.join()
+    close_pair(client_socket, server_socket)
+    if tunnel is not None:
+        tunnel.unregister()
+    if shaping is not None:
+        shaping.close()
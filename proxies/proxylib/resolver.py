@@ -0,0 +1,245 @@
+"""
+Mastermind proxy DNS resolver
+TTL-respecting positive/negative cache in front of dnspython
+Author: Mastermind
+"""
+
+import asyncio
+import ipaddress
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import dns.exception
+    import dns.resolver
+except ImportError:  # dnspython missing: resolve through getaddrinfo only
+    dns = None
+
+DEFAULT_CACHE_SIZE = 4096
+DEFAULT_MIN_TTL = 5
+DEFAULT_MAX_TTL = 3600
+DEFAULT_NEGATIVE_TTL = 30
+# TTL used for answers that come from getaddrinfo(), which does not report one
+FALLBACK_TTL = 60
+DNS_TIMEOUT = 5
+
+
+def is_ip_address(host):
+    """Return True if host is an IPv4 or IPv6 literal"""
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+class PendingLookup:
+    """A lookup in flight that other callers for the same name wait on"""
+
+    __slots__ = ('event', 'addresses', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.addresses = None
+        self.error = None
+
+
+class Resolver:
+    """Caching resolver shared by all connections of a proxy
+
+    - positive answers are kept for the record TTL (clamped to
+      min_ttl..max_ttl), NXDOMAIN/no-data answers for negative_ttl
+    - concurrent lookups of the same name are merged into one query
+    - the cache holds at most cache_size names, evicting the least
+      recently used
+    - names unknown to DNS are retried through getaddrinfo() so
+      /etc/hosts entries such as localhost keep working
+
+    resolve() returns a list of address strings, IPv4 first, and raises
+    socket.gaierror when the name does not resolve.
+    """
+
+    def __init__(self, cache_size=DEFAULT_CACHE_SIZE, min_ttl=DEFAULT_MIN_TTL,
+                 max_ttl=DEFAULT_MAX_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL):
+        self.cache_size = cache_size
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+
+        self._cache = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+        self._dns = None
+        if dns is not None:
+            try:
+                self._dns = dns.resolver.Resolver()
+                self._dns.lifetime = DNS_TIMEOUT
+            except dns.exception.DNSException:
+                self._dns = None
+
+        # Statistics
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.failures = 0
+
+    def lookup_dns(self, name):
+        """Query A and AAAA records; returns (addresses, ttl)"""
+        addresses = []
+        ttls = []
+        for rdtype in ('A', 'AAAA'):
+            try:
+                answer = self._dns.resolve(name, rdtype, raise_on_no_answer=False)
+            except dns.resolver.NXDOMAIN:
+                break
+            if answer.rrset is not None:
+                ttls.append(answer.rrset.ttl)
+                addresses.extend(rdata.address for rdata in answer.rrset)
+        if not addresses:
+            raise socket.gaierror(socket.EAI_NONAME, f"No address records for {name}")
+        return addresses, min(ttls)
+
+    def lookup_system(self, name):
+        """Resolve through getaddrinfo(); returns (addresses, ttl)"""
+        infos = socket.getaddrinfo(name, None, type=socket.SOCK_STREAM)
+        addresses = []
+        for family, _, _, _, sockaddr in sorted(infos, key=lambda info: info[0] != socket.AF_INET):
+            if sockaddr[0] not in addresses:
+                addresses.append(sockaddr[0])
+        return addresses, FALLBACK_TTL
+
+    def lookup(self, name):
+        """Resolve a name without the cache; returns (addresses, ttl)"""
+        if self._dns is not None:
+            try:
+                return self.lookup_dns(name)
+            except (socket.gaierror, dns.exception.DNSException):
+                pass  # Fall through to the system resolver (hosts file, search domains)
+        return self.lookup_system(name)
+
+    def store(self, name, addresses, ttl):
+        """Insert an answer (None for a negative one) and evict past the size limit"""
+        self._cache[name] = (time.monotonic() + ttl, addresses)
+        self._cache.move_to_end(name)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+            self.evictions += 1
+
+    def cached(self, name):
+        """Return a live cache entry for name, counting the hit; caller holds the lock"""
+        entry = self._cache.get(name)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._cache[name]
+            return None
+        self._cache.move_to_end(name)
+        if entry[1] is None:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def resolve(self, host):
+        """Resolve host to a list of addresses, using and filling the cache"""
+        if is_ip_address(host):
+            return [host]
+
+        name = host.lower().rstrip('.')
+        with self._lock:
+            entry = self.cached(name)
+            if entry is not None:
+                if entry[1] is None:
+                    raise socket.gaierror(socket.EAI_NONAME, f"{host} does not resolve (cached)")
+                return entry[1]
+
+            pending = self._inflight.get(name)
+            leader = pending is None
+            if leader:
+                pending = self._inflight[name] = PendingLookup()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            pending.event.wait()
+            if pending.error is not None:
+                # A fresh exception per waiter keeps tracebacks from piling up
+                raise socket.gaierror(*pending.error.args)
+            return pending.addresses
+
+        addresses, ttl, negative = None, self.negative_ttl, False
+        try:
+            addresses, ttl = self.lookup(name)
+            ttl = max(self.min_ttl, min(ttl, self.max_ttl))
+        except socket.gaierror as e:
+            # Only definitive answers are cached; timeouts are retried next time
+            negative = e.errno in (socket.EAI_NONAME, getattr(socket, 'EAI_NODATA', socket.EAI_NONAME))
+            pending.error = e
+        except UnicodeError:
+            # An empty or over-long label fails IDNA encoding: no lookup of it can ever succeed
+            negative = True
+            pending.error = socket.gaierror(socket.EAI_NONAME, f"{host} is not a valid host name")
+        except Exception as e:
+            pending.error = socket.gaierror(socket.EAI_AGAIN, str(e))
+        finally:
+            # Waiters are released whatever happened, or they would block on the event forever
+            if addresses is None and pending.error is None:
+                pending.error = socket.gaierror(socket.EAI_AGAIN, f"Lookup of {host} was interrupted")
+            with self._lock:
+                if pending.error is None:
+                    self.store(name, addresses, ttl)
+                else:
+                    self.failures += 1
+                    if negative:
+                        self.store(name, None, ttl)
+                del self._inflight[name]
+
+            pending.addresses = addresses
+            pending.event.set()
+
+        if pending.error is not None:
+            raise pending.error
+        return addresses
+
+    async def resolve_async(self, host):
+        """Resolve from a coroutine; cache hits never leave the event loop"""
+        if is_ip_address(host):
+            return [host]
+
+        name = host.lower().rstrip('.')
+        with self._lock:
+            entry = self.cached(name)
+        if entry is not None:
+            if entry[1] is None:
+                raise socket.gaierror(socket.EAI_NONAME, f"{host} does not resolve (cached)")
+            return entry[1]
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.resolve, host)
+
+    def stats(self):
+        """Return a snapshot of cache counters"""
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses + self.coalesced
+            return {
+                'entries': len(self._cache),
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'failures': self.failures,
+                'hit_rate': (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+            }
+
+    def format_stats(self):
+        """One-line summary for the periodic stats log"""
+        s = self.stats()
+        return (f"DNS - Entries: {s['entries']}, Hits: {s['hits']}, Negative hits: {s['negative_hits']}, "
+                f"Misses: {s['misses']}, Coalesced: {s['coalesced']}, Hit rate: {s['hit_rate']:.1%}")
@@ -0,0 +1,219 @@
+"""
+Mastermind secure channel
+Framed ChaCha20-Poly1305 / AES-GCM transport between the SEGURO proxy and its client helper
+Author: Mastermind
+"""
+
+import base64
+import os
+import struct
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+MAGIC = b"MMSC"
+VERSION = 1
+
+CIPHER_CHACHA20 = 1
+CIPHER_AESGCM = 2
+CIPHERS = {
+    CIPHER_CHACHA20: ChaCha20Poly1305,
+    CIPHER_AESGCM: AESGCM,
+}
+CIPHER_NAMES = {
+    'chacha20': CIPHER_CHACHA20,
+    'aesgcm': CIPHER_AESGCM,
+}
+
+KEY_SIZE = 32
+RANDOM_SIZE = 32
+TAG_SIZE = 16
+# Largest plaintext per record (same limit as a TLS record)
+MAX_RECORD_SIZE = 16384
+
+# Hello: magic, version, cipher id, 32 random bytes; the server echoes the layout with its own random
+HELLO = struct.Struct(">4sBB32s")
+# Record header: ciphertext length, authenticated as associated data
+RECORD_HEADER = struct.Struct(">H")
+
+RECV_SIZE = 65536
+
+
+class ChannelError(ConnectionError):
+    """Failed channel handshake or a record that did not authenticate"""
+
+
+def generate_key():
+    """Return a new random pre-shared key, base64 encoded"""
+    return base64.b64encode(os.urandom(KEY_SIZE)).decode()
+
+
+def decode_key(value):
+    """Decode a base64 pre-shared key"""
+    try:
+        key = base64.b64decode(value.strip(), validate=True)
+    except ValueError:
+        raise ValueError("Channel key must be base64")
+    if len(key) != KEY_SIZE:
+        raise ValueError(f"Channel key must be {KEY_SIZE} bytes")
+    return key
+
+
+def derive_keys(psk, cipher_id, client_random, server_random):
+    """Return (client-to-server key, server-to-client key) for one connection"""
+    material = HKDF(
+        algorithm=hashes.SHA256(),
+        length=KEY_SIZE * 2,
+        salt=client_random + server_random,
+        info=MAGIC + bytes((VERSION, cipher_id)),
+    ).derive(psk)
+    return material[:KEY_SIZE], material[KEY_SIZE:]
+
+
+class RecordCipher:
+    """One direction of a channel: an AEAD key and its nonce counter
+
+    Nonces are 4 zero bytes and a 64-bit record counter. Every connection
+    derives fresh keys from both hellos' random bytes, so counters can
+    start at zero without ever repeating a (key, nonce) pair.
+    """
+
+    def __init__(self, cipher_id, key):
+        self.aead = CIPHERS[cipher_id](key)
+        self.counter = 0
+
+    def next_nonce(self):
+        nonce = b"\x00\x00\x00\x00" + self.counter.to_bytes(8, 'big')
+        self.counter += 1
+        return nonce
+
+    def seal(self, plaintext):
+        """Return one framed record carrying plaintext"""
+        header = RECORD_HEADER.pack(len(plaintext) + TAG_SIZE)
+        return header + self.aead.encrypt(self.next_nonce(), plaintext, header)
+
+    def open(self, header, ciphertext):
+        """Return the plaintext of one record"""
+        try:
+            return self.aead.decrypt(self.next_nonce(), ciphertext, header)
+        except InvalidTag:
+            raise ChannelError("Record failed authentication (wrong key or tampered stream)")
+
+
+class SecureChannel:
+    """Socket-like wrapper that encrypts everything sent over sock
+
+    Implements the subset of the socket API the proxies use (recv,
+    recv_into, sendall, settimeout, shutdown, close), so SOCKS handling
+    and the copy relay run over it unchanged. One thread may send while
+    another receives. The splice relay must not be used: it would move
+    ciphertext without decrypting it.
+    """
+
+    def __init__(self, sock, cipher_id, send_key, recv_key):
+        self.sock = sock
+        self.sender = RecordCipher(cipher_id, send_key)
+        self.receiver = RecordCipher(cipher_id, recv_key)
+        self.raw = bytearray()
+        # Plaintext of the last record and how much of it has been returned
+        self.plain = b""
+        self.offset = 0
+
+    def read_record(self):
+        """Decrypt the next record into self.plain; returns False at end of stream"""
+        raw = self.raw
+        while True:
+            if len(raw) >= RECORD_HEADER.size:
+                length = RECORD_HEADER.unpack_from(raw)[0]
+                if length < TAG_SIZE or length > MAX_RECORD_SIZE + TAG_SIZE:
+                    raise ChannelError(f"Bad record length {length}")
+                end = RECORD_HEADER.size + length
+                if len(raw) >= end:
+                    with memoryview(raw) as view:
+                        self.plain = self.receiver.open(view[:RECORD_HEADER.size],
+                                                        view[RECORD_HEADER.size:end])
+                    self.offset = 0
+                    del raw[:end]
+                    return True
+            chunk = self.sock.recv(RECV_SIZE)
+            if not chunk:
+                if raw:
+                    raise ChannelError("Stream ended in the middle of a record")
+                return False
+            raw += chunk
+
+    def recv(self, bufsize):
+        """Return up to bufsize bytes of plaintext; b"" at end of stream"""
+        while self.offset >= len(self.plain):
+            if not self.read_record():
+                return b""
+        start = self.offset
+        self.offset = min(start + bufsize, len(self.plain))
+        if start == 0 and self.offset == len(self.plain):
+            return self.plain
+        return self.plain[start:self.offset]
+
+    def recv_into(self, buffer, nbytes=0):
+        """Fill buffer with plaintext; returns the byte count, 0 at end of stream"""
+        while self.offset >= len(self.plain):
+            if not self.read_record():
+                return 0
+        start = self.offset
+        self.offset = min(start + (nbytes or len(buffer)), len(self.plain))
+        count = self.offset - start
+        buffer[:count] = memoryview(self.plain)[start:self.offset]
+        return count
+
+    def sendall(self, data):
+        """Encrypt data into records of at most MAX_RECORD_SIZE and send them in one write"""
+        view = memoryview(data)
+        records = [self.sender.seal(view[offset:offset + MAX_RECORD_SIZE])
+                   for offset in range(0, len(view), MAX_RECORD_SIZE)]
+        self.sock.sendall(b"".join(records))
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def shutdown(self, how):
+        self.sock.shutdown(how)
+
+    def close(self):
+        self.sock.close()
+
+
+def recv_exact(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Peer closed during the channel handshake")
+        data += chunk
+    return data
+
+
+def client_handshake(sock, psk, cipher_id=CIPHER_CHACHA20):
+    """Open a channel from the client side of a connected socket"""
+    client_random = os.urandom(RANDOM_SIZE)
+    sock.sendall(HELLO.pack(MAGIC, VERSION, cipher_id, client_random))
+
+    magic, version, chosen, server_random = HELLO.unpack(recv_exact(sock, HELLO.size))
+    if magic != MAGIC or version != VERSION or chosen != cipher_id:
+        raise ChannelError("Server refused the channel hello")
+
+    c2s, s2c = derive_keys(psk, cipher_id, client_random, server_random)
+    return SecureChannel(sock, cipher_id, c2s, s2c)
+
+
+def server_handshake(sock, psk):
+    """Accept a channel on the server side; the client hello must not have been read yet"""
+    magic, version, cipher_id, client_random = HELLO.unpack(recv_exact(sock, HELLO.size))
+    if magic != MAGIC or version != VERSION or cipher_id not in CIPHERS:
+        raise ChannelError(f"Unsupported channel hello (version {version}, cipher {cipher_id})")
+
+    server_random = os.urandom(RANDOM_SIZE)
+    sock.sendall(HELLO.pack(MAGIC, VERSION, cipher_id, server_random))
+
+    c2s, s2c = derive_keys(psk, cipher_id, client_random, server_random)
+    return SecureChannel(sock, cipher_id, s2c, c2s)
@@ -0,0 +1,339 @@
+"""
+Mastermind bandwidth shaper
+Hierarchical token buckets for the relay loops: per-listener, per-source-IP and per-user rates
+Author: Mastermind
+"""
+
+import asyncio
+import os
+import re
+import threading
+import time
+
+# Burst allowance, in seconds of the bucket's rate
+DEFAULT_BURST = 0.5
+# A tenant that moved data this recently counts towards the fair share
+ACTIVE_WINDOW = 1.0
+# Longest single sleep, so a stopping proxy or a new tenant is noticed
+MAX_DELAY = 0.25
+
+RATE_PATTERN = re.compile(r'^\s*([0-9]*\.?[0-9]+)\s*([kmg]?)(bit|b)?(?:/s|ps)?\s*$', re.IGNORECASE)
+RATE_UNITS = {'': 1, 'k': 1000, 'm': 1000 ** 2, 'g': 1000 ** 3}
+
+
+def parse_rate(value):
+    """Parse '500k', '2.5M' (bytes/s) or '20mbit' into bytes per second; 0 means unlimited"""
+    match = RATE_PATTERN.match(str(value))
+    if not match:
+        raise ValueError(f"Invalid rate {value!r} (examples: 500k, 2M, 20mbit)")
+    number, unit, bits = match.groups()
+    rate = float(number) * RATE_UNITS[unit.lower()]
+    return rate / 8 if bits and bits.lower() == 'bit' else rate
+
+
+def format_rate(rate):
+    return f"{rate * 8 / 1e6:.1f} Mbit/s" if rate else "unlimited"
+
+
+class TokenBucket:
+    """Bytes allowed at rate with burst capacity; tokens go negative when a chunk overdraws"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'stamp')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.capacity = rate * burst
+        self.tokens = self.capacity
+        self.stamp = now
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def delay(self):
+        """Seconds until the bucket is out of debt"""
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class ShapingClass:
+    """One user or source IP: its own ceiling and its fair share of the listener"""
+
+    __slots__ = ('ceiling', 'share', 'last_active', 'flows')
+
+    def __init__(self, ceiling):
+        self.ceiling = ceiling
+        self.share = None
+        self.last_active = 0.0
+        self.flows = 0
+
+
+class ShapingTree:
+    """The buckets of one direction of traffic
+
+    Every chunk is charged to the listener bucket and to the ceilings of
+    the flow's user and source IP classes. A flow must wait while any of
+    its ceilings is in debt. While the listener is in debt, a flow may
+    still send within its tenant's fair share (listener rate divided by
+    the tenants active in the last ACTIVE_WINDOW); capacity an idle
+    tenant leaves unused keeps the listener out of debt, so the busy
+    ones borrow it up to their own ceilings.
+    """
+
+    def __init__(self, rate, per_ip_rate, per_user_rate, user_rates, burst):
+        self.per_ip_rate = per_ip_rate
+        self.per_user_rate = per_user_rate
+        self.user_rates = user_rates
+        self.burst = burst
+        self.root = TokenBucket(rate, burst, time.monotonic()) if rate else None
+        self.classes = {}
+        self.active_tenants = 1
+        self.next_recount = 0.0
+        self._lock = threading.Lock()
+
+        # Statistics
+        self.throttled = 0
+        self.throttle_seconds = 0.0
+
+    def acquire(self, key, rate):
+        """Return the class for key, creating it; caller holds the lock"""
+        cls = self.classes.get(key)
+        if cls is None:
+            ceiling = TokenBucket(rate, self.burst, time.monotonic()) if rate else None
+            cls = self.classes[key] = ShapingClass(ceiling)
+        cls.flows += 1
+        return cls
+
+    def open(self, ip, user):
+        """Return the Flow for one direction of a tunnel"""
+        with self._lock:
+            classes = []
+            if ip is not None:
+                classes.append(self.acquire(('ip', ip), self.per_ip_rate))
+            if user:
+                classes.append(self.acquire(('user', user), self.user_rates.get(user, self.per_user_rate)))
+        # The user is the tenant sharing the listener when known, otherwise the source IP
+        tenant = classes[-1] if classes else None
+        return Flow(self, classes, tenant)
+
+    def close(self, flow):
+        with self._lock:
+            for cls in flow.classes:
+                cls.flows -= 1
+
+    def recount(self, now):
+        """Refresh the active tenant count and drop idle classes; caller holds the lock"""
+        self.next_recount = now + ACTIVE_WINDOW / 4
+        active = 0
+        for key, cls in list(self.classes.items()):
+            if now - cls.last_active < ACTIVE_WINDOW:
+                active += 1
+            elif cls.flows == 0 and (cls.ceiling is None or cls.ceiling.tokens >= 0):
+                del self.classes[key]
+        self.active_tenants = max(active, 1)
+
+    def charge(self, flow, size):
+        """Account size bytes moved by flow; returns seconds to wait before moving more
+
+        Runs once per relayed chunk, so buckets are refilled inline rather
+        than through TokenBucket.refill().
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now >= self.next_recount:
+                self.recount(now)
+            wait = 0.0
+            for cls in flow.classes:
+                bucket = cls.ceiling
+                if bucket is not None:
+                    tokens = bucket.tokens + (now - bucket.stamp) * bucket.rate
+                    if tokens > bucket.capacity:
+                        tokens = bucket.capacity
+                    tokens -= size
+                    bucket.tokens = tokens
+                    bucket.stamp = now
+                    if tokens < 0 and -tokens / bucket.rate > wait:
+                        wait = -tokens / bucket.rate
+
+            root = self.root
+            if root is not None:
+                tokens = root.tokens + (now - root.stamp) * root.rate
+                if tokens > root.capacity:
+                    tokens = root.capacity
+                tokens -= size
+                root.tokens = tokens
+                root.stamp = now
+                tenant = flow.tenant
+                share_tokens = None
+                if tenant is not None:
+                    share = tenant.share
+                    if size:
+                        if tenant.last_active < now - ACTIVE_WINDOW:
+                            tenant.last_active = now
+                            self.recount(now)
+                        else:
+                            tenant.last_active = now
+                        rate = root.rate / self.active_tenants
+                        if share is None:
+                            share = tenant.share = TokenBucket(rate, self.burst, now)
+                        share.refill(now)
+                        share.rate = rate
+                        share.capacity = rate * self.burst
+                        share.tokens -= size
+                    elif share is not None:
+                        share.refill(now)
+                    if share is not None:
+                        share_tokens = share.tokens
+                # Over the listener rate, a tenant still within its fair share may go on
+                if tokens < 0 and (share_tokens is None or share_tokens < 0):
+                    root_wait = -tokens / root.rate
+                    if share_tokens is not None:
+                        root_wait = min(root_wait, -share_tokens / share.rate)
+                    if root_wait > wait:
+                        wait = root_wait
+
+            if wait:
+                if wait > MAX_DELAY:
+                    wait = MAX_DELAY
+                self.throttled += 1
+                self.throttle_seconds += wait
+            return wait
+
+    def delay(self, flow):
+        """Seconds flow still has to wait"""
+        return self.charge(flow, 0)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'classes': len(self.classes),
+                'active_tenants': self.active_tenants if self.classes else 0,
+                'throttled': self.throttled,
+                'throttle_seconds': self.throttle_seconds,
+            }
+
+
+class Flow:
+    """One direction of one tunnel, as seen by a ShapingTree"""
+
+    __slots__ = ('tree', 'classes', 'tenant')
+
+    def __init__(self, tree, classes, tenant):
+        self.tree = tree
+        self.classes = classes
+        self.tenant = tenant
+
+    def charge(self, size):
+        return self.tree.charge(self, size)
+
+    def delay(self):
+        return self.tree.delay(self)
+
+
+def throttle(flow, size):
+    """Charge size bytes to flow and sleep until it may send again"""
+    delay = flow.charge(size)
+    while delay:
+        time.sleep(delay)
+        delay = flow.delay()
+
+
+async def throttle_async(flow, size):
+    """throttle() for coroutines"""
+    delay = flow.charge(size)
+    while delay:
+        await asyncio.sleep(delay)
+        delay = flow.delay()
+
+
+class TunnelShaping:
+    """The client-to-server and server-to-client flows of one tunnel"""
+
+    __slots__ = ('shaper', 'upload', 'download')
+
+    def __init__(self, shaper, upload, download):
+        self.shaper = shaper
+        self.upload = upload
+        self.download = download
+
+    def close(self):
+        self.shaper.upload.close(self.upload)
+        self.shaper.download.close(self.download)
+
+
+class Shaper:
+    """Bandwidth limits of one proxy process
+
+    Rates are bytes per second and apply to each direction separately;
+    0 disables that level. user_rates overrides per_user_rate for named
+    users. With --workers every worker process enforces its own limits.
+    """
+
+    def __init__(self, rate=0, per_ip_rate=0, per_user_rate=0, user_rates=None, burst=DEFAULT_BURST):
+        self.rate = rate
+        self.per_ip_rate = per_ip_rate
+        self.per_user_rate = per_user_rate
+        self.user_rates = dict(user_rates or {})
+        self.burst = burst
+        self.upload = ShapingTree(rate, per_ip_rate, per_user_rate, self.user_rates, burst)
+        self.download = ShapingTree(rate, per_ip_rate, per_user_rate, self.user_rates, burst)
+
+    @property
+    def enabled(self):
+        return bool(self.rate or self.per_ip_rate or self.per_user_rate or self.user_rates)
+
+    def open(self, ip, user=None):
+        """Return the TunnelShaping for a new tunnel, or None when shaping is off"""
+        if not self.enabled:
+            return None
+        return TunnelShaping(self, self.upload.open(ip, user), self.download.open(ip, user))
+
+    def stats(self):
+        return {'upload': self.upload.stats(), 'download': self.download.stats()}
+
+    def format_stats(self):
+        """One-line summary for the periodic stats log"""
+        up, down = self.upload.stats(), self.download.stats()
+        return (f"Shaper - Rate: {format_rate(self.rate)}, Per IP: {format_rate(self.per_ip_rate)}, "
+                f"Per user: {format_rate(self.per_user_rate)}, Active tenants: {down['active_tenants']}, "
+                f"Throttled: {up['throttle_seconds']:.0f}s up / {down['throttle_seconds']:.0f}s down")
+
+
+def load_shaping_config(config_file, args):
+    """Build a Shaper from a shaping config file, overridden by any rate given on the command line
+
+    The file holds RATE=, PER_IP_RATE=, PER_USER_RATE=, BURST= and any
+    number of USER_RATE=<username>:<rate> lines.
+    """
+    values = {'RATE': '0', 'PER_IP_RATE': '0', 'PER_USER_RATE': '0', 'BURST': str(DEFAULT_BURST)}
+    user_rates = {}
+    if os.path.exists(config_file):
+        with open(config_file, 'r') as f:
+            for line in f:
+                key, sep, value = line.strip().partition('=')
+                if not sep:
+                    continue
+                if key == 'USER_RATE':
+                    user, _, rate = value.partition(':')
+                    user_rates[user.strip()] = parse_rate(rate)
+                elif key in values:
+                    values[key] = value.strip()
+
+    for key, option in (('RATE', args.rate), ('PER_IP_RATE', args.rate_per_ip),
+                        ('PER_USER_RATE', args.rate_per_user), ('BURST', args.rate_burst)):
+        if option is not None:
+            values[key] = option
+
+    return Shaper(parse_rate(values['RATE']), parse_rate(values['PER_IP_RATE']),
+                  parse_rate(values['PER_USER_RATE']), user_rates, float(values['BURST']))
+
+
+def add_shaping_arguments(parser):
+    """Register the bandwidth shaping command line options"""
+    parser.add_argument("--rate", default=None,
+                        help="Listener bandwidth per direction, e.g. 100mbit or 12M bytes/s (0 = unlimited)")
+    parser.add_argument("--rate-per-ip", default=None,
+                        help="Bandwidth per source IP and direction (0 = unlimited)")
+    parser.add_argument("--rate-per-user", default=None,
+                        help="Bandwidth per authenticated user and direction (0 = unlimited)")
+    parser.add_argument("--rate-burst", default=None,
+                        help=f"Burst allowance in seconds of each rate (default {DEFAULT_BURST})")
@@ -0,0 +1,123 @@
+"""
+Mastermind protocol sniffing
+Identifies SSH, OpenVPN, HTTP, TLS and SOCKS from the first bytes of a connection
+Author: Mastermind
+"""
+
+import socket
+import struct
+import time
+
+PROTO_SSH = 'ssh'
+PROTO_OPENVPN = 'openvpn'
+PROTO_HTTP = 'http'
+PROTO_TLS = 'tls'
+PROTO_SOCKS = 'socks'
+PROTO_UNKNOWN = 'unknown'
+
+PROTOCOLS = (PROTO_SSH, PROTO_OPENVPN, PROTO_HTTP, PROTO_TLS, PROTO_SOCKS)
+
+# classify() never needs more than this many bytes
+PEEK_SIZE = 16
+
+HTTP_METHODS = (b"GET ", b"POST ", b"HEAD ", b"PUT ", b"DELETE ", b"OPTIONS ", b"PATCH ", b"TRACE ",
+                b"CONNECT ")
+
+# OpenVPN TCP packets are a 16-bit length followed by opcode << 3 | key_id;
+# a client opens with P_CONTROL_HARD_RESET_CLIENT_V2 (7) or _V3 (10)
+OPENVPN_RESET_OPCODES = (7, 10)
+OPENVPN_MAX_RESET_SIZE = 1500
+
+
+def classify(data):
+    """Return the protocol of a connection that started with data, or None if more bytes are needed"""
+    if not data:
+        return None
+    first = data[0]
+
+    if first in (4, 5):
+        # SOCKS4 CONNECT/BIND, or a SOCKS5 greeting with at least one method
+        if len(data) < 2:
+            return None
+        if (first == 4 and data[1] in (1, 2)) or (first == 5 and data[1] > 0):
+            return PROTO_SOCKS
+        return PROTO_UNKNOWN
+
+    if first == 0x16:
+        # TLS handshake record, version 3.x
+        if len(data) < 2:
+            return None
+        return PROTO_TLS if data[1] == 3 else PROTO_UNKNOWN
+
+    if first == 0:
+        # Length-prefixed OpenVPN packet; real resets are far shorter than 256 bytes
+        if len(data) < 3:
+            return None
+        length = struct.unpack_from(">H", data)[0]
+        if data[2] >> 3 in OPENVPN_RESET_OPCODES and length <= OPENVPN_MAX_RESET_SIZE:
+            return PROTO_OPENVPN
+        return PROTO_UNKNOWN
+
+    if data.startswith(b"SSH-"):
+        return PROTO_SSH
+    if b"SSH-".startswith(data):
+        return None
+
+    for method in HTTP_METHODS:
+        if data.startswith(method):
+            return PROTO_HTTP
+    for method in HTTP_METHODS:
+        if method.startswith(data):
+            return None
+
+    return PROTO_UNKNOWN
+
+
+def set_receive_timeout(sock, seconds):
+    """Set SO_RCVTIMEO on a blocking socket; 0 waits forever"""
+    seconds = max(seconds, 0.0)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO,
+                    struct.pack("ll", int(seconds), int(seconds % 1 * 1000000)))
+
+
+def sniff(sock, timeout):
+    """Peek at a new connection until its protocol is known
+
+    Returns (protocol, data). protocol is None when the client sent
+    nothing within timeout, which is what clients of server-first
+    protocols such as SSH do. Peeking leaves every byte queued in the
+    kernel, so whichever handler takes the connection reads it afresh
+    and a splice() relay never copies it into userspace.
+    """
+    deadline = time.monotonic() + timeout
+    sock.settimeout(None)
+    data = b""
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # SO_RCVTIMEO lets MSG_WAITALL block in the kernel for the next byte;
+            # a socket timeout would make it return whatever is queued at once
+            set_receive_timeout(sock, max(remaining, 0.001))
+            try:
+                if data:
+                    peeked = sock.recv(len(data) + 1, socket.MSG_PEEK | socket.MSG_WAITALL)
+                else:
+                    peeked = sock.recv(PEEK_SIZE, socket.MSG_PEEK)
+            except BlockingIOError:
+                break
+            if len(peeked) <= len(data):
+                # End of stream before the protocol was clear
+                if not peeked:
+                    raise ConnectionError("Client closed before sending anything")
+                break
+            data = peeked
+
+            protocol = classify(data)
+            if protocol is not None:
+                return protocol, data
+    finally:
+        set_receive_timeout(sock, 0)
+
+    return (PROTO_UNKNOWN if data else None), data
@@ -0,0 +1,276 @@
+"""
+Mastermind SOCKS handshake parser
+Incremental SOCKS4/4a/5 server-side parser over a byte buffer
+Author: Mastermind
+"""
+
+import socket
+import struct
+
+from .tracing import trace_request
+
+# Event kinds returned by SocksParser.next_event()
+GREETING = 'greeting'   # value: bytes of offered SOCKS5 methods
+AUTH = 'auth'           # value: (username, password) from RFC 1929
+REQUEST = 'request'     # value: SocksRequest
+
+# SOCKS5 authentication methods
+METHOD_NO_AUTH = 0x00
+METHOD_USERNAME_PASSWORD = 0x02
+METHOD_NONE_ACCEPTABLE = 0xFF
+
+# Commands
+CMD_CONNECT = 0x01
+CMD_BIND = 0x02
+CMD_UDP_ASSOCIATE = 0x03
+
+# Address types
+ATYP_IPV4 = 0x01
+ATYP_DOMAIN = 0x03
+ATYP_IPV6 = 0x04
+
+# SOCKS5 reply codes
+REP_SUCCEEDED = 0x00
+REP_GENERAL_FAILURE = 0x01
+REP_HOST_UNREACHABLE = 0x04
+REP_CONNECTION_REFUSED = 0x05
+REP_COMMAND_NOT_SUPPORTED = 0x07
+REP_ADDRESS_NOT_SUPPORTED = 0x08
+
+# SOCKS4 reply codes
+SOCKS4_GRANTED = 90
+SOCKS4_REJECTED = 91
+
+# Upper bound on buffered handshake bytes (SOCKS4 user IDs are unbounded)
+MAX_HANDSHAKE_SIZE = 1024
+
+RECV_SIZE = 4096
+
+# Parser states
+STATE_VERSION = 0
+STATE_SOCKS4 = 1
+STATE_GREETING = 2
+STATE_METHOD = 3
+STATE_AUTH = 4
+STATE_REQUEST = 5
+STATE_DONE = 6
+
+
+class SocksError(ValueError):
+    """Malformed or unsupported SOCKS handshake"""
+
+
+class SocksRequest:
+    """A parsed SOCKS4/SOCKS5 request"""
+
+    __slots__ = ('version', 'command', 'atyp', 'address', 'port', 'userid')
+
+    def __init__(self, version, command, atyp, address, port, userid=b""):
+        self.version = version
+        self.command = command
+        self.atyp = atyp
+        self.address = address
+        self.port = port
+        self.userid = userid
+
+    def __repr__(self):
+        return f"SocksRequest(v{self.version}, cmd={self.command}, {self.address}:{self.port})"
+
+
+def decode_name(data):
+    try:
+        return data.decode()
+    except UnicodeDecodeError:
+        raise SocksError("Invalid domain name encoding")
+
+
+class SocksParser:
+    """State machine that turns raw handshake bytes into events
+
+    feed() appends whatever recv() returned, in any segmentation;
+    next_event() returns the next complete event or None when more bytes
+    are needed. After a SOCKS5 GREETING the server must call
+    select_method() before the parser continues, since the method decides
+    whether an AUTH sub-negotiation follows. Bytes the client pipelined
+    past the request are available from remaining().
+    """
+
+    def __init__(self, max_size=MAX_HANDSHAKE_SIZE):
+        self.buffer = bytearray()
+        self.max_size = max_size
+        self.state = STATE_VERSION
+        self.version = None
+
+    def feed(self, data):
+        self.buffer += data
+
+    def select_method(self, method):
+        """Tell the parser which SOCKS5 method the server chose"""
+        if self.state != STATE_METHOD:
+            raise SocksError("No greeting to answer")
+        self.state = STATE_AUTH if method == METHOD_USERNAME_PASSWORD else STATE_REQUEST
+
+    def remaining(self):
+        """Return and clear bytes received after the request"""
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+    def next_event(self):
+        """Return the next (kind, value) event, or None if more data is needed"""
+        event = self.parse_next()
+        # Only an incomplete message counts against the limit; pipelined payload may be large
+        if event is None and len(self.buffer) > self.max_size:
+            raise SocksError("Handshake too large")
+        return event
+
+    def parse_next(self):
+        state = self.state
+        if state == STATE_VERSION:
+            if not self.buffer:
+                return None
+            version = self.buffer[0]
+            if version == 4:
+                state = STATE_SOCKS4
+            elif version == 5:
+                state = STATE_GREETING
+            else:
+                raise SocksError(f"Unsupported SOCKS version: {version}")
+            self.version = version
+            self.state = state
+
+        if state == STATE_SOCKS4:
+            return self.parse_socks4()
+        if state == STATE_GREETING:
+            return self.parse_greeting()
+        if state == STATE_AUTH:
+            return self.parse_auth()
+        if state == STATE_REQUEST:
+            return self.parse_request()
+        if state == STATE_METHOD:
+            raise SocksError("select_method() must be called after a greeting")
+        return None
+
+    def parse_socks4(self):
+        buf = self.buffer
+        if len(buf) < 9:
+            return None
+        userid_end = buf.find(b"\x00", 8)
+        if userid_end < 0:
+            return None
+
+        command, port = buf[1], (buf[2] << 8) | buf[3]
+        end = userid_end + 1
+        if buf[4] == 0 and buf[5] == 0 and buf[6] == 0 and buf[7] != 0:
+            # SOCKS4a: 0.0.0.x means a NUL-terminated host name follows the user ID
+            name_end = buf.find(b"\x00", end)
+            if name_end < 0:
+                return None
+            atyp, address = ATYP_DOMAIN, decode_name(bytes(buf[end:name_end]))
+            end = name_end + 1
+        else:
+            atyp, address = ATYP_IPV4, socket.inet_ntoa(bytes(buf[4:8]))
+
+        request = SocksRequest(4, command, atyp, address, port, bytes(buf[8:userid_end]))
+        del buf[:end]
+        self.state = STATE_DONE
+        return REQUEST, request
+
+    def parse_greeting(self):
+        buf = self.buffer
+        if len(buf) < 2:
+            return None
+        end = 2 + buf[1]
+        if len(buf) < end:
+            return None
+        methods = bytes(buf[2:end])
+        del buf[:end]
+        self.state = STATE_METHOD
+        return GREETING, methods
+
+    def parse_auth(self):
+        buf = self.buffer
+        if len(buf) < 2:
+            return None
+        if buf[0] != 1:
+            raise SocksError(f"Unsupported auth version: {buf[0]}")
+        ulen = buf[1]
+        if len(buf) < 3 + ulen:
+            return None
+        plen = buf[2 + ulen]
+        end = 3 + ulen + plen
+        if len(buf) < end:
+            return None
+        username = bytes(buf[2:2 + ulen])
+        password = bytes(buf[3 + ulen:end])
+        del buf[:end]
+        self.state = STATE_REQUEST
+        return AUTH, (username, password)
+
+    def parse_request(self):
+        buf = self.buffer
+        if len(buf) < 5:
+            return None
+        if buf[0] != 5:
+            raise SocksError(f"Unexpected request version: {buf[0]}")
+        command, atyp = buf[1], buf[3]
+        if atyp == ATYP_IPV4:
+            end = 10
+            if len(buf) < end:
+                return None
+            address = socket.inet_ntoa(bytes(buf[4:8]))
+        elif atyp == ATYP_DOMAIN:
+            end = 7 + buf[4]
+            if len(buf) < end:
+                return None
+            address = decode_name(bytes(buf[5:end - 2]))
+        elif atyp == ATYP_IPV6:
+            end = 22
+            if len(buf) < end:
+                return None
+            address = socket.inet_ntop(socket.AF_INET6, bytes(buf[4:20]))
+        else:
+            raise SocksError(f"Unsupported address type: {atyp}")
+
+        port = (buf[end - 2] << 8) | buf[end - 1]
+        del buf[:end]
+        self.state = STATE_DONE
+        return REQUEST, SocksRequest(5, command, atyp, address, port)
+
+
+def recv_event(sock, parser):
+    """Read from a blocking socket until the parser yields an event"""
+    event = parser.next_event()
+    while event is None:
+        data = sock.recv(RECV_SIZE)
+        if not data:
+            raise ConnectionError("Client closed during handshake")
+        parser.feed(data)
+        event = parser.next_event()
+    if event[0] == REQUEST:
+        trace_request()
+    return event
+
+
+async def read_event_async(reader, parser):
+    """Read from an asyncio StreamReader until the parser yields an event"""
+    event = parser.next_event()
+    while event is None:
+        data = await reader.read(RECV_SIZE)
+        if not data:
+            raise ConnectionError("Client closed during handshake")
+        parser.feed(data)
+        event = parser.next_event()
+    if event[0] == REQUEST:
+        trace_request()
+    return event
+
+
+def socks4_reply(code, port=0):
+    return struct.pack(">BBHI", 0, code, port, 0)
+
+
+def socks5_reply(code, address="0.0.0.0", port=0):
+    if ':' in address:
+        return b"\x05" + bytes((code,)) + b"\x00\x04" + socket.inet_pton(socket.AF_INET6, address) + struct.pack(">H", port)
+    return b"\x05" + bytes((code,)) + b"\x00\x01" + socket.inet_aton(address) + struct.pack(">H", port)
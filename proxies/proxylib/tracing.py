@@ -0,0 +1,424 @@
+"""
+Mastermind proxy connection tracing
+Per-stage latency of every connection in HDR histograms, with a sampled log of slow connections
+Author: Mastermind
+"""
+
+import atexit
+import collections
+import datetime
+import json
+import os
+import socket
+import struct
+import threading
+import time
+
+from .admission import current_ticket
+from .logs import LOG_DIR, LogRule
+from .metrics import HdrHistogram
+
+# Stages of a connection, in seconds: queue is the time the connection
+# waited in the listen queue, resolve and connect are measured from the
+# start of the upstream dial, every other stage from accept
+STAGES = ('queue', 'request', 'resolve', 'connect', 'established', 'first_upstream', 'first_downstream',
+          'lifetime')
+
+# Connections slower than this to their first byte back to the client are logged
+DEFAULT_SLOW_THRESHOLD = 1.0
+# Keep one slow connection in N, and at most this many per second
+DEFAULT_SLOW_SAMPLE = 1
+DEFAULT_SLOW_RATE = 10
+# Slow connections kept in memory for the latency snapshot
+RECENT_SLOW = 50
+# Slow connections waiting for the writer; beyond this they are dropped
+PENDING_SLOW = 1000
+# Seconds between writes of the slow log and of the latency snapshot
+FLUSH_INTERVAL = 1
+SNAPSHOT_INTERVAL = 10
+# Size at which the slow log is rotated to <name>-slow.jsonl.1
+SLOW_LOG_MAX_BYTES = 4 * 1024 * 1024
+
+# struct tcp_info (linux/tcp.h): tcpi_last_data_recv, in milliseconds
+TCP_INFO_SIZE = 104
+TCP_INFO_LAST_DATA_RECV = 52
+
+
+def queue_delay(sock):
+    """Seconds since the client's last segment, or None off Linux
+
+    Read right after accept(), this is how long the completed connection
+    sat in the listen queue (to kernel jiffy resolution).
+    """
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, TCP_INFO_SIZE)
+    except (AttributeError, OSError):
+        return None
+    if len(info) < TCP_INFO_LAST_DATA_RECV + 4:
+        return None
+    return struct.unpack_from('I', info, TCP_INFO_LAST_DATA_RECV)[0] / 1000
+
+
+class ConnectionTrace:
+    """Monotonic stage timestamps of one connection
+
+    Each mark keeps its first occurrence only and feeds the stage
+    histogram as soon as it is known, so long-lived tunnels show up in
+    the setup stages right away rather than when they close.
+    """
+
+    __slots__ = ('tracer', 'ip', 'accepted', 'queue', 'request', 'dial', 'resolved', 'connected',
+                 'established', 'first_upstream', 'first_downstream', 'closed', 'target', 'evaluated')
+
+    def __init__(self, tracer, ip, queue):
+        self.tracer = tracer
+        self.ip = ip
+        self.accepted = time.monotonic()
+        self.queue = queue
+        self.request = None
+        self.dial = None
+        self.resolved = None
+        self.connected = None
+        self.established = None
+        self.first_upstream = None
+        self.first_downstream = None
+        self.closed = None
+        self.target = None
+        self.evaluated = False
+
+    def mark_request(self):
+        if self.request is None:
+            self.request = time.monotonic()
+            self.tracer.observe('request', self.request - self.accepted)
+
+    def mark_resolved(self, started, host, port):
+        if self.resolved is None:
+            self.dial = started
+            self.resolved = time.monotonic()
+            self.target = f"{host}:{port}"
+            self.tracer.observe('resolve', self.resolved - started)
+
+    def mark_connected(self):
+        if self.connected is None and self.resolved is not None:
+            self.connected = time.monotonic()
+            self.tracer.observe('connect', self.connected - self.resolved)
+
+    def mark_established(self):
+        if self.established is None:
+            self.established = time.monotonic()
+            self.tracer.observe('established', self.established - self.accepted)
+
+    def upstream_byte(self):
+        if self.first_upstream is None:
+            self.first_upstream = time.monotonic()
+            self.tracer.observe('first_upstream', self.first_upstream - self.accepted)
+
+    def downstream_byte(self):
+        if self.first_downstream is None:
+            self.first_downstream = time.monotonic()
+            self.tracer.observe('first_downstream', self.first_downstream - self.accepted)
+            self.tracer.evaluate(self)
+
+    def finish(self):
+        if self.closed is None:
+            self.closed = time.monotonic()
+            self.tracer.observe('lifetime', self.closed - self.accepted)
+            if not self.evaluated:
+                self.tracer.evaluate(self)
+
+    def stages(self):
+        """Known stage durations in milliseconds"""
+        stages = {}
+        if self.queue is not None:
+            stages['queue'] = self.queue * 1000
+        if self.resolved is not None:
+            stages['resolve'] = (self.resolved - self.dial) * 1000
+        if self.connected is not None:
+            stages['connect'] = (self.connected - self.resolved) * 1000
+        for stage in ('request', 'established', 'first_upstream', 'first_downstream'):
+            stamp = getattr(self, stage)
+            if stamp is not None:
+                stages[stage] = (stamp - self.accepted) * 1000
+        if self.closed is not None:
+            stages['lifetime'] = (self.closed - self.accepted) * 1000
+        return {stage: round(stages[stage], 3) for stage in STAGES if stage in stages}
+
+
+def current_trace():
+    """Trace of the connection being served, or None"""
+    ticket = current_ticket.get()
+    return ticket.trace if ticket is not None else None
+
+
+def trace_request():
+    """Mark the client's request as parsed"""
+    ticket = current_ticket.get()
+    if ticket is not None and ticket.trace is not None:
+        ticket.trace.mark_request()
+
+
+def first_byte_hooks():
+    """Return the (upstream, downstream) first-byte marks of the current connection, or (None, None)
+
+    Relays fetch these on the serving thread, as the helper thread of
+    the other direction does not see the connection's context.
+    """
+    trace = current_trace()
+    if trace is None:
+        return None, None
+    return trace.upstream_byte, trace.downstream_byte
+
+
+class StageLatency:
+    """The stage histograms of a tracer as one summary labelled by stage"""
+
+    kind = 'summary'
+
+    def __init__(self, tracer):
+        self.tracer = tracer
+        self.name = 'connection_stage_seconds'
+        self.help = 'Connection latency per lifecycle stage'
+
+    def samples(self, labels):
+        # The stage histograms are unnamed; their samples carry only the _sum/_count suffix
+        for stage, histogram in self.tracer.histograms.items():
+            for suffix, stage_labels, value in histogram.samples(dict(labels, stage=stage)):
+                yield self.name + suffix, stage_labels, value
+
+
+class ConnectionTracer:
+    """Stage histograms and the slow-connection log of one proxy process
+
+    A connection is slow when its first byte back to the client (or,
+    for tunnels that never get one, the end of the handshake) comes
+    slow_threshold seconds or more after accept. Slow connections are
+    sampled (one in slow_sample, at most slow_rate per second) into
+    <log_dir>/<name>-slow.jsonl. Every SNAPSHOT_INTERVAL the histograms
+    and the latest slow connections are written to
+    <log_dir>/<name>-latency-<pid>.json for the web panel; both files
+    are written from the tracer's own thread.
+    """
+
+    def __init__(self, name, enabled=True, slow_threshold=DEFAULT_SLOW_THRESHOLD,
+                 slow_sample=DEFAULT_SLOW_SAMPLE, slow_rate=DEFAULT_SLOW_RATE, log_dir=LOG_DIR):
+        self.name = name
+        self.enabled = enabled
+        self.slow_threshold = slow_threshold
+        self.log_dir = log_dir
+        self.histograms = {stage: HdrHistogram('', stage) for stage in STAGES}
+        self.rule = LogRule('slow', sample=slow_sample, rate=slow_rate)
+        self.recent = collections.deque(maxlen=RECENT_SLOW)
+        self.pending = collections.deque()
+        self.running = False
+        self._lock = threading.Lock()
+
+        # Statistics
+        self.traced = 0
+        self.slow = 0
+        self.dropped = 0
+
+    @property
+    def slow_log_path(self):
+        return os.path.join(self.log_dir, f"{self.name}-slow.jsonl")
+
+    @property
+    def snapshot_path(self):
+        return os.path.join(self.log_dir, f"{self.name}-latency-{os.getpid()}.json")
+
+    def track(self, metrics):
+        """Export the stage histograms and the tracer counters"""
+        metrics.register(StageLatency(self))
+        metrics.add_stats('trace', self.stats, counters=('traced', 'slow', 'logged', 'dropped'))
+
+    def begin(self, ip, sock=None):
+        """Start the trace of a newly accepted connection; None while tracing is off"""
+        if not self.enabled:
+            return None
+        queue = queue_delay(sock) if sock is not None else None
+        if queue is not None:
+            self.histograms['queue'].observe(queue)
+        with self._lock:
+            self.traced += 1
+        return ConnectionTrace(self, ip, queue)
+
+    def observe(self, stage, value):
+        self.histograms[stage].observe(value)
+
+    def evaluate(self, trace):
+        """Log trace if it is slow; called once, at the first byte back or at close"""
+        trace.evaluated = True
+        if trace.first_downstream is not None:
+            outcome, stamp = 'first_byte', trace.first_downstream
+        elif trace.established is not None:
+            outcome, stamp = 'established', trace.established
+        else:
+            outcome, stamp = 'failed', trace.closed
+        latency = stamp - trace.accepted
+        if latency < self.slow_threshold:
+            return
+        with self._lock:
+            self.slow += 1
+            if not self.rule.allow():
+                return
+        entry = {
+            'ts': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='milliseconds'),
+            'proxy': self.name,
+            'pid': os.getpid(),
+            'client': trace.ip,
+            'target': trace.target,
+            'outcome': outcome,
+            'latency_ms': round(latency * 1000, 3),
+            'stages': trace.stages(),
+        }
+        with self._lock:
+            self.recent.append(entry)
+            if len(self.pending) < PENDING_SLOW:
+                self.pending.append(entry)
+            else:
+                self.dropped += 1
+
+    def write_slow_log(self):
+        with self._lock:
+            entries = list(self.pending)
+            self.pending.clear()
+        if not entries:
+            return
+        path = self.slow_log_path
+        try:
+            if os.path.getsize(path) >= SLOW_LOG_MAX_BYTES:
+                os.replace(path, path + '.1')
+        except OSError:
+            pass
+        lines = ''.join(json.dumps(entry, separators=(',', ':')) + '\n' for entry in entries)
+        try:
+            with open(path, 'a') as f:
+                f.write(lines)
+        except OSError:
+            with self._lock:
+                self.dropped += len(entries)
+
+    def snapshot(self):
+        """Sparse stage buckets (upper bound in microseconds, count) plus the recent slow connections"""
+        stages = {}
+        for stage, histogram in self.histograms.items():
+            buckets, total, count, max_units = histogram.snapshot()
+            stages[stage] = {
+                'count': count,
+                'sum': total,
+                'max_us': max_units,
+                'buckets': [[histogram.bucket_range(index)[1], bucket_count] for index, bucket_count in buckets],
+            }
+        with self._lock:
+            recent = list(self.recent)
+        return {
+            'proxy': self.name,
+            'pid': os.getpid(),
+            'updated': time.time(),
+            'interval': SNAPSHOT_INTERVAL,
+            'slow_threshold_ms': self.slow_threshold * 1000,
+            'stats': self.stats(),
+            'stages': stages,
+            'slow': recent,
+        }
+
+    def write_snapshot(self):
+        path = self.snapshot_path
+        try:
+            with open(path + '.tmp', 'w') as f:
+                json.dump(self.snapshot(), f, separators=(',', ':'))
+            os.replace(path + '.tmp', path)
+        except OSError:
+            pass
+
+    def run(self):
+        """Writer thread: the slow log every FLUSH_INTERVAL, the snapshot every SNAPSHOT_INTERVAL"""
+        next_snapshot = 0.0
+        while self.running:
+            self.write_slow_log()
+            now = time.monotonic()
+            if now >= next_snapshot:
+                next_snapshot = now + SNAPSHOT_INTERVAL
+                self.write_snapshot()
+            time.sleep(FLUSH_INTERVAL)
+
+    def remove_stale_snapshots(self):
+        """Delete the snapshots of processes of this proxy that died without removing theirs"""
+        prefix = f"{self.name}-latency-"
+        try:
+            names = os.listdir(self.log_dir)
+        except OSError:
+            return
+        for name in names:
+            pid = name[len(prefix):-len('.json')]
+            if not (name.startswith(prefix) and name.endswith('.json') and pid.isdigit()):
+                continue
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                try:
+                    os.remove(os.path.join(self.log_dir, name))
+                except OSError:
+                    pass
+            except OSError:
+                pass  # Alive, owned by another user
+
+    def start(self):
+        """Start the writer thread; a no-op while tracing is off"""
+        if not self.enabled or self.running:
+            return
+        try:
+            os.makedirs(self.log_dir, exist_ok=True)
+        except OSError:
+            pass
+        self.remove_stale_snapshots()
+        self.running = True
+        atexit.register(self.close)
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def close(self):
+        """Write out the pending slow connections and remove this process's snapshot"""
+        self.running = False
+        self.write_slow_log()
+        try:
+            os.remove(self.snapshot_path)
+        except OSError:
+            pass
+
+    def stats(self):
+        return {
+            'traced': self.traced,
+            'slow': self.slow,
+            'logged': self.rule.kept,
+            'dropped': self.dropped,
+        }
+
+    def format_stats(self):
+        """One-line summary for the periodic stats log"""
+        s = self.stats()
+        first = self.histograms['first_downstream']
+        return (f"Latency - Traced: {s['traced']}, First byte p50 {first.quantile(0.5) * 1000:.1f} ms, "
+                f"p99 {first.quantile(0.99) * 1000:.1f} ms, Slow: {s['slow']} ({s['logged']} logged)")
+
+
+def load_tracing(name, args):
+    """Build the ConnectionTracer of a proxy from its command line options"""
+    return ConnectionTracer(name, enabled=not args.no_trace, slow_threshold=args.slow_threshold / 1000,
+                            slow_sample=args.slow_sample, slow_rate=args.slow_rate)
+
+
+def add_tracing_arguments(parser):
+    """Register the connection tracing command line options"""
+    parser.add_argument("--slow-threshold", type=float, default=DEFAULT_SLOW_THRESHOLD * 1000,
+                        help="Log connections whose first byte back to the client takes this many "
+                             "milliseconds or more")
+    parser.add_argument("--slow-sample", type=int, default=DEFAULT_SLOW_SAMPLE,
+                        help="Log one in N slow connections")
+    parser.add_argument("--slow-rate", type=float, default=DEFAULT_SLOW_RATE,
+                        help="Log at most N slow connections per second (0 = unlimited)")
+    parser.add_argument("--no-trace", action="store_true",
+                        help="Disable per-stage latency tracing and the slow-connection log")
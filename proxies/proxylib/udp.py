@@ -0,0 +1,392 @@
+"""
+Mastermind UDP relay
+SOCKS5 UDP ASSOCIATE (RFC 1928 section 7) with a per-client NAT table and batched socket reads
+Author: Mastermind
+"""
+
+import collections
+import selectors
+import socket
+import struct
+import threading
+
+from .reaper import ConnectionReaper
+from .resolver import is_ip_address
+from .socks import ATYP_IPV4, ATYP_DOMAIN, ATYP_IPV6, decode_name
+
+# Seconds a client's NAT entry lives without a datagram in either direction (0 = until its association ends)
+DEFAULT_UDP_IDLE_TIMEOUT = 60
+# Datagrams read from one socket per wakeup before the other sockets get a turn
+BATCH_SIZE = 64
+# Largest UDP payload, and so the size of the relay's one receive buffer
+MAX_DATAGRAM = 65535
+# Client source ports one association may open NAT entries for
+MAX_SESSIONS_PER_ASSOCIATION = 64
+# Parsed destinations remembered per NAT entry, and reply headers for the whole relay
+MAX_ROUTES = 64
+MAX_HEADERS = 4096
+
+PORT = struct.Struct(">H")
+
+
+def udp_header(address):
+    """SOCKS5 UDP request header (RSV, FRAG 0, ATYP, address, port) for an (ip, port) source"""
+    host, port = address[0], address[1]
+    if ':' in host:
+        # Replies from IPv4 peers arrive v4-mapped on dual-stack sockets
+        if host.startswith('::ffff:') and '.' in host:
+            return b"\x00\x00\x00\x01" + socket.inet_aton(host[7:]) + PORT.pack(port)
+        return b"\x00\x00\x00\x04" + socket.inet_pton(socket.AF_INET6, host) + PORT.pack(port)
+    return b"\x00\x00\x00\x01" + socket.inet_aton(host) + PORT.pack(port)
+
+
+class Association:
+    """One UDP ASSOCIATE: the control connection's client IP and the source port it announced"""
+
+    __slots__ = ('ip', 'port', 'shutdown', 'sessions', 'closed')
+
+    def __init__(self, ip, port, shutdown):
+        self.ip = ip
+        self.port = port
+        self.shutdown = shutdown
+        self.sessions = set()
+        self.closed = False
+
+    def matches(self, client):
+        # Port 0 (the usual announcement) accepts any source port of the client's IP
+        return not self.closed and (not self.port or client[1] == self.port)
+
+
+class UdpSession:
+    """NAT entry of one client address: its outbound sockets and cached destinations"""
+
+    __slots__ = ('client', 'association', 'sock4', 'sock6', 'routes', 'tunnel')
+
+    def __init__(self, client, association):
+        self.client = client
+        self.association = association
+        self.sock4 = None
+        self.sock6 = None
+        self.routes = {}
+        self.tunnel = None
+
+
+class UdpRelay:
+    """Relays SOCKS5 UDP datagrams between associated clients and their targets
+
+    Clients send to one shared socket. The first datagram from a client
+    address that belongs to an association opens a NAT entry with its own
+    outbound socket per address family, so every target sees one stable
+    source port per client and replies find their way back. The relay
+    thread waits on all sockets with one selector and drains up to
+    BATCH_SIZE datagrams per readable socket into a single reusable
+    buffer. NAT entries expire after idle_timeout seconds without traffic
+    on a ConnectionReaper timer wheel, and all of an association's entries
+    close with its TCP control connection.
+
+    Domain targets are resolved through resolver on a helper thread;
+    datagrams for a name not resolved yet are dropped, as UDP may.
+    """
+
+    def __init__(self, host, port, resolver, logger, metrics=None, idle_timeout=DEFAULT_UDP_IDLE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.resolver = resolver
+        self.logger = logger
+        self.metrics = metrics
+        self.reaper = ConnectionReaper(idle_timeout, 0)
+        self.running = False
+        self.sock = None
+        self.selector = None
+        self.associations = {}
+        self.sessions = {}
+        self.headers = {}
+        self.names = {}
+        self.expired = collections.deque()
+        self._lock = threading.Lock()
+
+        # Statistics
+        self.datagrams_in = 0
+        self.datagrams_out = 0
+        self.dropped = 0
+        self.sessions_opened = 0
+
+    def start(self):
+        """Bind the client-facing socket and start the relay thread; returns the bound port"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # A successor started by a graceful restart binds while this instance shuts down
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        try:
+            sock.bind((self.host, self.port))
+        except OSError:
+            sock.close()
+            raise
+        sock.setblocking(False)
+        self.sock = sock
+        self.port = sock.getsockname()[1]
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(sock, selectors.EVENT_READ, None)
+        self.running = True
+        self.reaper.start()
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+        return self.port
+
+    def stop(self):
+        """Stop relaying and end every association by shutting its control connection down"""
+        self.running = False
+        self.reaper.stop()
+        with self._lock:
+            associations = [a for candidates in self.associations.values() for a in candidates]
+        for association in associations:
+            try:
+                association.shutdown()
+            except OSError:
+                pass
+
+    def associate(self, ip, port=0, shutdown=lambda: None):
+        """Register a UDP ASSOCIATE from a control connection's client IP
+
+        shutdown is called from stop() and must make the control
+        connection's handler return, which then calls release().
+        """
+        association = Association(ip, port, shutdown)
+        with self._lock:
+            self.associations.setdefault(ip, []).append(association)
+        return association
+
+    def release(self, association):
+        """The control connection closed: drop the association and its NAT entries"""
+        association.closed = True
+        with self._lock:
+            candidates = self.associations.get(association.ip)
+            if candidates is not None:
+                candidates.remove(association)
+                if not candidates:
+                    del self.associations[association.ip]
+        # NAT entries belong to the relay thread
+        self.expired.append(association)
+
+    def run(self):
+        buffer = bytearray(MAX_DATAGRAM)
+        view = memoryview(buffer)
+        try:
+            while self.running:
+                for key, _ in self.selector.select(self.reaper.tick_seconds):
+                    if key.data is None:
+                        self.read_clients(buffer, view)
+                    else:
+                        self.read_replies(key.fileobj, key.data, buffer, view)
+                while self.expired:
+                    self.expire(self.expired.popleft())
+        finally:
+            for session in list(self.sessions.values()):
+                self.close_session(session)
+            self.selector.close()
+            self.sock.close()
+
+    def read_clients(self, buffer, view):
+        """Forward a batch of client datagrams to their targets"""
+        sock = self.sock
+        forwarded = 0
+        payload_bytes = 0
+        for _ in range(BATCH_SIZE):
+            try:
+                size, client = sock.recvfrom_into(buffer)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                continue
+            session = self.sessions.get(client) or self.open_session(client)
+            if session is None:
+                self.dropped += 1
+                continue
+            sent = self.forward(session, view, size)
+            if sent < 0:
+                self.dropped += 1
+                continue
+            forwarded += 1
+            payload_bytes += sent
+            if session.tunnel is not None:
+                session.tunnel.touch()
+        self.datagrams_in += forwarded
+        if self.metrics is not None and payload_bytes:
+            self.metrics.bytes_in.inc(payload_bytes)
+
+    def forward(self, session, view, size):
+        """Send one client datagram on; returns the payload size, or -1 if it was dropped"""
+        # RSV(2) FRAG(1) ATYP(1) DST.ADDR DST.PORT DATA; fragments are not supported
+        if size < 4 or view[2]:
+            return -1
+        atyp = view[3]
+        if atyp == ATYP_IPV4:
+            end = 10
+        elif atyp == ATYP_IPV6:
+            end = 22
+        elif atyp == ATYP_DOMAIN and size > 4:
+            end = 7 + view[4]
+        else:
+            return -1
+        if size < end:
+            return -1
+
+        key = bytes(view[3:end])
+        target = session.routes.get(key)
+        if target is None:
+            target = self.route(key)
+            if target is None:
+                return -1
+            if len(session.routes) >= MAX_ROUTES:
+                session.routes.clear()
+            session.routes[key] = target
+
+        family, address = target
+        out = session.sock4 if family == socket.AF_INET else session.sock6
+        try:
+            if out is None:
+                out = self.open_outbound(session, family)
+            return out.sendto(view[end:size], address)
+        except OSError:
+            return -1
+
+    def route(self, key):
+        """(family, address) for an ATYP-prefixed destination, or None while a name resolves"""
+        atyp = key[0]
+        port = PORT.unpack_from(key, len(key) - 2)[0]
+        if atyp == ATYP_IPV4:
+            return socket.AF_INET, (socket.inet_ntoa(key[1:5]), port)
+        if atyp == ATYP_IPV6:
+            return socket.AF_INET6, (socket.inet_ntop(socket.AF_INET6, key[1:17]), port)
+
+        try:
+            name = decode_name(key[2:-2])
+        except ValueError:
+            return None
+        if is_ip_address(name):
+            address = name
+        else:
+            address = self.names.get(name)
+            if address is None:
+                if name not in self.names:
+                    self.names[name] = None
+                    threading.Thread(target=self.resolve, args=(name,), daemon=True).start()
+                return None
+        family = socket.AF_INET6 if ':' in address else socket.AF_INET
+        return family, (address, port)
+
+    def resolve(self, name):
+        try:
+            address = self.resolver.resolve(name)[0]
+        except OSError:
+            address = None
+        if address is None or len(self.names) > MAX_ROUTES * 16:
+            # Failed or too many names: forget it so a later datagram tries again
+            self.names.pop(name, None)
+        else:
+            self.names[name] = address
+
+    def read_replies(self, sock, session, buffer, view):
+        """Return a batch of target datagrams to the client of session"""
+        client_sock = self.sock
+        returned = 0
+        payload_bytes = 0
+        for _ in range(BATCH_SIZE):
+            try:
+                size, source = sock.recvfrom_into(buffer)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                continue
+            header = self.headers.get(source)
+            if header is None:
+                if len(self.headers) >= MAX_HEADERS:
+                    self.headers.clear()
+                header = self.headers[source] = udp_header(source)
+            try:
+                client_sock.sendmsg((header, view[:size]), (), 0, session.client)
+            except OSError:
+                self.dropped += 1
+                continue
+            returned += 1
+            payload_bytes += size
+        if returned:
+            if session.tunnel is not None:
+                session.tunnel.touch()
+            self.datagrams_out += returned
+            if self.metrics is not None:
+                self.metrics.bytes_out.inc(payload_bytes)
+
+    def open_session(self, client):
+        """NAT entry for a new client address, if it belongs to an association"""
+        with self._lock:
+            candidates = self.associations.get(client[0], ())
+            association = next((a for a in candidates if a.matches(client)), None)
+        if association is None or len(association.sessions) >= MAX_SESSIONS_PER_ASSOCIATION:
+            return None
+        session = UdpSession(client, association)
+        session.tunnel = self.reaper.register(lambda: self.expired.append(session))
+        association.sessions.add(session)
+        self.sessions[client] = session
+        self.sessions_opened += 1
+        return session
+
+    def open_outbound(self, session, family):
+        out = socket.socket(family, socket.SOCK_DGRAM)
+        out.setblocking(False)
+        self.selector.register(out, selectors.EVENT_READ, session)
+        if family == socket.AF_INET:
+            session.sock4 = out
+        else:
+            session.sock6 = out
+        return out
+
+    def expire(self, item):
+        """Close an idle NAT entry, or every entry of a released association"""
+        if isinstance(item, Association):
+            for session in list(item.sessions):
+                self.close_session(session)
+        else:
+            self.close_session(item)
+
+    def close_session(self, session):
+        if self.sessions.get(session.client) is not session:
+            return
+        del self.sessions[session.client]
+        session.association.sessions.discard(session)
+        if session.tunnel is not None:
+            session.tunnel.unregister()
+        for out in (session.sock4, session.sock6):
+            if out is not None:
+                self.selector.unregister(out)
+                out.close()
+
+    def stats(self):
+        """Return a snapshot of relay counters"""
+        with self._lock:
+            associations = sum(len(candidates) for candidates in self.associations.values())
+        return {
+            'associations': associations,
+            'sessions': len(self.sessions),
+            'sessions_opened': self.sessions_opened,
+            'sessions_expired': self.reaper.reaped_idle,
+            'datagrams_in': self.datagrams_in,
+            'datagrams_out': self.datagrams_out,
+            'dropped': self.dropped,
+        }
+
+    def format_stats(self):
+        """One-line summary for the periodic stats log"""
+        s = self.stats()
+        return (f"UDP relay - Associations: {s['associations']}, NAT entries: {s['sessions']}, "
+                f"Datagrams in/out: {s['datagrams_in']}/{s['datagrams_out']}, Dropped: {s['dropped']}")
+
+
+def add_udp_arguments(parser):
+    """Register the UDP ASSOCIATE command line options"""
+    parser.add_argument("--udp-port", type=int, default=None,
+                        help="UDP port for SOCKS5 UDP ASSOCIATE (default: the TCP port; 0 = any free port)")
+    parser.add_argument("--udp-idle-timeout", type=float, default=DEFAULT_UDP_IDLE_TIMEOUT,
+                        help="Seconds a client's UDP NAT entry lives without traffic (0 = until the association ends)")
+    parser.add_argument("--no-udp", action="store_true", help="Refuse SOCKS5 UDP ASSOCIATE")
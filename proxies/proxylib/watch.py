@@ -0,0 +1,173 @@
+"""
+Mastermind configuration watcher
+Calls back when proxy configuration files change: inotify on Linux, stat polling elsewhere
+Author: Mastermind
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+
+# Seconds between stat checks when inotify is unavailable
+DEFAULT_POLL_INTERVAL = 2.0
+# Seconds to wait for a burst of writes to one file to settle before reloading
+SETTLE_DELAY = 0.2
+
+# inotify(7) flags
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_CLOEXEC = 0o2000000
+# Whole-file replacements (editors, sed -i, mv) show up on the directory, not the old inode
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+EVENT = struct.Struct("iIII")
+
+
+def file_version(path):
+    """(inode, size, mtime) of path, or None if it does not exist"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def inotify_libc():
+    """libc with inotify support, or None"""
+    name = ctypes.util.find_library('c')
+    if not name:
+        return None
+    try:
+        libc = ctypes.CDLL(name, use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, 'inotify_init1') or not hasattr(libc, 'inotify_add_watch'):
+        return None
+    return libc
+
+
+class ConfigWatcher:
+    """Run callback() on a background thread whenever one of paths changes
+
+    With inotify the directories holding the files are watched, so edits,
+    atomic replacements and files created after start are all seen
+    within SETTLE_DELAY. Without it (or if a directory does not exist
+    yet) the files' inode, size and mtime are compared every
+    poll_interval seconds. Changes are compared against the versions
+    seen at the last reload, so a burst of events reloads once.
+    """
+
+    def __init__(self, paths, callback, logger=None, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.callback = callback
+        self.logger = logger
+        self.poll_interval = poll_interval
+        self.backend = None
+        self.running = False
+        self.versions = [file_version(path) for path in self.paths]
+
+        # Statistics
+        self.reloads = 0
+        self.errors = 0
+
+    def open_inotify(self):
+        """Watch the directories of every path; returns the inotify fd or None"""
+        libc = inotify_libc()
+        if libc is None:
+            return None
+        fd = libc.inotify_init1(IN_CLOEXEC)
+        if fd < 0:
+            return None
+        for directory in {os.path.dirname(path) for path in self.paths}:
+            if libc.inotify_add_watch(fd, directory.encode(), WATCH_MASK) < 0:
+                os.close(fd)
+                return None
+        return fd
+
+    def changed(self):
+        """Return True, and remember the new versions, if any path changed since the last check"""
+        versions = [file_version(path) for path in self.paths]
+        if versions == self.versions:
+            return False
+        self.versions = versions
+        return True
+
+    def reload(self):
+        try:
+            self.callback()
+            self.reloads += 1
+        except Exception as e:
+            self.errors += 1
+            if self.logger:
+                self.logger.error(f"Configuration reload failed: {e}")
+
+    def read_events(self, fd):
+        """Drain pending inotify events; returns True if one concerns a watched file"""
+        names = {os.path.basename(path).encode() for path in self.paths}
+        relevant = False
+        while select.select([fd], [], [], 0)[0]:
+            data = os.read(fd, 65536)
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = EVENT.unpack_from(data, offset)
+                offset += EVENT.size
+                if data[offset:offset + length].rstrip(b"\0") in names:
+                    relevant = True
+                offset += length
+        return relevant
+
+    def run_inotify(self, fd):
+        try:
+            while self.running:
+                if not select.select([fd], [], [], 1.0)[0]:
+                    continue
+                if not self.read_events(fd):
+                    continue
+                # Let the writer finish, then fold its remaining events into this reload
+                time.sleep(SETTLE_DELAY)
+                self.read_events(fd)
+                if self.changed():
+                    self.reload()
+        finally:
+            os.close(fd)
+
+    def run_poll(self):
+        while self.running:
+            time.sleep(self.poll_interval)
+            if self.changed():
+                self.reload()
+
+    def start(self):
+        """Start watching on a daemon thread"""
+        if self.running:
+            return
+        self.running = True
+        fd = self.open_inotify()
+        if fd is not None:
+            self.backend = 'inotify'
+            target, args = self.run_inotify, (fd,)
+        else:
+            self.backend = 'poll'
+            target, args = self.run_poll, ()
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        if self.logger:
+            self.logger.info(f"Watching {', '.join(self.paths)} for changes ({self.backend})")
+
+    def stop(self):
+        self.running = False
+
+    def stats(self):
+        return {
+            'reloads': self.reloads,
+            'reload_errors': self.errors,
+        }
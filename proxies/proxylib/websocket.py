@@ -0,0 +1,355 @@
+"""
+Mastermind WebSocket codec
+RFC 6455 handshake, streaming frame parser and WebSocket-to-TCP relay
+Author: Mastermind
+"""
+
+import base64
+import hashlib
+import socket
+import struct
+import threading
+
+from .buffers import DEFAULT_BUFFER_SIZE
+from .relay import close_pair, shutdown_pair
+from .tracing import first_byte_hooks
+
+WEBSOCKET_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# Opcodes
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+# Event kinds returned by FrameParser.next_event()
+DATA = 'data'     # value: unmasked payload bytes of a text/binary/continuation frame
+PING = 'ping'     # value: ping payload
+PONG = 'pong'     # value: pong payload
+CLOSE = 'close'   # value: close payload (status code + reason)
+
+# Close status codes
+CLOSE_NORMAL = 1000
+CLOSE_PROTOCOL_ERROR = 1002
+
+MAX_CONTROL_PAYLOAD = 125
+
+# Seconds to wait for a client that sent a key to show whether it speaks WebSocket frames
+FRAMING_PEEK_TIMEOUT = 1.0
+
+
+class WebSocketError(ValueError):
+    """Protocol violation by the WebSocket peer"""
+
+    def __init__(self, message, code=CLOSE_PROTOCOL_ERROR):
+        super().__init__(message)
+        self.code = code
+
+
+def accept_key(key):
+    """Compute Sec-WebSocket-Accept for a client's Sec-WebSocket-Key"""
+    digest = hashlib.sha1(key.strip().encode('latin-1') + WEBSOCKET_GUID).digest()
+    return base64.b64encode(digest).decode()
+
+
+def is_upgrade(request):
+    """Return True when an HttpRequest asks for a WebSocket upgrade"""
+    return 'websocket' in request.header('upgrade', '').lower()
+
+
+def looks_like_frame(data):
+    """Return True if data, the first bytes a client sent after the 101, can start a masked frame
+
+    HTTP Custom style clients send raw bytes instead; an SSH banner starts
+    with 'S', which has reserved bits set.
+    """
+    first = data[0]
+    if first & 0x70 or first & 0x0F not in (OP_CONTINUATION, OP_TEXT, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG):
+        return False
+    return len(data) < 2 or bool(data[1] & 0x80)
+
+
+def client_sends_frames(sock, rest, timeout=FRAMING_PEEK_TIMEOUT):
+    """Tell WebSocket frames from raw bytes by the first bytes the client sends after the 101
+
+    rest holds whatever arrived behind the request head. Without it the
+    socket is peeked, so the bytes stay queued for the relay, for up to
+    timeout seconds; a client that stays silent is taken to send raw
+    bytes. The socket is left with that timeout for the caller to reset.
+    """
+    data = rest
+    if not data:
+        # SSH clients send their banner at once
+        sock.settimeout(timeout)
+        try:
+            data = sock.recv(2, socket.MSG_PEEK)
+        except socket.timeout:
+            return False
+    return bool(data) and looks_like_frame(data)
+
+
+def handshake_response(key=None, status="101 Switching Protocols", extra_headers=()):
+    """Build the 101 reply; Sec-WebSocket-Accept is included when the client sent a key"""
+    lines = [f"HTTP/1.1 {status}", "Upgrade: websocket", "Connection: Upgrade"]
+    if key:
+        lines.append(f"Sec-WebSocket-Accept: {accept_key(key)}")
+    lines.extend(extra_headers)
+    return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+
+def apply_mask(data, key, offset=0):
+    """XOR data with a 4-byte masking key, starting at key position offset
+
+    The payload and the repeated key are converted to two big integers
+    and XORed in one operation, so the work runs in C over the whole
+    buffer instead of a Python loop per byte. Masking is its own inverse.
+    """
+    length = len(data)
+    if not length:
+        return b""
+    shift = offset & 3
+    if shift:
+        key = key[shift:] + key[:shift]
+    mask = (key * ((length >> 2) + 1))[:length]
+    return (int.from_bytes(data, 'little') ^ int.from_bytes(mask, 'little')).to_bytes(length, 'little')
+
+
+def frame_header(opcode, length, fin=True, mask_key=None):
+    """Encode a frame header for a payload of length bytes"""
+    first = (0x80 if fin else 0) | opcode
+    mask_bit = 0x80 if mask_key else 0
+    if length < 126:
+        header = bytes((first, mask_bit | length))
+    elif length < 65536:
+        header = struct.pack(">BBH", first, mask_bit | 126, length)
+    else:
+        header = struct.pack(">BBQ", first, mask_bit | 127, length)
+    return header + mask_key if mask_key else header
+
+
+def encode_frame(opcode, payload=b"", fin=True, mask_key=None):
+    """Encode a complete frame; clients must pass a 4-byte mask_key"""
+    header = frame_header(opcode, len(payload), fin, mask_key)
+    if mask_key:
+        payload = apply_mask(payload, mask_key)
+    return header + payload
+
+
+def close_frame(code=CLOSE_NORMAL, reason=b""):
+    """Encode an unmasked close frame"""
+    return encode_frame(OP_CLOSE, struct.pack(">H", code) + reason[:MAX_CONTROL_PAYLOAD - 2])
+
+
+class FrameParser:
+    """Streaming parser for the frames a WebSocket peer sends
+
+    Data frame payloads are returned as soon as their bytes arrive,
+    already unmasked, as DATA events, so a tunnel never buffers a whole
+    frame. Control frames (at most 125 bytes) are returned whole, and may
+    arrive between the fragments of a message. Fragmented messages are
+    checked for a valid opcode sequence and streamed like any other data.
+    """
+
+    def __init__(self, require_mask=True):
+        self.buffer = bytearray()
+        self.require_mask = require_mask
+        # Payload bytes still to come in the current data frame
+        self.remaining = 0
+        self.mask_key = None
+        self.mask_offset = 0
+        # True between the first and the final fragment of a message
+        self.in_message = False
+
+    def feed(self, data):
+        self.buffer += data
+
+    def next_event(self):
+        """Return the next (kind, value) event, or None if more data is needed"""
+        buf = self.buffer
+        while not self.remaining:
+            if len(buf) < 2:
+                return None
+            first, second = buf[0], buf[1]
+            if first & 0x70:
+                raise WebSocketError("Reserved bits set without a negotiated extension")
+            fin = first & 0x80
+            opcode = first & 0x0F
+            length = second & 0x7F
+
+            pos = 2
+            if length == 126:
+                if len(buf) < 4:
+                    return None
+                length = (buf[2] << 8) | buf[3]
+                pos = 4
+            elif length == 127:
+                if len(buf) < 10:
+                    return None
+                length = int.from_bytes(buf[2:10], 'big')
+                pos = 10
+
+            key = None
+            if second & 0x80:
+                if len(buf) < pos + 4:
+                    return None
+                key = bytes(buf[pos:pos + 4])
+                pos += 4
+            elif self.require_mask:
+                raise WebSocketError("Client frames must be masked")
+
+            if opcode >= OP_CLOSE:
+                if not fin or length > MAX_CONTROL_PAYLOAD:
+                    raise WebSocketError("Control frames must be final and at most 125 bytes")
+                end = pos + length
+                if len(buf) < end:
+                    return None
+                payload = bytes(buf[pos:end])
+                del buf[:end]
+                if key:
+                    payload = apply_mask(payload, key)
+                if opcode == OP_CLOSE:
+                    return CLOSE, payload
+                if opcode == OP_PING:
+                    return PING, payload
+                if opcode == OP_PONG:
+                    return PONG, payload
+                raise WebSocketError(f"Unknown control opcode: {opcode}")
+
+            if opcode == OP_CONTINUATION:
+                if not self.in_message:
+                    raise WebSocketError("Continuation frame outside a fragmented message")
+            elif opcode in (OP_TEXT, OP_BINARY):
+                if self.in_message:
+                    raise WebSocketError("New message started before the previous one finished")
+            else:
+                raise WebSocketError(f"Unknown data opcode: {opcode}")
+
+            del buf[:pos]
+            self.in_message = not fin
+            self.mask_key = key
+            self.mask_offset = 0
+            self.remaining = length
+
+        if not buf:
+            return None
+        count = min(len(buf), self.remaining)
+        if count == len(buf):
+            chunk = bytes(buf)
+            buf.clear()
+        else:
+            chunk = bytes(buf[:count])
+            del buf[:count]
+        if self.mask_key:
+            chunk = apply_mask(chunk, self.mask_key, self.mask_offset)
+            self.mask_offset += count
+        self.remaining -= count
+        return DATA, chunk
+
+
+def send_frame(sock, header, payload):
+    """Send header and payload with one sendmsg() call, finishing short writes"""
+    sent = sock.sendmsg((header, payload))
+    if sent < len(header) + len(payload):
+        sock.sendall((header + bytes(payload))[sent:])
+
+
+def relay_websocket(client_socket, server_socket, is_running, pool=None, metrics=None, initial_data=b"",
+                    reaper=None):
+    """Relay between a WebSocket client and a raw TCP backend until either side closes
+
+    Client frames are parsed and their unmasked payload written to the
+    backend; backend bytes go back as one unmasked binary frame per read.
+    Pings are answered with pongs and a close frame is echoed before the
+    tunnel is torn down. Writes to the client from both directions share
+    a lock so frames never interleave. initial_data holds frame bytes the
+    client sent together with its upgrade request. reaper, a
+    ConnectionReaper, closes the tunnel once it is idle or over age.
+    """
+    write_lock = threading.Lock()
+    first_upstream, first_downstream = first_byte_hooks()
+    tunnel = reaper.register(lambda: shutdown_pair(client_socket, server_socket)) if reaper is not None else None
+    if tunnel is not None:
+        client_socket.settimeout(None)
+        server_socket.settimeout(None)
+
+    def send_client(header, payload=b""):
+        with write_lock:
+            send_frame(client_socket, header, payload)
+
+    def backend_to_client():
+        first = first_downstream
+        buffer = pool.acquire() if pool is not None else bytearray(DEFAULT_BUFFER_SIZE)
+        view = memoryview(buffer)
+        try:
+            while is_running():
+                received = server_socket.recv_into(buffer)
+                if not received:
+                    send_client(close_frame(CLOSE_NORMAL))
+                    break
+                send_client(frame_header(OP_BINARY, received), view[:received])
+                if first is not None:
+                    first()
+                    first = None
+                if metrics is not None:
+                    metrics.bytes_out.inc(received)
+                if tunnel is not None:
+                    tunnel.touch()
+        except OSError:
+            pass
+        finally:
+            view.release()
+            if pool is not None:
+                pool.release(buffer)
+            close_pair(server_socket, client_socket)
+
+    server_to_client = threading.Thread(target=backend_to_client)
+    server_to_client.daemon = True
+    server_to_client.start()
+
+    parser = FrameParser()
+    parser.feed(initial_data)
+    buffer = pool.acquire() if pool is not None else bytearray(DEFAULT_BUFFER_SIZE)
+    view = memoryview(buffer)
+    try:
+        while is_running():
+            event = parser.next_event()
+            if event is None:
+                received = client_socket.recv_into(buffer)
+                if not received:
+                    break
+                parser.feed(view[:received])
+                if tunnel is not None:
+                    tunnel.touch()
+                continue
+
+            kind, payload = event
+            if kind == DATA:
+                server_socket.sendall(payload)
+                if first_upstream is not None:
+                    first_upstream()
+                    first_upstream = None
+                if metrics is not None:
+                    metrics.bytes_in.inc(len(payload))
+            elif kind == PING:
+                send_client(frame_header(OP_PONG, len(payload)), payload)
+            elif kind == CLOSE:
+                # Echo the status code back, then tear the tunnel down
+                send_client(frame_header(OP_CLOSE, min(len(payload), 2)), payload[:2])
+                break
+    except WebSocketError as e:
+        try:
+            send_client(close_frame(e.code, str(e).encode()))
+        except OSError:
+            pass
+    except OSError:
+        pass
+    finally:
+        view.release()
+        if pool is not None:
+            pool.release(buffer)
+        close_pair(client_socket, server_socket)
+        server_to_client.join()
+        if tunnel is not None:
+            tunnel.unregister()
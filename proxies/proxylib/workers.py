@@ -0,0 +1,234 @@
+"""
+Mastermind proxy worker supervisor
+Pre-forks N copies of a proxy that share one port through SO_REUSEPORT
+Author: Mastermind
+"""
+
+import os
+import signal
+import sys
+import threading
+import time
+from multiprocessing.sharedctypes import RawArray
+
+from .logs import stop_logging
+from .metrics import MetricsRegistry, start_metrics_server, worker_metrics_address
+
+# Seconds between restarts of the same worker slot, to avoid crash loops
+RESTART_DELAY = 1.0
+# Seconds between supervisor statistics log lines
+STATS_INTERVAL = 60
+# Seconds between counter snapshots published by each worker
+PUBLISH_INTERVAL = 1.0
+# Seconds past the drain deadline before draining workers are terminated
+DRAIN_GRACE = 5
+
+
+class WorkerSupervisor:
+    """Fork worker processes from a configured proxy and keep them alive
+
+    The proxy object is built once in the supervisor (so logging and
+    configuration are loaded once) and every forked worker calls start()
+    on its own copy. The supervisor opens one SO_REUSEPORT listener per
+    worker through the proxy's ListenerHandoff and each worker accepts
+    on its own; the kernel then spreads new connections across them.
+    On a graceful restart the supervisor hands all of them to its
+    successor and signals the workers to drain.
+
+    Each worker publishes its connection counters into a shared array;
+    the supervisor sums them and carries the totals of dead workers
+    forward so restarts do not reset the aggregate. With a metrics
+    address configured on the proxy, the supervisor serves those sums
+    there and worker N serves its own metrics on the address returned by
+    worker_metrics_address().
+    """
+
+    def __init__(self, proxy, workers, name):
+        self.proxy = proxy
+        self.workers = workers
+        self.name = name
+        self.logger = proxy.logger
+        self.running = False
+
+        # Two slots per worker: active connections, total connections
+        self.counters = RawArray('q', workers * 2)
+        self.retired_total = 0
+        self.restarts = 0
+        self.children = {}
+        self.last_spawn = [0.0] * workers
+        self.metrics_server = None
+        self.listeners = []
+        self.terminating = False
+
+    def publish_counters(self, index):
+        """Copy this worker's counters into the shared array (worker side)"""
+        while True:
+            self.counters[index * 2] = self.proxy.connections
+            self.counters[index * 2 + 1] = self.proxy.total_connections
+            time.sleep(PUBLISH_INTERVAL)
+
+    def run_worker(self, index):
+        """Body of a forked worker process; never returns"""
+        try:
+            signal.signal(signal.SIGTERM, lambda sig, frame: sys.exit(0))
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+            # A restarted worker must not keep the supervisor's metrics socket open
+            if self.metrics_server is not None:
+                self.metrics_server.socket.close()
+
+            publisher = threading.Thread(target=self.publish_counters, args=(index,))
+            publisher.daemon = True
+            publisher.start()
+
+            if self.proxy.metrics_address:
+                self.proxy.metrics_address = worker_metrics_address(self.proxy.metrics_address, index)
+                self.proxy.metrics.labels['worker'] = str(index)
+
+            self.proxy.handoff.assign(self.listeners, index)
+            self.proxy.start()
+        except SystemExit:
+            pass
+        except Exception as e:
+            self.logger.error(f"{self.name} worker {index} crashed: {e}")
+        finally:
+            # os._exit() skips atexit, so write out the queued log records and slow connections first
+            stop_logging()
+            self.proxy.tracer.close()
+            os._exit(0)
+
+    def spawn(self, index):
+        """Fork the worker for one slot"""
+        self.last_spawn[index] = time.monotonic()
+        pid = os.fork()
+        if pid == 0:
+            self.run_worker(index)
+        self.children[pid] = index
+        self.logger.info(f"{self.name} worker {index} started (pid {pid})")
+
+    def reap(self):
+        """Collect exited workers and restart them"""
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+
+            index = self.children.pop(pid, None)
+            if index is None:
+                continue
+
+            # Keep the dead worker's history in the aggregate
+            self.retired_total += self.counters[index * 2 + 1]
+            self.counters[index * 2] = 0
+            self.counters[index * 2 + 1] = 0
+
+            if not self.running:
+                continue
+
+            self.logger.warning(f"{self.name} worker {index} (pid {pid}) exited with status {status}, restarting")
+            self.restarts += 1
+            delay = self.last_spawn[index] + RESTART_DELAY - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.spawn(index)
+
+    def stats(self):
+        """Return connection counters summed over all workers"""
+        active = sum(self.counters[i * 2] for i in range(self.workers))
+        total = self.retired_total + sum(self.counters[i * 2 + 1] for i in range(self.workers))
+        return {
+            'workers': len(self.children),
+            'active': active,
+            'total': total,
+            'restarts': self.restarts,
+        }
+
+    def start_metrics_server(self):
+        """Serve the aggregated worker counters on the proxy's metrics address"""
+        registry = MetricsRegistry({'proxy': self.proxy.metrics.labels['proxy']})
+        registry.function('workers', 'Worker processes alive', lambda: self.stats()['workers'])
+        registry.function('worker_restarts_total', 'Worker processes restarted',
+                          lambda: self.restarts, 'counter')
+        registry.function('connections_active', 'Connections currently open across all workers',
+                          lambda: self.stats()['active'])
+        registry.function('connections_total', 'Connections accepted across all workers',
+                          lambda: self.stats()['total'], 'counter')
+        return start_metrics_server(registry, self.proxy.metrics_address, self.logger, self.name)
+
+    def stop(self, sig=None, frame=None):
+        """Stop supervising and terminate every worker"""
+        self.running = False
+        self.terminating = True
+
+    def drain(self):
+        """The listeners went to a successor: stop respawning and let every worker drain"""
+        self.running = False
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except ProcessLookupError:
+                pass
+
+    def wait_drained(self):
+        """Give draining workers until the drain deadline to finish their tunnels and exit"""
+        handoff = self.proxy.handoff
+        deadline = handoff.drain_started + handoff.drain_timeout + DRAIN_GRACE
+        while self.children and not self.terminating and time.monotonic() < deadline:
+            time.sleep(0.5)
+            self.reap()
+
+    def run(self):
+        """Start all workers and supervise them until stopped"""
+        self.running = True
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        handoff = self.proxy.handoff
+        try:
+            self.listeners = handoff.open_listeners(self.workers, (self.proxy.host, self.proxy.port),
+                                                    self.proxy.backlog, reuse_port=True)
+        except OSError as e:
+            self.logger.error(f"{self.name} cannot listen on {self.proxy.host}:{self.proxy.port}: {e}")
+            return
+        handoff.on_drain = self.drain
+        handoff.ready()
+
+        self.logger.info(f"{self.name} starting {self.workers} workers on {self.proxy.host}:{self.proxy.port} (SO_REUSEPORT)")
+        for index in range(self.workers):
+            self.spawn(index)
+
+        if self.proxy.metrics_address:
+            self.metrics_server = self.start_metrics_server()
+
+        last_stats = time.monotonic()
+        try:
+            while self.running:
+                time.sleep(0.5)
+                self.reap()
+
+                if time.monotonic() - last_stats >= STATS_INTERVAL:
+                    last_stats = time.monotonic()
+                    s = self.stats()
+                    self.logger.info(f"{self.name} Stats - Workers: {s['workers']}, Active: {s['active']}, "
+                                     f"Total: {s['total']}, Restarts: {s['restarts']}")
+        finally:
+            if handoff.draining:
+                self.wait_drained()
+            if self.metrics_server is not None:
+                self.metrics_server.shutdown()
+                self.metrics_server.server_close()
+            for pid in list(self.children):
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+            for pid in list(self.children):
+                try:
+                    os.waitpid(pid, 0)
+                except ChildProcessError:
+                    pass
+            self.children.clear()
+            self.logger.info(f"{self.name} stopped")
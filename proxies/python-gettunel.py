@@ -2,6 +2,7 @@
 """
 Mastermind Python GETTUNEL Proxy
 GET tunnel proxy for HTTP tunneling
+Serves HTTP CONNECT, HTTP Custom/Injector GET-tunnel payloads and keep-alive forwarding
 Author: Mastermind
 """
 
@@ -12,73 +13,507 @@ import signal
 import sys
 import os
 import time
+import argparse
+from urllib.parse import urlsplit
+
+from proxylib.admission import (AdmissionControl, add_admission_arguments, handshake_done,
+                                 reject_connection, DEFAULT_MAX_CONNECTIONS, DEFAULT_MAX_PER_IP,
+                                 DEFAULT_MAX_HANDSHAKES, DEFAULT_BACKLOG)
+from proxylib.buffers import BufferPool, DEFAULT_BUFFER_SIZE
+from proxylib.resolver import Resolver
+from proxylib.connector import Connector
+from proxylib.http import (HttpError, SocketReader, parse_head, parse_response_head, rewrite_head,
+                           request_body_kind, response_body_kind, wants_keep_alive, BODY_NONE, BODY_CLOSE,
+                           BODY_CHUNKED, HOP_BY_HOP_HEADERS)
+from proxylib.handoff import ListenerHandoff, add_handoff_arguments, DEFAULT_DRAIN_TIMEOUT
+from proxylib.logs import add_logging_arguments, configure_logging, setup_proxy_logging
+from proxylib.metrics import ProxyMetrics, add_metrics_arguments, start_metrics_server
+from proxylib.pool import ConnectionPool
+from proxylib.reaper import ConnectionReaper, add_reaper_arguments, DEFAULT_IDLE_TIMEOUT, DEFAULT_MAX_LIFETIME
+from proxylib.relay import relay, splice_supported, RELAY_MODES
+from proxylib.tracing import (ConnectionTracer, add_tracing_arguments, current_trace, load_tracing,
+                              trace_request)
+from proxylib.workers import WorkerSupervisor
+
+DEFAULT_BACKEND = ('127.0.0.1', 22)
+
+# Seconds a client may take to send a request head
+HANDSHAKE_TIMEOUT = 10
+# Seconds an idle keep-alive client connection is kept open
+KEEPALIVE_TIMEOUT = 30
+# Seconds to wait on a forwarded request's origin
+UPSTREAM_TIMEOUT = 30
+
+def error_response(status):
+    """Build a body-less error response that closes the connection"""
+    return (f"HTTP/1.1 {status}\r\n"
+            f"Content-Length: 0\r\n"
+            f"Connection: close\r\n"
+            f"Server: Mastermind-Proxy/2.0\r\n\r\n").encode()
+
+BAD_REQUEST = error_response("400 Bad Request")
+BAD_GATEWAY = error_response("502 Bad Gateway")
+
+CONNECT_ESTABLISHED = b"HTTP/1.1 200 Connection established\r\n\r\n"
+
+def split_host_port(value, default_port):
+    """Split host[:port] (IPv6 in brackets) into (host, port)"""
+    if value.startswith('['):
+        host, _, rest = value[1:].partition(']')
+        port = rest[1:] if rest.startswith(':') else ''
+    else:
+        host, sep, port = value.rpartition(':')
+        if not sep:
+            host, port = value, ''
+    if not host:
+        raise HttpError(f"Bad host: {value!r}")
+    try:
+        return host, int(port) if port else default_port
+    except ValueError:
+        raise HttpError(f"Bad port: {value!r}")
 
 class PythonGetTunnelProxy:
-    def __init__(self, host='0.0.0.0', port=8007):
+    def __init__(self, host='0.0.0.0', port=8007, backend=None, relay_mode='auto',
+                 buffer_size=DEFAULT_BUFFER_SIZE,
+                 max_connections=DEFAULT_MAX_CONNECTIONS, max_per_ip=DEFAULT_MAX_PER_IP,
+                 max_handshakes=DEFAULT_MAX_HANDSHAKES, backlog=DEFAULT_BACKLOG, metrics_address=None,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, max_lifetime=DEFAULT_MAX_LIFETIME,
+                 drain_timeout=DEFAULT_DRAIN_TIMEOUT, tracer=None):
         self.host = host
         self.port = port
+        self.relay_mode = relay_mode
         self.running = False
-        self.connections = 0
+        self.reuse_port = False
+        
+        # Traffic and latency metrics, served in Prometheus format on metrics_address
+        self.metrics = ProxyMetrics('gettunel')
+        self.metrics_address = metrics_address
+        
+        # Receive buffers shared by every forward loop
+        self.buffer_pool = BufferPool(buffer_size)
+        
+        # Per-stage connection latency and the slow-connection log
+        self.tracer = tracer or ConnectionTracer("python-gettunel")
+        self.tracer.track(self.metrics)
+        
+        # Connection limits enforced in the accept loop
+        self.admission = AdmissionControl(max_connections, max_per_ip, max_handshakes, self.metrics,
+                                          self.tracer)
+        self.backlog = backlog
+        
+        # Cached resolver, Happy Eyeballs connector and idle keep-alive upstreams per origin
+        self.resolver = Resolver()
+        self.connector = Connector(self.resolver, metrics=self.metrics)
+        
+        self.metrics.track(self.admission, self.buffer_pool, self.resolver, self.connector)
+        self.track_upstreams()
+        
+        # Idle and lifetime limits of established tunnels
+        self.reaper = ConnectionReaper(idle_timeout, max_lifetime)
+        self.metrics.add_stats('reaper', self.reaper.stats,
+                               counters=('reaped', 'reaped_idle', 'reaped_lifetime'))
+        
+        # Configuration
+        self.config_dir = "config/proxies"
+        self.backend = backend or self.load_backend_config()
         
         # Setup logging
-        log_dir = "/var/log/mastermind/proxies"
-        os.makedirs(log_dir, exist_ok=True)
-        
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(f"{log_dir}/python-gettunel.log"),
-                logging.StreamHandler()
-            ]
-        )
+        self.setup_logging()
+        
+        # Listening socket handed over across graceful restarts
+        self.handoff = ListenerHandoff(self.port, self.logger, drain_timeout)
+    
+    def setup_logging(self):
+        """Setup logging configuration"""
+        setup_proxy_logging("python-gettunel", self.metrics)
         self.logger = logging.getLogger(__name__)
-
-    def handle_client(self, client_socket, client_addr):
+    
+    @property
+    def connections(self):
+        """Connections currently being served"""
+        return self.admission.active
+    
+    @property
+    def total_connections(self):
+        """Connections accepted since start"""
+        return self.admission.admitted
+    
+    def track_upstreams(self):
+        """Create the upstream pool on self.connector and the forwarding metrics on self.metrics"""
+        self.upstream_pool = ConnectionPool(self.connector)
+        self.metrics.add_stats('upstream_pool', self.upstream_pool.stats,
+                               counters=('hits', 'misses', 'stale', 'discards'))
+        self.requests = self.metrics.counter('http_requests_total', 'Forwarded plain HTTP requests')
+        self.first_byte_time = self.metrics.histogram(
+            'upstream_first_byte_seconds', 'Time from sending a forwarded request to its response head')
+    
+    def share(self, metrics, buffer_pool, resolver, connector, reaper, tracer):
+        """Serve on another proxy's components, as the OPENVPN mux embeds this one
+        
+        The upstream pool and the forwarding metrics are built again on
+        them, so pooled connects and request counts report to that proxy.
+        """
+        self.metrics = metrics
+        self.buffer_pool = buffer_pool
+        self.resolver = resolver
+        self.connector = connector
+        self.reaper = reaper
+        self.tracer = tracer
+        self.track_upstreams()
+    
+    def load_backend_config(self):
+        """Load the default GET-tunnel backend address"""
+        config_file = f"{self.config_dir}/python-gettunel-backend.conf"
+        host, port = DEFAULT_BACKEND
+        
+        if os.path.exists(config_file):
+            try:
+                with open(config_file, 'r') as f:
+                    for line in f:
+                        if line.startswith('BACKEND_HOST='):
+                            host = line.split('=', 1)[1].strip()
+                        elif line.startswith('BACKEND_PORT='):
+                            port = int(line.split('=', 1)[1].strip())
+            except:
+                pass
+        
+        return host, port
+    
+    def relay_data(self, client_socket, server_socket):
+        """Relay data between sockets"""
+        relay(client_socket, server_socket, lambda: self.running, self.relay_mode, self.buffer_pool,
+              self.metrics, reaper=self.reaper)
+    
+    def open_tunnel(self, client_socket, reader, host, port, reply):
+        """Connect to host:port, send reply and relay until either side closes"""
+        try:
+            server_socket = self.connector.connect(host, port)
+            server_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except Exception as e:
+            self.logger.error(f"Tunnel connect error ({host}:{port}): {e}")
+            client_socket.sendall(BAD_GATEWAY)
+            return
+        
+        try:
+            client_socket.sendall(reply)
+            handshake_done()
+            client_socket.settimeout(None)
+            
+            # Forward anything the client sent right behind the request
+            pending = reader.take_buffer()
+            if pending:
+                server_socket.sendall(pending)
+        except OSError:
+            server_socket.close()
+            raise
+        
+        self.relay_data(client_socket, server_socket)
+    
+    def handle_connect(self, client_socket, reader, request):
+        """Handle CONNECT host:port"""
+        host, port = split_host_port(request.target, 443)
+        self.logger.info(f"CONNECT {host}:{port}")
+        self.open_tunnel(client_socket, reader, host, port, CONNECT_ESTABLISHED)
+    
+    def is_get_tunnel(self, request):
+        """Return True for HTTP Custom/Injector style tunnel payloads"""
+        return 'upgrade' in request.headers or 'x-real-host' in request.headers
+    
+    def handle_get_tunnel(self, client_socket, reader, request):
+        """Handle a GET-tunnel payload: reply, then relay raw bytes to the backend or X-Real-Host"""
+        real_host = request.header('x-real-host')
+        if real_host:
+            host, port = split_host_port(real_host, self.backend[1])
+        else:
+            host, port = self.backend
+        
+        if 'upgrade' in request.headers:
+            reply = b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n\r\n"
+        else:
+            reply = CONNECT_ESTABLISHED
+        
+        self.logger.info(f"GET tunnel {request.method} {request.target} -> {host}:{port}")
+        self.open_tunnel(client_socket, reader, host, port, reply)
+    
+    def send_upstream(self, upstream, upstream_head, reader, body_kind, body_length):
+        """Send one request upstream and return (response head, upstream reader)"""
+        upstream.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        upstream.settimeout(UPSTREAM_TIMEOUT)
+        upstream.sendall(upstream_head)
+        self.metrics.bytes_in.inc(len(upstream_head))
+        trace = current_trace()
+        if trace is not None:
+            trace.upstream_byte()
+        reader.forward_body(upstream, body_kind, body_length, self.metrics.bytes_in, self.buffer_pool)
+        
+        upstream_reader = SocketReader(upstream)
+        response_head = upstream_reader.read_head()
+        if response_head is None:
+            raise ConnectionError("Upstream closed before responding")
+        return response_head, upstream_reader
+    
+    def forward_request(self, client_socket, reader, head, request):
+        """Forward one absolute-form request over a pooled upstream connection
+        
+        Returns True when the client connection can serve another request.
+        """
+        url = urlsplit(request.target)
+        if url.scheme != 'http' or not url.hostname:
+            client_socket.sendall(BAD_REQUEST)
+            return False
+        host, port = url.hostname, url.port or 80
+        path = url.path or '/'
+        if url.query:
+            path += '?' + url.query
+        
+        body_kind, body_length = request_body_kind(request)
+        extra = [] if 'host' in request.headers else [f"Host: {url.netloc}"]
+        # The body is relayed as chunked, so a Content-Length sent alongside must not reach an
+        # origin that could frame the body by it instead (request smuggling)
+        drop = HOP_BY_HOP_HEADERS | {'content-length'} if body_kind == BODY_CHUNKED else HOP_BY_HOP_HEADERS
+        upstream_head = rewrite_head(head, f"{request.method} {path} HTTP/1.1", drop=drop, extra=extra)
+        
+        started = time.monotonic()
+        try:
+            upstream, reused = self.upstream_pool.acquire(host, port)
+        except Exception as e:
+            self.logger.error(f"Upstream connect error ({host}:{port}): {e}")
+            client_socket.sendall(BAD_GATEWAY)
+            return False
+        
+        try:
+            try:
+                response_head, upstream_reader = self.send_upstream(upstream, upstream_head, reader,
+                                                                    body_kind, body_length)
+            except OSError:
+                # A pooled connection may have been closed by the origin; replay body-less requests once
+                if not reused or body_kind != BODY_NONE:
+                    raise
+                upstream.close()
+                upstream = self.connector.connect(host, port)
+                response_head, upstream_reader = self.send_upstream(upstream, upstream_head, reader,
+                                                                    body_kind, body_length)
+        except Exception as e:
+            upstream.close()
+            self.logger.error(f"Upstream request error ({host}:{port}): {e}")
+            client_socket.sendall(BAD_GATEWAY)
+            return False
+        
+        self.first_byte_time.observe(time.monotonic() - started)
+        
+        try:
+            response = parse_response_head(response_head)
+            
+            # Pass interim responses (100 Continue, 103 Early Hints) through
+            while 100 <= response.status < 200 and response.status != 101:
+                client_socket.sendall(response_head)
+                response_head = upstream_reader.read_head()
+                if response_head is None:
+                    raise ConnectionError("Upstream closed after an interim response")
+                response = parse_response_head(response_head)
+            
+            kind, length = response_body_kind(response, request.method)
+            keep_client = wants_keep_alive(request) and kind != BODY_CLOSE and response.status != 101
+            keep_upstream = wants_keep_alive(response) and kind != BODY_CLOSE and response.status != 101
+            
+            status_line = response_head.split(b"\r\n", 1)[0].decode('latin-1')
+            client_head = rewrite_head(response_head, status_line,
+                                       extra=["Connection: keep-alive" if keep_client else "Connection: close"])
+            client_socket.sendall(client_head)
+            self.metrics.bytes_out.inc(len(client_head))
+            trace = current_trace()
+            if trace is not None:
+                trace.downstream_byte()
+            upstream_reader.forward_body(client_socket, kind, length, self.metrics.bytes_out, self.buffer_pool)
+        except BaseException:
+            upstream.close()
+            raise
+        
+        # Bytes past the response mean the origin is out of sync; do not reuse it
+        if keep_upstream and not upstream_reader.buffer:
+            self.upstream_pool.release(host, port, upstream)
+        else:
+            upstream.close()
+        
+        self.requests.inc()
+        handshake_done()
+        return keep_client
+    
+    def handle_client(self, client_socket, client_addr, ticket=None):
         """Handle incoming client connection"""
-        self.connections += 1
+        if ticket:
+            ticket.activate()
+        
         try:
             self.logger.info(f"Python GETTUNEL connection from {client_addr}")
-            time.sleep(0.1)
+            
+            # Heads and bodies are written separately; Nagle would hold back the second write
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client_socket.settimeout(HANDSHAKE_TIMEOUT)
+            reader = SocketReader(client_socket)
+            
+            # Serve requests until the client closes or a tunnel takes over the connection
+            while self.running:
+                head = reader.read_head()
+                if head is None:
+                    break
+                request = parse_head(head)
+                trace_request()
+                
+                if request.method == 'CONNECT':
+                    self.handle_connect(client_socket, reader, request)
+                    break
+                if self.is_get_tunnel(request):
+                    self.handle_get_tunnel(client_socket, reader, request)
+                    break
+                if not self.forward_request(client_socket, reader, head, request):
+                    break
+                
+                client_socket.settimeout(KEEPALIVE_TIMEOUT)
+        
+        except HttpError as e:
+            self.logger.warning(f"GETTUNEL bad request from {client_addr}: {e}")
+            try:
+                client_socket.sendall(BAD_REQUEST)
+            except OSError:
+                pass
+        except (ConnectionError, socket.timeout):
+            pass  # Client went away or went idle
         except Exception as e:
             self.logger.error(f"Client error: {e}")
         finally:
             client_socket.close()
-            self.connections -= 1
-
+            if ticket:
+                ticket.release()
+    
+    def print_stats(self):
+        """Print proxy statistics"""
+        while self.running:
+            time.sleep(60)
+            self.logger.info(f"GETTUNEL Stats - Active: {self.connections}, Total: {self.total_connections}, "
+                             f"Requests: {self.requests.value}")
+            self.logger.info(f"GETTUNEL {self.upstream_pool.format_stats()}")
+            self.logger.info(f"GETTUNEL {self.admission.format_stats()}")
+            self.logger.info(f"GETTUNEL {self.reaper.format_stats()}")
+            self.logger.info(f"GETTUNEL {self.resolver.format_stats()}")
+            self.logger.info(f"GETTUNEL {self.connector.format_stats()}")
+            if self.tracer.enabled:
+                self.logger.info(f"GETTUNEL {self.tracer.format_stats()}")
+    
     def start(self):
         """Start the proxy server"""
         self.running = True
+        self.reaper.start()
+        self.tracer.start()
+        
+        # Create server socket
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        
+        # Start statistics thread
+        stats_thread = threading.Thread(target=self.print_stats)
+        stats_thread.daemon = True
+        stats_thread.start()
+        
+        if self.metrics_address:
+            start_metrics_server(self.metrics, self.metrics_address, self.logger, "GETTUNEL")
         
         try:
-            server_socket.bind((self.host, self.port))
-            server_socket.listen(50)
+            server_socket = self.handoff.listen(server_socket, (self.host, self.port), self.backlog)
+            
             self.logger.info(f"Mastermind Python GETTUNEL Proxy started on {self.host}:{self.port}")
+            self.logger.info(f"GET tunnel backend: {self.backend[0]}:{self.backend[1]}")
+            if self.relay_mode != 'copy':
+                self.logger.info(f"Tunnel relay: {'splice' if splice_supported() else 'copy (splice unavailable)'}")
             
-            while self.running:
+            while self.running and self.handoff.accepting:
                 try:
                     client_socket, client_addr = server_socket.accept()
-                    client_thread = threading.Thread(target=self.handle_client, args=(client_socket, client_addr))
+                    
+                    ticket = self.admission.admit(client_addr[0], client_socket)
+                    if ticket is None:
+                        reject_connection(client_socket, http=True)
+                        continue
+                    
+                    client_thread = threading.Thread(
+                        target=self.handle_client,
+                        args=(client_socket, client_addr, ticket)
+                    )
                     client_thread.daemon = True
                     client_thread.start()
+                
+                except socket.timeout:
+                    continue
                 except socket.error:
+                    if self.running:
+                        self.logger.error("Socket accept error")
                     break
+        
         except Exception as e:
             self.logger.error(f"Server error: {e}")
         finally:
             server_socket.close()
-
+            self.handoff.drain(lambda: self.connections)
+            self.upstream_pool.close()
+            self.logger.info("Mastermind Python GETTUNEL Proxy stopped")
+    
     def stop(self):
+        """Stop the proxy server"""
         self.running = False
+        self.reaper.stop()
+        self.tracer.stop()
+
+def parse_backend(value):
+    """Parse a host:port backend argument"""
+    host, sep, port = value.rpartition(':')
+    if not sep or not host:
+        raise argparse.ArgumentTypeError("backend must be host:port")
+    return host.strip('[]'), int(port)
 
 def signal_handler(sig, frame):
+    """Handle interrupt signals"""
+    print("\nMastermind Python GETTUNEL Proxy shutting down...")
     proxy.stop()
     sys.exit(0)
 
 if __name__ == "__main__":
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
-    proxy = PythonGetTunnelProxy()
-    proxy.start()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Mastermind Python GETTUNEL Proxy")
+    parser.add_argument("--host", default="0.0.0.0", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8007, help="Port to listen on")
+    parser.add_argument("--backend", type=parse_backend, default=None,
+                        help="Default GET-tunnel backend as host:port (default: config file, then 127.0.0.1:22)")
+    parser.add_argument("--relay", choices=RELAY_MODES, default="auto",
+                        help="Tunnel relay: zero-copy splice() on Linux, or the userspace copy loop")
+    parser.add_argument("--buffer-size", type=int, default=DEFAULT_BUFFER_SIZE,
+                        help="Size in bytes of each pooled relay buffer")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes sharing the port via SO_REUSEPORT")
+    add_admission_arguments(parser)
+    add_reaper_arguments(parser)
+    add_handoff_arguments(parser)
+    add_tracing_arguments(parser)
+    add_metrics_arguments(parser)
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    configure_logging(args)
+
+    # Create proxy
+    proxy = PythonGetTunnelProxy(host=args.host, port=args.port, backend=args.backend, relay_mode=args.relay,
+                                 buffer_size=args.buffer_size, max_connections=args.max_connections,
+                                 max_per_ip=args.max_per_ip, max_handshakes=args.max_handshakes,
+                                 backlog=args.backlog, metrics_address=args.metrics,
+                                 idle_timeout=args.idle_timeout, max_lifetime=args.max_lifetime,
+                                 drain_timeout=args.drain_timeout,
+                                 tracer=load_tracing("python-gettunel", args))
+
+    if args.workers > 1:
+        WorkerSupervisor(proxy, args.workers, "Mastermind Python GETTUNEL Proxy").run()
+    else:
+        # Register signal handlers
+        signal.signal(signal.SIGINT, signal_handler)
+        signal.signal(signal.SIGTERM, signal_handler)
+
+        # Start proxy
+        proxy.start()
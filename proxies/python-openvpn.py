@@ -2,6 +2,7 @@
 """
 Mastermind Python OPENVPN Proxy
 OpenVPN-compatible proxy server
+Single-port multiplexer: sniffs each connection and hands it to OpenVPN, SSH, HTTP, TLS or SOCKS
 Author: Mastermind
 """
 
@@ -12,73 +13,373 @@ import signal
 import sys
 import os
 import time
+import argparse
+import importlib.util
+
+from proxylib.admission import (AdmissionControl, add_admission_arguments, handshake_done,
+                                 reject_connection, DEFAULT_MAX_CONNECTIONS, DEFAULT_MAX_PER_IP,
+                                 DEFAULT_MAX_HANDSHAKES, DEFAULT_BACKLOG)
+from proxylib.buffers import BufferPool, DEFAULT_BUFFER_SIZE
+from proxylib.resolver import Resolver
+from proxylib.connector import Connector
+from proxylib.handoff import ListenerHandoff, add_handoff_arguments, DEFAULT_DRAIN_TIMEOUT
+from proxylib.logs import add_logging_arguments, configure_logging, setup_proxy_logging
+from proxylib.metrics import ProxyMetrics, add_metrics_arguments, start_metrics_server
+from proxylib.reaper import ConnectionReaper, add_reaper_arguments, DEFAULT_IDLE_TIMEOUT, DEFAULT_MAX_LIFETIME
+from proxylib.relay import relay, splice_supported, RELAY_MODES
+from proxylib.sniff import (sniff, PROTOCOLS, PROTO_SSH, PROTO_OPENVPN, PROTO_HTTP, PROTO_TLS,
+                            PROTO_SOCKS, PROTO_UNKNOWN)
+from proxylib.tracing import ConnectionTracer, add_tracing_arguments, load_tracing, trace_request
+from proxylib.workers import WorkerSupervisor
+
+# Backend used for HTTP/SOCKS when it is handled in this process
+INTERNAL = 'internal'
+
+DEFAULT_BACKENDS = {
+    PROTO_OPENVPN: ('127.0.0.1', 1194),
+    PROTO_SSH: ('127.0.0.1', 22),
+    PROTO_TLS: ('127.0.0.1', 443),
+    PROTO_HTTP: INTERNAL,
+    PROTO_SOCKS: INTERNAL,
+}
+
+# Seconds to wait for a client's first bytes before assuming SSH (the server speaks first)
+DEFAULT_PEEK_TIMEOUT = 1.0
+
+def load_proxy_class(filename, class_name):
+    """Import a proxy class from one of the sibling (hyphenated) proxy scripts"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+    spec = importlib.util.spec_from_file_location(filename[:-3].replace('-', '_'), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return getattr(module, class_name)
+
+def parse_backend(value):
+    """Parse a host:port backend argument, or 'internal'"""
+    if value == INTERNAL:
+        return INTERNAL
+    host, sep, port = value.rpartition(':')
+    if not sep or not host:
+        raise argparse.ArgumentTypeError("backend must be host:port")
+    return host.strip('[]'), int(port)
 
 class PythonOpenVPNProxy:
-    def __init__(self, host='0.0.0.0', port=8006):
+    def __init__(self, host='0.0.0.0', port=8006, backends=None, peek_timeout=None, relay_mode='auto',
+                 buffer_size=DEFAULT_BUFFER_SIZE,
+                 max_connections=DEFAULT_MAX_CONNECTIONS, max_per_ip=DEFAULT_MAX_PER_IP,
+                 max_handshakes=DEFAULT_MAX_HANDSHAKES, backlog=DEFAULT_BACKLOG, metrics_address=None,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, max_lifetime=DEFAULT_MAX_LIFETIME,
+                 drain_timeout=DEFAULT_DRAIN_TIMEOUT, tracer=None):
         self.host = host
         self.port = port
+        self.relay_mode = relay_mode
         self.running = False
-        self.connections = 0
+        self.reuse_port = False
+        
+        # Traffic and latency metrics, served in Prometheus format on metrics_address
+        self.metrics = ProxyMetrics('openvpn')
+        self.metrics_address = metrics_address
+        self.dispatch_time = self.metrics.histogram(
+            'mux_dispatch_seconds', 'Time from accept until the protocol was identified')
+        
+        # Receive buffers shared by every forward loop
+        self.buffer_pool = BufferPool(buffer_size)
+        
+        # Per-stage connection latency and the slow-connection log
+        self.tracer = tracer or ConnectionTracer("python-openvpn")
+        self.tracer.track(self.metrics)
+        
+        # Connection limits enforced in the accept loop
+        self.admission = AdmissionControl(max_connections, max_per_ip, max_handshakes, self.metrics,
+                                          self.tracer)
+        self.backlog = backlog
+        
+        # Cached resolver and Happy Eyeballs connector for the backends
+        self.resolver = Resolver()
+        self.connector = Connector(self.resolver, metrics=self.metrics)
+        
+        self.metrics.track(self.admission, self.buffer_pool, self.resolver, self.connector)
+        
+        # Idle and lifetime limits of established tunnels
+        self.reaper = ConnectionReaper(idle_timeout, max_lifetime)
+        self.metrics.add_stats('reaper', self.reaper.stats,
+                               counters=('reaped', 'reaped_idle', 'reaped_lifetime'))
+        
+        # Dispatch counters per protocol, plus sniff timeouts
+        self.dispatched = dict.fromkeys(PROTOCOLS + (PROTO_UNKNOWN,), 0)
+        self.peek_timeouts = 0
+        self.stats_lock = threading.Lock()
+        self.metrics.add_stats('mux', self.mux_stats, counters=PROTOCOLS + (PROTO_UNKNOWN, 'peek_timeouts'))
+        
+        # Configuration: command-line values override the config file
+        self.config_dir = "config/proxies"
+        config_backends, config_timeout = self.load_mux_config()
+        self.backends = dict(config_backends, **(backends or {}))
+        self.peek_timeout = peek_timeout if peek_timeout is not None else config_timeout
         
         # Setup logging
-        log_dir = "/var/log/mastermind/proxies"
-        os.makedirs(log_dir, exist_ok=True)
-        
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(f"{log_dir}/python-openvpn.log"),
-                logging.StreamHandler()
-            ]
-        )
+        self.setup_logging()
+        
+        # Listening socket handed over across graceful restarts
+        self.handoff = ListenerHandoff(self.port, self.logger, drain_timeout)
+        
+        # In-process handlers for protocols without an external backend
+        self.handlers = {}
+        if self.backends[PROTO_SOCKS] == INTERNAL:
+            self.handlers[PROTO_SOCKS] = self.embed(
+                load_proxy_class('python-simple.py', 'SimpleSocksProxy')(mode='thread', relay_mode=relay_mode))
+        if self.backends[PROTO_HTTP] == INTERNAL:
+            self.handlers[PROTO_HTTP] = self.embed(
+                load_proxy_class('python-gettunel.py', 'PythonGetTunnelProxy')(relay_mode=relay_mode))
+    
+    def setup_logging(self):
+        """Setup logging configuration"""
+        setup_proxy_logging("python-openvpn", self.metrics)
         self.logger = logging.getLogger(__name__)
-
-    def handle_client(self, client_socket, client_addr):
+    
+    @property
+    def connections(self):
+        """Connections currently being served"""
+        return self.admission.active
+    
+    @property
+    def total_connections(self):
+        """Connections accepted since start"""
+        return self.admission.admitted
+    
+    def load_mux_config(self):
+        """Load per-protocol backends and the peek timeout"""
+        config_file = f"{self.config_dir}/python-openvpn-mux.conf"
+        backends = dict(DEFAULT_BACKENDS)
+        peek_timeout = DEFAULT_PEEK_TIMEOUT
+        
+        if os.path.exists(config_file):
+            try:
+                with open(config_file, 'r') as f:
+                    for line in f:
+                        key, sep, value = line.strip().partition('=')
+                        if not sep:
+                            continue
+                        if key == 'PEEK_TIMEOUT':
+                            peek_timeout = float(value)
+                        elif key.endswith('_BACKEND') and key[:-8].lower() in backends:
+                            backends[key[:-8].lower()] = parse_backend(value.strip())
+            except:
+                pass
+        
+        return backends, peek_timeout
+    
+    def embed(self, handler):
+        """Run another proxy's handle_client() on this proxy's buffers, connector, metrics, reaper and tracer"""
+        handler.running = True
+        # The handler's own reaper and tracer threads never run; its tunnels report to this proxy's
+        handler.share(self.metrics, self.buffer_pool, self.resolver, self.connector, self.reaper, self.tracer)
+        return handler
+    
+    def mux_stats(self):
+        """Return dispatch counters"""
+        with self.stats_lock:
+            return dict(self.dispatched, peek_timeouts=self.peek_timeouts)
+    
+    def relay_data(self, client_socket, server_socket):
+        """Relay data between sockets"""
+        relay(client_socket, server_socket, lambda: self.running, self.relay_mode, self.buffer_pool,
+              self.metrics, reaper=self.reaper)
+    
+    def forward(self, client_socket, protocol):
+        """Connect to the protocol's backend and relay; sniffed bytes are still queued on client_socket"""
+        host, port = self.backends[protocol]
+        # Raw protocols have no request of their own to parse: sniffing it is the request stage
+        trace_request()
+        try:
+            server_socket = self.connector.connect(host, port)
+        except Exception as e:
+            self.logger.error(f"{protocol} backend connect error ({host}:{port}): {e}")
+            return
+        
+        handshake_done()
+        self.relay_data(client_socket, server_socket)
+    
+    def handle_client(self, client_socket, client_addr, ticket=None):
         """Handle incoming client connection"""
-        self.connections += 1
+        if ticket:
+            ticket.activate()
+        
         try:
-            self.logger.info(f"Python OPENVPN connection from {client_addr}")
-            time.sleep(0.1)
+            started = time.monotonic()
+            protocol, data = sniff(client_socket, self.peek_timeout)
+            
+            if protocol is None:
+                # Silent client: SSH clients wait for the server banner
+                protocol = PROTO_SSH
+                with self.stats_lock:
+                    self.peek_timeouts += 1
+            else:
+                self.dispatch_time.observe(time.monotonic() - started)
+            
+            with self.stats_lock:
+                self.dispatched[protocol] += 1
+            
+            self.logger.info(f"Python OPENVPN {protocol} connection from {client_addr}")
+            if protocol == PROTO_UNKNOWN:
+                self.logger.warning(f"Unrecognised protocol from {client_addr}: {data[:16]!r}")
+                # Consume what was peeked so close() sends a FIN rather than a reset
+                client_socket.recv(len(data))
+                return
+            
+            handler = self.handlers.get(protocol)
+            if handler is not None:
+                # The handler closes the socket; the ticket stays ours
+                handler.handle_client(client_socket, client_addr)
+            else:
+                self.forward(client_socket, protocol)
+        
+        except ConnectionError:
+            pass  # Client went away before sending anything
         except Exception as e:
             self.logger.error(f"Client error: {e}")
         finally:
             client_socket.close()
-            self.connections -= 1
-
+            if ticket:
+                ticket.release()
+    
+    def print_stats(self):
+        """Print proxy statistics"""
+        while self.running:
+            time.sleep(60)
+            stats = self.mux_stats()
+            self.logger.info(f"OPENVPN Stats - Active: {self.connections}, Total: {self.total_connections}")
+            self.logger.info("OPENVPN Dispatch - " + ", ".join(f"{name}: {count}" for name, count in stats.items()))
+            self.logger.info(f"OPENVPN {self.admission.format_stats()}")
+            self.logger.info(f"OPENVPN {self.reaper.format_stats()}")
+            self.logger.info(f"OPENVPN {self.connector.format_stats()}")
+            if self.tracer.enabled:
+                self.logger.info(f"OPENVPN {self.tracer.format_stats()}")
+    
     def start(self):
         """Start the proxy server"""
         self.running = True
+        self.reaper.start()
+        self.tracer.start()
+        
+        # Create server socket
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        
+        # Start statistics thread
+        stats_thread = threading.Thread(target=self.print_stats)
+        stats_thread.daemon = True
+        stats_thread.start()
+        
+        if self.metrics_address:
+            start_metrics_server(self.metrics, self.metrics_address, self.logger, "OPENVPN")
         
         try:
-            server_socket.bind((self.host, self.port))
-            server_socket.listen(50)
+            server_socket = self.handoff.listen(server_socket, (self.host, self.port), self.backlog)
+            
             self.logger.info(f"Mastermind Python OPENVPN Proxy started on {self.host}:{self.port}")
+            for protocol in PROTOCOLS:
+                backend = self.backends[protocol]
+                target = backend if backend == INTERNAL else f"{backend[0]}:{backend[1]}"
+                self.logger.info(f"Dispatch {protocol} -> {target}")
+            self.logger.info(f"Peek timeout: {self.peek_timeout}s (silent clients go to ssh)")
+            if self.relay_mode != 'copy':
+                self.logger.info(f"Relay: {'splice' if splice_supported() else 'copy (splice unavailable)'}")
             
-            while self.running:
+            while self.running and self.handoff.accepting:
                 try:
                     client_socket, client_addr = server_socket.accept()
-                    client_thread = threading.Thread(target=self.handle_client, args=(client_socket, client_addr))
+                    
+                    ticket = self.admission.admit(client_addr[0], client_socket)
+                    if ticket is None:
+                        reject_connection(client_socket)
+                        continue
+                    
+                    client_thread = threading.Thread(
+                        target=self.handle_client,
+                        args=(client_socket, client_addr, ticket)
+                    )
                     client_thread.daemon = True
                     client_thread.start()
+                
+                except socket.timeout:
+                    continue
                 except socket.error:
+                    if self.running:
+                        self.logger.error("Socket accept error")
                     break
+        
         except Exception as e:
             self.logger.error(f"Server error: {e}")
         finally:
             server_socket.close()
-
+            self.handoff.drain(lambda: self.connections)
+            self.logger.info("Mastermind Python OPENVPN Proxy stopped")
+    
     def stop(self):
+        """Stop the proxy server"""
         self.running = False
+        self.reaper.stop()
+        self.tracer.stop()
+        for handler in self.handlers.values():
+            handler.running = False
 
 def signal_handler(sig, frame):
+    """Handle interrupt signals"""
+    print("\nMastermind Python OPENVPN Proxy shutting down...")
     proxy.stop()
     sys.exit(0)
 
 if __name__ == "__main__":
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
-    proxy = PythonOpenVPNProxy()
-    proxy.start()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Mastermind Python OPENVPN Proxy (single-port multiplexer)")
+    parser.add_argument("--host", default="0.0.0.0", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8006, help="Port to listen on")
+    for protocol in PROTOCOLS:
+        default = DEFAULT_BACKENDS[protocol]
+        shown = default if default == INTERNAL else f"{default[0]}:{default[1]}"
+        parser.add_argument(f"--{protocol}-backend", type=parse_backend, default=None,
+                            help=f"Backend for {protocol} connections as host:port"
+                                 f"{' or internal' if protocol in (PROTO_HTTP, PROTO_SOCKS) else ''}"
+                                 f" (default: config file, then {shown})")
+    parser.add_argument("--peek-timeout", type=float, default=None,
+                        help=f"Seconds to wait for a client's first bytes before dispatching to ssh "
+                             f"(default: config file, then {DEFAULT_PEEK_TIMEOUT})")
+    parser.add_argument("--relay", choices=RELAY_MODES, default="auto",
+                        help="Relay: zero-copy splice() on Linux, or the userspace copy loop")
+    parser.add_argument("--buffer-size", type=int, default=DEFAULT_BUFFER_SIZE,
+                        help="Size in bytes of each pooled relay buffer")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes sharing the port via SO_REUSEPORT")
+    add_admission_arguments(parser)
+    add_reaper_arguments(parser)
+    add_handoff_arguments(parser)
+    add_tracing_arguments(parser)
+    add_metrics_arguments(parser)
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    configure_logging(args)
+
+    backends = {protocol: getattr(args, f"{protocol}_backend") for protocol in PROTOCOLS
+                if getattr(args, f"{protocol}_backend") is not None}
+
+    # Create proxy
+    proxy = PythonOpenVPNProxy(host=args.host, port=args.port, backends=backends, peek_timeout=args.peek_timeout,
+                               relay_mode=args.relay, buffer_size=args.buffer_size,
+                               max_connections=args.max_connections, max_per_ip=args.max_per_ip,
+                               max_handshakes=args.max_handshakes, backlog=args.backlog,
+                               metrics_address=args.metrics,
+                               idle_timeout=args.idle_timeout, max_lifetime=args.max_lifetime,
+                               drain_timeout=args.drain_timeout,
+                               tracer=load_tracing("python-openvpn", args))
+
+    if args.workers > 1:
+        WorkerSupervisor(proxy, args.workers, "Mastermind Python OPENVPN Proxy").run()
+    else:
+        # Register signal handlers
+        signal.signal(signal.SIGINT, signal_handler)
+        signal.signal(signal.SIGTERM, signal_handler)
+
+        # Start proxy
+        proxy.start()
@@ -7,275 +7,374 @@ Author: Mastermind
 
 import socket
 import threading
-import struct
 import time
 import logging
 import signal
 import sys
 import os
-import hashlib
-import base64
-from cryptography.fernet import Fernet
+import argparse
+import getpass
+
+from proxylib.admission import (AdmissionControl, add_admission_arguments, handshake_done,
+                                 current_client_ip, reject_connection, DEFAULT_MAX_CONNECTIONS,
+                                 DEFAULT_MAX_PER_IP, DEFAULT_MAX_HANDSHAKES, DEFAULT_BACKLOG)
+from proxylib.auth import (Authenticator, FileUserSource, SQLiteUserSource, add_auth_arguments,
+                           hash_password, DEFAULT_USERS_DB, DEFAULT_CACHE_TTL, DEFAULT_MAX_FAILURES,
+                           DEFAULT_LOCKOUT)
+from proxylib.buffers import BufferPool, DEFAULT_BUFFER_SIZE
+from proxylib.resolver import Resolver
+from proxylib.connector import Connector
+from proxylib.handoff import ListenerHandoff, add_handoff_arguments, DEFAULT_DRAIN_TIMEOUT
+from proxylib.logs import add_logging_arguments, configure_logging, setup_proxy_logging
+from proxylib.metrics import ProxyMetrics, add_metrics_arguments, start_metrics_server
+from proxylib.reaper import ConnectionReaper, add_reaper_arguments, DEFAULT_IDLE_TIMEOUT, DEFAULT_MAX_LIFETIME
+from proxylib.relay import relay, splice_supported, RELAY_MODES
+from proxylib.shaper import Shaper, add_shaping_arguments, load_shaping_config
+from proxylib.securechannel import (server_handshake, generate_key, decode_key, ChannelError,
+                                    MAGIC)
+from proxylib.socks import (SocksParser, SocksError, recv_event, socks5_reply, GREETING, CMD_CONNECT,
+                            METHOD_USERNAME_PASSWORD, REP_SUCCEEDED, REP_HOST_UNREACHABLE,
+                            REP_CONNECTION_REFUSED, REP_COMMAND_NOT_SUPPORTED)
+from proxylib.tracing import ConnectionTracer, add_tracing_arguments, load_tracing
+from proxylib.workers import WorkerSupervisor
+
+# Seconds a client may take to finish the channel hello
+HANDSHAKE_TIMEOUT = 10
+
+# Accounts written to a new users file; the same defaults the proxy always shipped with
+DEFAULT_USERS = {
+    'mastermind': 'mastermind123',
+    'admin': 'admin123',
+    'user': 'user123',
+}
 
 class SecureSocksProxy:
-    def __init__(self, host='0.0.0.0', port=8002):
+    def __init__(self, host='0.0.0.0', port=8002, relay_mode='auto', require_channel=False,
+                 buffer_size=DEFAULT_BUFFER_SIZE, shaper=None, users_file=None, users_db=DEFAULT_USERS_DB,
+                 auth_cache_ttl=DEFAULT_CACHE_TTL, auth_max_failures=DEFAULT_MAX_FAILURES,
+                 auth_lockout=DEFAULT_LOCKOUT,
+                 max_connections=DEFAULT_MAX_CONNECTIONS, max_per_ip=DEFAULT_MAX_PER_IP,
+                 max_handshakes=DEFAULT_MAX_HANDSHAKES, backlog=DEFAULT_BACKLOG, metrics_address=None,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, max_lifetime=DEFAULT_MAX_LIFETIME,
+                 drain_timeout=DEFAULT_DRAIN_TIMEOUT, tracer=None):
         self.host = host
         self.port = port
+        self.relay_mode = relay_mode
+        self.require_channel = require_channel
         self.running = False
-        self.connections = 0
-        self.total_connections = 0
+        self.reuse_port = False
+        
+        # Traffic and latency metrics, served in Prometheus format on metrics_address
+        self.metrics = ProxyMetrics('seguro')
+        self.metrics_address = metrics_address
+        self.channel_sessions = self.metrics.counter(
+            'channel_sessions_total', 'Connections that opened an encrypted channel')
+        self.channel_errors = self.metrics.counter(
+            'channel_errors_total', 'Channel hellos refused or records that failed authentication')
+        
+        # Receive buffers shared by every forward loop
+        self.buffer_pool = BufferPool(buffer_size)
+        
+        # Per-stage connection latency and the slow-connection log
+        self.tracer = tracer or ConnectionTracer("python-seguro")
+        self.tracer.track(self.metrics)
+        
+        # Connection limits enforced in the accept loop
+        self.admission = AdmissionControl(max_connections, max_per_ip, max_handshakes, self.metrics,
+                                          self.tracer)
+        self.backlog = backlog
+        
+        # Cached resolver and Happy Eyeballs connector for SOCKS targets
+        self.resolver = Resolver()
+        self.connector = Connector(self.resolver, metrics=self.metrics)
         
-        # Authentication database
-        self.users = {
-            'mastermind': self.hash_password('mastermind123'),
-            'admin': self.hash_password('admin123'),
-            'user': self.hash_password('user123')
-        }
+        self.metrics.track(self.admission, self.buffer_pool, self.resolver, self.connector)
         
-        # Generate encryption key
-        self.encryption_key = Fernet.generate_key()
-        self.cipher = Fernet(self.encryption_key)
+        # Idle and lifetime limits of established tunnels
+        self.reaper = ConnectionReaper(idle_timeout, max_lifetime)
+        self.metrics.add_stats('reaper', self.reaper.stats,
+                               counters=('reaped', 'reaped_idle', 'reaped_lifetime'))
+        
+        # Bandwidth limits applied in the relay loops, per authenticated user as well as per IP
+        self.shaper = shaper or Shaper()
+        self.metrics.add_stats('shaper', self.shaper.stats, counters=('throttled', 'throttle_seconds'))
         
         # Setup logging
         self.setup_logging()
         
+        # Listening socket handed over across graceful restarts
+        self.handoff = ListenerHandoff(self.port, self.logger, drain_timeout)
+        
+        # Pre-shared key for the encrypted channel, shared with seguro-client.py
+        self.config_dir = "config/proxies"
+        self.channel_key = self.load_channel_key()
+        
+        # Users from the users file and the Mastermind database, reloaded when either changes
+        self.users_file = users_file or f"{self.config_dir}/python-seguro-users.conf"
+        self.ensure_users_file()
+        sources = [SQLiteUserSource(users_db)] if users_db else []
+        sources.append(FileUserSource(self.users_file))
+        self.authenticator = Authenticator(sources, cache_ttl=auth_cache_ttl, max_failures=auth_max_failures,
+                                           lockout=auth_lockout, logger=self.logger)
+        self.metrics.add_stats('auth', self.authenticator.stats,
+                               counters=('cache_hits', 'cache_misses', 'successes', 'failures',
+                                         'throttled', 'lockouts', 'reloads'))
+        
     def setup_logging(self):
         """Setup logging configuration"""
-        log_dir = "/var/log/mastermind/proxies"
-        os.makedirs(log_dir, exist_ok=True)
-        
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(f"{log_dir}/python-seguro.log"),
-                logging.StreamHandler()
-            ]
-        )
+        setup_proxy_logging("python-seguro", self.metrics)
         self.logger = logging.getLogger(__name__)
         
-    def hash_password(self, password):
-        """Hash password using SHA256"""
-        return hashlib.sha256(password.encode()).hexdigest()
+    @property
+    def connections(self):
+        """Connections currently being served"""
+        return self.admission.active
+        
+    @property
+    def total_connections(self):
+        """Connections accepted since start"""
+        return self.admission.admitted
+        
+    def ensure_users_file(self):
+        """Create the users file with the default accounts on first start"""
+        if os.path.exists(self.users_file):
+            return
+        
+        os.makedirs(os.path.dirname(self.users_file) or '.', exist_ok=True)
+        fd = os.open(self.users_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write("# username:hash, one per line; hashes from python-seguro.py --hash-password\n")
+            for username, password in DEFAULT_USERS.items():
+                f.write(f"{username}:{hash_password(password)}\n")
+        self.logger.warning(f"Created {self.users_file} with the default accounts; change their passwords")
         
-    def authenticate_user(self, username, password):
+    def authenticate_user(self, username, password, client_ip):
         """Authenticate user credentials"""
-        if username in self.users:
-            return self.users[username] == self.hash_password(password)
-        return False
+        return self.authenticator.authenticate(username, password, client_ip)
         
-    def encrypt_data(self, data):
-        """Encrypt data using Fernet encryption"""
-        try:
-            return self.cipher.encrypt(data)
-        except:
-            return data
-            
-    def decrypt_data(self, data):
-        """Decrypt data using Fernet encryption"""
-        try:
-            return self.cipher.decrypt(data)
-        except:
-            return data
-            
-    def handle_socks5_auth(self, client_socket):
-        """Handle SOCKS5 authentication with security"""
+    def load_channel_key(self):
+        """Load the channel pre-shared key, generating and saving one on first start"""
+        config_file = f"{self.config_dir}/python-seguro-key.conf"
+        
+        if os.path.exists(config_file):
+            with open(config_file, 'r') as f:
+                for line in f:
+                    if line.startswith('SEGURO_KEY='):
+                        return decode_key(line.split('=', 1)[1])
+        
+        key = generate_key()
+        os.makedirs(self.config_dir, exist_ok=True)
+        fd = os.open(config_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(f"SEGURO_KEY={key}\n")
+        self.logger.info(f"Generated channel key in {config_file}; copy it to seguro-client.py")
+        return decode_key(key)
+        
+    def handle_socks5_auth(self, client_socket, parser, client_ip):
+        """Handle SOCKS5 authentication with security; returns the username or None"""
         try:
             # Read authentication request
-            data = client_socket.recv(3)
-            if len(data) < 3:
-                return False
-                
-            ver, ulen = struct.unpack("BB", data[:2])
-            if ver != 1:
-                return False
-                
-            username = client_socket.recv(ulen).decode()
-            plen = struct.unpack("B", client_socket.recv(1))[0]
-            password = client_socket.recv(plen).decode()
+            kind, (username, password) = recv_event(client_socket, parser)
+            username = username.decode(errors="replace")
+            password = password.decode(errors="replace")
             
             # Authenticate user
-            if self.authenticate_user(username, password):
-                client_socket.send(b"\x01\x00")  # Success
+            if self.authenticate_user(username, password, client_ip):
+                client_socket.sendall(b"\x01\x00")  # Success
                 self.logger.info(f"Successful authentication for user: {username}")
-                return True
+                return username
             else:
-                client_socket.send(b"\x01\x01")  # Failure
+                client_socket.sendall(b"\x01\x01")  # Failure
                 self.logger.warning(f"Failed authentication for user: {username}")
-                return False
+                return None
                 
         except Exception as e:
             self.logger.error(f"Authentication error: {e}")
-            return False
+            return None
             
-    def handle_socks5(self, client_socket):
+    def handle_socks5(self, client_socket, client_ip):
         """Handle SOCKS5 protocol with authentication"""
         try:
             # Authentication negotiation
-            data = client_socket.recv(262)
-            if len(data) < 3:
-                return False
-                
-            ver, nmethods = struct.unpack("BB", data[:2])
-            if ver != 5:
+            parser = SocksParser()
+            kind, methods = recv_event(client_socket, parser)
+            if kind != GREETING:
+                self.logger.warning("SEGURO only accepts SOCKS5 clients")
                 return False
                 
             # Check for username/password authentication
-            methods = data[2:2+nmethods]
-            if 2 in methods:  # Username/password authentication
-                client_socket.send(b"\x05\x02")
+            if METHOD_USERNAME_PASSWORD in methods:
+                client_socket.sendall(b"\x05\x02")
+                parser.select_method(METHOD_USERNAME_PASSWORD)
                 
                 # Perform authentication
-                if not self.handle_socks5_auth(client_socket):
+                username = self.handle_socks5_auth(client_socket, parser, client_ip)
+                if username is None:
                     return False
             else:
-                client_socket.send(b"\x05\xFF")  # No acceptable methods
+                client_socket.sendall(b"\x05\xFF")  # No acceptable methods
                 return False
             
             # Read connection request
-            data = client_socket.recv(4)
-            if len(data) < 4:
-                return False
-                
-            ver, cmd, rsv, atyp = struct.unpack("BBBB", data)
+            kind, request = recv_event(client_socket, parser)
             
-            if cmd == 1:  # CONNECT
-                if atyp == 1:  # IPv4
-                    addr_data = client_socket.recv(6)
-                    dst_addr = socket.inet_ntoa(addr_data[:4])
-                    dst_port = struct.unpack(">H", addr_data[4:6])[0]
-                elif atyp == 3:  # Domain name
-                    addr_len = struct.unpack("B", client_socket.recv(1))[0]
-                    dst_addr = client_socket.recv(addr_len).decode()
-                    dst_port = struct.unpack(">H", client_socket.recv(2))[0]
-                else:
-                    return False
-                    
-                self.logger.info(f"SOCKS5 SEGURO request: {dst_addr}:{dst_port}")
-                return self.handle_connect(client_socket, dst_addr, dst_port)
+            if request.command == CMD_CONNECT:
+                self.logger.info(f"SOCKS5 SEGURO request: {request.address}:{request.port}")
+                return self.handle_connect(client_socket, request.address, request.port,
+                                           parser.remaining(), username)
+                                           
+            client_socket.sendall(socks5_reply(REP_COMMAND_NOT_SUPPORTED))
+            return False
                 
+        except SocksError as e:
+            self.logger.warning(f"SOCKS5 handshake error: {e}")
+            return False
+        except ChannelError:
+            raise
         except Exception as e:
             self.logger.error(f"SOCKS5 error: {e}")
             return False
             
-    def handle_connect(self, client_socket, dst_addr, dst_port):
-        """Handle CONNECT request with encryption"""
+    def handle_connect(self, client_socket, dst_addr, dst_port, initial_data=b"", username=None):
+        """Handle CONNECT request; client_socket may be an encrypted channel"""
         try:
-            # Connect to target server
-            server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            # Connect to target server, racing every resolved address
+            server_socket = self.connector.connect(dst_addr, dst_port)
             server_socket.settimeout(10)
-            server_socket.connect((dst_addr, dst_port))
-            
-            # Send success response
-            response = b"\x05\x00\x00\x01" + socket.inet_aton("0.0.0.0") + struct.pack(">H", 0)
-            client_socket.send(response)
-                
-            # Start encrypted data relay
-            self.relay_data_encrypted(client_socket, server_socket)
-            return True
-            
         except Exception as e:
             self.logger.error(f"Connect error: {e}")
             # Send error response
-            response = b"\x05\x05\x00\x01" + socket.inet_aton("0.0.0.0") + struct.pack(">H", 0)
-            client_socket.send(response)
+            code = REP_HOST_UNREACHABLE if isinstance(e, socket.gaierror) else REP_CONNECTION_REFUSED
+            client_socket.sendall(socks5_reply(code))
             return False
             
-    def relay_data_encrypted(self, client_socket, server_socket):
-        """Relay data with optional encryption"""
-        def forward_encrypted(source, destination, encrypt=False):
-            try:
-                while self.running:
-                    data = source.recv(4096)
-                    if not data:
-                        break
-                    
-                    # Apply encryption if specified
-                    if encrypt and len(data) > 0:
-                        try:
-                            data = self.encrypt_data(data)
-                        except:
-                            pass  # Fall back to unencrypted
-                            
-                    destination.send(data)
-            except:
-                pass
-            finally:
-                source.close()
-                destination.close()
-                
-        # Start forwarding threads (encrypt client to server traffic)
-        client_to_server = threading.Thread(
-            target=forward_encrypted, 
-            args=(client_socket, server_socket, True)
-        )
-        server_to_client = threading.Thread(
-            target=forward_encrypted, 
-            args=(server_socket, client_socket, False)
-        )
-        
-        client_to_server.daemon = True
-        server_to_client.daemon = True
-        
-        client_to_server.start()
-        server_to_client.start()
-        
-        client_to_server.join()
-        server_to_client.join()
-        
-    def handle_client(self, client_socket, client_addr):
+        try:
+            # Send success response
+            client_socket.sendall(socks5_reply(REP_SUCCEEDED))
+            handshake_done()
+            
+            # Forward anything the client sent right behind the request
+            if initial_data:
+                server_socket.sendall(initial_data)
+        except OSError:
+            server_socket.close()
+            raise
+            
+        self.relay_data(client_socket, server_socket, username)
+        return True
+            
+    def relay_data(self, client_socket, server_socket, username=None):
+        """Relay data; channels always use the copy loop, splice would move raw ciphertext"""
+        mode = self.relay_mode if isinstance(client_socket, socket.socket) else 'copy'
+        relay(client_socket, server_socket, lambda: self.running, mode, self.buffer_pool,
+              self.metrics, self.shaper.open(current_client_ip(), username), reaper=self.reaper)
+        
+    def open_channel(self, client_socket):
+        """Return an encrypted channel if the client sent a channel hello, else the plain socket"""
+        client_socket.settimeout(HANDSHAKE_TIMEOUT)
+        first = client_socket.recv(1, socket.MSG_PEEK)
+        if not first:
+            raise ConnectionError("Client closed before the handshake")
+        
+        if first != MAGIC[:1]:
+            if self.require_channel:
+                raise ChannelError("Plain SOCKS5 refused, encrypted channel required")
+            client_socket.settimeout(None)
+            return client_socket
+        
+        channel = server_handshake(client_socket, self.channel_key)
+        client_socket.settimeout(None)
+        self.channel_sessions.inc()
+        return channel
+        
+    def handle_client(self, client_socket, client_addr, ticket=None):
         """Handle incoming client connection"""
-        self.connections += 1
-        self.total_connections += 1
+        if ticket:
+            ticket.activate()
         
         try:
             self.logger.info(f"New SEGURO connection from {client_addr}")
             
-            # Only support SOCKS5 for secure proxy
-            self.handle_socks5(client_socket)
+            # SOCKS5 runs either inside an encrypted channel or, unless required, in the clear
+            self.handle_socks5(self.open_channel(client_socket), client_addr[0])
                 
+        except ChannelError as e:
+            self.channel_errors.inc()
+            self.logger.warning(f"SEGURO channel error from {client_addr}: {e}")
+        except (ConnectionError, socket.timeout):
+            pass  # Client went away or stalled during the handshake
         except Exception as e:
             self.logger.error(f"Client handling error: {e}")
         finally:
             client_socket.close()
-            self.connections -= 1
+            if ticket:
+                ticket.release()
             
     def print_stats(self):
         """Print proxy statistics"""
         while self.running:
             time.sleep(60)  # Print stats every minute
-            self.logger.info(f"SEGURO Proxy Stats - Active: {self.connections}, Total: {self.total_connections}")
+            self.logger.info(f"SEGURO Proxy Stats - Active: {self.connections}, Total: {self.total_connections}, "
+                             f"Channels: {self.channel_sessions.value}, Channel errors: {self.channel_errors.value}")
+            self.logger.info(f"SEGURO Proxy {self.buffer_pool.format_stats()}")
+            self.logger.info(f"SEGURO Proxy {self.admission.format_stats()}")
+            self.logger.info(f"SEGURO Proxy {self.reaper.format_stats()}")
+            self.logger.info(f"SEGURO Proxy {self.resolver.format_stats()}")
+            self.logger.info(f"SEGURO Proxy {self.connector.format_stats()}")
+            if self.tracer.enabled:
+                self.logger.info(f"SEGURO Proxy {self.tracer.format_stats()}")
+            self.logger.info(f"SEGURO Proxy {self.authenticator.format_stats()}")
+            if self.shaper.enabled:
+                self.logger.info(f"SEGURO Proxy {self.shaper.format_stats()}")
             
     def start(self):
         """Start the secure proxy server"""
         self.running = True
+        self.reaper.start()
+        self.tracer.start()
         
         # Create server socket
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         
         # Start statistics thread
         stats_thread = threading.Thread(target=self.print_stats)
         stats_thread.daemon = True
         stats_thread.start()
         
+        if self.metrics_address:
+            start_metrics_server(self.metrics, self.metrics_address, self.logger, "SEGURO Proxy")
+        
         try:
-            server_socket.bind((self.host, self.port))
-            server_socket.listen(50)
+            server_socket = self.handoff.listen(server_socket, (self.host, self.port), self.backlog)
             
             self.logger.info(f"Mastermind Python SEGURO Proxy started on {self.host}:{self.port}")
-            self.logger.info("Authentication required - Users: mastermind, admin, user")
+            self.logger.info(f"Authentication required - {len(self.authenticator.users)} users")
+            self.logger.info(f"Encrypted channel: {'required' if self.require_channel else 'optional'}")
+            if self.relay_mode != 'copy':
+                self.logger.info(f"Relay: {'splice' if splice_supported() else 'copy (splice unavailable)'}"
+                                 " for plain clients")
             
-            while self.running:
+            while self.running and self.handoff.accepting:
                 try:
                     client_socket, client_addr = server_socket.accept()
+                    
+                    ticket = self.admission.admit(client_addr[0], client_socket)
+                    if ticket is None:
+                        reject_connection(client_socket)
+                        continue
+                        
                     client_thread = threading.Thread(
                         target=self.handle_client,
-                        args=(client_socket, client_addr)
+                        args=(client_socket, client_addr, ticket)
                     )
                     client_thread.daemon = True
                     client_thread.start()
                     
+                except socket.timeout:
+                    continue
                 except socket.error:
                     if self.running:
                         self.logger.error("Socket accept error")
@@ -285,11 +384,14 @@ class SecureSocksProxy:
             self.logger.error(f"Server error: {e}")
         finally:
             server_socket.close()
+            self.handoff.drain(lambda: self.connections)
             self.logger.info("Mastermind Python SEGURO Proxy stopped")
             
     def stop(self):
         """Stop the proxy server"""
         self.running = False
+        self.reaper.stop()
+        self.tracer.stop()
         
 def signal_handler(sig, frame):
     """Handle interrupt signals"""
@@ -298,10 +400,51 @@ def signal_handler(sig, frame):
     sys.exit(0)
 
 if __name__ == "__main__":
-    # Register signal handlers
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
+    parser = argparse.ArgumentParser(description="Mastermind Python SEGURO Proxy")
+    parser.add_argument("--host", default="0.0.0.0", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8002, help="Port to listen on")
+    parser.add_argument("--relay", choices=RELAY_MODES, default="auto",
+                        help="Relay for plain SOCKS5 clients; encrypted channels always use the copy loop")
+    parser.add_argument("--require-channel", action="store_true",
+                        help="Refuse plain SOCKS5 clients; only accept seguro-client.py channels")
+    parser.add_argument("--buffer-size", type=int, default=DEFAULT_BUFFER_SIZE,
+                        help="Size in bytes of each pooled relay buffer")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes sharing the port via SO_REUSEPORT")
+    add_auth_arguments(parser, "config/proxies/python-seguro-users.conf")
+    add_shaping_arguments(parser)
+    add_admission_arguments(parser)
+    add_reaper_arguments(parser)
+    add_handoff_arguments(parser)
+    add_tracing_arguments(parser)
+    add_metrics_arguments(parser)
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    configure_logging(args)
     
-    # Create and start proxy
-    proxy = SecureSocksProxy()
-    proxy.start()
\ No newline at end of file
+    if args.hash_password:
+        print(hash_password(getpass.getpass("Password: ")))
+        sys.exit(0)
+    
+    # Create proxy
+    proxy = SecureSocksProxy(host=args.host, port=args.port, relay_mode=args.relay,
+                             require_channel=args.require_channel, buffer_size=args.buffer_size,
+                             shaper=load_shaping_config("config/proxies/python-seguro-shaping.conf", args),
+                             users_file=args.users_file, users_db=args.users_db,
+                             auth_cache_ttl=args.auth_cache_ttl, auth_max_failures=args.auth_max_failures,
+                             auth_lockout=args.auth_lockout,
+                             max_connections=args.max_connections, max_per_ip=args.max_per_ip,
+                             max_handshakes=args.max_handshakes, backlog=args.backlog,
+                             metrics_address=args.metrics,
+                             idle_timeout=args.idle_timeout, max_lifetime=args.max_lifetime,
+                             drain_timeout=args.drain_timeout,
+                             tracer=load_tracing("python-seguro", args))
+    
+    if args.workers > 1:
+        WorkerSupervisor(proxy, args.workers, "Mastermind Python SEGURO Proxy").run()
+    else:
+        # Register signal handlers
+        signal.signal(signal.SIGINT, signal_handler)
+        signal.signal(signal.SIGTERM, signal_handler)
+        
+        proxy.start()
\ No newline at end of file
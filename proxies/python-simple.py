@@ -1,230 +1,555 @@
 #!/usr/bin/env python3
 """
 Mastermind Python SIMPLE Proxy
-Basic SOCKS4/5 proxy server with simple authentication
+Basic SOCKS4/5 proxy server with simple authentication and SOCKS5 UDP ASSOCIATE
 Author: Mastermind
 """
 
 import socket
 import threading
-import struct
 import time
 import logging
 import signal
 import sys
-import os
+import asyncio
+import argparse
+
+from proxylib.admission import (AdmissionControl, add_admission_arguments, handshake_done,
+                                 current_client_ip, reject_connection, rejection_for, DEFAULT_MAX_CONNECTIONS,
+                                 DEFAULT_MAX_PER_IP, DEFAULT_MAX_HANDSHAKES, DEFAULT_BACKLOG)
+from proxylib.buffers import BufferPool, DEFAULT_BUFFER_SIZE
+from proxylib.resolver import Resolver
+from proxylib.connector import Connector
+from proxylib.handoff import ListenerHandoff, add_handoff_arguments, ACCEPT_POLL, DEFAULT_DRAIN_TIMEOUT
+from proxylib.logs import add_logging_arguments, configure_logging, setup_proxy_logging
+from proxylib.metrics import ProxyMetrics, add_metrics_arguments, start_metrics_server
+from proxylib.reaper import ConnectionReaper, add_reaper_arguments, DEFAULT_IDLE_TIMEOUT, DEFAULT_MAX_LIFETIME
+from proxylib.relay import relay, splice_supported, RELAY_MODES
+from proxylib.shaper import Shaper, add_shaping_arguments, load_shaping_config, throttle_async
+from proxylib.socks import (SocksParser, SocksError, recv_event, read_event_async, socks4_reply,
+                            socks5_reply, REQUEST, CMD_CONNECT, CMD_UDP_ASSOCIATE, METHOD_NO_AUTH,
+                            SOCKS4_GRANTED, SOCKS4_REJECTED, REP_SUCCEEDED, REP_HOST_UNREACHABLE,
+                            REP_CONNECTION_REFUSED, REP_COMMAND_NOT_SUPPORTED)
+from proxylib.tracing import ConnectionTracer, add_tracing_arguments, first_byte_hooks, load_tracing
+from proxylib.udp import UdpRelay, add_udp_arguments, DEFAULT_UDP_IDLE_TIMEOUT
+from proxylib.workers import WorkerSupervisor
+
+# Per-direction read size for the asyncio relay; also caps the StreamReader
+# buffer so memory per tunnel stays flat regardless of peer speed.
+ASYNC_CHUNK_SIZE = 16384
+# Seconds a thread-mode client may take to finish the SOCKS handshake
+HANDSHAKE_TIMEOUT = 10
 
 class SimpleSocksProxy:
-    def __init__(self, host='0.0.0.0', port=8001):
+    def __init__(self, host='0.0.0.0', port=8001, mode='asyncio', relay_mode='auto',
+                 buffer_size=DEFAULT_BUFFER_SIZE, shaper=None,
+                 max_connections=DEFAULT_MAX_CONNECTIONS, max_per_ip=DEFAULT_MAX_PER_IP,
+                 max_handshakes=DEFAULT_MAX_HANDSHAKES, backlog=DEFAULT_BACKLOG, metrics_address=None,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, max_lifetime=DEFAULT_MAX_LIFETIME,
+                 drain_timeout=DEFAULT_DRAIN_TIMEOUT, udp=True, udp_port=None,
+                 udp_idle_timeout=DEFAULT_UDP_IDLE_TIMEOUT, tracer=None):
         self.host = host
         self.port = port
+        self.mode = mode
+        self.relay_mode = relay_mode
         self.running = False
-        self.connections = 0
-        self.total_connections = 0
+        self.reuse_port = False
+        
+        # Traffic and latency metrics, served in Prometheus format on metrics_address
+        self.metrics = ProxyMetrics('simple')
+        self.metrics_address = metrics_address
+        
+        # Receive buffers shared by every copy-mode forward loop
+        self.buffer_pool = BufferPool(buffer_size)
+
+        # Per-stage connection latency and the slow-connection log
+        self.tracer = tracer or ConnectionTracer("python-simple")
+        self.tracer.track(self.metrics)
+        
+        # Connection limits enforced in the accept loop
+        self.admission = AdmissionControl(max_connections, max_per_ip, max_handshakes, self.metrics,
+                                          self.tracer)
+        self.backlog = backlog
+        
+        # Cached resolver and Happy Eyeballs connector for SOCKS targets
+        self.resolver = Resolver()
+        self.connector = Connector(self.resolver, metrics=self.metrics)
+        
+        self.metrics.track(self.admission, self.buffer_pool, self.resolver, self.connector)
+        
+        # Idle and lifetime limits of established tunnels
+        self.reaper = ConnectionReaper(idle_timeout, max_lifetime)
+        self.metrics.add_stats('reaper', self.reaper.stats,
+                               counters=('reaped', 'reaped_idle', 'reaped_lifetime'))
+        
+        # Bandwidth limits applied in both relay engines
+        self.shaper = shaper or Shaper()
+        self.metrics.add_stats('shaper', self.shaper.stats, counters=('throttled', 'throttle_seconds'))
         
         # Setup logging
         self.setup_logging()
         
+        # Listening socket handed over across graceful restarts
+        self.handoff = ListenerHandoff(self.port, self.logger, drain_timeout)
+        
+        # SOCKS5 UDP ASSOCIATE relay, bound when the proxy starts (UDP port defaults to the TCP port)
+        self.udp_relay = None
+        if udp:
+            self.udp_relay = UdpRelay(self.host, self.port if udp_port is None else udp_port, self.resolver,
+                                      self.logger, self.metrics, udp_idle_timeout)
+            self.metrics.add_stats('udp', self.udp_relay.stats,
+                                   counters=('sessions_opened', 'sessions_expired', 'datagrams_in',
+                                             'datagrams_out', 'dropped'))
+        
     def setup_logging(self):
         """Setup logging configuration"""
-        log_dir = "/var/log/mastermind/proxies"
-        os.makedirs(log_dir, exist_ok=True)
-        
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(f"{log_dir}/python-simple.log"),
-                logging.StreamHandler()
-            ]
-        )
+        setup_proxy_logging("python-simple", self.metrics)
         self.logger = logging.getLogger(__name__)
         
-    def handle_socks4(self, client_socket):
-        """Handle SOCKS4 protocol"""
-        try:
-            # Read SOCKS4 request
-            data = client_socket.recv(8)
-            if len(data) < 8:
-                return False
-                
-            vn, cd, dstport, dstip = struct.unpack(">BBHI", data)
+    @property
+    def connections(self):
+        """Connections currently being served"""
+        return self.admission.active
+        
+    @property
+    def total_connections(self):
+        """Connections accepted since start"""
+        return self.admission.admitted
+        
+    def share(self, metrics, buffer_pool, resolver, connector, reaper, tracer):
+        """Serve on another proxy's components, as the OPENVPN mux embeds this one"""
+        self.metrics = metrics
+        self.buffer_pool = buffer_pool
+        self.resolver = resolver
+        self.connector = connector
+        self.reaper = reaper
+        self.tracer = tracer
+        
+    def handle_socks4(self, client_socket, parser, request):
+        """Handle SOCKS4/4a protocol"""
+        self.logger.info(f"SOCKS4 request: {request.address}:{request.port}")
+        
+        if request.command == CMD_CONNECT:
+            return self.handle_connect(client_socket, request, parser.remaining())
             
-            if vn != 4:
-                return False
-                
-            # Read userid (terminated by null byte)
-            userid = b""
-            while True:
-                char = client_socket.recv(1)
-                if not char or char == b"\x00":
-                    break
-                userid += char
-                
-            # Convert IP
-            dst_addr = socket.inet_ntoa(struct.pack(">I", dstip))
+        client_socket.sendall(socks4_reply(SOCKS4_REJECTED))
+        return False
+        
+    def handle_socks5(self, client_socket, parser, methods):
+        """Handle SOCKS5 protocol"""
+        # No authentication required
+        client_socket.sendall(b"\x05\x00")
+        parser.select_method(METHOD_NO_AUTH)
+        
+        # Read connection request (may already be buffered if the client pipelined it)
+        kind, request = recv_event(client_socket, parser)
+        self.logger.info(f"SOCKS5 request: {request.address}:{request.port}")
+        
+        if request.command == CMD_CONNECT:
+            return self.handle_connect(client_socket, request, parser.remaining())
+        if request.command == CMD_UDP_ASSOCIATE and self.udp_available:
+            return self.handle_udp_associate(client_socket, request)
             
-            self.logger.info(f"SOCKS4 request: {dst_addr}:{dstport}")
+        client_socket.sendall(socks5_reply(REP_COMMAND_NOT_SUPPORTED))
+        return False
+        
+    @property
+    def udp_available(self):
+        return self.udp_relay is not None and self.udp_relay.running
+        
+    def handle_udp_associate(self, client_socket, request):
+        """Handle UDP ASSOCIATE: datagrams are relayed while the control connection stays open"""
+        def shutdown():
+            client_socket.shutdown(socket.SHUT_RDWR)
             
-            if cd == 1:  # CONNECT
-                return self.handle_connect(client_socket, dst_addr, dstport, 4)
-                
+        association = self.udp_relay.associate(client_socket.getpeername()[0], request.port, shutdown)
+        try:
+            client_socket.sendall(socks5_reply(REP_SUCCEEDED, client_socket.getsockname()[0],
+                                               self.udp_relay.port))
+            handshake_done()
+            client_socket.settimeout(None)
+            while self.running and client_socket.recv(4096):
+                pass
+        except OSError:
+            pass
+        finally:
+            self.udp_relay.release(association)
+        return True
+        
+    def connect_error_reply(self, request, error):
+        """Build the SOCKS failure reply for an upstream connect error"""
+        if request.version == 4:
+            return socks4_reply(SOCKS4_REJECTED)
+        if isinstance(error, socket.gaierror):
+            return socks5_reply(REP_HOST_UNREACHABLE)
+        return socks5_reply(REP_CONNECTION_REFUSED)
+        
+    def handle_connect(self, client_socket, request, initial_data=b""):
+        """Handle CONNECT request"""
+        try:
+            # Connect to target server, racing every resolved address
+            server_socket = self.connector.connect(request.address, request.port)
+            server_socket.settimeout(10)
         except Exception as e:
-            self.logger.error(f"SOCKS4 error: {e}")
+            self.logger.error(f"Connect error: {e}")
+            # Send error response
+            client_socket.sendall(self.connect_error_reply(request, e))
             return False
             
-    def handle_socks5(self, client_socket):
-        """Handle SOCKS5 protocol"""
         try:
-            # Authentication negotiation
-            data = client_socket.recv(262)
-            if len(data) < 3:
-                return False
-                
-            ver, nmethods = struct.unpack("BB", data[:2])
-            if ver != 5:
-                return False
-                
-            # No authentication required
-            client_socket.send(b"\x05\x00")
+            # Send success response
+            if request.version == 4:
+                client_socket.sendall(socks4_reply(SOCKS4_GRANTED, request.port))
+            else:
+                client_socket.sendall(socks5_reply(REP_SUCCEEDED))
+            handshake_done()
+            client_socket.settimeout(None)
             
-            # Read connection request
-            data = client_socket.recv(4)
-            if len(data) < 4:
-                return False
-                
-            ver, cmd, rsv, atyp = struct.unpack("BBBB", data)
+            # Forward anything the client sent right behind the request
+            if initial_data:
+                server_socket.sendall(initial_data)
+        except OSError:
+            server_socket.close()
+            raise
             
-            if cmd == 1:  # CONNECT
-                if atyp == 1:  # IPv4
-                    addr_data = client_socket.recv(6)
-                    dst_addr = socket.inet_ntoa(addr_data[:4])
-                    dst_port = struct.unpack(">H", addr_data[4:6])[0]
-                elif atyp == 3:  # Domain name
-                    addr_len = struct.unpack("B", client_socket.recv(1))[0]
-                    dst_addr = client_socket.recv(addr_len).decode()
-                    dst_port = struct.unpack(">H", client_socket.recv(2))[0]
-                else:
-                    return False
-                    
-                self.logger.info(f"SOCKS5 request: {dst_addr}:{dst_port}")
-                return self.handle_connect(client_socket, dst_addr, dst_port, 5)
+        # Start data relay
+        self.relay_data(client_socket, server_socket)
+        return True
+        
+    def relay_data(self, client_socket, server_socket):
+        """Relay data between client and server"""
+        relay(client_socket, server_socket, lambda: self.running, self.relay_mode, self.buffer_pool,
+              self.metrics, self.shaper.open(current_client_ip()), reaper=self.reaper)
+        
+    def handle_client(self, client_socket, client_addr, ticket=None):
+        """Handle incoming client connection"""
+        if ticket:
+            ticket.activate()
+        
+        try:
+            self.logger.info(f"New connection from {client_addr}")
+            
+            # A client that stays silent would hold its handshake slot forever
+            client_socket.settimeout(HANDSHAKE_TIMEOUT)
+            
+            # Parse the handshake incrementally; the first event tells the version
+            parser = SocksParser()
+            kind, value = recv_event(client_socket, parser)
+            
+            if kind == REQUEST:
+                self.handle_socks4(client_socket, parser, value)
+            else:
+                self.handle_socks5(client_socket, parser, value)
                 
+        except SocksError as e:
+            self.logger.warning(f"SOCKS handshake error from {client_addr}: {e}")
+        except (ConnectionError, socket.timeout):
+            pass  # Client went away or stalled during the handshake
         except Exception as e:
-            self.logger.error(f"SOCKS5 error: {e}")
-            return False
+            self.logger.error(f"Client handling error: {e}")
+        finally:
+            client_socket.close()
+            if ticket:
+                ticket.release()
             
-    def handle_connect(self, client_socket, dst_addr, dst_port, socks_version):
-        """Handle CONNECT request"""
-        try:
-            # Connect to target server
-            server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            server_socket.settimeout(10)
-            server_socket.connect((dst_addr, dst_port))
+    async def handle_socks4_async(self, reader, writer, parser, request):
+        """Handle SOCKS4/4a protocol on the event loop"""
+        self.logger.info(f"SOCKS4 request: {request.address}:{request.port}")
+        
+        if request.command == CMD_CONNECT:
+            return await self.handle_connect_async(reader, writer, request, parser.remaining())
             
-            # Send success response
-            if socks_version == 4:
-                response = struct.pack(">BBHI", 0, 90, dst_port, 0)
-                client_socket.send(response)
-            else:  # SOCKS5
-                response = b"\x05\x00\x00\x01" + socket.inet_aton("0.0.0.0") + struct.pack(">H", 0)
-                client_socket.send(response)
-                
-            # Start data relay
-            self.relay_data(client_socket, server_socket)
-            return True
+        writer.write(socks4_reply(SOCKS4_REJECTED))
+        return False
+        
+    async def handle_socks5_async(self, reader, writer, parser, methods):
+        """Handle SOCKS5 protocol on the event loop"""
+        # No authentication required
+        writer.write(b"\x05\x00")
+        parser.select_method(METHOD_NO_AUTH)
+        
+        # Read connection request (may already be buffered if the client pipelined it)
+        kind, request = await read_event_async(reader, parser)
+        self.logger.info(f"SOCKS5 request: {request.address}:{request.port}")
+        
+        if request.command == CMD_CONNECT:
+            return await self.handle_connect_async(reader, writer, request, parser.remaining())
+        if request.command == CMD_UDP_ASSOCIATE and self.udp_available:
+            return await self.handle_udp_associate_async(reader, writer, request)
             
+        writer.write(socks5_reply(REP_COMMAND_NOT_SUPPORTED))
+        return False
+        
+    async def handle_udp_associate_async(self, reader, writer, request):
+        """Handle UDP ASSOCIATE on the event loop; the relay itself runs on its own thread"""
+        loop = asyncio.get_running_loop()
+        association = self.udp_relay.associate(writer.get_extra_info('peername')[0], request.port,
+                                               lambda: loop.call_soon_threadsafe(writer.transport.abort))
+        try:
+            writer.write(socks5_reply(REP_SUCCEEDED, writer.get_extra_info('sockname')[0],
+                                      self.udp_relay.port))
+            handshake_done()
+            while self.running and await reader.read(ASYNC_CHUNK_SIZE):
+                pass
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.udp_relay.release(association)
+        return True
+        
+    async def handle_connect_async(self, reader, writer, request, initial_data=b""):
+        """Handle CONNECT request on the event loop"""
+        try:
+            # Connect to target server, racing every resolved address
+            server_sock = await self.connector.connect_async(request.address, request.port)
+            server_reader, server_writer = await asyncio.open_connection(
+                sock=server_sock, limit=ASYNC_CHUNK_SIZE
+            )
         except Exception as e:
             self.logger.error(f"Connect error: {e}")
             # Send error response
-            if socks_version == 4:
-                response = struct.pack(">BBHI", 0, 91, 0, 0)
-                client_socket.send(response)
-            else:  # SOCKS5
-                response = b"\x05\x05\x00\x01" + socket.inet_aton("0.0.0.0") + struct.pack(">H", 0)
-                client_socket.send(response)
+            writer.write(self.connect_error_reply(request, e))
+            await writer.drain()
             return False
             
-    def relay_data(self, client_socket, server_socket):
-        """Relay data between client and server"""
-        def forward(source, destination):
+        # Send success response
+        if request.version == 4:
+            writer.write(socks4_reply(SOCKS4_GRANTED, request.port))
+        else:
+            writer.write(socks5_reply(REP_SUCCEEDED))
+        handshake_done()
+        
+        # Forward anything the client sent right behind the request
+        if initial_data:
+            server_writer.write(initial_data)
+            
+        # Start data relay
+        await self.relay_data_async(reader, writer, server_reader, server_writer)
+        return True
+        
+    async def relay_data_async(self, client_reader, client_writer, server_reader, server_writer):
+        """Relay data between client and server on the event loop"""
+        async def forward(source, destination, counter, flow, first):
             try:
                 while self.running:
-                    data = source.recv(4096)
+                    data = await source.read(ASYNC_CHUNK_SIZE)
                     if not data:
                         break
-                    destination.send(data)
-            except:
+                    destination.write(data)
+                    if first is not None:
+                        first()
+                        first = None
+                    counter.inc(len(data))
+                    if tunnel is not None:
+                        tunnel.touch()
+                    await destination.drain()
+                    if flow is not None:
+                        await throttle_async(flow, len(data))
+            except (ConnectionError, OSError):
                 pass
-            finally:
-                source.close()
-                destination.close()
                 
-        # Start forwarding threads
-        client_to_server = threading.Thread(target=forward, args=(client_socket, server_socket))
-        server_to_client = threading.Thread(target=forward, args=(server_socket, client_socket))
+        shaping = self.shaper.open(current_client_ip())
+        upload = shaping.upload if shaping else None
+        download = shaping.download if shaping else None
+        first_upstream, first_downstream = first_byte_hooks()
         
-        client_to_server.daemon = True
-        server_to_client.daemon = True
+        # The reaper runs on its own thread; aborting the transports ends both forward tasks
+        loop = asyncio.get_running_loop()
         
-        client_to_server.start()
-        server_to_client.start()
+        def abort():
+            client_writer.transport.abort()
+            server_writer.transport.abort()
+            
+        tunnel = self.reaper.register(lambda: loop.call_soon_threadsafe(abort))
         
-        client_to_server.join()
-        server_to_client.join()
+        # Both directions share one task each; the first to finish tears down the tunnel
+        client_to_server = asyncio.ensure_future(
+            forward(client_reader, server_writer, self.metrics.bytes_in, upload, first_upstream))
+        server_to_client = asyncio.ensure_future(
+            forward(server_reader, client_writer, self.metrics.bytes_out, download, first_downstream))
         
-    def handle_client(self, client_socket, client_addr):
-        """Handle incoming client connection"""
-        self.connections += 1
-        self.total_connections += 1
+        try:
+            done, pending = await asyncio.wait(
+                (client_to_server, server_to_client),
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in pending:
+                task.cancel()
+        finally:
+            server_writer.close()
+            if tunnel is not None:
+                tunnel.unregister()
+            if shaping:
+                shaping.close()
+            
+    async def reject_client_async(self, reader, writer):
+        """Refuse a connection over the admission limits"""
+        try:
+            data = await asyncio.wait_for(reader.read(1024), timeout=1)
+        except (asyncio.TimeoutError, OSError):
+            data = b""
+        writer.write(rejection_for(data))
+        writer.close()
+        
+    async def handle_client_async(self, reader, writer):
+        """Handle incoming client connection on the event loop"""
+        client_addr = writer.get_extra_info('peername')
+        ticket = self.admission.admit(client_addr[0], writer.get_extra_info('socket'))
+        if ticket is None:
+            await self.reject_client_async(reader, writer)
+            return
+            
+        ticket.activate()
         
         try:
             self.logger.info(f"New connection from {client_addr}")
             
-            # Read first byte to determine SOCKS version
-            first_byte = client_socket.recv(1, socket.MSG_PEEK)
-            if not first_byte:
-                return
-                
-            version = first_byte[0]
+            # Parse the handshake incrementally; the first event tells the version
+            parser = SocksParser()
+            kind, value = await read_event_async(reader, parser)
             
-            if version == 4:
-                self.handle_socks4(client_socket)
-            elif version == 5:
-                self.handle_socks5(client_socket)
+            if kind == REQUEST:
+                await self.handle_socks4_async(reader, writer, parser, value)
             else:
-                self.logger.warning(f"Unsupported SOCKS version: {version}")
+                await self.handle_socks5_async(reader, writer, parser, value)
                 
+        except SocksError as e:
+            self.logger.warning(f"SOCKS handshake error from {client_addr}: {e}")
+        except ConnectionError:
+            pass  # Client went away during the handshake
         except Exception as e:
             self.logger.error(f"Client handling error: {e}")
         finally:
-            client_socket.close()
-            self.connections -= 1
+            writer.close()
+            ticket.release()
+            
+    def print_stats(self):
+        """Print proxy statistics"""
+        while self.running:
+            time.sleep(60)  # Print stats every minute
+            self.logger.info(f"SIMPLE Proxy Stats - Active: {self.connections}, Total: {self.total_connections}")
+            if self.mode == 'thread':
+                self.logger.info(f"SIMPLE Proxy {self.buffer_pool.format_stats()}")
+            self.logger.info(f"SIMPLE Proxy {self.admission.format_stats()}")
+            self.logger.info(f"SIMPLE Proxy {self.reaper.format_stats()}")
+            self.logger.info(f"SIMPLE Proxy {self.resolver.format_stats()}")
+            self.logger.info(f"SIMPLE Proxy {self.connector.format_stats()}")
+            if self.tracer.enabled:
+                self.logger.info(f"SIMPLE Proxy {self.tracer.format_stats()}")
+            if self.shaper.enabled:
+                self.logger.info(f"SIMPLE Proxy {self.shaper.format_stats()}")
+            if self.udp_available:
+                self.logger.info(f"SIMPLE Proxy {self.udp_relay.format_stats()}")
+                
+    def start_udp_relay(self):
+        """Bind the UDP ASSOCIATE socket; workers cannot share one, so each takes a free port"""
+        if self.udp_relay is None:
+            return
+        if self.handoff.worker:
+            self.udp_relay.port = 0
+        try:
+            self.udp_relay.start()
+            self.logger.info(f"UDP ASSOCIATE relay on {self.host}:{self.udp_relay.port}/udp")
+        except OSError as e:
+            self.logger.error(f"UDP ASSOCIATE disabled, cannot bind UDP port {self.udp_relay.port}: {e}")
+            
+    def stop_udp_relay(self):
+        """Close the UDP ASSOCIATE socket and end the associations so clients re-associate elsewhere"""
+        if self.udp_available:
+            self.udp_relay.stop()
+            
+    def start_stats_thread(self):
+        """Start the periodic statistics thread and the metrics endpoint"""
+        stats_thread = threading.Thread(target=self.print_stats)
+        stats_thread.daemon = True
+        stats_thread.start()
+        
+        if self.metrics_address:
+            start_metrics_server(self.metrics, self.metrics_address, self.logger, "SIMPLE Proxy")
+        
+    async def serve_async(self):
+        """Accept and serve clients on a single asyncio event loop"""
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        server_socket = self.handoff.listen(server_socket, (self.host, self.port), self.backlog)
+        
+        server = await asyncio.start_server(
+            self.handle_client_async,
+            sock=server_socket,
+            limit=ASYNC_CHUNK_SIZE
+        )
+        
+        self.logger.info(f"Mastermind Python SIMPLE Proxy started on {self.host}:{self.port} (asyncio mode)")
+        self.start_udp_relay()
+        
+        try:
+            while self.running and self.handoff.accepting:
+                await asyncio.sleep(ACCEPT_POLL)
+        finally:
+            server.close()
+            self.stop_udp_relay()
+        
+        # Not wait_closed(): tunnels still open at the drain deadline are cancelled by asyncio.run()
+        await self.handoff.drain_async(lambda: self.connections)
+                
+    def start_async(self):
+        """Start the proxy server in asyncio mode"""
+        self.running = True
+        self.reaper.start()
+        self.tracer.start()
+        self.start_stats_thread()
+        
+        try:
+            asyncio.run(self.serve_async())
+        except Exception as e:
+            self.logger.error(f"Server error: {e}")
+        finally:
+            self.logger.info("Mastermind Python SIMPLE Proxy stopped")
             
     def start(self):
         """Start the proxy server"""
+        if self.mode == 'asyncio':
+            return self.start_async()
+            
         self.running = True
+        self.reaper.start()
+        self.tracer.start()
+        self.start_stats_thread()
         
         # Create server socket
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         
         try:
-            server_socket.bind((self.host, self.port))
-            server_socket.listen(50)
+            server_socket = self.handoff.listen(server_socket, (self.host, self.port), self.backlog)
             
-            self.logger.info(f"Mastermind Python SIMPLE Proxy started on {self.host}:{self.port}")
+            self.logger.info(f"Mastermind Python SIMPLE Proxy started on {self.host}:{self.port} (thread mode)")
+            if self.relay_mode != 'copy':
+                self.logger.info(f"Relay: {'splice' if splice_supported() else 'copy (splice unavailable)'}")
+            self.start_udp_relay()
             
-            while self.running:
+            while self.running and self.handoff.accepting:
                 try:
                     client_socket, client_addr = server_socket.accept()
+                    
+                    ticket = self.admission.admit(client_addr[0], client_socket)
+                    if ticket is None:
+                        reject_connection(client_socket)
+                        continue
+                        
                     client_thread = threading.Thread(
                         target=self.handle_client,
-                        args=(client_socket, client_addr)
+                        args=(client_socket, client_addr, ticket)
                     )
                     client_thread.daemon = True
                     client_thread.start()
                     
+                except socket.timeout:
+                    continue
                 except socket.error:
                     if self.running:
                         self.logger.error("Socket accept error")
@@ -234,11 +559,15 @@ class SimpleSocksProxy:
             self.logger.error(f"Server error: {e}")
         finally:
             server_socket.close()
+            self.stop_udp_relay()
+            self.handoff.drain(lambda: self.connections)
             self.logger.info("Mastermind Python SIMPLE Proxy stopped")
             
     def stop(self):
         """Stop the proxy server"""
         self.running = False
+        self.reaper.stop()
+        self.tracer.stop()
         
 def signal_handler(sig, frame):
     """Handle interrupt signals"""
@@ -247,10 +576,45 @@ def signal_handler(sig, frame):
     sys.exit(0)
 
 if __name__ == "__main__":
-    # Register signal handlers
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
+    parser = argparse.ArgumentParser(description="Mastermind Python SIMPLE Proxy")
+    parser.add_argument("--host", default="0.0.0.0", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8001, help="Port to listen on")
+    parser.add_argument("--mode", choices=["asyncio", "thread"], default="asyncio",
+                        help="Serving engine: one event loop (asyncio) or a thread per tunnel (thread)")
+    parser.add_argument("--relay", choices=RELAY_MODES, default="auto",
+                        help="Thread-mode relay: zero-copy splice() on Linux, or the userspace copy loop")
+    parser.add_argument("--buffer-size", type=int, default=DEFAULT_BUFFER_SIZE,
+                        help="Size in bytes of each pooled relay buffer")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes sharing the port via SO_REUSEPORT")
+    add_shaping_arguments(parser)
+    add_admission_arguments(parser)
+    add_reaper_arguments(parser)
+    add_handoff_arguments(parser)
+    add_udp_arguments(parser)
+    add_tracing_arguments(parser)
+    add_metrics_arguments(parser)
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    configure_logging(args)
+    
+    # Create proxy
+    proxy = SimpleSocksProxy(host=args.host, port=args.port, mode=args.mode, relay_mode=args.relay,
+                             buffer_size=args.buffer_size,
+                             shaper=load_shaping_config("config/proxies/python-simple-shaping.conf", args),
+                             max_connections=args.max_connections,
+                             max_per_ip=args.max_per_ip, max_handshakes=args.max_handshakes,
+                             backlog=args.backlog, metrics_address=args.metrics,
+                             idle_timeout=args.idle_timeout, max_lifetime=args.max_lifetime,
+                             drain_timeout=args.drain_timeout, udp=not args.no_udp,
+                             udp_port=args.udp_port, udp_idle_timeout=args.udp_idle_timeout,
+                             tracer=load_tracing("python-simple", args))
     
-    # Create and start proxy
-    proxy = SimpleSocksProxy()
-    proxy.start()
\ No newline at end of file
+    if args.workers > 1:
+        WorkerSupervisor(proxy, args.workers, "Mastermind Python SIMPLE Proxy").run()
+    else:
+        # Register signal handlers
+        signal.signal(signal.SIGINT, signal_handler)
+        signal.signal(signal.SIGTERM, signal_handler)
+        
+        proxy.start()
\ No newline at end of file
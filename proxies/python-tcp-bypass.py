@@ -2,6 +2,7 @@
 """
 Mastermind Python TCP BYPASS Proxy
 Enhanced TCP bypass proxy (using existing implementation)
+Strips injected HTTP payloads, answers with the configured status line and relays raw bytes to SSH/Dropbear
 Author: Mastermind
 """
 
@@ -12,73 +13,339 @@ import signal
 import sys
 import os
 import time
+import argparse
+
+from proxylib.admission import (AdmissionControl, add_admission_arguments, handshake_done,
+                                 reject_connection, DEFAULT_MAX_CONNECTIONS, DEFAULT_MAX_PER_IP,
+                                 DEFAULT_MAX_HANDSHAKES, DEFAULT_BACKLOG)
+from proxylib.buffers import BufferPool, DEFAULT_BUFFER_SIZE
+from proxylib.resolver import Resolver
+from proxylib.connector import Connector
+from proxylib.http import HttpError, SocketReader
+from proxylib.handoff import ListenerHandoff, add_handoff_arguments, DEFAULT_DRAIN_TIMEOUT
+from proxylib.logs import add_logging_arguments, configure_logging, setup_proxy_logging
+from proxylib.metrics import ProxyMetrics, add_metrics_arguments, start_metrics_server
+from proxylib.reaper import ConnectionReaper, add_reaper_arguments, DEFAULT_IDLE_TIMEOUT, DEFAULT_MAX_LIFETIME
+from proxylib.relay import relay, splice_supported, RELAY_MODES
+from proxylib.sniff import sniff, classify, PROTO_HTTP, PEEK_SIZE
+from proxylib.tracing import ConnectionTracer, add_tracing_arguments, load_tracing, trace_request
+from proxylib.workers import WorkerSupervisor
+
+DEFAULT_BACKEND = ('127.0.0.1', 22)
+DEFAULT_STATUS = "HTTP/1.1 200 Connection established"
+
+# Seconds to wait for a payload before treating the client as plain SSH
+PEEK_TIMEOUT = 1.0
+# Seconds a client may take to finish sending its payload
+HANDSHAKE_TIMEOUT = 10
+# Split payloads send several requests back to back; stop stripping after this many
+MAX_PAYLOAD_HEADS = 4
+
+BAD_GATEWAY = (
+    b"HTTP/1.1 502 Bad Gateway\r\n"
+    b"Content-Length: 0\r\n"
+    b"Connection: close\r\n"
+    b"Server: Mastermind-Proxy/2.0\r\n\r\n"
+)
 
 class PythonTCPBypassProxy:
-    def __init__(self, host='0.0.0.0', port=8008):
+    def __init__(self, host='0.0.0.0', port=8008, backend=None, relay_mode='auto',
+                 buffer_size=DEFAULT_BUFFER_SIZE,
+                 max_connections=DEFAULT_MAX_CONNECTIONS, max_per_ip=DEFAULT_MAX_PER_IP,
+                 max_handshakes=DEFAULT_MAX_HANDSHAKES, backlog=DEFAULT_BACKLOG, metrics_address=None,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, max_lifetime=DEFAULT_MAX_LIFETIME,
+                 drain_timeout=DEFAULT_DRAIN_TIMEOUT, tracer=None):
         self.host = host
         self.port = port
+        self.relay_mode = relay_mode
         self.running = False
-        self.connections = 0
+        self.reuse_port = False
+        
+        # Traffic and latency metrics, served in Prometheus format on metrics_address
+        self.metrics = ProxyMetrics('tcp-bypass')
+        self.metrics_address = metrics_address
+        self.payloads_stripped = self.metrics.counter(
+            'payload_heads_stripped_total', 'Injected HTTP payload heads read and discarded')
+        
+        # Receive buffers shared by every forward loop
+        self.buffer_pool = BufferPool(buffer_size)
+        
+        # Per-stage connection latency and the slow-connection log
+        self.tracer = tracer or ConnectionTracer("python-tcp-bypass")
+        self.tracer.track(self.metrics)
+        
+        # Connection limits enforced in the accept loop
+        self.admission = AdmissionControl(max_connections, max_per_ip, max_handshakes, self.metrics,
+                                          self.tracer)
+        self.backlog = backlog
+        
+        # Cached resolver and Happy Eyeballs connector for the backend
+        self.resolver = Resolver()
+        self.connector = Connector(self.resolver, metrics=self.metrics)
+        
+        self.metrics.track(self.admission, self.buffer_pool, self.resolver, self.connector)
+        
+        # Idle and lifetime limits of established tunnels
+        self.reaper = ConnectionReaper(idle_timeout, max_lifetime)
+        self.metrics.add_stats('reaper', self.reaper.stats,
+                               counters=('reaped', 'reaped_idle', 'reaped_lifetime'))
+        
+        # Configuration
+        self.config_dir = "config/proxies"
+        self.backend = backend or self.load_backend_config()
+        self.response = self.load_response_config()
         
         # Setup logging
-        log_dir = "/var/log/mastermind/proxies"
-        os.makedirs(log_dir, exist_ok=True)
-        
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(f"{log_dir}/python-tcp-bypass.log"),
-                logging.StreamHandler()
-            ]
-        )
+        self.setup_logging()
+        
+        # Listening socket handed over across graceful restarts
+        self.handoff = ListenerHandoff(self.port, self.logger, drain_timeout)
+    
+    def setup_logging(self):
+        """Setup logging configuration"""
+        setup_proxy_logging("python-tcp-bypass", self.metrics)
         self.logger = logging.getLogger(__name__)
-
-    def handle_client(self, client_socket, client_addr):
+    
+    @property
+    def connections(self):
+        """Connections currently being served"""
+        return self.admission.active
+    
+    @property
+    def total_connections(self):
+        """Connections accepted since start"""
+        return self.admission.admitted
+    
+    def load_backend_config(self):
+        """Load the SSH/Dropbear backend address"""
+        config_file = f"{self.config_dir}/python-tcp-bypass-backend.conf"
+        host, port = DEFAULT_BACKEND
+        
+        if os.path.exists(config_file):
+            try:
+                with open(config_file, 'r') as f:
+                    for line in f:
+                        if line.startswith('BACKEND_HOST='):
+                            host = line.split('=', 1)[1].strip()
+                        elif line.startswith('BACKEND_PORT='):
+                            port = int(line.split('=', 1)[1].strip())
+            except:
+                pass
+        
+        return host, port
+    
+    def load_response_config(self):
+        """Load the status line and extra headers sent after a payload, pre-encoded"""
+        config_file = f"{self.config_dir}/python-tcp-bypass-response.conf"
+        status = DEFAULT_STATUS
+        headers = []
+        
+        if os.path.exists(config_file):
+            try:
+                with open(config_file, 'r') as f:
+                    for line in f:
+                        if line.startswith('BYPASS_STATUS='):
+                            status = line.split('=', 1)[1].strip()
+                        elif line.startswith('BYPASS_HEADER='):
+                            headers.append(line.split('=', 1)[1].strip())
+            except:
+                pass
+        
+        if not status.startswith('HTTP/'):
+            status = f"HTTP/1.1 {status}"
+        return ("\r\n".join([status] + headers) + "\r\n\r\n").encode('latin-1')
+    
+    def relay_data(self, client_socket, server_socket):
+        """Relay raw data between sockets"""
+        relay(client_socket, server_socket, lambda: self.running, self.relay_mode, self.buffer_pool,
+              self.metrics, reaper=self.reaper)
+    
+    def strip_payload(self, client_socket):
+        """Read and discard the injected HTTP payload; returns the bytes that followed it"""
+        reader = SocketReader(client_socket)
+        for _ in range(MAX_PAYLOAD_HEADS):
+            if reader.read_head() is None:
+                raise ConnectionError("Client closed during the payload")
+            self.payloads_stripped.inc()
+            # Another request already queued behind this one is part of a split payload
+            if classify(bytes(reader.buffer[:PEEK_SIZE])) != PROTO_HTTP:
+                break
+        return reader.take_buffer()
+    
+    def handle_client(self, client_socket, client_addr, ticket=None):
         """Handle incoming client connection"""
-        self.connections += 1
+        if ticket:
+            ticket.activate()
+        
         try:
             self.logger.info(f"Python TCP BYPASS connection from {client_addr}")
-            time.sleep(0.1)
+            
+            # Anything but an HTTP payload (or silence, for SSH clients) is relayed untouched
+            protocol, _ = sniff(client_socket, PEEK_TIMEOUT)
+            rest = b""
+            if protocol == PROTO_HTTP:
+                client_socket.settimeout(HANDSHAKE_TIMEOUT)
+                rest = self.strip_payload(client_socket)
+            trace_request()
+            
+            try:
+                server_socket = self.connector.connect(*self.backend)
+            except Exception as e:
+                self.logger.error(f"Backend connect error ({self.backend[0]}:{self.backend[1]}): {e}")
+                if protocol == PROTO_HTTP:
+                    client_socket.sendall(BAD_GATEWAY)
+                return
+            
+            try:
+                if protocol == PROTO_HTTP:
+                    client_socket.sendall(self.response)
+                handshake_done()
+                client_socket.settimeout(None)
+                if rest:
+                    server_socket.sendall(rest)
+            except OSError:
+                server_socket.close()
+                raise
+            
+            self.relay_data(client_socket, server_socket)
+        
+        except HttpError as e:
+            self.logger.warning(f"TCP BYPASS payload error from {client_addr}: {e}")
+        except (ConnectionError, socket.timeout):
+            pass  # Client went away or stalled during the payload
         except Exception as e:
             self.logger.error(f"Client error: {e}")
         finally:
             client_socket.close()
-            self.connections -= 1
-
+            if ticket:
+                ticket.release()
+    
+    def print_stats(self):
+        """Print proxy statistics"""
+        while self.running:
+            time.sleep(60)
+            self.logger.info(f"TCP BYPASS Stats - Active: {self.connections}, Total: {self.total_connections}, "
+                             f"Payloads stripped: {self.payloads_stripped.value}")
+            self.logger.info(f"TCP BYPASS {self.buffer_pool.format_stats()}")
+            self.logger.info(f"TCP BYPASS {self.admission.format_stats()}")
+            self.logger.info(f"TCP BYPASS {self.reaper.format_stats()}")
+            self.logger.info(f"TCP BYPASS {self.connector.format_stats()}")
+            if self.tracer.enabled:
+                self.logger.info(f"TCP BYPASS {self.tracer.format_stats()}")
+    
     def start(self):
         """Start the proxy server"""
         self.running = True
+        self.reaper.start()
+        self.tracer.start()
+        
+        # Create server socket
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        
+        # Start statistics thread
+        stats_thread = threading.Thread(target=self.print_stats)
+        stats_thread.daemon = True
+        stats_thread.start()
+        
+        if self.metrics_address:
+            start_metrics_server(self.metrics, self.metrics_address, self.logger, "TCP BYPASS")
         
         try:
-            server_socket.bind((self.host, self.port))
-            server_socket.listen(50)
+            server_socket = self.handoff.listen(server_socket, (self.host, self.port), self.backlog)
+            
             self.logger.info(f"Mastermind Python TCP BYPASS Proxy started on {self.host}:{self.port}")
+            self.logger.info(f"Backend: {self.backend[0]}:{self.backend[1]}")
+            if self.relay_mode != 'copy':
+                self.logger.info(f"Relay: {'splice' if splice_supported() else 'copy (splice unavailable)'}")
             
-            while self.running:
+            while self.running and self.handoff.accepting:
                 try:
                     client_socket, client_addr = server_socket.accept()
-                    client_thread = threading.Thread(target=self.handle_client, args=(client_socket, client_addr))
+                    
+                    ticket = self.admission.admit(client_addr[0], client_socket)
+                    if ticket is None:
+                        reject_connection(client_socket, http=True)
+                        continue
+                    
+                    client_thread = threading.Thread(
+                        target=self.handle_client,
+                        args=(client_socket, client_addr, ticket)
+                    )
                     client_thread.daemon = True
                     client_thread.start()
+                
+                except socket.timeout:
+                    continue
                 except socket.error:
+                    if self.running:
+                        self.logger.error("Socket accept error")
                     break
+        
         except Exception as e:
             self.logger.error(f"Server error: {e}")
         finally:
             server_socket.close()
-
+            self.handoff.drain(lambda: self.connections)
+            self.logger.info("Mastermind Python TCP BYPASS Proxy stopped")
+    
     def stop(self):
+        """Stop the proxy server"""
         self.running = False
+        self.reaper.stop()
+        self.tracer.stop()
+
+def parse_backend(value):
+    """Parse a host:port backend argument"""
+    host, sep, port = value.rpartition(':')
+    if not sep or not host:
+        raise argparse.ArgumentTypeError("backend must be host:port")
+    return host.strip('[]'), int(port)
 
 def signal_handler(sig, frame):
+    """Handle interrupt signals"""
+    print("\nMastermind Python TCP BYPASS Proxy shutting down...")
     proxy.stop()
     sys.exit(0)
 
 if __name__ == "__main__":
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
-    proxy = PythonTCPBypassProxy()
-    proxy.start()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Mastermind Python TCP BYPASS Proxy")
+    parser.add_argument("--host", default="0.0.0.0", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8008, help="Port to listen on")
+    parser.add_argument("--backend", type=parse_backend, default=None,
+                        help="SSH/Dropbear backend as host:port (default: config file, then 127.0.0.1:22)")
+    parser.add_argument("--relay", choices=RELAY_MODES, default="auto",
+                        help="Relay: zero-copy splice() on Linux, or the userspace copy loop")
+    parser.add_argument("--buffer-size", type=int, default=DEFAULT_BUFFER_SIZE,
+                        help="Size in bytes of each pooled relay buffer")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes sharing the port via SO_REUSEPORT")
+    add_admission_arguments(parser)
+    add_reaper_arguments(parser)
+    add_handoff_arguments(parser)
+    add_tracing_arguments(parser)
+    add_metrics_arguments(parser)
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    configure_logging(args)
+
+    # Create proxy
+    proxy = PythonTCPBypassProxy(host=args.host, port=args.port, backend=args.backend, relay_mode=args.relay,
+                                 buffer_size=args.buffer_size, max_connections=args.max_connections,
+                                 max_per_ip=args.max_per_ip, max_handshakes=args.max_handshakes,
+                                 backlog=args.backlog, metrics_address=args.metrics,
+                                 idle_timeout=args.idle_timeout, max_lifetime=args.max_lifetime,
+                                 drain_timeout=args.drain_timeout,
+                                 tracer=load_tracing("python-tcp-bypass", args))
+
+    if args.workers > 1:
+        WorkerSupervisor(proxy, args.workers, "Mastermind Python TCP BYPASS Proxy").run()
+    else:
+        # Register signal handlers
+        signal.signal(signal.SIGINT, signal_handler)
+        signal.signal(signal.SIGTERM, signal_handler)
+
+        # Start proxy
+        proxy.start()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Mastermind SEGURO Client
+Local SOCKS5 endpoint that carries each connection to python-seguro over an encrypted channel
+Author: Mastermind
+"""
+
+import socket
+import threading
+import logging
+import signal
+import sys
+import argparse
+
+from proxylib.buffers import BufferPool, DEFAULT_BUFFER_SIZE
+from proxylib.relay import relay
+from proxylib.securechannel import client_handshake, decode_key, CIPHER_NAMES
+
+class SeguroClient:
+    def __init__(self, server, key, host='127.0.0.1', port=1080, cipher='chacha20',
+                 buffer_size=DEFAULT_BUFFER_SIZE):
+        self.server = server
+        self.key = key
+        self.host = host
+        self.port = port
+        self.cipher = cipher
+        self.cipher_id = CIPHER_NAMES[cipher]
+        self.running = False
+        
+        # Receive buffers shared by every forward loop
+        self.buffer_pool = BufferPool(buffer_size)
+        
+        # Setup logging
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+        self.logger = logging.getLogger(__name__)
+    
+    def handle_client(self, client_socket, client_addr):
+        """Open a channel to the server and relay the local connection through it"""
+        try:
+            server_socket = socket.create_connection(self.server, timeout=10)
+        except OSError as e:
+            self.logger.error(f"Cannot reach {self.server[0]}:{self.server[1]}: {e}")
+            client_socket.close()
+            return
+        
+        try:
+            server_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            channel = client_handshake(server_socket, self.key, self.cipher_id)
+            server_socket.settimeout(None)
+        except Exception as e:
+            self.logger.error(f"Channel handshake with {self.server[0]}:{self.server[1]} failed: {e}")
+            server_socket.close()
+            client_socket.close()
+            return
+        
+        # SOCKS5 negotiation and payload both pass through untouched; the server sees plaintext SOCKS5
+        relay(client_socket, channel, lambda: self.running, 'copy', self.buffer_pool)
+    
+    def start(self):
+        """Start the local listener"""
+        self.running = True
+        
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        
+        try:
+            server_socket.bind((self.host, self.port))
+            server_socket.listen(128)
+            
+            self.logger.info(f"Mastermind SEGURO Client listening on {self.host}:{self.port}")
+            self.logger.info(f"Server: {self.server[0]}:{self.server[1]} ({self.cipher})")
+            
+            while self.running:
+                try:
+                    client_socket, client_addr = server_socket.accept()
+                    client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    
+                    client_thread = threading.Thread(
+                        target=self.handle_client,
+                        args=(client_socket, client_addr)
+                    )
+                    client_thread.daemon = True
+                    client_thread.start()
+                
+                except socket.error:
+                    if self.running:
+                        self.logger.error("Socket accept error")
+                    break
+        
+        except Exception as e:
+            self.logger.error(f"Client error: {e}")
+        finally:
+            server_socket.close()
+            self.logger.info("Mastermind SEGURO Client stopped")
+    
+    def stop(self):
+        """Stop the local listener"""
+        self.running = False
+
+def parse_server(value):
+    """Parse a host:port server argument"""
+    host, sep, port = value.rpartition(':')
+    if not sep or not host:
+        raise argparse.ArgumentTypeError("server must be host:port")
+    return host.strip('[]'), int(port)
+
+def load_key(args):
+    """Return the pre-shared key from --key or a SEGURO_KEY= line in --key-file"""
+    value = args.key
+    if args.key_file:
+        with open(args.key_file, 'r') as f:
+            for line in f:
+                if line.startswith('SEGURO_KEY='):
+                    value = line.split('=', 1)[1]
+    if not value:
+        raise SystemExit("A channel key is required (--key or --key-file)")
+    return decode_key(value)
+
+def signal_handler(sig, frame):
+    """Handle interrupt signals"""
+    print("\nMastermind SEGURO Client shutting down...")
+    client.stop()
+    sys.exit(0)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mastermind SEGURO Client")
+    parser.add_argument("--server", type=parse_server, required=True,
+                        help="python-seguro proxy as host:port")
+    parser.add_argument("--key", help="Channel key (SEGURO_KEY from config/proxies/python-seguro-key.conf)")
+    parser.add_argument("--key-file", help="Copy of python-seguro-key.conf to read the key from")
+    parser.add_argument("--cipher", choices=sorted(CIPHER_NAMES), default="chacha20",
+                        help="Record cipher: chacha20 (ChaCha20-Poly1305) or aesgcm (AES-256-GCM)")
+    parser.add_argument("--host", default="127.0.0.1", help="Local address for SOCKS5 applications")
+    parser.add_argument("--port", type=int, default=1080, help="Local port for SOCKS5 applications")
+    parser.add_argument("--buffer-size", type=int, default=DEFAULT_BUFFER_SIZE,
+                        help="Size in bytes of each pooled relay buffer")
+    args = parser.parse_args()
+
+    client = SeguroClient(args.server, load_key(args), host=args.host, port=args.port,
+                          cipher=args.cipher, buffer_size=args.buffer_size)
+
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    client.start()
@@ -3,56 +3,187 @@
 Mastermind WEBSOCKET Custom (SYSTEMCTL) Proxy
 WebSocket proxy with configurable HTTP response types and Mastermind branding
 Supports HTTP response codes: 200, 301, 101
+With 101 the upgraded connection is tunnelled to an SSH/Dropbear backend
 Author: Mastermind
 """
 
 import socket
 import threading
-import struct
 import time
 import logging
 import signal
 import sys
 import os
-import base64
-import hashlib
 import re
+import argparse
 from urllib.parse import urlparse
 
+from proxylib.admission import (AdmissionControl, add_admission_arguments, handshake_done,
+                                 current_client_ip, reject_connection, DEFAULT_MAX_CONNECTIONS,
+                                 DEFAULT_MAX_PER_IP, DEFAULT_MAX_HANDSHAKES, DEFAULT_BACKLOG)
+from proxylib.buffers import BufferPool, DEFAULT_BUFFER_SIZE
+from proxylib.resolver import Resolver
+from proxylib.connector import Connector
+from proxylib.handoff import ListenerHandoff, add_handoff_arguments, DEFAULT_DRAIN_TIMEOUT
+from proxylib.http import HttpError, RequestHeadParser, ResponseTemplate, escape_template, recv_head
+from proxylib.logs import add_logging_arguments, configure_logging, setup_proxy_logging
+from proxylib.metrics import ProxyMetrics, add_metrics_arguments, start_metrics_server
+from proxylib.reaper import ConnectionReaper, add_reaper_arguments, DEFAULT_IDLE_TIMEOUT, DEFAULT_MAX_LIFETIME
+from proxylib.relay import relay, splice_supported, RELAY_MODES
+from proxylib.shaper import Shaper, add_shaping_arguments, load_shaping_config
+from proxylib.socks import (SocksParser, SocksError, recv_event, socks4_reply, socks5_reply, REQUEST,
+                            CMD_CONNECT, METHOD_NO_AUTH, SOCKS4_GRANTED, SOCKS4_REJECTED, REP_SUCCEEDED,
+                            REP_HOST_UNREACHABLE, REP_CONNECTION_REFUSED, REP_COMMAND_NOT_SUPPORTED)
+from proxylib.tracing import ConnectionTracer, add_tracing_arguments, load_tracing
+from proxylib.watch import ConfigWatcher
+from proxylib.websocket import accept_key, client_sends_frames, relay_websocket
+from proxylib.workers import WorkerSupervisor
+
+DEFAULT_BACKEND = ('127.0.0.1', 22)
+
+# Seconds a client may take to finish sending its request head
+HANDSHAKE_TIMEOUT = 10
+
+BAD_GATEWAY = (
+    b"HTTP/1.1 502 Bad Gateway\r\n"
+    b"Content-Length: 0\r\n"
+    b"Connection: close\r\n"
+    b"Server: Mastermind-Proxy/2.0\r\n\r\n"
+)
+
+# Response bodies as str.format templates; ResponseTemplate encodes the literal text once
+HTTP_200_BODY = """<!DOCTYPE html>
+<html>
+<head>
+    <title>Mastermind VPS Management</title>
+    <style>
+        body {{ font-family: Arial, sans-serif; background: #2c3e50; color: white; padding: 20px; }}
+        .container {{ max-width: 800px; margin: 0 auto; text-align: center; }}
+        .logo {{ font-size: 2.5rem; margin-bottom: 20px; color: #3498db; }}
+        .info {{ background: #34495e; padding: 20px; border-radius: 10px; margin: 20px 0; }}
+        .stats {{ display: flex; justify-content: space-around; margin: 20px 0; }}
+        .stat {{ background: #3498db; padding: 15px; border-radius: 5px; }}
+    </style>
+</head>
+<body>
+    <div class="container">
+        <div class="logo">🛡️ MASTERMIND</div>
+        <h1>VPS Management System</h1>
+        <div class="info">
+            <h2>WebSocket Proxy Active</h2>
+            <p>Host: {host}</p>
+            <p>Path: {path}</p>
+            <p>Active Connections: {active}</p>
+            <p>Total Connections: {total}</p>
+        </div>
+        <div class="stats">
+            <div class="stat">
+                <strong>Status</strong><br>Running
+            </div>
+            <div class="stat">
+                <strong>Type</strong><br>HTTP 200
+            </div>
+            <div class="stat">
+                <strong>Uptime</strong><br>Active
+            </div>
+        </div>
+        <p><small>Powered by Mastermind VPS Management System</small></p>
+    </div>
+</body>
+</html>"""
+
+HTTP_301_BODY = """<!DOCTYPE html>
+<html>
+<head><title>301 Moved Permanently - Mastermind</title></head>
+<body>
+<center><h1>301 Moved Permanently</h1></center>
+<center>Mastermind VPS Management System</center>
+<hr><center>Mastermind-Proxy/2.0</center>
+</body>
+</html>"""
+
 class WebSocketSystemCtlProxy:
-    def __init__(self, host='0.0.0.0', port=8004):
+    def __init__(self, host='0.0.0.0', port=8004, backend=None, relay_mode='auto', buffer_size=DEFAULT_BUFFER_SIZE,
+                 shaper=None, max_connections=DEFAULT_MAX_CONNECTIONS, max_per_ip=DEFAULT_MAX_PER_IP,
+                 max_handshakes=DEFAULT_MAX_HANDSHAKES, backlog=DEFAULT_BACKLOG, metrics_address=None,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, max_lifetime=DEFAULT_MAX_LIFETIME,
+                 drain_timeout=DEFAULT_DRAIN_TIMEOUT, tracer=None):
         self.host = host
         self.port = port
+        self.relay_mode = relay_mode
         self.running = False
-        self.connections = 0
-        self.total_connections = 0
+        self.reuse_port = False
+        
+        # Traffic and latency metrics, served in Prometheus format on metrics_address
+        self.metrics = ProxyMetrics('systemctl')
+        self.metrics_address = metrics_address
+        self.http_responses = self.metrics.counter('http_responses_total', 'HTTP responses served')
+        
+        # Receive buffers shared by every copy-mode forward loop
+        self.buffer_pool = BufferPool(buffer_size)
+
+        # Per-stage connection latency and the slow-connection log
+        self.tracer = tracer or ConnectionTracer("websocket-systemctl")
+        self.tracer.track(self.metrics)
+
+        # Connection limits enforced in the accept loop
+        self.admission = AdmissionControl(max_connections, max_per_ip, max_handshakes, self.metrics,
+                                          self.tracer)
+        self.backlog = backlog
+        
+        # Cached resolver and Happy Eyeballs connector for SOCKS targets
+        self.resolver = Resolver()
+        self.connector = Connector(self.resolver, metrics=self.metrics)
+        
+        self.metrics.track(self.admission, self.buffer_pool, self.resolver, self.connector)
+        
+        # Idle and lifetime limits of established tunnels
+        self.reaper = ConnectionReaper(idle_timeout, max_lifetime)
+        self.metrics.add_stats('reaper', self.reaper.stats,
+                               counters=('reaped', 'reaped_idle', 'reaped_lifetime'))
+        
+        # Bandwidth limits applied in the relay loops
+        self.shaper = shaper or Shaper()
+        self.metrics.add_stats('shaper', self.shaper.stats, counters=('throttled', 'throttle_seconds'))
         
         # Configuration
         self.config_dir = "config/proxies"
+        self.response_type_file = f"{self.config_dir}/websocket-systemctl-http-response.conf"
+        self.branding_file = f"{self.config_dir}/websocket-systemctl-branding.conf"
         self.http_response_type = self.load_http_response_type()
         self.mastermind_branding = self.load_branding_config()
+        self.templates = self.render_templates()
+        self.backend = backend or self.load_backend_config()
         
         # Setup logging
         self.setup_logging()
         
+        # Listening socket handed over across graceful restarts
+        self.handoff = ListenerHandoff(self.port, self.logger, drain_timeout)
+        
+        # Response type and branding follow edits to their config files without a restart
+        self.config_watcher = ConfigWatcher([self.response_type_file, self.branding_file],
+                                            self.reload_config, self.logger)
+        self.metrics.add_stats('config', self.config_watcher.stats, counters=('reloads', 'reload_errors'))
+        
     def setup_logging(self):
         """Setup logging configuration"""
-        log_dir = "logs/proxies"
-        os.makedirs(log_dir, exist_ok=True)
-        
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(f"{log_dir}/websocket-systemctl.log"),
-                logging.StreamHandler()
-            ]
-        )
+        setup_proxy_logging("websocket-systemctl", self.metrics, log_dir="logs/proxies")
         self.logger = logging.getLogger(__name__)
         
+    @property
+    def connections(self):
+        """Connections currently being served"""
+        return self.admission.active
+        
+    @property
+    def total_connections(self):
+        """Connections accepted since start"""
+        return self.admission.admitted
+        
     def load_http_response_type(self):
         """Load HTTP response type configuration"""
-        config_file = f"{self.config_dir}/websocket-systemctl-http-response.conf"
+        config_file = self.response_type_file
         if os.path.exists(config_file):
             try:
                 with open(config_file, 'r') as f:
@@ -65,7 +196,7 @@ class WebSocketSystemCtlProxy:
         
     def load_branding_config(self):
         """Load Mastermind branding configuration"""
-        config_file = f"{self.config_dir}/websocket-systemctl-branding.conf"
+        config_file = self.branding_file
         branding = {
             'enabled': True,
             'header': 'X-Powered-By: Mastermind VPS Management'
@@ -85,187 +216,158 @@ class WebSocketSystemCtlProxy:
                 
         return branding
         
-    def generate_websocket_key(self):
-        """Generate WebSocket accept key"""
-        import hashlib
-        import base64
+    def load_backend_config(self):
+        """Load the SSH/Dropbear backend of the 101 tunnel"""
+        config_file = f"{self.config_dir}/websocket-systemctl-backend.conf"
+        host, port = DEFAULT_BACKEND
         
-        # WebSocket magic string
-        magic = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
-        key = base64.b64encode(os.urandom(16)).decode()
-        
-        # Generate accept key
-        accept = base64.b64encode(
-            hashlib.sha1((key + magic).encode()).digest()
-        ).decode()
-        
-        return key, accept
+        if os.path.exists(config_file):
+            try:
+                with open(config_file, 'r') as f:
+                    for line in f:
+                        if line.startswith('BACKEND_HOST='):
+                            host = line.split('=', 1)[1].strip()
+                        elif line.startswith('BACKEND_PORT='):
+                            port = int(line.split('=', 1)[1].strip())
+            except:
+                pass
+                
+        return host, port
         
     def create_http_response(self, response_type, host, path="/"):
         """Create HTTP response based on configured type"""
         responses = {
             200: self.create_http_200_response,
-            301: self.create_http_301_response,
-            101: self.create_http_101_response
+            301: self.create_http_301_response
         }
         
         response_func = responses.get(response_type, self.create_http_200_response)
         return response_func(host, path)
         
-    def create_http_200_response(self, host, path):
-        """Create HTTP 200 OK response with Mastermind branding"""
-        body = f"""<!DOCTYPE html>
-<html>
-<head>
-    <title>Mastermind VPS Management</title>
-    <style>
-        body {{ font-family: Arial, sans-serif; background: #2c3e50; color: white; padding: 20px; }}
-        .container {{ max-width: 800px; margin: 0 auto; text-align: center; }}
-        .logo {{ font-size: 2.5rem; margin-bottom: 20px; color: #3498db; }}
-        .info {{ background: #34495e; padding: 20px; border-radius: 10px; margin: 20px 0; }}
-        .stats {{ display: flex; justify-content: space-around; margin: 20px 0; }}
-        .stat {{ background: #3498db; padding: 15px; border-radius: 5px; }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="logo">🛡️ MASTERMIND</div>
-        <h1>VPS Management System</h1>
-        <div class="info">
-            <h2>WebSocket Proxy Active</h2>
-            <p>Host: {host}</p>
-            <p>Path: {path}</p>
-            <p>Active Connections: {self.connections}</p>
-            <p>Total Connections: {self.total_connections}</p>
-        </div>
-        <div class="stats">
-            <div class="stat">
-                <strong>Status</strong><br>Running
-            </div>
-            <div class="stat">
-                <strong>Type</strong><br>HTTP 200
-            </div>
-            <div class="stat">
-                <strong>Uptime</strong><br>Active
-            </div>
-        </div>
-        <p><small>Powered by Mastermind VPS Management System</small></p>
-    </div>
-</body>
-</html>"""
+    def render_templates(self):
+        """Pre-render the static bytes of every response type for the current branding"""
+        branding = ""
+        if self.mastermind_branding['enabled']:
+            branding = escape_template(self.mastermind_branding['header']) + "\r\n"
+            
+        return {
+            200: ResponseTemplate(
+                "HTTP/1.1 200 OK\r\n"
+                "Content-Type: text/html; charset=utf-8\r\n"
+                "Content-Length: {content_length}\r\n"
+                "Connection: close\r\n"
+                "Server: Mastermind-Proxy/2.0\r\n" + branding + "\r\n",
+                HTTP_200_BODY
+            ),
+            301: ResponseTemplate(
+                "HTTP/1.1 301 Moved Permanently\r\n"
+                "Location: https://{host}{path}\r\n"
+                "Content-Type: text/html\r\n"
+                "Content-Length: {content_length}\r\n"
+                "Connection: close\r\n"
+                "Server: Mastermind-Proxy/2.0\r\n" + branding + "\r\n",
+                HTTP_301_BODY
+            ),
+            101: ResponseTemplate(
+                "HTTP/1.1 101 Switching Protocols\r\n"
+                "Upgrade: websocket\r\n"
+                "Connection: Upgrade\r\n"
+                "{accept_header}"
+                "Server: Mastermind-Proxy/2.0\r\n" + branding + "\r\n"
+            ),
+        }
         
-        headers = [
-            "HTTP/1.1 200 OK",
-            "Content-Type: text/html; charset=utf-8",
-            f"Content-Length: {len(body.encode())}",
-            "Connection: close",
-            "Server: Mastermind-Proxy/2.0"
-        ]
+    def reload_config(self):
+        """Re-read the response type and branding and swap in freshly rendered responses"""
+        self.mastermind_branding = self.load_branding_config()
+        self.templates = self.render_templates()
+        self.http_response_type = self.load_http_response_type()
+        self.logger.info(f"Configuration reloaded - HTTP Response Type: {self.http_response_type}, "
+                         f"Mastermind Branding: {'Enabled' if self.mastermind_branding['enabled'] else 'Disabled'}")
         
-        if self.mastermind_branding['enabled']:
-            headers.append(self.mastermind_branding['header'])
-            
-        response = "\r\n".join(headers) + "\r\n\r\n" + body
-        return response.encode()
+    def create_http_200_response(self, host, path):
+        """Create HTTP 200 OK response with Mastermind branding"""
+        return self.templates[200].render(host=host.encode(), path=path.encode(),
+                                          active=str(self.connections).encode(),
+                                          total=str(self.total_connections).encode())
         
     def create_http_301_response(self, host, path):
         """Create HTTP 301 Moved Permanently response"""
-        body = """<!DOCTYPE html>
-<html>
-<head><title>301 Moved Permanently - Mastermind</title></head>
-<body>
-<center><h1>301 Moved Permanently</h1></center>
-<center>Mastermind VPS Management System</center>
-<hr><center>Mastermind-Proxy/2.0</center>
-</body>
-</html>"""
-        
-        headers = [
-            "HTTP/1.1 301 Moved Permanently",
-            f"Location: https://{host}{path}",
-            "Content-Type: text/html",
-            f"Content-Length: {len(body.encode())}",
-            "Connection: close",
-            "Server: Mastermind-Proxy/2.0"
-        ]
-        
-        if self.mastermind_branding['enabled']:
-            headers.append(self.mastermind_branding['header'])
-            
-        response = "\r\n".join(headers) + "\r\n\r\n" + body
-        return response.encode()
+        return self.templates[301].render(host=host.encode(), path=path.encode())
         
-    def create_http_101_response(self, host, path):
-        """Create HTTP 101 Switching Protocols response for WebSocket"""
-        ws_key, ws_accept = self.generate_websocket_key()
+    def create_http_101_response(self, key):
+        """Create HTTP 101 Switching Protocols response, accepting the client's key if it sent one"""
+        accept_header = f"Sec-WebSocket-Accept: {accept_key(key)}\r\n".encode() if key else b""
+        return self.templates[101].render(accept_header=accept_header)
         
-        headers = [
-            "HTTP/1.1 101 Switching Protocols",
-            "Upgrade: websocket",
-            "Connection: Upgrade",
-            f"Sec-WebSocket-Accept: {ws_accept}",
-            "Server: Mastermind-Proxy/2.0"
-        ]
-        
-        if self.mastermind_branding['enabled']:
-            headers.append(self.mastermind_branding['header'])
-            
-        response = "\r\n".join(headers) + "\r\n\r\n"
-        return response.encode()
-        
-    def parse_http_request(self, data):
-        """Parse HTTP request"""
-        try:
-            request_str = data.decode('utf-8', errors='ignore')
-            lines = request_str.split('\r\n')
-            
-            if not lines:
-                return None, None, None
-                
-            # Parse request line
-            request_line = lines[0]
-            parts = request_line.split(' ')
-            if len(parts) < 3:
-                return None, None, None
-                
-            method = parts[0]
-            path = parts[1]
-            
-            # Parse headers
-            headers = {}
-            for line in lines[1:]:
-                if ':' in line:
-                    key, value = line.split(':', 1)
-                    headers[key.strip().lower()] = value.strip()
-                    
-            host = headers.get('host', 'unknown')
-            
-            return method, host, path
-            
-        except Exception as e:
-            self.logger.error(f"HTTP request parsing error: {e}")
-            return None, None, None
-            
     def handle_http_request(self, client_socket, data):
         """Handle HTTP request with configurable response"""
-        method, host, path = self.parse_http_request(data)
-        
-        if not method:
+        # The head may continue past the first read; only Host and the WebSocket key are extracted
+        parser = RequestHeadParser(('host', 'sec-websocket-key'))
+        parser.feed(data)
+        try:
+            client_socket.settimeout(HANDSHAKE_TIMEOUT)
+            request = recv_head(client_socket, parser)
+        except HttpError as e:
+            self.logger.warning(f"HTTP request error: {e}")
+            client_socket.close()
+            return
+        except (ConnectionError, socket.timeout):
             client_socket.close()
             return
             
+        method, host, path = request.method, request.header('host', 'unknown'), request.target
         self.logger.info(f"HTTP {method} request: {host}{path} - Response type: {self.http_response_type}")
         
+        if self.http_response_type == 101:
+            self.handle_websocket_tunnel(client_socket, request, parser.remaining())
+            return
+            
         # Create appropriate response
         response = self.create_http_response(self.http_response_type, host, path)
         
         try:
-            client_socket.send(response)
+            client_socket.sendall(response)
+            self.http_responses.inc()
+            self.metrics.bytes_out.inc(len(response))
+            handshake_done()
         except:
             pass
         finally:
             client_socket.close()
             
+    def handle_websocket_tunnel(self, client_socket, request, rest):
+        """Answer the upgrade with 101 and tunnel the connection to the backend"""
+        try:
+            server_socket = self.connector.connect(*self.backend)
+        except Exception as e:
+            self.logger.error(f"Backend connect error ({self.backend[0]}:{self.backend[1]}): {e}")
+            client_socket.sendall(BAD_GATEWAY)
+            return
+            
+        key = request.header('sec-websocket-key')
+        try:
+            response = self.create_http_101_response(key)
+            client_socket.sendall(response)
+            self.http_responses.inc()
+            self.metrics.bytes_out.inc(len(response))
+            handshake_done()
+            framed = bool(key) and client_sends_frames(client_socket, rest)
+            client_socket.settimeout(None)
+        except OSError:
+            server_socket.close()
+            raise
+            
+        if framed:
+            # RFC 6455 client: payload travels in masked frames
+            relay_websocket(client_socket, server_socket, lambda: self.running, self.buffer_pool,
+                            self.metrics, rest, reaper=self.reaper)
+        else:
+            # SSH over WebSocket as HTTP Custom clients do it: raw bytes follow the 101
+            if rest:
+                server_socket.sendall(rest)
+            self.relay_data(client_socket, server_socket)
+            
     def handle_socks_request(self, client_socket, data):
         """Handle SOCKS proxy request"""
         try:
@@ -273,128 +375,107 @@ class WebSocketSystemCtlProxy:
                 return
                 
             version = data[0]
-            
-            if version == 4:
-                self.handle_socks4(client_socket, data)
-            elif version == 5:
-                self.handle_socks5(client_socket, data)
-            else:
+            if version not in (4, 5):
                 # Treat as HTTP request
                 self.handle_http_request(client_socket, data)
-                
-        except Exception as e:
-            self.logger.error(f"SOCKS handling error: {e}")
-            client_socket.close()
-            
-    def handle_socks4(self, client_socket, data):
-        """Handle SOCKS4 requests"""
-        try:
-            if len(data) < 8:
                 return
                 
-            vn, cd, dstport, dstip = struct.unpack(">BBHI", data[:8])
+            # Parse the handshake incrementally, starting from the bytes already read
+            parser = SocksParser()
+            parser.feed(data)
+            kind, value = recv_event(client_socket, parser)
             
-            # Read userid
-            userid_start = 8
-            userid_end = data.find(b'\x00', userid_start)
-            if userid_end == -1:
-                userid_end = len(data)
-                
-            dst_addr = socket.inet_ntoa(struct.pack(">I", dstip))
-            
-            if cd == 1:  # CONNECT
-                self.handle_connect_socks4(client_socket, dst_addr, dstport)
+            if kind == REQUEST:
+                self.handle_socks4(client_socket, parser, value)
+            else:
+                self.handle_socks5(client_socket, parser)
                 
+        except SocksError as e:
+            self.logger.warning(f"SOCKS handshake error: {e}")
         except Exception as e:
-            self.logger.error(f"SOCKS4 error: {e}")
+            self.logger.error(f"SOCKS handling error: {e}")
             client_socket.close()
             
-    def handle_socks5(self, client_socket, initial_data):
-        """Handle SOCKS5 requests"""
-        try:
-            # Send no authentication required
-            client_socket.send(b"\x05\x00")
+    def handle_socks4(self, client_socket, parser, request):
+        """Handle SOCKS4/4a requests"""
+        if request.command == CMD_CONNECT:
+            self.handle_connect_socks4(client_socket, request.address, request.port,
+                                       parser.remaining())
+        else:
+            client_socket.sendall(socks4_reply(SOCKS4_REJECTED))
             
-            # Read connection request
-            data = client_socket.recv(1024)
-            if len(data) < 4:
-                return
-                
-            ver, cmd, rsv, atyp = struct.unpack("BBBB", data[:4])
+    def handle_socks5(self, client_socket, parser):
+        """Handle SOCKS5 requests"""
+        # Send no authentication required
+        client_socket.sendall(b"\x05\x00")
+        parser.select_method(METHOD_NO_AUTH)
+        
+        # Read connection request (may already be buffered if the client pipelined it)
+        kind, request = recv_event(client_socket, parser)
+        
+        if request.command == CMD_CONNECT:
+            self.handle_connect_socks5(client_socket, request.address, request.port,
+                                       parser.remaining())
+        else:
+            client_socket.sendall(socks5_reply(REP_COMMAND_NOT_SUPPORTED))
             
-            if cmd == 1 and atyp == 1:  # CONNECT + IPv4
-                dst_addr = socket.inet_ntoa(data[4:8])
-                dst_port = struct.unpack(">H", data[8:10])[0]
-                self.handle_connect_socks5(client_socket, dst_addr, dst_port)
-            elif cmd == 1 and atyp == 3:  # CONNECT + Domain
-                addr_len = data[4]
-                dst_addr = data[5:5+addr_len].decode()
-                dst_port = struct.unpack(">H", data[5+addr_len:7+addr_len])[0]
-                self.handle_connect_socks5(client_socket, dst_addr, dst_port)
-                
+    def handle_connect_socks4(self, client_socket, dst_addr, dst_port, initial_data=b""):
+        """Handle SOCKS4 CONNECT"""
+        try:
+            server_socket = self.connector.connect(dst_addr, dst_port)
         except Exception as e:
-            self.logger.error(f"SOCKS5 error: {e}")
+            # Send error response
+            client_socket.sendall(socks4_reply(SOCKS4_REJECTED))
             client_socket.close()
+            return
             
-    def handle_connect_socks4(self, client_socket, dst_addr, dst_port):
-        """Handle SOCKS4 CONNECT"""
         try:
-            server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            server_socket.connect((dst_addr, dst_port))
-            
             # Send success response
-            response = struct.pack(">BBHI", 0, 90, dst_port, 0)
-            client_socket.send(response)
+            client_socket.sendall(socks4_reply(SOCKS4_GRANTED, dst_port))
+            handshake_done()
             
-            self.relay_data(client_socket, server_socket)
+            if initial_data:
+                server_socket.sendall(initial_data)
+        except OSError:
+            server_socket.close()
+            raise
+            
+        self.relay_data(client_socket, server_socket)
             
+    def handle_connect_socks5(self, client_socket, dst_addr, dst_port, initial_data=b""):
+        """Handle SOCKS5 CONNECT"""
+        try:
+            # Race every resolved address of the target
+            server_socket = self.connector.connect(dst_addr, dst_port)
         except Exception as e:
             # Send error response
-            response = struct.pack(">BBHI", 0, 91, 0, 0)
-            client_socket.send(response)
+            code = REP_HOST_UNREACHABLE if isinstance(e, socket.gaierror) else REP_CONNECTION_REFUSED
+            client_socket.sendall(socks5_reply(code))
             client_socket.close()
+            return
             
-    def handle_connect_socks5(self, client_socket, dst_addr, dst_port):
-        """Handle SOCKS5 CONNECT"""
         try:
-            server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            server_socket.connect((dst_addr, dst_port))
-            
             # Send success response
-            response = b"\x05\x00\x00\x01" + socket.inet_aton("0.0.0.0") + struct.pack(">H", 0)
-            client_socket.send(response)
+            client_socket.sendall(socks5_reply(REP_SUCCEEDED))
+            handshake_done()
             
-            self.relay_data(client_socket, server_socket)
+            if initial_data:
+                server_socket.sendall(initial_data)
+        except OSError:
+            server_socket.close()
+            raise
             
-        except Exception as e:
-            # Send error response
-            response = b"\x05\x05\x00\x01" + socket.inet_aton("0.0.0.0") + struct.pack(">H", 0)
-            client_socket.send(response)
-            client_socket.close()
+        self.relay_data(client_socket, server_socket)
             
     def relay_data(self, client_socket, server_socket):
         """Relay data between sockets"""
-        def forward(source, destination):
-            try:
-                while self.running:
-                    data = source.recv(4096)
-                    if not data:
-                        break
-                    destination.send(data)
-            except:
-                pass
-            finally:
-                source.close()
-                destination.close()
-                
-        # Start forwarding threads
-        threading.Thread(target=forward, args=(client_socket, server_socket), daemon=True).start()
-        threading.Thread(target=forward, args=(server_socket, client_socket), daemon=True).start()
+        relay(client_socket, server_socket, lambda: self.running, self.relay_mode, self.buffer_pool,
+              self.metrics, self.shaper.open(current_client_ip()), reaper=self.reaper)
         
-    def handle_client(self, client_socket, client_addr):
+    def handle_client(self, client_socket, client_addr, ticket=None):
         """Handle incoming client connection"""
-        self.connections += 1
-        self.total_connections += 1
+        if ticket:
+            ticket.activate()
         
         try:
             self.logger.info(f"New WebSocket SYSTEMCTL connection from {client_addr}")
@@ -418,46 +499,74 @@ class WebSocketSystemCtlProxy:
                 client_socket.close()
             except:
                 pass
-            self.connections -= 1
+            if ticket:
+                ticket.release()
             
     def print_stats(self):
         """Print proxy statistics"""
         while self.running:
             time.sleep(60)
             self.logger.info(f"WebSocket SYSTEMCTL Stats - Active: {self.connections}, Total: {self.total_connections}, Response Type: {self.http_response_type}")
+            self.logger.info(f"WebSocket SYSTEMCTL {self.buffer_pool.format_stats()}")
+            self.logger.info(f"WebSocket SYSTEMCTL {self.admission.format_stats()}")
+            self.logger.info(f"WebSocket SYSTEMCTL {self.reaper.format_stats()}")
+            self.logger.info(f"WebSocket SYSTEMCTL {self.resolver.format_stats()}")
+            self.logger.info(f"WebSocket SYSTEMCTL {self.connector.format_stats()}")
+            if self.tracer.enabled:
+                self.logger.info(f"WebSocket SYSTEMCTL {self.tracer.format_stats()}")
+            if self.shaper.enabled:
+                self.logger.info(f"WebSocket SYSTEMCTL {self.shaper.format_stats()}")
             
     def start(self):
         """Start the WebSocket proxy server"""
         self.running = True
+        self.reaper.start()
+        self.tracer.start()
         os.makedirs(self.config_dir, exist_ok=True)
+        self.config_watcher.start()
         
         # Create server socket
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         
         # Start statistics thread
         stats_thread = threading.Thread(target=self.print_stats)
         stats_thread.daemon = True
         stats_thread.start()
         
+        if self.metrics_address:
+            start_metrics_server(self.metrics, self.metrics_address, self.logger, "WebSocket SYSTEMCTL")
+        
         try:
-            server_socket.bind((self.host, self.port))
-            server_socket.listen(50)
+            server_socket = self.handoff.listen(server_socket, (self.host, self.port), self.backlog)
             
             self.logger.info(f"Mastermind WEBSOCKET Custom (SYSTEMCTL) Proxy started on {self.host}:{self.port}")
             self.logger.info(f"HTTP Response Type: {self.http_response_type}")
+            self.logger.info(f"WebSocket backend (101): {self.backend[0]}:{self.backend[1]}")
             self.logger.info(f"Mastermind Branding: {'Enabled' if self.mastermind_branding['enabled'] else 'Disabled'}")
+            if self.relay_mode != 'copy':
+                self.logger.info(f"Relay: {'splice' if splice_supported() else 'copy (splice unavailable)'}")
             
-            while self.running:
+            while self.running and self.handoff.accepting:
                 try:
                     client_socket, client_addr = server_socket.accept()
+                    
+                    ticket = self.admission.admit(client_addr[0], client_socket)
+                    if ticket is None:
+                        reject_connection(client_socket, http=True)
+                        continue
+                        
                     client_thread = threading.Thread(
                         target=self.handle_client,
-                        args=(client_socket, client_addr)
+                        args=(client_socket, client_addr, ticket)
                     )
                     client_thread.daemon = True
                     client_thread.start()
                     
+                except socket.timeout:
+                    continue
                 except socket.error:
                     if self.running:
                         self.logger.error("Socket accept error")
@@ -467,12 +576,23 @@ class WebSocketSystemCtlProxy:
             self.logger.error(f"Server error: {e}")
         finally:
             server_socket.close()
+            self.handoff.drain(lambda: self.connections)
             self.logger.info("Mastermind WEBSOCKET Custom (SYSTEMCTL) Proxy stopped")
             
     def stop(self):
         """Stop the proxy server"""
         self.running = False
-        
+        self.reaper.stop()
+        self.tracer.stop()
+        self.config_watcher.stop()
+        
+def parse_backend(value):
+    """Parse a host:port backend argument"""
+    host, sep, port = value.rpartition(':')
+    if not sep or not host:
+        raise argparse.ArgumentTypeError("backend must be host:port")
+    return host.strip('[]'), int(port)
+
 def signal_handler(sig, frame):
     """Handle interrupt signals"""
     print("\nMastermind WEBSOCKET Custom (SYSTEMCTL) Proxy shutting down...")
@@ -480,10 +600,43 @@ def signal_handler(sig, frame):
     sys.exit(0)
 
 if __name__ == "__main__":
-    # Register signal handlers
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
+    parser = argparse.ArgumentParser(description="Mastermind WEBSOCKET Custom (SYSTEMCTL) Proxy")
+    parser.add_argument("--host", default="0.0.0.0", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8004, help="Port to listen on")
+    parser.add_argument("--backend", type=parse_backend, default=None,
+                        help="SSH/Dropbear backend of 101 tunnels as host:port (default: config file, then 127.0.0.1:22)")
+    parser.add_argument("--relay", choices=RELAY_MODES, default="auto",
+                        help="Relay: zero-copy splice() on Linux, or the userspace copy loop")
+    parser.add_argument("--buffer-size", type=int, default=DEFAULT_BUFFER_SIZE,
+                        help="Size in bytes of each pooled relay buffer")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes sharing the port via SO_REUSEPORT")
+    add_shaping_arguments(parser)
+    add_admission_arguments(parser)
+    add_reaper_arguments(parser)
+    add_handoff_arguments(parser)
+    add_tracing_arguments(parser)
+    add_metrics_arguments(parser)
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    configure_logging(args)
+    
+    # Create proxy
+    shaper = load_shaping_config("config/proxies/websocket-systemctl-shaping.conf", args)
+    proxy = WebSocketSystemCtlProxy(host=args.host, port=args.port, backend=args.backend, relay_mode=args.relay,
+                                    buffer_size=args.buffer_size, shaper=shaper,
+                                    max_connections=args.max_connections,
+                                    max_per_ip=args.max_per_ip, max_handshakes=args.max_handshakes,
+                                    backlog=args.backlog, metrics_address=args.metrics,
+                                    idle_timeout=args.idle_timeout, max_lifetime=args.max_lifetime,
+                                    drain_timeout=args.drain_timeout,
+                                    tracer=load_tracing("websocket-systemctl", args))
     
-    # Create and start proxy
-    proxy = WebSocketSystemCtlProxy()
-    proxy.start()
\ No newline at end of file
+    if args.workers > 1:
+        WorkerSupervisor(proxy, args.workers, "Mastermind WEBSOCKET Custom (SYSTEMCTL) Proxy").run()
+    else:
+        # Register signal handlers
+        signal.signal(signal.SIGINT, signal_handler)
+        signal.signal(signal.SIGTERM, signal_handler)
+        
+        proxy.start()
\ No newline at end of file
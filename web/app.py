@@ -6,7 +6,9 @@ Flask-based web application for managing VPS services
 
 from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash
 import subprocess
+import glob
 import json
+import math
 import os
 import sys
 import time
@@ -184,10 +186,24 @@ class ServiceManager:
         except:
             return False
     
+    def supports_graceful_reload(self, service_name):
+        """Whether the unit hands its listening socket to a new process on reload"""
+        try:
+            result = subprocess.run(
+                ['systemctl', 'show', '--property=NotifyAccess', '--value', service_name],
+                capture_output=True, text=True
+            )
+            return result.stdout.strip() == 'all'
+        except:
+            return False
+    
     def restart_service(self, service_name):
-        """Restart a service"""
+        """Restart a service, gracefully when it supports it so open tunnels are not dropped"""
         try:
-            subprocess.run(['systemctl', 'restart', service_name], check=True)
+            if self.get_service_status(service_name) == 'active' and self.supports_graceful_reload(service_name):
+                subprocess.run(['systemctl', 'reload', service_name], check=True)
+            else:
+                subprocess.run(['systemctl', 'restart', service_name], check=True)
             return True
         except:
             return False
@@ -244,9 +260,123 @@ class SystemMonitor:
                 }
         return interfaces
 
+class ProxyLatencyMonitor:
+    """Read the per-stage latency snapshots and slow-connection logs written by the proxies"""
+    
+    # Percentiles reported per stage
+    QUANTILES = (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('p999', 0.999))
+    # A snapshot not rewritten for this many of its intervals belongs to a stopped process
+    STALE_INTERVALS = 3
+    
+    def __init__(self, log_dir):
+        self.log_dir = log_dir
+    
+    def snapshots(self):
+        """Current latency snapshots, one per proxy process"""
+        now = time.time()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.log_dir, '*-latency-*.json')):
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if now - snapshot.get('updated', 0) <= snapshot.get('interval', 10) * self.STALE_INTERVALS:
+                snapshots.append(snapshot)
+        return snapshots
+    
+    @staticmethod
+    def quantile(buckets, count, peak, fraction):
+        """Upper bound in microseconds of the bucket holding the fraction-th value"""
+        rank = max(1, math.ceil(fraction * count))
+        seen = 0
+        for upper, bucket_count in buckets:
+            seen += bucket_count
+            if seen >= rank:
+                return min(upper, peak)
+        return peak
+    
+    def summarize(self, stages):
+        """Percentiles in milliseconds of merged {stage: {upper_us: count}} buckets"""
+        summary = {}
+        for stage, merged in stages.items():
+            buckets = sorted(merged['buckets'].items())
+            count = merged['count']
+            entry = {'count': count, 'mean': merged['sum'] * 1000 / count if count else 0.0,
+                     'max': merged['max_us'] / 1000}
+            for label, fraction in self.QUANTILES:
+                entry[label] = self.quantile(buckets, count, merged['max_us'], fraction) / 1000 if count else 0.0
+            summary[stage] = entry
+        return summary
+    
+    def get_latency(self):
+        """Stage percentiles per proxy, merged over its worker processes, and the latest slow connections"""
+        proxies = {}
+        slow = []
+        for snapshot in self.snapshots():
+            proxy = proxies.setdefault(snapshot['proxy'], {
+                'proxy': snapshot['proxy'],
+                'processes': 0,
+                'slow_threshold_ms': snapshot.get('slow_threshold_ms'),
+                'traced': 0,
+                'slow': 0,
+                'stages': {},
+            })
+            proxy['processes'] += 1
+            proxy['traced'] += snapshot['stats'].get('traced', 0)
+            proxy['slow'] += snapshot['stats'].get('slow', 0)
+            for stage, data in snapshot['stages'].items():
+                merged = proxy['stages'].setdefault(stage, {'count': 0, 'sum': 0.0, 'max_us': 0, 'buckets': {}})
+                merged['count'] += data['count']
+                merged['sum'] += data['sum']
+                merged['max_us'] = max(merged['max_us'], data['max_us'])
+                for upper, bucket_count in data['buckets']:
+                    merged['buckets'][upper] = merged['buckets'].get(upper, 0) + bucket_count
+            slow.extend(snapshot.get('slow', []))
+        
+        for proxy in proxies.values():
+            proxy['stages'] = self.summarize(proxy['stages'])
+        slow.sort(key=lambda entry: entry['ts'], reverse=True)
+        return {
+            'proxies': sorted(proxies.values(), key=lambda proxy: proxy['proxy']),
+            'slow': slow[:20],
+        }
+    
+    @staticmethod
+    def tail(path, limit):
+        """Last limit lines of a file, reading only its end"""
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            end = f.tell()
+            size = min(end, limit * 1024)
+            f.seek(end - size)
+            lines = f.read(size).splitlines()
+        if size < end:
+            lines = lines[1:]  # Partial first line
+        return lines[-limit:]
+    
+    def get_slow_connections(self, proxy='', limit=50):
+        """Latest entries of the slow-connection logs, newest first"""
+        entries = []
+        for path in glob.glob(os.path.join(self.log_dir, '*-slow.jsonl')):
+            if proxy and os.path.basename(path) != f"{proxy}-slow.jsonl":
+                continue
+            try:
+                lines = self.tail(path, limit)
+            except OSError:
+                continue
+            for line in lines:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+        entries.sort(key=lambda entry: entry.get('ts', ''), reverse=True)
+        return entries[:limit]
+
 # Initialize managers
 service_manager = ServiceManager()
 system_monitor = SystemMonitor()
+latency_monitor = ProxyLatencyMonitor(os.path.join(LOG_DIR, "proxies"))
 
 # Authentication decorator
 def login_required(f):
@@ -404,6 +534,20 @@ def api_network_stats():
     """API endpoint for network statistics"""
     return jsonify(system_monitor.get_network_stats())
 
+@app.route('/api/proxies/latency')
+@login_required
+def api_proxies_latency():
+    """API endpoint for per-stage proxy connection latency"""
+    return jsonify(latency_monitor.get_latency())
+
+@app.route('/api/proxies/slow')
+@login_required
+def api_proxies_slow():
+    """API endpoint for the slow-connection logs"""
+    limit = max(1, min(request.args.get('limit', 50, type=int), 1000))
+    proxy = request.args.get('proxy', '')
+    return jsonify(latency_monitor.get_slow_connections(proxy, limit))
+
 @app.route('/api/logs')
 @login_required
 def api_logs():